@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Bedrock admission control: shared budget, fast rejects, per-user fairness and backoff on throttles.
+
+Fires a burst of generations from many containers (one thread and one
+BedrockGovernor each, sharing the admission counters in a stand-in
+DynamoDB table) at a FakeBedrock with an account quota. Without admission
+control every container calls Bedrock and retries throttles the way
+botocore does; with it, no call is throttled and the requests that cannot
+be served within the queue limit are turned away at once with Retry-After.
+Also checks that a noisy user cannot take the slots of quiet ones, that a
+governor configured above the real quota backs off after throttles, that
+a deep queue costs at most three DynamoDB round trips, and that the
+handlers answer 429 (refunding credits) and re-queue jobs when admission
+is refused. Exits non-zero if a check fails.
+
+    python benchmarks/bench_bedrock_admission.py --quota 4 --requests 24 --bedrock-ms 300
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import emulator
+from local_aws import FakeBedrock, FakeResponseStream, FakeTable
+
+import bedrock_admission  # noqa: E402
+import image_gen  # noqa: E402
+import logger  # noqa: E402
+import metrics  # noqa: E402
+from bedrock_admission import AdmissionRejected, BedrockGovernor, DynamoDbWindows  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+from model_router import TITAN_V1  # noqa: E402
+
+BODY = json.dumps({'taskType': 'TEXT_IMAGE', 'textToImageParams': {'text': 'A lighthouse at dusk'},
+                   'imageGenerationConfig': {'numberOfImages': 1}})
+
+def admission_table():
+    return FakeTable(os.environ['BEDROCK_ADMISSION_TABLE'], 'windowKey')
+
+def call_with_retries(bedrock, rng):
+    """The client before admission control: a second attempt after botocore's standard backoff (up to 1 s)"""
+    for attempt in range(2):
+        try:
+            bedrock.invoke_model(modelId=TITAN_V1, body=BODY)
+            return 'ok', None
+        except ClientError:
+            if attempt == 0:
+                time.sleep(rng.random())
+    return 'failed', None
+
+def call_governed(bedrock, governor, user):
+    try:
+        governor.admit(user)
+        governor.invoke_model(bedrock, modelId=TITAN_V1, body=BODY)
+        return 'ok', None
+    except AdmissionRejected as e:
+        return 'rejected', e.retry_after
+    except ClientError:
+        return 'failed', None
+
+def burst(requests, offsets, bedrock, call):
+    """Run call(i) for every request at its offset (seconds), one thread each; returns [(outcome, ms, retry_after)]"""
+    start = time.perf_counter()
+
+    def container(i):
+        time.sleep(max(0, start + offsets[i] - time.perf_counter()))
+        sent = time.perf_counter()
+        outcome, retry_after = call(i)
+        return outcome, (time.perf_counter() - sent) * 1000, retry_after
+    
+    with ThreadPoolExecutor(max_workers=requests) as executor:
+        return list(executor.map(container, range(requests)))
+
+def summarize(name, results, bedrock):
+    by_outcome = {}
+    for outcome, ms, _ in results:
+        by_outcome.setdefault(outcome, []).append(ms)
+    parts = [f"{outcome} {len(ms)} (p50 {statistics.median(ms):.0f} ms, max {max(ms):.0f} ms)"
+             for outcome, ms in sorted(by_outcome.items())]
+    print(f"  {name:<22} {', '.join(parts)}; {bedrock.calls['throttled']} throttled calls")
+    return by_outcome
+
+def adaptive_run(quota, max_rate, duration, bedrock_ms, feedback):
+    """One container calling as fast as admission allows for duration seconds, against a lower real quota"""
+    bedrock = FakeBedrock(bedrock_ms, max_rps=quota)
+    governor = BedrockGovernor(DynamoDbWindows(admission_table()), max_rate=max_rate, user_share=1,
+                               max_queue_seconds=1)
+    lowest_rate = governor.rate
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        try:
+            governor.admit('user_adaptive')
+        except AdmissionRejected:
+            time.sleep(0.05)
+            continue
+        try:
+            if feedback:
+                governor.invoke_model(bedrock, modelId=TITAN_V1, body=BODY)
+            else:
+                bedrock.invoke_model(modelId=TITAN_V1, body=BODY)
+        except ClientError:
+            pass
+        lowest_rate = min(lowest_rate, governor.rate)
+    return bedrock.calls['throttled'], bedrock.calls['invoke_model'], lowest_rate
+
+class FrozenClock:
+    """botocore Clock stand-in that stays in one second"""
+
+    def current_time(self):
+        return 1000.0
+
+    def sleep(self, seconds):
+        pass
+
+def table_calls(table):
+    return table.calls['update_item'] + table.calls['batch_get_item']
+
+def at_window_start():
+    """Sleep until early in a wall-clock second, so several calls land in one admission window"""
+    time.sleep((1.05 - time.time() % 1) % 1)
+
+def generate_event(**body):
+    return emulator.claims_event('POST', '/image/generate', dict({'prompt': 'A lighthouse at dusk'}, **body))
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quota', type=float, default=4, help='Bedrock calls per second the account allows')
+    parser.add_argument('--requests', type=int, default=24)
+    parser.add_argument('--spread', type=float, default=1.0, help='seconds the burst arrives over')
+    parser.add_argument('--bedrock-ms', type=float, default=300)
+    parser.add_argument('--max-queue', type=float, default=2)
+    parser.add_argument('--duration', type=float, default=6, help='seconds of the adaptive backoff runs')
+    args = parser.parse_args()
+    logger._stream = open(os.devnull, 'w')
+    metrics.use_sink(metrics.MemorySink())
+    
+    print(f"🚦 Bedrock admission control: {args.requests} requests over {args.spread:g}s, "
+          f"quota {args.quota:g}/s, {args.bedrock_ms:g} ms per call")
+    print("=" * 70)
+    failures = []
+    rng = random.Random(0)
+    offsets = sorted(rng.random() * args.spread for _ in range(args.requests))
+    
+    # Bedrock quotas are per minute, so short bursts above the per-second rate pass
+    bedrock = FakeBedrock(args.bedrock_ms, max_rps=args.quota, burst=2 * args.quota)
+    retry_rng = random.Random(1)
+    baseline = summarize('retries only', burst(args.requests, offsets, bedrock,
+                                               lambda i: call_with_retries(bedrock, retry_rng)), bedrock)
+    baseline_throttled = bedrock.calls['throttled']
+    
+    bedrock = FakeBedrock(args.bedrock_ms, max_rps=args.quota, burst=2 * args.quota)
+    windows = DynamoDbWindows(admission_table())
+    results = burst(args.requests, offsets, bedrock, lambda i: call_governed(
+        bedrock, BedrockGovernor(windows, max_rate=args.quota, max_queue_seconds=args.max_queue), f"user_{i}"))
+    governed = summarize('admission control', results, bedrock)
+    print()
+    
+    print("Checks")
+    check(baseline_throttled > 0 and bedrock.calls['throttled'] == 0,
+          f"no throttled calls with admission control ({baseline_throttled} without)", failures)
+    check(not governed.get('failed'), "every admitted call succeeds", failures)
+    rejected = governed.get('rejected', [])
+    failed_before = baseline.get('failed', [])
+    check(rejected and max(rejected) < 100,
+          f"{len(rejected)} rejects answered in {max(rejected, default=0):.0f} ms at most"
+          + (f" (failures took {statistics.median(failed_before):.0f} ms p50 before)" if failed_before else ""),
+          failures)
+    retry_afters = [retry_after for outcome, _, retry_after in results if outcome == 'rejected']
+    check(all(1 <= r <= args.max_queue + 1 for r in retry_afters),
+          f"rejects carry Retry-After ({min(retry_afters, default=0)}-{max(retry_afters, default=0)} s)", failures)
+    served = len(governed.get('ok', []))
+    check(served >= len(baseline.get('ok', [])),
+          f"admission serves as many requests ({served} vs {len(baseline.get('ok', []))})", failures)
+    
+    # A noisy user bursts first, then quiet users ask for one image each
+    quiet_users = 3
+    noisy = args.requests - quiet_users
+    fairness_offsets = [0.01 * i / noisy for i in range(noisy)] + [0.3] * quiet_users
+    admitted_quiet = {}
+    for share in (1.0, bedrock_admission.USER_SHARE):
+        bedrock = FakeBedrock(50, max_rps=args.quota, burst=2 * args.quota)
+        windows = DynamoDbWindows(admission_table())
+        at_window_start()
+        results = burst(args.requests, fairness_offsets, bedrock, lambda i: call_governed(
+            bedrock, BedrockGovernor(windows, max_rate=args.quota, user_share=share, max_queue_seconds=args.max_queue),
+            'user_noisy' if i < noisy else f"user_quiet_{i}"))
+        admitted_quiet[share] = sum(outcome == 'ok' for outcome, _, _ in results[noisy:])
+        admitted_noisy = sum(outcome == 'ok' for outcome, _, _ in results[:noisy])
+        print(f"  user share {share:<4g}: noisy user {admitted_noisy}/{noisy} admitted, "
+              f"quiet users {admitted_quiet[share]}/{quiet_users}")
+    check(admitted_quiet[bedrock_admission.USER_SHARE] == quiet_users and admitted_quiet[1.0] < quiet_users,
+          "a noisy user cannot take the quiet users' slots", failures)
+    
+    # Configured for twice the real quota: only feedback from throttles brings the rate down
+    fixed_throttled, fixed_calls, _ = adaptive_run(args.quota / 2, args.quota, args.duration, 50, feedback=False)
+    adaptive_throttled, adaptive_calls, lowest_rate = adaptive_run(args.quota / 2, args.quota, args.duration, 50,
+                                                                   feedback=True)
+    print(f"  configured {args.quota:g}/s over a {args.quota / 2:g}/s quota: {fixed_throttled}/{fixed_calls} calls "
+          f"throttled without feedback, {adaptive_throttled}/{adaptive_calls} with (rate down to {lowest_rate:.2f}/s)")
+    # CUBIC probes back up to the configured rate within seconds, so throttles drop rather than vanish
+    fixed_share, adaptive_share = fixed_throttled / fixed_calls, adaptive_throttled / adaptive_calls
+    check(adaptive_share < 0.8 * fixed_share,
+          f"backing off cuts the throttled share ({adaptive_share:.0%} vs {fixed_share:.0%})", failures)
+    
+    # A worker queue (20 s) where only the last window has room, then none has
+    table = admission_table()
+    governor = BedrockGovernor(DynamoDbWindows(table), max_rate=1, user_share=1, max_queue_seconds=20,
+                               clock=FrozenClock())
+    for _ in range(20):
+        governor.reserve('user_deep')
+    before = table_calls(table)
+    start_at = governor.reserve('user_deep')
+    admit_calls = table_calls(table) - before
+    before = table_calls(table)
+    try:
+        governor.reserve('user_deep')
+        rejected = False
+    except AdmissionRejected:
+        rejected = True
+    reject_calls = table_calls(table) - before
+    print(f"  20 s queue: last free slot taken in {admit_calls} DynamoDB calls, full queue rejected in {reject_calls}")
+    check(start_at == 1020 and admit_calls <= 3 and rejected and reject_calls <= 2,
+          "queueing costs at most three DynamoDB round trips however deep the queue", failures)
+    
+    # Handlers: one slot per second, no queueing
+    aws = emulator.LocalAws()
+    aws.install(image_gen)
+    bedrock_admission.use_governor(BedrockGovernor(DynamoDbWindows(aws.admission), max_rate=1, max_queue_seconds=0))
+    credits_before = aws.users.items[emulator.USER_ID]['credits']
+    at_window_start()
+    first = image_gen.handler(generate_event(), None)
+    second = image_gen.handler(generate_event(), None)
+    stream = FakeResponseStream()
+    image_gen.stream_handler(generate_event(), stream)
+    prelude, _ = stream.response()
+    queued = image_gen.handler(generate_event(numberOfImages=2, **{'async': True}), None)
+    job_id = json.loads(queued['body'])['jobId']
+    worker_event = {'Records': [{'body': json.dumps({'jobId': job_id, 'cognitoSub': emulator.SUB})}]}
+    try:
+        image_gen.worker(worker_event, None)
+        requeued = False
+    except AdmissionRejected:
+        requeued = aws.images.items[job_id]['status'] == image_gen.JOB_QUEUED
+    credits_after = aws.users.items[emulator.USER_ID]['credits']
+    check(first['statusCode'] == 200 and second['statusCode'] == 429
+          and second['headers'].get('Retry-After') == '1' and json.loads(second['body'])['retryAfter'] == 1,
+          "handler answers 429 with Retry-After once the second's slot is taken", failures)
+    check(prelude['statusCode'] == 429 and prelude['headers'].get('Retry-After') == '1',
+          "stream handler answers 429 before streaming", failures)
+    check(credits_before - credits_after == 1 + 2, "rejected requests are refunded (job credits stay reserved)",
+          failures)
+    time.sleep(1)
+    image_gen.worker(worker_event, None)
+    check(requeued and aws.images.items[job_id]['status'] == image_gen.JOB_COMPLETED,
+          "a rejected job is re-queued and completes in a later window", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Memory per request for Bedrock image payloads: json.loads + b64decode vs the streaming decoder.
+
+Each variant runs in a fresh interpreter that builds --concurrency Titan-like
+responses ({"images": ["<base64>", ...]}), resets the peak RSS counter, then
+handles them on --concurrency threads and uploads every image to the FakeS3
+stand-in. Reports peak RSS above the baseline per request (Linux) and the
+traced peak of one request. Derivatives are left out so only the payload
+handling is compared. Exits non-zero if a check fails.
+
+    python benchmarks/bench_bedrock_payload.py --images 5 --concurrency 8
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from local_aws import FakeS3, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('IMAGES_BUCKET', 'imagify-images')
+import image_gen  # noqa: E402
+from image_payload import iter_images  # noqa: E402
+
+def response_body(images, seed):
+    """Titan response bytes for `images` images of roughly the given size"""
+    payload = [base64.b64encode(os.urandom(size)).decode() for size in images]
+    return json.dumps({'images': payload, 'error': None, 'seed': seed}).encode()
+
+def legacy(body, s3, image_ids):
+    """The previous handling: whole body -> parsed JSON -> base64 str -> bytes"""
+    images_base64 = json.loads(body.read())['images']
+    for index, image_id in enumerate(image_ids):
+        image_bytes = base64.b64decode(images_base64[index])
+        images_base64[index] = None
+        s3.put_object(Bucket=os.environ['IMAGES_BUCKET'], Key=f"images/user_1/{image_id}.png", Body=image_bytes,
+                      ContentType='image/png')
+
+def streaming(body, s3, image_ids):
+    image_gen.s3 = s3
+    image_gen.upload_images(iter_images(body), 'user_1', image_ids)
+
+VARIANTS = {'legacy': legacy, 'streaming': streaming}
+
+def _status_kib(field):
+    return int(re.search(rf'{field}:\s+(\d+)', open('/proc/self/status').read()).group(1))
+
+def child(args):
+    """Measure one variant in this (fresh) interpreter and print the result as JSON"""
+    handle = VARIANTS[args.child]
+    image_gen.store_derivatives = lambda *a: {}
+    sizes = [args.image_kib * 1024] * args.images
+    bodies = [response_body(sizes, seed) for seed in range(args.concurrency)]
+    image_ids = [f"img_{i}" for i in range(args.images)]
+    s3 = FakeS3(keep_bodies=False)
+
+    # Warm-up so thread stacks, imports and allocator arenas are not counted
+    handle(io.BytesIO(response_body([1024], 0)), s3, image_ids[:1])
+    baseline = _status_kib('VmRSS')
+    open('/proc/self/clear_refs', 'w').write('5')  # reset VmHWM to the current RSS
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(lambda body: handle(io.BytesIO(body), s3, image_ids), bodies))
+    elapsed = time.perf_counter() - start
+    peak_rss = _status_kib('VmHWM') - baseline
+
+    tracemalloc.start()
+    handle(io.BytesIO(bodies[0]), FakeS3(keep_bodies=False), image_ids)
+    traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stored = sorted(obj['ContentLength'] for obj in s3.objects.values())
+    print(json.dumps({'peak_rss_kib': peak_rss / args.concurrency, 'traced_kib': traced / 1024,
+                      'ms': elapsed * 1000 / args.concurrency, 'stored': stored}))
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=5, help='images per Bedrock response')
+    parser.add_argument('--image-kib', type=int, default=1500, help='decoded size of each image')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests handled at once')
+    parser.add_argument('--child', choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args)
+
+    print(f"🧪 Bedrock payloads: {args.images} x {args.image_kib} KiB images per response, "
+          f"{args.concurrency} concurrent requests")
+    print("=" * 70)
+    print(f"  {'':<20} {'peak RSS/request':>18} {'traced peak':>14} {'ms/request':>12}")
+    results = {}
+    for name in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', name, '--images', str(args.images),
+             '--image-kib', str(args.image_kib), '--concurrency', str(args.concurrency)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        results[name] = result = json.loads(output.strip().splitlines()[-1])
+        print(f"  {name:<20} {result['peak_rss_kib'] / 1024:14.1f} MiB {result['traced_kib'] / 1024:10.1f} MiB "
+              f"{result['ms']:12.1f}")
+    print()
+
+    print("Checks")
+    failures = []
+    payload = [os.urandom(size) for size in (0, 1, 2, 3, 70_001)]
+    # Escaped slashes ("\/") are valid JSON and some encoders emit them
+    body = json.dumps({'error': None, 'images': [base64.b64encode(p).decode() for p in payload]}).replace('/', '\\/')
+    check(list(iter_images(io.BytesIO(body.encode()), chunk_size=7)) == payload,
+          "streamed images identical to json.loads + b64decode", failures)
+    check(results['streaming']['stored'] == results['legacy']['stored'], "same objects uploaded", failures)
+    decoded_mib = args.images * args.image_kib / 1024
+    ratio = results['legacy']['traced_kib'] / results['streaming']['traced_kib']
+    check(ratio >= 2, f"traced peak {ratio:.1f}x lower ({decoded_mib:.1f} MiB of decoded images per response)",
+          failures)
+    check(results['streaming']['peak_rss_kib'] < results['legacy']['peak_rss_kib'], "lower peak RSS per request",
+          failures)
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
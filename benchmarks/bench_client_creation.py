@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Cold client creation: botocore JSON models vs the model_snapshot.py snapshot.
+
+Every run is a fresh interpreter (like a new Lambda container) that creates
+the clients and resources the handlers use, once with the stock loader and
+once with the snapshot loader. No AWS calls are made.
+
+    python benchmarks/bench_client_creation.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from local_aws import LAMBDA_DIR
+
+# Runs inside the child interpreter; prints per-client creation times as JSON
+CHILD = r'''
+import json, sys, time
+start = time.perf_counter()
+import boto3, botocore.session
+imported = time.perf_counter()
+session = botocore.session.get_session()
+if sys.argv[1]:
+    from model_snapshot import create_loader
+    session.register_component('data_loader', create_loader(sys.argv[1]))
+session = boto3.session.Session(botocore_session=session, region_name='ap-southeast-1')
+timings = {'import boto3': imported - start, 'session + loader': time.perf_counter() - imported}
+for kind, name in json.loads(sys.argv[2]):
+    t = time.perf_counter()
+    getattr(session, kind)(name)
+    timings[f"{kind} {name}"] = time.perf_counter() - t
+timings['total'] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+def run_child(snapshot_path, targets):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(LAMBDA_DIR), PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD, snapshot_path or '', json.dumps(targets)],
+        env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    
+    sys.path.insert(0, os.path.abspath(LAMBDA_DIR))
+    import model_snapshot
+    
+    targets = [('client', name) for name in model_snapshot.CLIENTS]
+    targets += [('resource', name) for name in model_snapshot.RESOURCES]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, 'botocore_models.snapshot')
+        subprocess.run(
+            [sys.executable, os.path.join(LAMBDA_DIR, 'model_snapshot.py'), 'build', snapshot_path],
+            check=True, capture_output=True
+        )
+        size_kib = os.path.getsize(snapshot_path) / 1024
+        
+        results = {}
+        for label, path in (('json models', None), ('snapshot', snapshot_path)):
+            runs = [run_child(path, targets) for _ in range(args.runs)]
+            results[label] = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+    
+    print(f"🧪 Cold client creation (median of {args.runs} fresh interpreters, ms)")
+    print(f"   snapshot: {len(targets)} clients/resources, {size_kib:.0f} KiB")
+    print("=" * 70)
+    print(f"  {'':<28} {'json models':>12} {'snapshot':>12} {'speedup':>9}")
+    for key in results['json models']:
+        before, after = results['json models'][key], results['snapshot'][key]
+        print(f"  {key:<28} {before:12.1f} {after:12.1f} {before / after if after else 0:8.1f}x")
+
+if __name__ == '__main__':
+    main()
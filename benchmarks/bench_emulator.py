@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Local handler emulator: every scenario served by the stand-ins, latency and regressions visible.
+
+Runs emulator.py's scenarios against the local stand-ins and checks that
+each handler answers without errors, that simulated service latency and
+concurrency show up in the numbers, that allocation profiles are collected,
+and that comparing against a baseline flags a slower dependency. Scenarios
+whose module cannot load here (the authorizer needs the Lambda runtime's
+cryptography build) are reported as skipped. Exits non-zero if a check fails.
+
+    python benchmarks/bench_emulator.py --iterations 50
+"""
+import argparse
+import sys
+
+import emulator
+import loadgen
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--dynamodb-ms', type=float, default=5)
+    parser.add_argument('--bedrock-ms', type=float, default=100)
+    args = parser.parse_args()
+    
+    print(f"🧪 Local handler emulator: all scenarios, {args.iterations} invocations each")
+    print("=" * 70)
+    baseline = emulator.run(list(emulator.SCENARIOS), args.iterations, allocation_iterations=20)
+    emulator.print_report(baseline)
+    print()
+    
+    print("Checks")
+    failures = []
+    endpoints = baseline['endpoints']
+    check(set(endpoints) | set(baseline['skipped']) == set(emulator.SCENARIOS)
+          and set(baseline['skipped']) <= {'authorizer'}, "every handler runs in-process", failures)
+    check(all(e['errors'] == 0 for e in endpoints.values()), "no scenario fails against the stand-ins", failures)
+    check(endpoints['generate']['aws_calls_per_request'].get('bedrock') == 1
+          and endpoints['generate_async']['aws_calls_per_request'].get('sqs') == 1,
+          "Bedrock and SQS stand-ins are called", failures)
+    check(all(e['allocations']['peak_kib_p50'] > 0 for e in endpoints.values()),
+          "allocation profiles collected", failures)
+    
+    slow = emulator.run(['credits', 'generate'], args.iterations, latency_ms={'dynamodb': args.dynamodb_ms},
+                        allocation_iterations=5)
+    credits = slow['endpoints']['credits']['latency_ms']['p50']
+    check(credits >= args.dynamodb_ms, f"{args.dynamodb_ms:g} ms DynamoDB latency shows in credits ({credits:.2f} ms)",
+          failures)
+    flagged = {name for name, _, _, _ in loadgen.compare(slow, baseline, 0.20)}
+    check('credits' in flagged, "--compare flags the slower dependency", failures)
+    
+    sequential = emulator.run(['generate_async'], args.iterations, latency_ms={'sqs': 10}, allocation_iterations=5)
+    parallel = emulator.run(['generate_async'], args.iterations, concurrency=8, latency_ms={'sqs': 10},
+                            allocation_iterations=5)
+    speedup = (parallel['endpoints']['generate_async']['throughput_rps']
+               / sequential['endpoints']['generate_async']['throughput_rps'])
+    check(speedup > 4, f"8 concurrent invocations overlap waits ({speedup:.1f}x throughput)", failures)
+    
+    bedrock = emulator.run(['generate'], 10, latency_ms={'bedrock': args.bedrock_ms}, allocation_iterations=2)
+    check(bedrock['endpoints']['generate']['latency_ms']['p50'] >= args.bedrock_ms,
+          f"{args.bedrock_ms:g} ms Bedrock latency shows in generate", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
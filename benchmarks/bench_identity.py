@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Benchmark user resolution: full-table email scan vs identity.resolve_user.
+
+Runs against the in-memory FakeTable so it works offline:
+
+    python benchmarks/bench_identity.py --sizes 10000 100000 1000000
+"""
+import argparse
+import statistics
+import time
+
+from local_aws import FakeTable, add_lambda_path
+
+add_lambda_path()
+import identity  # noqa: E402
+
+def build_users_table(size):
+    table = FakeTable('imagify-users', 'userId', indexes={'EmailIndex': 'email'})
+    table.load(
+        {'userId': f'user_{i}', 'email': f'user{i}@example.com', 'credits': 10}
+        for i in range(size)
+    )
+    return table
+
+def time_calls(func, samples):
+    latencies = []
+    for i in range(samples):
+        start = time.perf_counter()
+        func(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+def run(size, samples):
+    table = build_users_table(size)
+    emails = [f'user{(i * 7919) % size}@example.com' for i in range(samples)]
+    subs = [f'sub-{(i * 7919) % size}' for i in range(samples)]
+
+    def scan_lookup(i):
+        table.scan(FilterExpression='email = :email', ExpressionAttributeValues={':email': emails[i]})
+
+    def cold_lookup(i):
+        identity.resolve_user(table, subs[i], emails[i])
+
+    def warm_lookup(i):
+        identity.resolve_user(table, subs[i], emails[i])
+
+    identity._user_ids.clear()
+    scan_ms = time_calls(scan_lookup, min(samples, 5))
+    cold_ms = time_calls(cold_lookup, samples)
+    warm_ms = time_calls(warm_lookup, samples)
+    return scan_ms, cold_ms, warm_ms
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    print("🧪 User resolution benchmark (median ms per lookup)")
+    print("=" * 70)
+    print(f"{'users':>10} {'scan':>12} {'GSI (cold)':>12} {'cached (warm)':>14}")
+    for size in args.sizes:
+        scan_ms, cold_ms, warm_ms = run(size, args.samples)
+        print(f"{size:>10} {scan_ms:>12.3f} {cold_ms:>12.3f} {warm_ms:>14.3f}")
+
+if __name__ == '__main__':
+    main()
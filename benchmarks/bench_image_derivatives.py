@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Thumbnail/medium WebP and AVIF derivatives of generated images.
+
+Runs image_gen.upload_images on synthetic 1024x1024 PNGs against the FakeS3
+stand-in (with simulated latency), with and without the derivative stage,
+and reports the added latency and the bytes a client downloads per view for
+each rendition. Checks that no derivative needs an S3 GET, that every key
+lands on the Images row, and that a failing derivative upload does not fail
+the generation. Exits non-zero if a check fails.
+
+    python benchmarks/bench_image_derivatives.py --images 4 --latency-ms 30
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+from local_aws import FakeDynamoDBResource, FakeS3, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('IMAGES_BUCKET', 'imagify-images')
+os.environ.setdefault('IMAGES_TABLE', 'imagify-images')
+from PIL import Image, ImageFilter  # noqa: E402
+import image_gen  # noqa: E402
+import image_derivatives  # noqa: E402
+import logger  # noqa: E402
+
+def synthetic_png(seed, size=1024):
+    """Photo-like test image: smooth gradients, soft shapes and sensor noise"""
+    gradient = Image.merge('RGB', [Image.linear_gradient('L').rotate(angle).resize((size, size))
+                                   for angle in (seed * 37 % 360, seed * 91 % 360, seed * 53 % 360)])
+    shapes = Image.effect_mandelbrot((size, size), (-2 + seed * 0.01, -1.2, 0.8, 1.2), 64).convert('RGB')
+    noise = Image.merge('RGB', [Image.effect_noise((size, size), 24)] * 3)
+    image = Image.blend(Image.blend(gradient, shapes, 0.35), noise, 0.12).filter(ImageFilter.GaussianBlur(1))
+    output = io.BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
+
+def upload(pngs, latency_ms, derivatives=True):
+    """One upload_images call; returns (ms, s3, s3_keys, derivatives)"""
+    s3 = FakeS3(latency_ms=latency_ms)
+    image_gen.s3 = s3
+    image_gen.store_derivatives = image_derivatives.store_derivatives if derivatives else (lambda *args: {})
+    image_ids = [f"img_{i:04d}" for i in range(len(pngs))]
+    start = time.perf_counter()
+    keys, stored = image_gen.upload_images(iter(pngs), 'user_1', image_ids)
+    return (time.perf_counter() - start) * 1000, s3, keys, stored
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=4, help='images per generation request')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency-ms', type=float, default=30, help='simulated S3 PUT latency')
+    args = parser.parse_args()
+    
+    logger._stream = open(os.devnull, 'w')
+    formats = image_derivatives.supported_formats()
+    pngs = [synthetic_png(i) for i in range(args.images)]
+    
+    print(f"🧪 Image derivatives: {args.images} x 1024px PNG per request, formats {', '.join(formats)}, "
+          f"{args.latency_ms:g} ms S3 latency")
+    print("=" * 70)
+    for label, derivatives in (('PNG only', False), ('PNG + derivatives', True)):
+        timings = [upload(pngs, args.latency_ms, derivatives)[0] for _ in range(args.runs)]
+        print(f"  {label:<22} {statistics.median(timings):8.1f} ms per request (median of {args.runs})")
+    
+    _, s3, keys, stored = upload(pngs, args.latency_ms)
+    png_bytes = statistics.mean(len(png) for png in pngs)
+    print(f"\n  {'bytes per view':<22} {png_bytes / 1024:8.1f} KiB  original PNG")
+    sizes = {}
+    for name in image_derivatives.DERIVATIVE_SIZES:
+        for fmt in formats:
+            sizes[name, fmt] = statistics.mean(len(s3.objects[(os.environ['IMAGES_BUCKET'], entry[name][fmt])]['Body'])
+                                               for entry in stored)
+            print(f"  {'':<22} {sizes[name, fmt] / 1024:8.1f} KiB  {name} {fmt}"
+                  f"  (-{100 * (1 - sizes[name, fmt] / png_bytes):.1f}%)")
+    print()
+    
+    print("Checks")
+    failures = []
+    expected = len(image_derivatives.DERIVATIVE_SIZES) * len(formats)
+    check(formats and all(sum(len(v) for v in entry.values()) == expected for entry in stored),
+          f"{expected} derivatives per image", failures)
+    check(s3.calls['get_object'] == 0, "rendered from memory, no S3 GET", failures)
+    check(all(obj.get('CacheControl') == image_gen.IMAGE_CACHE_CONTROL for obj in s3.objects.values()),
+          "derivatives uploaded with immutable cache headers", failures)
+    check(all(size < png_bytes / 10 for (name, _), size in sizes.items() if name == 'thumb'),
+          "thumbnails under a tenth of the PNG", failures)
+    
+    images_table = FakeTable(os.environ['IMAGES_TABLE'], 'imageId')
+    image_gen.dynamodb = FakeDynamoDBResource({images_table.name: images_table})
+    image_gen.save_images('user_1', 'a prompt', [f"img_{i:04d}" for i in range(len(keys))], keys, stored)
+    check(all(images_table.items[f"img_{i:04d}"]['derivatives'] == stored[i] for i in range(len(keys))),
+          "derivative keys recorded on the Images rows", failures)
+    
+    # A failing derivative upload still stores the original
+    put_object = FakeS3.put_object
+    FakeS3.put_object = lambda self, Key, **kw: (
+        (_ for _ in ()).throw(RuntimeError('S3 down')) if Key.endswith('.webp') else put_object(self, Key=Key, **kw))
+    try:
+        _, s3, keys, stored = upload(pngs[:1], 0)
+        check(len(keys) == 1 and (os.environ['IMAGES_BUCKET'], keys[0]) in s3.objects
+              and not any('webp' in by_format for by_format in stored[0].values()),
+              "a failed derivative upload does not fail the image", failures)
+    finally:
+        FakeS3.put_object = put_object
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Image history pages: table scan vs keyset pagination on UserCreatedIndex.
+
+Loads one FakeTable with users owning --sizes images each and reports, per
+user, the items read and latency of a first page and of a deep page (reached
+through cursors) against the old option, a full scan filtered by userId.
+Checks that the page cost does not grow with the user's image count, that
+walking the cursors returns every image once and newest first, that forged
+or foreign cursors are rejected, and that the first page is cached until a
+generation invalidates it. Exits non-zero if a check fails.
+
+    python benchmarks/bench_image_history.py --sizes 100 10000 100000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from local_aws import FakeDynamoDBResource, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('IMAGES_BUCKET', 'imagify-images')
+os.environ.setdefault('IMAGES_TABLE', 'imagify-images')
+os.environ.setdefault('USERS_TABLE', 'imagify-users')
+from botocore.credentials import ReadOnlyCredentials  # noqa: E402
+import identity  # noqa: E402
+import image_delivery  # noqa: E402
+import image_gen  # noqa: E402
+import image_history  # noqa: E402
+import logger  # noqa: E402
+import metrics  # noqa: E402
+
+START = datetime(2024, 1, 1)
+
+def build_images_table(sizes):
+    """Images rows of users user_0..user_n, created in time order (interleaved like real traffic)"""
+    table = FakeTable(os.environ['IMAGES_TABLE'], 'imageId', indexes={image_history.HISTORY_INDEX: ('userId', 'createdAt')})
+    counts = dict(enumerate(sizes))
+    rows, second = [], 0
+    while counts:
+        for user, left in list(counts.items()):
+            second += 1
+            rows.append({
+                'imageId': f"img_{second:08d}",
+                'userId': f"user_{user}",
+                'prompt': f"prompt {second}",
+                'imageKey': f"images/user_{user}/img_{second:08d}.png",
+                'derivatives': {'thumb': {'webp': f"images/user_{user}/img_{second:08d}_thumb.webp"}},
+                'createdAt': (START + timedelta(seconds=second)).isoformat()
+            })
+            counts[user] = left - 1
+            if left == 1:
+                del counts[user]
+    table.load(rows)
+    return table
+
+def measure(table, call, samples):
+    """(median ms, items read per call)"""
+    timings = []
+    reads = table.calls['items_read']
+    for _ in range(samples):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), (table.calls['items_read'] - reads) / samples
+
+def scan_page(table, user_id, limit):
+    """History without the index: scan every row, keep the user's, sort, cut a page"""
+    items, start_key = [], None
+    while True:
+        params = {'FilterExpression': 'userId = :user_id', 'ExpressionAttributeValues': {':user_id': user_id}}
+        if start_key:
+            params['ExclusiveStartKey'] = start_key
+        response = table.scan(**params)
+        items.extend(response['Items'])
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            break
+    return sorted(items, key=lambda item: item['createdAt'], reverse=True)[:limit]
+
+def deep_cursor(table, user_id, pages, limit):
+    cursor = None
+    for _ in range(pages):
+        cursor = image_history.get_history(table, user_id, limit, cursor)['nextCursor']
+    return cursor
+
+def history_event(user, **params):
+    return {'httpMethod': 'GET', 'resource': '/image/history', 'queryStringParameters': params or None,
+            'requestContext': {'authorizer': {'claims': {'sub': f"sub-{user}"}}}}
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 100_000], help='images per user')
+    parser.add_argument('--limit', type=int, default=image_history.HISTORY_PAGE_SIZE, help='page size')
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+    
+    logger._stream = open(os.devnull, 'w')
+    metrics.use_sink(metrics.MemorySink())
+    image_delivery.use_signer(image_delivery.S3UrlSigner(
+        os.environ['IMAGES_BUCKET'], 'ap-southeast-1', get_credentials=lambda: ReadOnlyCredentials('AKID', 'secret', None)))
+    image_history.HISTORY_CACHE_TTL_SECONDS = 0  # measure the query path; the cache is checked below
+    table = build_images_table(args.sizes)
+    
+    print(f"🧪 Image history: {len(table.items)} rows, pages of {args.limit} (median of {args.samples})")
+    print("=" * 70)
+    print(f"  {'images/user':>11} {'scan ms':>10} {'scan reads':>11} {'page 1 ms':>10} {'deep page ms':>13} {'reads/page':>11}")
+    results = {}
+    for user, size in enumerate(args.sizes):
+        user_id = f"user_{user}"
+        scan_ms, scan_reads = measure(table, lambda: scan_page(table, user_id, args.limit), 3)
+        first_ms, first_reads = measure(table, lambda: image_history.get_history(table, user_id, args.limit),
+                                        args.samples)
+        cursor = deep_cursor(table, user_id, max(1, size // args.limit // 2), args.limit)
+        deep_ms, deep_reads = measure(table, lambda: image_history.get_history(table, user_id, args.limit, cursor),
+                                      args.samples)
+        results[size] = (first_ms, deep_ms, first_reads, deep_reads)
+        print(f"  {size:>11} {scan_ms:10.2f} {scan_reads:11.0f} {first_ms:10.3f} {deep_ms:13.3f} "
+              f"{max(first_reads, deep_reads):11.0f}")
+    print()
+    
+    print("Checks")
+    failures = []
+    smallest, largest = results[min(args.sizes)], results[max(args.sizes)]
+    check(all(reads <= args.limit for r in results.values() for reads in r[2:]),
+          f"each page reads at most {args.limit} items at every size", failures)
+    check(max(largest[:2]) < 3 * max(min(smallest[:2]), 0.01),
+          f"page latency at {max(args.sizes)} images within 3x of {min(args.sizes)}", failures)
+    
+    # Walking every page returns each image once, newest first
+    user_id = f"user_{args.sizes.index(sorted(args.sizes)[len(args.sizes) // 2])}"
+    seen, cursor = [], None
+    while True:
+        page = image_history.get_history(table, user_id, image_history.MAX_HISTORY_PAGE_SIZE, cursor)
+        seen.extend(page['images'])
+        cursor = page['nextCursor']
+        if not cursor:
+            break
+    expected = sorted((item for item in table.items.values() if item['userId'] == user_id),
+                      key=lambda item: item['createdAt'], reverse=True)
+    check([image['imageId'] for image in seen] == [item['imageId'] for item in expected],
+          f"cursors walk all {len(expected)} images of {user_id} once, newest first", failures)
+    check(all(set(image) <= {'imageId', 'createdAt', 'prompt', 'status', 'imageUrl', 'derivatives'}
+              and image['imageUrl'].startswith('https://') for image in seen),
+          "rows carry projected attributes and signed URLs only", failures)
+    
+    # Forged and foreign cursors
+    users_table = FakeTable(os.environ['USERS_TABLE'], 'userId', indexes={'EmailIndex': 'email'})
+    users_table.load({'userId': f"user_{user}", 'credits': 100} for user in range(len(args.sizes)))
+    for user in range(len(args.sizes)):
+        identity.remember_user_id(f"sub-{user}", f"user_{user}")
+    image_gen.dynamodb = FakeDynamoDBResource({table.name: table, users_table.name: users_table})
+    foreign = image_history.get_history(table, 'user_0', 1)['nextCursor']
+    responses = [image_gen.handler(history_event(1, cursor=cursor), None)['statusCode']
+                 for cursor in (foreign, foreign[:-4] + 'AAAA', 'not a cursor', '')]
+    check(responses == [400, 400, 400, 200], "forged or another user's cursor rejected with 400", failures)
+    check(image_gen.handler(history_event(1, limit='500'), None)['statusCode'] == 400, "page size capped", failures)
+    
+    # First page cached per warm container, dropped when the user generates
+    image_history.HISTORY_CACHE_TTL_SECONDS = 30
+    queries = table.calls['query']
+    first = image_gen.handler(history_event(0), None)
+    cached = image_gen.handler(history_event(0), None)
+    check(table.calls['query'] == queries + 1 and first['body'] == cached['body'],
+          "first page served from the container cache", failures)
+    image_gen.generate_and_store = lambda prompt, db_user_id, image_ids, *args: (
+        [f"images/{db_user_id}/{image_id}.png" for image_id in image_ids], [{} for _ in image_ids], 0, 0)
+    generated = image_gen.handler({'httpMethod': 'POST', 'body': '{"prompt": "a new one"}',
+                                   'requestContext': history_event(0)['requestContext']}, None)
+    newest = image_history.get_history(table, 'user_0')['images'][0]
+    check(generated['statusCode'] == 200 and newest['prompt'] == 'a new one',
+          "a new generation invalidates the cached first page", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
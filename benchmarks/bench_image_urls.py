@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Signed image URLs: botocore generate_presigned_url vs image_delivery's local signer.
+
+Signs --urls distinct image keys on one thread with each, checks the local
+SigV4 signatures match botocore's byte for byte, that signing never opens a
+network connection, that URLs are stable within a signing window, and that
+the local signer sustains --min-rate URLs/s. CloudFront signing is measured
+too when the cryptography package is importable. Exits non-zero if a check
+fails.
+
+    python benchmarks/bench_image_urls.py --urls 50000
+"""
+import argparse
+import calendar
+import socket
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+from local_aws import add_lambda_path
+
+add_lambda_path()
+import boto3  # noqa: E402
+from botocore.config import Config  # noqa: E402
+from botocore.credentials import ReadOnlyCredentials  # noqa: E402
+import image_delivery  # noqa: E402
+
+BUCKET = 'imagify-images'
+REGION = 'ap-southeast-1'
+CREDENTIALS = ReadOnlyCredentials('AKIDEXAMPLE', 'wJalrXUtnFEMI/K7MDENG/bPxRfiCYEXAMPLEKEY', 'session/token+==')
+
+def botocore_client():
+    session = boto3.session.Session(aws_access_key_id=CREDENTIALS.access_key,
+                                    aws_secret_access_key=CREDENTIALS.secret_key,
+                                    aws_session_token=CREDENTIALS.token, region_name=REGION)
+    return session.client('s3', config=Config(signature_version='s3v4', s3={'addressing_style': 'virtual'}))
+
+def rate(sign, keys):
+    start = time.perf_counter()
+    for key in keys:
+        sign(key)
+    return len(keys) / (time.perf_counter() - start)
+
+def same_signature(signer, client, key):
+    """Local signature equals botocore's for the same key, time and lifetime"""
+    expected = urlparse(client.generate_presigned_url('get_object', Params={'Bucket': BUCKET, 'Key': key},
+                                                      ExpiresIn=4200))
+    query = parse_qs(expected.query)
+    signed_at = calendar.timegm(time.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ'))
+    actual = urlparse(signer.sign_at(key, signed_at, 4200))
+    return (actual.netloc, actual.path, parse_qs(actual.query)) == (expected.netloc, expected.path, query)
+
+def cloudfront_signer():
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except Exception:  # missing, or the Lambda's vendored build for another Python
+        return None
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                            serialization.NoEncryption())
+    return image_delivery.CloudFrontUrlSigner('d111111abcdef8.cloudfront.net', 'K2JCJMDEHXQW5F', pem)
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=50_000)
+    parser.add_argument('--min-rate', type=float, default=10_000, help='required local signing rate (URLs/s)')
+    args = parser.parse_args()
+    
+    keys = [f"images/user_{i % 1000}/img_{i:032x}.png" for i in range(args.urls)]
+    client = botocore_client()
+    signer = image_delivery.S3UrlSigner(BUCKET, REGION, get_credentials=lambda: CREDENTIALS)
+    
+    print(f"🧪 Signed image URLs: {args.urls} keys, one thread")
+    print("=" * 70)
+    botocore_rate = rate(lambda key: client.generate_presigned_url(
+        'get_object', Params={'Bucket': BUCKET, 'Key': key}, ExpiresIn=4200), keys[:max(args.urls // 10, 1)])
+    print(f"  {'botocore presign':<28} {botocore_rate:10.0f} URLs/s")
+    
+    # Any connection attempt while signing fails the run
+    connect = socket.socket.connect
+    socket.socket.connect = lambda *a, **kw: (_ for _ in ()).throw(AssertionError('network call while signing'))
+    try:
+        local_rate = rate(signer.sign, keys)
+        offline = True
+    except AssertionError:
+        local_rate, offline = 0, False
+    finally:
+        socket.socket.connect = connect
+    print(f"  {'image_delivery S3 signer':<28} {local_rate:10.0f} URLs/s")
+    
+    cdn = cloudfront_signer()
+    if cdn is not None:
+        cold = rate(cdn.sign, keys[:1000])
+        warm = rate(cdn.sign, keys[:1000])
+        print(f"  {'CloudFront signer (cold)':<28} {cold:10.0f} URLs/s")
+        print(f"  {'CloudFront signer (cached)':<28} {warm:10.0f} URLs/s")
+    else:
+        print("  ℹ️  cryptography not importable, CloudFront signer not measured")
+    print()
+    
+    print("Checks")
+    failures = []
+    check(local_rate >= args.min_rate, f"local signer over {args.min_rate:.0f} URLs/s on one core", failures)
+    check(offline, "signing makes no network calls", failures)
+    sample = ['images/user_1/img_1.png', 'images/u 1/ả+b~.png', 'images/user_2/a%20b.png']
+    check(all(same_signature(signer, client, key) for key in sample), "signatures identical to botocore's", failures)
+    
+    window = signer.window_seconds
+    start = (time.time() // window + 1) * window
+    first, later, next_window = (signer.sign(keys[0], now) for now in (start, start + window - 1, start + window))
+    check(first == later != next_window, f"URL stable for a {window}s window, then re-signed", failures)
+    expires = int(parse_qs(urlparse(first).query)['X-Amz-Expires'][0])
+    check(expires - window >= signer.ttl_seconds, f"valid {signer.ttl_seconds}s or more from any request", failures)
+    check(image_delivery.image_key(f"https://{BUCKET}.s3.amazonaws.com/images/u/a%20b.png") == 'images/u/a b.png',
+          "legacy public URLs map back to their keys", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
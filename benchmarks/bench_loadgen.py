@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Load generator: open-loop scheduling, HDR percentiles and regression JSON.
+
+Runs loadgen.py against the in-process stand-in API (local_api.py) and
+checks that the profiles schedule the right number of requests, that the
+send rate holds while the server is slow (open loop), that HDR percentiles
+match exact sorted ones, that a server stall shows in p99 where a closed
+loop of users (the old test_performance.py loop) hides it, that connections
+are reused, and that the JSON report round-trips and flags a regression.
+Exits non-zero if a check fails.
+
+    python benchmarks/bench_loadgen.py --rate 100 --stall 1.0
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+
+import loadgen
+from local_api import StandInApi
+
+FAST = {('GET', '/user/credits'): (20, 40), ('GET', '/image/history'): (20, 40)}
+SLOW = {('GET', '/user/credits'): (400, 800), ('GET', '/image/history'): (400, 800)}
+MIX = loadgen.parse_mix('credits=8,history=2')
+
+async def open_loop(latency_ms, rate, duration, connections=64, stall=None, scale=1.0):
+    server = StandInApi(latency_ms, scale=scale)
+    pool = loadgen.ConnectionPool(await server.start(), size=connections)
+    try:
+        if stall:
+            at, seconds = stall
+            asyncio.get_running_loop().call_later(at, server.stall, seconds)
+        stats, elapsed, max_lag = await loadgen.run_load(pool, list(loadgen.constant(rate, duration)), MIX)
+    finally:
+        pool.close()
+        await server.stop()
+    result = loadgen.report({'name': 'constant', 'rate': rate, 'duration': duration}, stats, elapsed, max_lag,
+                            int(rate * duration))
+    result['connections_opened'] = pool.opened
+    return result
+
+async def closed_loop(latency_ms, users, duration, stall):
+    """The previous test: each user sends, waits for the response, sends again"""
+    server = StandInApi(latency_ms)
+    pool = loadgen.ConnectionPool(await server.start(), size=users)
+    histogram = loadgen.HdrHistogram()
+    deadline = time.perf_counter() + duration
+    
+    async def user():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await pool.request('GET', '/user/credits')
+            histogram.record((time.perf_counter() - start) * 1e6)
+    
+    asyncio.get_running_loop().call_later(stall[0], server.stall, stall[1])
+    await asyncio.gather(*(user() for _ in range(users)))
+    pool.close()
+    await server.stop()
+    return histogram
+
+def merged(result):
+    histogram = loadgen.HdrHistogram()
+    for endpoint in result['endpoints'].values():
+        histogram.merge(loadgen.HdrHistogram.from_dict(endpoint['histogram']))
+    return histogram
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=100, help='requests per second of the open-loop runs')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--stall', type=float, default=1.0, help='seconds the server stops answering')
+    parser.add_argument('--users', type=int, default=4, help='users of the closed-loop comparison')
+    args = parser.parse_args()
+    
+    print(f"🧪 Load generator: {args.rate:g} req/s open loop vs {args.users} closed-loop users, "
+          f"{args.stall:g} s server stall")
+    print("=" * 70)
+    steady = asyncio.run(open_loop(FAST, args.rate, args.duration))
+    slow = asyncio.run(open_loop(SLOW, args.rate, args.duration))
+    stalled = asyncio.run(open_loop(FAST, args.rate, args.duration, stall=(1.0, args.stall)))
+    closed = asyncio.run(closed_loop(FAST, args.users, args.duration, (1.0, args.stall)))
+    for name, result in (('steady', steady), ('slow server', slow), ('stalled', stalled)):
+        print(f"  {name}: {result['scheduled_requests']} requests in {result['duration_s']:.2f} s, "
+              f"max send lag {result['max_send_lag_ms']:.1f} ms, {result['connections_opened']} connections")
+        loadgen.print_report(result)
+    closed_p99 = closed.value_at_percentile(99) / 1000
+    print(f"  closed loop: {closed.total} requests, p99 {closed_p99:.1f}ms")
+    print()
+    
+    print("Checks")
+    failures = []
+    counts = (len(list(loadgen.constant(50, 10))), len(list(loadgen.step(10, 10, 1, 3))),
+              len(list(loadgen.ramp(4, 60, **{'from': 10}))))
+    check(counts == (500, 60, 140), f"constant/step/ramp schedule {counts} requests (500, 60, 140)", failures)
+    offsets = list(loadgen.poisson(loadgen.constant(50, 100), seed=1))
+    check(abs(len(offsets) / offsets[-1] - 50) < 2, "Poisson arrivals keep the profile's average rate", failures)
+    
+    slow_rate = sum(e['requests'] for e in slow['endpoints'].values()) / args.duration
+    check(slow['max_send_lag_ms'] < 20 and abs(slow_rate - args.rate) < args.rate * 0.02,
+          f"send rate holds at {args.rate:g} req/s with a 20x slower server (open loop)", failures)
+    
+    rng = random.Random(7)
+    values = sorted(int(rng.lognormvariate(11, 1)) for _ in range(100_000))
+    histogram = loadgen.HdrHistogram()
+    for value in values:
+        histogram.record(value)
+    exact = {p: values[max(0, math.ceil(len(values) * p / 100) - 1)] for p in (50, 90, 95, 99, 99.9, 100)}
+    errors = [abs(histogram.value_at_percentile(p) - value) / value for p, value in exact.items()]
+    check(max(errors) <= 0.001, f"HDR percentiles within 0.1% of exact ones (worst {max(errors):.4%})", failures)
+    
+    stalled_p99 = merged(stalled).value_at_percentile(99) / 1000
+    check(stalled_p99 >= args.stall * 1000 * 0.5,
+          f"the stall shows in the open-loop p99 ({stalled_p99:.0f} ms)", failures)
+    check(closed_p99 < args.stall * 1000 * 0.5,
+          f"while the closed loop's p99 hides it ({closed_p99:.0f} ms, coordinated omission)", failures)
+    check(steady['connections_opened'] <= 64 and steady['connections_opened'] < steady['scheduled_requests'] / 10,
+          f"keep-alive connections reused ({steady['connections_opened']} for {steady['scheduled_requests']} requests)",
+          failures)
+    
+    baseline = json.loads(json.dumps(steady))
+    check(merged(baseline).value_at_percentile(99) == merged(steady).value_at_percentile(99)
+          and not loadgen.compare(steady, baseline, 0.10), "JSON report round-trips without regressions", failures)
+    regressed = asyncio.run(open_loop(FAST, args.rate, 2, scale=2.0))
+    flagged = {(name, metric) for name, metric, _, _ in loadgen.compare(regressed, baseline, 0.10)}
+    check(('credits', 'p50') in flagged, "a 2x slower server is flagged as a regression", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""Microbenchmark: stdlib logging + json.dumps f-strings vs the logger.log_event fast path.
+
+    python benchmarks/bench_logging.py --iterations 100000
+"""
+import argparse
+import io
+import json
+import logging
+import time
+from datetime import datetime
+
+from local_aws import add_lambda_path
+
+add_lambda_path()
+import logger  # noqa: E402
+
+SAMPLE_EVENT = {
+    'path': '/auth/login',
+    'httpMethod': 'POST',
+    'headers': {'Content-Type': 'application/json', 'Authorization': 'Bearer x' * 40},
+    'requestContext': {'requestId': 'abc', 'identity': {'sourceIp': '127.0.0.1'}},
+    'body': json.dumps({'email': 'perf@test.com', 'password': 'TestPass123!'})
+}
+
+def legacy_logger(stream):
+    """The previous setup: basicConfig-style formatter on the stdlib logger"""
+    legacy = logging.getLogger('bench.legacy')
+    legacy.handlers = []
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    legacy.addHandler(handler)
+    legacy.setLevel(logging.INFO)
+    legacy.propagate = False
+    return legacy
+
+def legacy_api_call(legacy):
+    log_data = {
+        'timestamp': datetime.now().isoformat(),
+        'function': 'auth',
+        'user_id': 'user_1',
+        'action': 'login',
+        'success': True,
+        'duration_ms': 12.3
+    }
+    legacy.info(f"API_CALL: {json.dumps(log_data)}")
+
+def legacy_event_dump(stream):
+    print(f"Event: {json.dumps(SAMPLE_EVENT)}", file=stream)
+
+def fast_api_call():
+    logger.log_api_call('auth', 'user_1', 'login', True, 12.3)
+
+def fast_event_dump():
+    logger.log_event('REQUEST', logger.DEBUG, path=SAMPLE_EVENT['path'], method=SAMPLE_EVENT['httpMethod'])
+
+def bench(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100_000)
+    args = parser.parse_args()
+
+    sink = io.StringIO()
+    legacy = legacy_logger(sink)
+    logger._stream = sink
+
+    results = [
+        ('API_CALL (legacy)', bench(lambda: legacy_api_call(legacy), args.iterations)),
+        ('API_CALL (fast path)', bench(fast_api_call, args.iterations)),
+        ('event dump (legacy print)', bench(lambda: legacy_event_dump(sink), args.iterations)),
+        ('request line (DEBUG, gated)', bench(fast_event_dump, args.iterations)),
+    ]
+
+    print("🧪 Logging microbenchmark (µs per call)")
+    print("=" * 70)
+    for name, micros in results:
+        print(f"  {name:<32} {micros:8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Warm login latency: Cognito auth then EmailIndex query vs both at once.
+
+Runs auth.login against FakeCognito and FakeTable stand-ins with the given
+per-call latencies and compares it with the previous sequential flow.
+Checks that a login costs about the slower of the two calls rather than
+their sum, and that failed authentication never returns profile data.
+Exits non-zero if a check fails.
+
+    python benchmarks/bench_login.py --cognito-ms 250 --dynamodb-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from local_aws import FakeCognito, FakeDynamoDBResource, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('USERS_TABLE', 'imagify-users')
+os.environ.setdefault('USER_POOL_ID', 'ap-southeast-1_example')
+os.environ.setdefault('USER_POOL_CLIENT_ID', 'example-client')
+import auth  # noqa: E402
+import logger  # noqa: E402
+from identity import find_user_by_email  # noqa: E402
+
+def sequential_login(data):
+    """The previous flow: admin_initiate_auth, then the EmailIndex query"""
+    auth_result = auth.cognito.admin_initiate_auth(
+        UserPoolId=os.environ['USER_POOL_ID'], ClientId=os.environ['USER_POOL_CLIENT_ID'],
+        AuthFlow='ADMIN_NO_SRP_AUTH', AuthParameters={'USERNAME': data['email'], 'PASSWORD': data['password']})
+    user = find_user_by_email(auth.dynamodb.Table(os.environ['USERS_TABLE']), data['email'])
+    return auth.cors_response(200, {'token': auth_result['AuthenticationResult']['IdToken'],
+                                    'user': {'userId': user['userId'], 'email': user['email'],
+                                             'credits': int(user['credits'])}})
+
+def median_ms(login, data, samples):
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        response = login(data)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert response['statusCode'] == 200, response
+    return statistics.median(timings)
+
+def login_event(email, password):
+    return {'path': '/auth/login', 'httpMethod': 'POST', 'body': json.dumps({'email': email, 'password': password})}
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cognito-ms', type=float, default=250, help='simulated admin_initiate_auth latency')
+    parser.add_argument('--dynamodb-ms', type=float, default=150, help='simulated EmailIndex query latency')
+    parser.add_argument('--samples', type=int, default=10)
+    args = parser.parse_args()
+
+    logger._stream = open(os.devnull, 'w')
+    auth.cognito = cognito = FakeCognito(latency_ms=args.cognito_ms)
+    users_table = FakeTable(os.environ['USERS_TABLE'], 'userId', indexes={'EmailIndex': 'email'},
+                            latency_ms=args.dynamodb_ms)
+    auth.dynamodb = FakeDynamoDBResource({users_table.name: users_table})
+    cognito.add_user('an@example.com', 'correct horse')
+    users_table.load([{'userId': 'user_1', 'email': 'an@example.com', 'credits': 10}])
+    data = {'email': 'an@example.com', 'password': 'correct horse'}
+
+    print(f"🧪 Warm login: Cognito {args.cognito_ms:g} ms, EmailIndex query {args.dynamodb_ms:g} ms")
+    print("=" * 70)
+    sequential = median_ms(sequential_login, data, args.samples)
+    concurrent = median_ms(auth.login, data, args.samples)
+    print(f"  {'sequential':<20} {sequential:8.1f} ms per login (median of {args.samples})")
+    print(f"  {'concurrent':<20} {concurrent:8.1f} ms per login")
+    print()
+
+    print("Checks")
+    failures = []
+    slower, total = max(args.cognito_ms, args.dynamodb_ms), args.cognito_ms + args.dynamodb_ms
+    check(concurrent <= slower * 1.1 + 5, f"login within 10% of the slower call ({slower:g} ms)", failures)
+    check(concurrent < total * 0.8, f"well under the sum of both calls ({total:g} ms)", failures)
+    body = json.loads(auth.handler(login_event('an@example.com', 'correct horse'), None)['body'])
+    check(body['token'] and body['user'] == {'userId': 'user_1', 'email': 'an@example.com', 'credits': 10},
+          "token and profile returned on success", failures)
+
+    responses = [auth.handler(login_event(email, password), None)
+                 for email, password in (('an@example.com', 'wrong'), ('nobody@example.com', 'correct horse'))]
+    check(all(r['statusCode'] == 401 and set(json.loads(r['body'])) == {'error'} for r in responses),
+          "wrong password or unknown user: 401 without profile data", failures)
+    users_table.query = lambda **kwargs: (_ for _ in ()).throw(RuntimeError('DynamoDB down'))
+    response = auth.handler(login_event('an@example.com', 'wrong'), None)
+    check(response['statusCode'] == 401, "auth failure wins over a failing profile query", failures)
+    response = auth.handler(login_event('an@example.com', 'correct horse'), None)
+    check(response['statusCode'] == 500 and 'token' not in json.loads(response['body']),
+          "no token without a profile", failures)
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
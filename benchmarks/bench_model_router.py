@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Model routing: per-model adapters, fastest healthy model, failover and hedged requests.
+
+Runs ModelRouter against a FakeBedrock serving Titan v1, Titan v2 and
+Stable Diffusion XL with a different latency each. Checks that every
+adapter round-trips its model's request and response formats (and that a
+filtered Stable Diffusion artifact is an error), that a new container starts
+on the first model and sends only a sampled share of requests to unmeasured
+ones, that requests settle on the fastest model once each was measured and
+that seeded requests stay pinned to the first model, that a failing model is
+failed over at once, skipped while unhealthy and tried again after the
+cooldown, that a model slower than the latency budget is hedged (the answer
+comes at about budget + the next model's latency) and then routed around,
+that hedges wait for an admission slot, and that the handlers report the
+model that served them. Exits non-zero if a check fails.
+
+    python benchmarks/bench_model_router.py --budget-ms 300 --slow-ms 1500
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import emulator
+from local_aws import FakeBedrock, FakeResponseStream, png
+
+import image_gen  # noqa: E402
+import logger  # noqa: E402
+import metrics  # noqa: E402
+from bedrock_admission import BedrockGovernor, LocalWindows  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+import model_router  # noqa: E402
+from model_router import ADAPTERS, SDXL, TITAN_V1, TITAN_V2, ModelRouter  # noqa: E402
+
+PROMPT = 'A lighthouse at dusk'
+
+def run(router, bedrock, requests, image_count=1, **kwargs):
+    """Route `requests` generations one after another; returns [(model_id, ms, fallback)]"""
+    results = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        routed = router.invoke(bedrock, PROMPT, image_gen.image_generation_config(image_count, None), **kwargs)
+        images = list(routed.images())
+        assert len(images) == image_count
+        results.append((routed.model_id, (time.perf_counter() - started) * 1000, routed.fallback))
+    return results
+
+def warm(router, bedrock):
+    """Measure every model once (every request probes while some are unmeasured)"""
+    probe_rate, router.probe_rate = router.probe_rate, 1
+    results = run(router, bedrock, len(router.adapters))
+    router.probe_rate = probe_rate
+    return results
+
+def at_window_start():
+    """Sleep until early in a wall-clock second, so the calls land in one admission window"""
+    time.sleep((1.05 - time.time() % 1) % 1)
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=300, help='latency budget before a hedged call')
+    parser.add_argument('--slow-ms', type=float, default=1500, help='latency of a degraded model')
+    parser.add_argument('--requests', type=int, default=12)
+    parser.add_argument('--probe-rate', type=float, default=0.1, help='share of requests probing unmeasured models')
+    args = parser.parse_args()
+    logger._stream = open(os.devnull, 'w')
+    metrics.use_sink(metrics.MemorySink())
+    latencies = {TITAN_V1: 120, TITAN_V2: 40, SDXL: 80}
+    
+    print(f"🧭 Model routing: {', '.join(f'{model_id} {ms} ms' for model_id, ms in latencies.items())}, "
+          f"budget {args.budget_ms:g} ms")
+    print("=" * 70)
+    failures = []
+    
+    print("Adapters")
+    images = [png(32, 32, seed) for seed in range(3)]
+    bedrock = FakeBedrock(images=images)
+    for model_id, adapter in ADAPTERS.items():
+        generation_config = image_gen.image_generation_config(1, 7)
+        body = json.loads(adapter.request_body(PROMPT, generation_config))
+        response = bedrock.invoke_model(modelId=model_id, body=json.dumps(body))
+        decoded = list(adapter.iter_images(response['body']))
+        seed = body.get('seed', body.get('imageGenerationConfig', {}).get('seed'))
+        check(decoded == images[:1] and seed == 7, f"{model_id} round-trips one seeded image", failures)
+    filtered = json.dumps({'artifacts': [{'base64': '', 'finishReason': 'CONTENT_FILTERED'}]}).encode()
+    try:
+        list(ADAPTERS[SDXL].iter_images(io.BytesIO(filtered)))
+        raised = False
+    except ValueError:
+        raised = True
+    check(raised, f"a {SDXL} artifact finished with CONTENT_FILTERED is an error", failures)
+    print()
+    
+    print("Routing")
+    bedrock = FakeBedrock(latencies)
+    router = ModelRouter(latency_budget_ms=args.budget_ms, probe_rate=args.probe_rate,
+                         sample=random.Random(1).random)
+    results = run(router, bedrock, args.requests)
+    served = {model_id: sum(r[0] == model_id for r in results) for model_id in latencies}
+    print(f"  {args.requests} requests at probe rate {args.probe_rate:g}: {served}")
+    check(results[0][0] == TITAN_V1, f"a new container starts on the first model ({TITAN_V1})", failures)
+    check(len({model_id for model_id, _, _ in results[:len(latencies)]}) < len(latencies) and served[SDXL] <= 1,
+          f"unmeasured models get sampled probes, not one request each ({served[SDXL]} {SDXL} call)", failures)
+    warm(router, bedrock)
+    settled = run(router, bedrock, args.requests)
+    p50 = statistics.median(ms for _, ms, _ in settled)
+    check(all(model_id == TITAN_V2 for model_id, _, _ in settled),
+          f"once measured every request goes to the fastest model ({TITAN_V2}, p50 {p50:.0f} ms)", failures)
+    pinned = [router.invoke(bedrock, PROMPT, image_gen.image_generation_config(1, 7), pinned=True).model_id
+              for _ in range(3)]
+    check(pinned == [TITAN_V1] * 3, f"seeded requests stay on {TITAN_V1} for the generation cache", failures)
+    sdxl_calls = bedrock.model_calls[SDXL]
+    multi = run(router, bedrock, 3, image_count=3)
+    check(all(model_id == TITAN_V2 for model_id, _, _ in multi) and bedrock.model_calls[SDXL] == sdxl_calls,
+          "3-image requests never go to Stable Diffusion XL (1 image per call)", failures)
+    print()
+    
+    print("Failover")
+    bedrock = FakeBedrock(latencies)
+    router = ModelRouter(latency_budget_ms=args.budget_ms, cooldown_seconds=1)
+    warm(router, bedrock)
+    bedrock.failures[TITAN_V2] = 'ServiceUnavailableException'
+    before = bedrock.model_calls[TITAN_V2]
+    results = run(router, bedrock, args.requests)
+    failed_calls = bedrock.model_calls[TITAN_V2] - before
+    snapshot = router.snapshot()[TITAN_V2]
+    print(f"  {TITAN_V2} unavailable: tried {failed_calls} times in {args.requests} requests, "
+          f"error rate {snapshot['errorRate']:.0%}, served by {sorted({r[0] for r in results})}")
+    check(all(model_id == SDXL for model_id, _, _ in results), "every request is served by the next model", failures)
+    check(max(ms for _, ms, _ in results) < latencies[SDXL] + 50, "failover costs no extra wait", failures)
+    check(not snapshot['healthy'] and failed_calls < args.requests / 2,
+          f"the failing model is skipped once unhealthy ({failed_calls} calls)", failures)
+    del bedrock.failures[TITAN_V2]
+    time.sleep(1.1)
+    check(run(router, bedrock, 1)[0][0] == TITAN_V2, "and tried again after the cooldown", failures)
+    
+    bedrock.failures[TITAN_V1] = 'ValidationException'
+    router = ModelRouter(latency_budget_ms=args.budget_ms)
+    before = sum(bedrock.model_calls.values())
+    try:
+        run(router, bedrock, 1)
+        raised = False
+    except ClientError:
+        raised = True
+    check(raised and sum(bedrock.model_calls.values()) - before == 1 and router.snapshot()[TITAN_V1]['calls'] == 0,
+          "request errors are raised without trying other models", failures)
+    print()
+    
+    print("Hedging")
+    bedrock = FakeBedrock(latencies)
+    router = ModelRouter(latency_budget_ms=args.budget_ms)
+    warm(router, bedrock)
+    bedrock.latency_ms = dict(latencies, **{TITAN_V2: args.slow_ms})
+    hedged = run(router, bedrock, 2)
+    print(f"  {TITAN_V2} at {args.slow_ms:g} ms: answered by "
+          f"{', '.join(f'{model_id} in {ms:.0f} ms' for model_id, ms, _ in hedged)}")
+    check(all(model_id == SDXL and fallback for model_id, _, fallback in hedged),
+          "the next model answers when the first breaches the budget", failures)
+    worst = max(ms for _, ms, _ in hedged)
+    check(worst < args.budget_ms + latencies[SDXL] + 100 < args.slow_ms,
+          f"hedged answers take {worst:.0f} ms (budget + {latencies[SDXL]} ms) instead of {args.slow_ms:g} ms",
+          failures)
+    time.sleep(args.slow_ms / 1000)
+    before = bedrock.model_calls[TITAN_V2]
+    results = run(router, bedrock, 3)
+    check(bedrock.model_calls[TITAN_V2] == before and not any(fallback for _, _, fallback in results),
+          f"once its slow calls are recorded the slow model is routed around ({results[0][0]})", failures)
+    
+    bedrock = FakeBedrock(dict(latencies, **{TITAN_V1: args.slow_ms / 2}))
+    router = ModelRouter(model_ids=[TITAN_V1, TITAN_V2], latency_budget_ms=args.budget_ms / 2)
+    governor = BedrockGovernor(LocalWindows(), max_rate=1, max_queue_seconds=0)
+    at_window_start()
+    governor.admit('user_hedge')
+    model_id, ms, _ = run(router, bedrock, 1, governor=governor, user_key='user_hedge')[0]
+    check(model_id == TITAN_V1 and bedrock.model_calls[TITAN_V2] == 0,
+          f"no hedge without an admission slot (waited {ms:.0f} ms for the first model)", failures)
+    print()
+    
+    print("Handlers")
+    aws = emulator.LocalAws()
+    aws.install(image_gen)
+    model_router.use_router(ModelRouter(probe_rate=1))
+    aws.bedrock.latency_ms = latencies
+    statuses = []
+    for _ in range(len(latencies) + 1):
+        response = image_gen.handler(emulator.claims_event('POST', '/image/generate', {'prompt': PROMPT}), None)
+        statuses.append(response['statusCode'])
+    aws.bedrock.failures[TITAN_V2] = 'ModelNotReadyException'
+    stream = FakeResponseStream()
+    image_gen.stream_handler(emulator.claims_event('POST', '/image/generate', {'prompt': PROMPT, 'numberOfImages': 2}),
+                             stream)
+    prelude, body = stream.response()
+    events = [json.loads(line) for line in body.decode().splitlines()]
+    invoked = next(event for event in events if event['event'] == 'model_invoked')
+    check(all(status == 200 for status in statuses) and aws.bedrock.model_calls[SDXL] == 1,
+          "the generate handler routes through every model and serves each request", failures)
+    check(prelude['statusCode'] == 200 and invoked['modelId'] == TITAN_V1 and invoked['fallback']
+          and events[-1]['event'] == 'done',
+          f"the stream reports the model that served it ({invoked['modelId']}, fallback)", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
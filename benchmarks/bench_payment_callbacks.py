@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""VNPAY callback retry storm: unconditional credit update vs the transactions ledger.
+
+Creates --orders payment URLs through payment.create_vnpay_url, then delivers
+every signed success callback --deliveries times from a thread pool (VNPAY
+retries plus browser refreshes). Runs against the in-memory DynamoDB
+stand-in and checks that each order is credited exactly once.
+
+    python benchmarks/bench_payment_callbacks.py --orders 200 --deliveries 5
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from local_aws import FakeDynamoDBResource, FakeSecretsManager, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('VNPAY_SECRET_ARN', 'arn:aws:secretsmanager:local:000000000000:secret:vnpay')
+os.environ.setdefault('USERS_TABLE', 'imagify-users')
+os.environ.setdefault('TRANSACTIONS_TABLE', 'imagify-transactions')
+import payment  # noqa: E402
+import metrics  # noqa: E402
+import logger  # noqa: E402
+
+HASH_SECRET = 'bench-secret'
+
+def setup(users_count, latency_ms):
+    secrets = FakeSecretsManager()
+    secrets.put_secret(os.environ['VNPAY_SECRET_ARN'], json.dumps({'tmn_code': 'TESTCODE', 'hash_secret': HASH_SECRET}))
+    users = FakeTable(os.environ['USERS_TABLE'], 'userId', latency_ms=latency_ms)
+    users.load({'userId': f'user_{i}', 'credits': 0} for i in range(users_count))
+    transactions = FakeTable(os.environ['TRANSACTIONS_TABLE'], 'transactionId', latency_ms=latency_ms)
+    payment.secrets_client = secrets
+    payment.dynamodb = FakeDynamoDBResource({users.name: users, transactions.name: transactions})
+    payment._vnpay_secret = None
+    return users, transactions
+
+def success_callback(payment_url):
+    """The query VNPAY sends back for a successful payment of payment_url"""
+    request = dict(parse_qsl(urlparse(payment_url).query))
+    params = {
+        'vnp_Amount': request['vnp_Amount'],
+        'vnp_ResponseCode': '00',
+        'vnp_TmnCode': request['vnp_TmnCode'],
+        'vnp_TransactionNo': str(abs(hash(request['vnp_TxnRef'])) % 10**8),
+        'vnp_TxnRef': request['vnp_TxnRef']
+    }
+    sign_data = urlencode(dict(sorted(params.items())))
+    params['vnp_SecureHash'] = hmac.new(HASH_SECRET.encode('utf-8'), sign_data.encode('utf-8'),
+                                        hashlib.sha512).hexdigest()
+    return params
+
+def legacy_callback(params):
+    """The previous crediting: one unconditional update per delivery"""
+    amount = int(params['vnp_Amount']) // 100
+    credits = next(pkg['credits'] for pkg in payment.CREDIT_PACKAGES.values() if pkg['amount'] == amount)
+    payment.dynamodb.Table(os.environ['USERS_TABLE']).update_item(
+        Key={'userId': payment.user_id_from_txn_ref(params['vnp_TxnRef'])},
+        UpdateExpression='SET credits = credits + :credits',
+        ExpressionAttributeValues={':credits': credits}
+    )
+
+def ledger_callback(params):
+    payment.handle_vnpay_callback(dict(params))
+
+def run(callback, args):
+    users, transactions = setup(args.orders, args.latency_ms)
+    callbacks = []
+    for i in range(args.orders):
+        response = payment.create_vnpay_url({'userId': f'user_{i}', 'packageType': 'basic'})
+        callbacks.append(success_callback(json.loads(response['body'])['paymentUrl']))
+        time.sleep(0.001)  # distinct millisecond timestamps in vnp_TxnRef
+    
+    deliveries = [params for params in callbacks for _ in range(args.deliveries)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(callback, deliveries))
+    elapsed = time.perf_counter() - start
+    
+    granted = sum(int(item['credits']) for item in users.items.values())
+    expected = args.orders * payment.CREDIT_PACKAGES['basic']['credits']
+    paid = sum(1 for item in transactions.items.values() if item['status'] == 'paid')
+    return len(deliveries) / elapsed, granted, expected, paid
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--deliveries', type=int, default=5, help='times each callback is delivered')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--latency-ms', type=float, default=2, help='simulated DynamoDB latency')
+    args = parser.parse_args()
+    
+    logger._stream = open(os.devnull, 'w')
+    metrics.use_sink(metrics.MemorySink())
+    
+    print(f"🧪 VNPAY callbacks: {args.orders} orders x {args.deliveries} deliveries, {args.workers} workers")
+    print("=" * 70)
+    print(f"  {'':<24} {'callbacks/s':>12} {'credits granted':>16} {'expected':>10}")
+    failures = []
+    for name, callback in (('unconditional update', legacy_callback), ('transactions ledger', ledger_callback)):
+        throughput, granted, expected, paid = run(callback, args)
+        print(f"  {name:<24} {throughput:12.0f} {granted:16} {expected:10}")
+        if callback is ledger_callback and (granted != expected or paid != args.orders):
+            failures.append(f"ledger granted {granted} credits for {paid} paid orders, expected {expected}")
+    
+    print("=" * 70)
+    if failures:
+        print(f"❌ {failures[0]}")
+        sys.exit(1)
+    print("✅ Every order credited exactly once")
+
+if __name__ == '__main__':
+    main()
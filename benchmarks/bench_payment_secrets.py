@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""VNPAY payment paths with a per-call Secrets Manager lookup vs the secret cache.
+
+Drives payment.create_vnpay_url and payment.handle_vnpay_callback against the
+FakeSecretsManager stand-in (with simulated latency) and counts
+GetSecretValue calls. Also checks that callbacks keep verifying across a
+secret rotation. Exits non-zero if a check fails.
+
+    python benchmarks/bench_payment_secrets.py --requests 500 --latency-ms 20
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import sys
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+from local_aws import FakeDynamoDBResource, FakeSecretsManager, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('VNPAY_SECRET_ARN', 'arn:aws:secretsmanager:local:000000000000:secret:vnpay')
+os.environ.setdefault('USERS_TABLE', 'imagify-users')
+os.environ.setdefault('TRANSACTIONS_TABLE', 'imagify-transactions')
+import payment  # noqa: E402
+import metrics  # noqa: E402
+import logger  # noqa: E402
+
+SECRET_ARN = os.environ['VNPAY_SECRET_ARN']
+
+def vnpay_secret(hash_secret):
+    return json.dumps({'tmn_code': 'TESTCODE', 'hash_secret': hash_secret,
+                       'return_url': 'https://imagify.local/payment-result'})
+
+def signed_callback(hash_secret, txn_ref='user_1_1700000000', amount=10000):
+    """Callback query parameters as VNPAY would send them"""
+    params = {
+        'vnp_Amount': str(amount * 100),
+        'vnp_ResponseCode': '00',
+        'vnp_TmnCode': 'TESTCODE',
+        'vnp_TxnRef': txn_ref
+    }
+    sign_data = urlencode(dict(sorted(params.items())))
+    params['vnp_SecureHash'] = hmac.new(hash_secret.encode('utf-8'), sign_data.encode('utf-8'),
+                                        hashlib.sha512).hexdigest()
+    return params
+
+def legacy_get_vnpay_credentials(secrets):
+    """The previous implementation: one GetSecretValue per request"""
+    secret = json.loads(secrets.get_secret_value(SecretId=SECRET_ARN)['SecretString'])
+    return {'tmn_code': secret['tmn_code'], 'hash_secret': secret['hash_secret'],
+            'return_url': secret.get('return_url')}
+
+def legacy_request(secrets, params):
+    creds = legacy_get_vnpay_credentials(secrets)
+    sign_data = urlencode(dict(sorted((k, v) for k, v in params.items() if k != 'vnp_SecureHash')))
+    signature = hmac.new(creds['hash_secret'].encode('utf-8'), sign_data.encode('utf-8'),
+                         hashlib.sha512).hexdigest()
+    assert signature == params['vnp_SecureHash']
+
+def cached_request(params):
+    payment.handle_vnpay_callback(dict(params))
+
+def verifies(params):
+    try:
+        cached_request(params)
+        return True
+    except ValueError:
+        return False
+
+def setup(latency_ms):
+    secrets = FakeSecretsManager(latency_ms=latency_ms)
+    secrets.put_secret(SECRET_ARN, vnpay_secret('secret-v1'))
+    users = FakeTable(os.environ['USERS_TABLE'], 'userId')
+    users.load([{'userId': 'user_1', 'credits': 0}])
+    transactions = FakeTable(os.environ['TRANSACTIONS_TABLE'], 'transactionId')
+    payment.secrets_client = secrets
+    payment.dynamodb = FakeDynamoDBResource({users.name: users, transactions.name: transactions})
+    payment._vnpay_secret = None
+    return secrets
+
+def timed(func, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies), statistics.quantiles(latencies, n=100)[98]
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--latency-ms', type=float, default=20, help='simulated Secrets Manager latency')
+    args = parser.parse_args()
+    
+    logger._stream = open(os.devnull, 'w')
+    metrics.use_sink(metrics.MemorySink())
+    failures = []
+    params = signed_callback('secret-v1')
+    
+    secrets = setup(args.latency_ms)
+    legacy_p50, legacy_p99 = timed(lambda: legacy_request(secrets, params), args.requests)
+    legacy_calls = secrets.calls['get_secret_value']
+    
+    secrets = setup(args.latency_ms)
+    cached_p50, cached_p99 = timed(lambda: cached_request(params), args.requests)
+    cached_calls = secrets.calls['get_secret_value']
+    
+    print(f"🧪 VNPAY callback verification, {args.requests} requests, {args.latency_ms:g} ms Secrets Manager latency")
+    print("=" * 70)
+    print(f"  {'':<22} {'p50 ms':>10} {'p99 ms':>10} {'GetSecretValue':>16}")
+    print(f"  {'per-call lookup':<22} {legacy_p50:10.3f} {legacy_p99:10.3f} {legacy_calls:16}")
+    print(f"  {'secret cache':<22} {cached_p50:10.3f} {cached_p99:10.3f} {cached_calls:16}")
+    print()
+    
+    print("Checks")
+    check(cached_calls == 1, f"warm requests reuse the cached secret ({cached_calls} call)", failures)
+    
+    response = payment.create_vnpay_url({'userId': 'user_1', 'packageType': 'basic'})
+    query = dict(parse_qsl(urlparse(json.loads(response['body'])['paymentUrl']).query))
+    secure_hash = query.pop('vnp_SecureHash')
+    expected = hmac.new(b'secret-v1', urlencode(query).encode('utf-8'), hashlib.sha512).hexdigest()
+    check(secure_hash == expected, "payment URL signed with the precomputed HMAC-SHA512 key", failures)
+    
+    # Rotation: a callback signed with the new secret forces one refresh of AWSCURRENT,
+    # and callbacks still signed with the old secret verify against AWSPREVIOUS
+    secrets.put_secret(SECRET_ARN, vnpay_secret('secret-v2'))
+    payment.get_vnpay_secret().min_refresh_seconds = 0
+    before = secrets.calls['get_secret_value']
+    check(verifies(signed_callback('secret-v2')) and payment.get_vnpay_secret().version_id() == 'v2',
+          "new AWSCURRENT picked up after rotation", failures)
+    check(verifies(signed_callback('secret-v1')),
+          "callback signed with the previous secret verifies against AWSPREVIOUS", failures)
+    rotation_calls = secrets.calls['get_secret_value'] - before
+    check(not verifies(signed_callback('not-the-secret')), "forged callback rejected", failures)
+    
+    # Refresh-ahead: close to expiry get() answers from memory and refreshes in the background
+    cache = payment.SecretCache(secrets, SECRET_ARN, ttl_seconds=0.3, refresh_ahead_seconds=0.25)
+    cache.get()
+    time.sleep(0.1)
+    before = secrets.calls['get_secret_value']
+    start = time.perf_counter()
+    cache.get()
+    blocked_ms = (time.perf_counter() - start) * 1000
+    time.sleep(args.latency_ms / 1000 + 0.05)
+    check(blocked_ms < args.latency_ms / 2 and secrets.calls['get_secret_value'] == before + 1,
+          f"refresh-ahead runs in the background ({blocked_ms:.2f} ms in get())", failures)
+    print(f"  ℹ️  GetSecretValue calls across rotation: {rotation_calls}")
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Reconciliation of the Transactions table against a VNPAY settlement CSV on local fixtures.
+
+Builds an in-memory Transactions table with --rows orders and a matching
+settlement export, injects a known number of each mismatch kind, then runs
+reconcile.reconcile twice: once reporting, once with repair. Checks the
+counts, that repairs credit users exactly once and that a --since window
+reports only its own mismatches, and reports throughput and peak traced
+memory. Exits non-zero if a check fails.
+
+    python benchmarks/bench_reconcile.py --rows 1000000
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from decimal import Decimal
+
+from local_aws import FakeDynamoDBResource, FakeTable, add_lambda_path
+
+add_lambda_path()
+import reconcile  # noqa: E402
+from transactions_ledger import FAILED, PAID, PENDING  # noqa: E402
+
+START = 1700000000
+
+def pay_date(epoch):
+    """vnp_PayDate format: yyyyMMddHHmmss in GMT+7"""
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(epoch + reconcile.VNPAY_UTC_OFFSET_SECONDS))
+
+def build_fixtures(rows, injected, directory, seed=7):
+    """Transactions/Users tables, a settlement CSV with `injected` rows of each mismatch kind, and the
+    {row index: kind} of those rows
+    
+    Row i is created (and paid) at START + i // 1000; one legacy paid row has no createdAt.
+    """
+    rng = random.Random(seed)
+    transactions = FakeTable('imagify-transactions', 'transactionId')
+    users = FakeTable('imagify-users', 'userId')
+    users.load({'userId': f'user_{i}', 'credits': Decimal(0)} for i in range(1000))
+    
+    settlement_path = os.path.join(directory, 'settlement.csv')
+    kinds = [reconcile.MISSING_CREDIT, reconcile.MISSING_TRANSACTION, reconcile.AMOUNT_MISMATCH,
+             reconcile.NOT_SETTLED, reconcile.UNSETTLED_PAID]
+    special = {i * (rows // (len(kinds) * injected + 1)): kinds[i % len(kinds)]
+               for i in range(1, len(kinds) * injected + 1)}
+    
+    with open(settlement_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['vnp_TxnRef', 'vnp_Amount', 'vnp_TransactionStatus', 'vnp_TransactionNo', 'vnp_PayDate'])
+        ledger = []
+        for i in range(rows):
+            user_id = f'user_{rng.randrange(1000)}'
+            txn_ref = f'{user_id}_{1700000000000 + i}'
+            row = {'transactionId': txn_ref, 'userId': user_id, 'packageType': 'basic',
+                   'amount': Decimal(10000), 'credits': Decimal(100), 'status': PAID,
+                   'createdAt': Decimal(START + i // 1000)}
+            kind = special.get(i)
+            settled = (txn_ref, 1000000, '00')
+            if kind == reconcile.MISSING_CREDIT:
+                row['status'] = rng.choice([PENDING, FAILED])
+            elif kind == reconcile.MISSING_TRANSACTION:
+                row = None
+            elif kind == reconcile.AMOUNT_MISMATCH:
+                settled = (txn_ref, 5000000, '00')
+            elif kind == reconcile.NOT_SETTLED:
+                settled = (txn_ref, 1000000, '02')
+            elif kind == reconcile.UNSETTLED_PAID:
+                settled = None
+            if row is not None:
+                ledger.append(row)
+            if settled:
+                writer.writerow([*settled, str(10**7 + i), pay_date(START + i // 1000)])
+            if len(ledger) >= 10000:
+                transactions.load(ledger)
+                ledger = []
+        transactions.load(ledger)
+        # Paid before the ledger had createdAt
+        transactions.load([{'transactionId': 'user_0_1600000000000', 'userId': 'user_0', 'amount': Decimal(10000),
+                            'credits': Decimal(100), 'status': PAID, 'paidAt': Decimal(START + rows // 1000)}])
+        writer.writerow(['user_0_1600000000000', 1000000, '00', '9999', pay_date(START + rows // 1000)])
+    return transactions, users, settlement_path, special
+
+def run(transactions, users, settlement_path, report_path, args, repair=False, buckets=None, since=None):
+    resource = FakeDynamoDBResource({transactions.name: transactions, users.name: users})
+    start = time.perf_counter()
+    counts = reconcile.reconcile(
+        transactions, settlement_path, report_path, buckets=buckets or args.buckets, segments=args.segments,
+        repair_client=resource.meta.client if repair else None, users_table_name=users.name, since=since
+    )
+    return counts, time.perf_counter() - start
+
+def peak_memory(transactions, users, settlement_path, report_path, args, buckets):
+    """Peak traced allocations of one report-only run (tracing slows it down, so it is not timed)"""
+    tracemalloc.start()
+    run(transactions, users, settlement_path, report_path, args, buckets=buckets)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--injected', type=int, default=20, help='rows of each mismatch kind')
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--buckets', type=int, default=64)
+    args = parser.parse_args()
+    
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        transactions, users, settlement_path, special = build_fixtures(args.rows, args.injected, directory)
+        report_path = os.path.join(directory, 'report.csv')
+        
+        print(f"🧪 Reconciliation: {len(transactions.items)} ledger rows, {args.segments} segments, "
+              f"{args.buckets} buckets")
+        print("=" * 70)
+        for label, repair in (('report only', False), ('repair', True), ('re-run after repair', False)):
+            counts, elapsed = run(transactions, users, settlement_path, report_path, args, repair)
+            print(f"  {label:<22} {counts['ledger_rows'] / elapsed:10.0f} rows/s  "
+                  + ' '.join(f"{kind}={counts[kind]}" for kind in (*reconcile.REPAIRABLE, 'repaired')))
+            if label == 'report only':
+                with open(report_path) as f:
+                    reported = sum(1 for _ in f) - 1
+                check(all(counts[kind] == args.injected for kind in (
+                    reconcile.MISSING_CREDIT, reconcile.MISSING_TRANSACTION, reconcile.AMOUNT_MISMATCH,
+                    reconcile.NOT_SETTLED, reconcile.UNSETTLED_PAID)), "every injected mismatch found", failures)
+                check(reported == 5 * args.injected, f"report lists {reported} mismatches", failures)
+            elif label == 'repair':
+                granted = sum(int(user['credits']) for user in users.items.values())
+                check(counts['repaired'] == 2 * args.injected and counts['already_settled'] == 0,
+                      f"{counts['repaired']} orders repaired", failures)
+                check(granted == 2 * args.injected * 100, f"{granted} credits granted (100 per repaired order)",
+                      failures)
+            else:
+                check(not any(counts[kind] for kind in reconcile.REPAIRABLE), "nothing left to repair", failures)
+        
+        # The second half by creation / pay date: rows outside it are left out on both sides
+        since = START + args.rows // 2000
+        counts, _ = run(transactions, users, settlement_path, report_path, args, since=since)
+        expected = Counter(kind for i, kind in special.items() if START + i // 1000 >= since)
+        found = {kind: counts[kind] for kind in (reconcile.AMOUNT_MISMATCH, reconcile.NOT_SETTLED,
+                                                 reconcile.UNSETTLED_PAID)}
+        print(f"  {'--since (2nd half)':<22} {counts['ledger_rows']} ledger rows, {counts['settlement_rows']} settlement "
+              f"rows, " + ' '.join(f"{kind}={n}" for kind, n in found.items()))
+        check(found == {kind: expected[kind] for kind in found}
+              and not any(counts[kind] for kind in reconcile.REPAIRABLE),
+              "a window reports only its own mismatches (legacy rows without createdAt included)", failures)
+        
+        # Memory is bounded by the bucket buffers plus one bucket of rows, not the table size
+        peak = peak_memory(transactions, users, settlement_path, report_path, args, args.buckets)
+    with tempfile.TemporaryDirectory() as directory:
+        small = build_fixtures(args.rows // 4, args.injected, directory)[:3]
+        small_peak = peak_memory(*small, os.path.join(directory, 'report.csv'), args, args.buckets)
+    print(f"  peak traced memory, {args.rows // 4:>9} rows: {small_peak / 2**20:7.1f} MiB")
+    print(f"  peak traced memory, {args.rows:>9} rows: {peak / 2**20:7.1f} MiB")
+    check(peak < small_peak * 2, "4x the rows stays within 2x the memory", failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
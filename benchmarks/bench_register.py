@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Sign-up bursts: the previous four-call registration vs auth.register.
+
+Registers --signups new users on --concurrency threads against FakeCognito
+and FakeTable stand-ins with simulated latency, once with the previous flow
+(admin_get_user pre-check, then create, set password and put_item in turn,
+userId from the current second) and once with auth.register. Reports the
+latency per sign-up, round trips and how many Users rows survive the burst.
+Checks that no sign-up is lost to an id collision, that ids sort by creation
+time, and that duplicates and half-finished registrations are handled.
+Exits non-zero if a check fails.
+
+    python benchmarks/bench_register.py --signups 200 --concurrency 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from local_aws import FakeCognito, FakeDynamoDBResource, FakeTable, add_lambda_path
+
+add_lambda_path()
+os.environ.setdefault('USERS_TABLE', 'imagify-users')
+os.environ.setdefault('USER_POOL_ID', 'ap-southeast-1_example')
+import auth  # noqa: E402
+import identity  # noqa: E402
+import logger  # noqa: E402
+
+def previous_register(data):
+    """The flow before this change, reduced to its AWS calls"""
+    user_id = f"user_{int(datetime.now().timestamp())}"
+    pool = os.environ['USER_POOL_ID']
+    try:
+        auth.cognito.admin_get_user(UserPoolId=pool, Username=data['email'])
+        return auth.cors_response(400, {'error': 'User already exists'})
+    except Exception:
+        pass
+    auth.cognito.admin_create_user(UserPoolId=pool, Username=data['email'], TemporaryPassword=data['password'],
+                                   MessageAction='SUPPRESS')
+    auth.cognito.admin_set_user_password(UserPoolId=pool, Username=data['email'], Password=data['password'],
+                                         Permanent=True)
+    auth.dynamodb.Table(os.environ['USERS_TABLE']).put_item(Item={
+        'userId': user_id, 'email': data['email'], 'name': data['name'], 'credits': 10,
+        'createdAt': datetime.now().isoformat()})
+    return auth.cors_response(201, {'message': 'User registered', 'userId': user_id})
+
+def fresh_backends(args):
+    auth.cognito = cognito = FakeCognito(latency_ms=args.cognito_ms)
+    table = FakeTable(os.environ['USERS_TABLE'], 'userId', indexes={'EmailIndex': 'email'}, latency_ms=args.dynamodb_ms)
+    auth.dynamodb = FakeDynamoDBResource({table.name: table})
+    return cognito, table
+
+def burst(register, args):
+    """(median ms per sign-up, wall seconds, responses, cognito, table)"""
+    cognito, table = fresh_backends(args)
+    timings = []
+
+    def sign_up(i):
+        start = time.perf_counter()
+        response = register({'email': f"campaign{i}@example.com", 'password': 'Passw0rd!', 'name': f"User {i}"})
+        timings.append((time.perf_counter() - start) * 1000)
+        return response
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        responses = list(pool.map(sign_up, range(args.signups)))
+    return statistics.median(timings), time.perf_counter() - start, responses, cognito, table
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--signups', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--cognito-ms', type=float, default=120, help='simulated latency per Cognito call')
+    parser.add_argument('--dynamodb-ms', type=float, default=40, help='simulated latency per DynamoDB call')
+    args = parser.parse_args()
+
+    logger._stream = open(os.devnull, 'w')
+    print(f"🧪 Sign-up burst: {args.signups} registrations on {args.concurrency} threads, "
+          f"Cognito {args.cognito_ms:g} ms, DynamoDB {args.dynamodb_ms:g} ms")
+    print("=" * 70)
+    print(f"  {'':<12} {'ms/sign-up':>11} {'sign-ups/s':>11} {'Cognito calls':>14} {'rows stored':>12}")
+    results = {}
+    for name, register in (('previous', previous_register), ('register', auth.register)):
+        ms, seconds, responses, cognito, table = results[name] = burst(register, args)
+        print(f"  {name:<12} {ms:11.1f} {args.signups / seconds:11.1f} "
+              f"{sum(cognito.calls.values()) / args.signups:14.1f} {len(table.items):12}")
+    print()
+
+    print("Checks")
+    failures = []
+    ms, _, responses, cognito, table = results['register']
+    expected = args.cognito_ms + max(args.cognito_ms, args.dynamodb_ms)
+    check(ms <= expected * 1.1 + 5, f"sign-up costs create + max(password, put) = {expected:g} ms", failures)
+    check(cognito.calls['admin_get_user'] == 0, "no existence pre-check", failures)
+    ids = [json.loads(r['body'])['userId'] for r in responses if r['statusCode'] == 201]
+    check(len(ids) == len(set(ids)) == len(table.items) == args.signups,
+          f"all {args.signups} sign-ups stored under distinct ids", failures)
+    lost = args.signups - len(results['previous'][4].items)
+    print(f"  ℹ️  the previous flow lost {lost} of {args.signups} rows to same-second ids")
+    ordered = [identity.new_user_id(1_700_000_000 + i / 1000) for i in range(1000)]
+    check(ordered == sorted(ordered) and all(len(i) == 31 for i in ordered), "ids sort by creation time", failures)
+
+    cognito, table = fresh_backends(args)
+    data = {'email': 'dup@example.com', 'password': 'Passw0rd!', 'name': 'Dup'}
+    first, again = auth.register(data), auth.register(data)
+    check(first['statusCode'] == 201 and again['statusCode'] == 400 and len(table.items) == 1,
+          "duplicate email rejected by Cognito's own uniqueness error", failures)
+
+    put_item = table.put_item
+    table.put_item = lambda **kwargs: (_ for _ in ()).throw(RuntimeError('DynamoDB down'))
+    failed = auth.register({'email': 'retry@example.com', 'password': 'Passw0rd!', 'name': 'Retry'})
+    table.put_item = put_item
+    retried = auth.register({'email': 'retry@example.com', 'password': 'Passw0rd!', 'name': 'Retry'})
+    check(failed['statusCode'] == 500 and retried['statusCode'] == 201 and len(table.items) == 2,
+          "a failed write rolls back the Cognito user so the sign-up can be retried", failures)
+
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Time to first byte of image generation: buffered handler vs image_gen.stream_handler.
+
+Runs both against the emulator's stand-ins (emulator.LocalAws) with
+simulated Bedrock, S3 and DynamoDB latency, the streaming one writing to a
+FakeResponseStream that records when each chunk arrives. Checks that the
+first byte leaves right after the credit reservation instead of after the
+whole pipeline, that progress events arrive in pipeline order, that image
+mode sends the PNG before its S3 upload completes, that failures before and
+after the first byte are reported (and refunded), and that the Runtime API
+writer sends every write as its own HTTP chunk. Exits non-zero if a check fails.
+
+    python benchmarks/bench_streaming.py --bedrock-ms 1500 --s3-ms 200
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import emulator
+from local_aws import FakeResponseStream
+
+import image_gen  # noqa: E402
+import logger  # noqa: E402
+import response_stream  # noqa: E402
+
+def generate_event(**body):
+    return emulator.claims_event('POST', '/image/generate', dict({'prompt': 'A lighthouse at dusk'}, **body))
+
+def buffered(event):
+    start = time.perf_counter()
+    response = image_gen.handler(event, None)
+    return response, (time.perf_counter() - start) * 1000
+
+def streamed(event):
+    stream = FakeResponseStream()
+    start = time.perf_counter()
+    image_gen.stream_handler(event, stream)
+    ttfb = (stream.writes[0][0] - start) * 1000 if stream.writes else None
+    return stream, ttfb, (stream.ended_at - start) * 1000
+
+def events_of(stream):
+    prelude, body = stream.response()
+    return prelude, [json.loads(line) for line in body.splitlines()]
+
+class RuntimeApi(BaseHTTPRequestHandler):
+    """Receives one streamed invocation response and records when each chunk arrived"""
+    chunks = []
+
+    def do_POST(self):
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                while self.rfile.readline() not in (b'\r\n', b''):
+                    pass
+                break
+            RuntimeApi.chunks.append((time.perf_counter(), self.rfile.read(size)))
+            self.rfile.readline()
+        self.send_response(202)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bedrock-ms', type=float, default=1500)
+    parser.add_argument('--s3-ms', type=float, default=200)
+    parser.add_argument('--dynamodb-ms', type=float, default=10)
+    parser.add_argument('--images', type=int, default=2)
+    args = parser.parse_args()
+    
+    logger._stream = open(os.devnull, 'w')
+    aws = emulator.LocalAws({'bedrock': args.bedrock_ms, 's3': args.s3_ms, 'dynamodb': args.dynamodb_ms},
+                            image_size=512)
+    aws.install(image_gen)
+    put_done = []
+    put_object = aws.s3.put_object
+    aws.s3.put_object = lambda **kwargs: (put_object(**kwargs), put_done.append((time.perf_counter(), kwargs['Key'])))[0]
+    
+    print(f"🧪 Streaming generation: Bedrock {args.bedrock_ms:g} ms, S3 {args.s3_ms:g} ms, "
+          f"DynamoDB {args.dynamodb_ms:g} ms, {args.images} images")
+    print("=" * 70)
+    response, buffered_ms = buffered(generate_event(numberOfImages=args.images))
+    stream, ttfb, total = streamed(generate_event(numberOfImages=args.images))
+    prelude, events = events_of(stream)
+    print(f"  {'buffered handler':<20} first byte {buffered_ms:8.1f} ms   complete {buffered_ms:8.1f} ms")
+    print(f"  {'stream_handler':<20} first byte {ttfb:8.1f} ms   complete {total:8.1f} ms")
+    for event in events:
+        print(f"    {event['elapsedMs']:8.1f} ms  {event['event']}")
+    print()
+    
+    print("Checks")
+    failures = []
+    check(response['statusCode'] == 200 and prelude['statusCode'] == 200
+          and prelude['headers']['Content-Type'] == response_stream.NDJSON_CONTENT_TYPE,
+          "both variants succeed; the stream is NDJSON", failures)
+    check(ttfb < args.bedrock_ms * 0.1 and ttfb < buffered_ms * 0.05,
+          f"first byte after the reservation ({ttfb:.0f} ms vs {buffered_ms:.0f} ms)", failures)
+    names = [event['event'] for event in events]
+    per_image = [[e['event'] for e in events if e.get('index') == i] for i in range(args.images)]
+    check(names[:2] == ['credits_reserved', 'model_invoked'] and names[-1] == 'done'
+          and all(steps == ['image_decoded', 'image_uploaded', 'image_ready'] for steps in per_image),
+          "events in pipeline order: reserved, invoked, decoded/uploaded/ready per image, done", failures)
+    ready = [e for e in events if e['event'] == 'image_ready']
+    ids = prelude['headers']['X-Image-Ids'].split(',')
+    check([e['imageId'] for e in sorted(ready, key=lambda e: e['index'])] == ids
+          and all(e['imageUrl'].startswith('https://') for e in ready)
+          and all(image_id in aws.images.items for image_id in ids), "URLs signed and rows saved", failures)
+    check(events[-1]['remainingCredits'] == 10 ** 9 - 2 * args.images, "credits committed once", failures)
+    
+    put_done.clear()
+    image_stream, image_ttfb, _ = streamed(generate_event(stream='image'))
+    prelude, body = image_stream.response()
+    png_written = next(t for t, data in image_stream.writes if data.startswith(b'\x89PNG'))
+    upload_done = next(t for t, key in put_done if key.endswith(f"{prelude['headers']['X-Image-Ids']}.png"))
+    check(prelude['headers']['Content-Type'] == 'image/png' and body == aws.bedrock.images[0],
+          "image mode streams the PNG itself", failures)
+    check(png_written < upload_done, f"PNG sent {(upload_done - png_written) * 1000:.0f} ms before its S3 upload "
+          "completed", failures)
+    
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    aws.users.items[emulator.USER_ID]['credits'] = 0
+    broke, _, _ = streamed(generate_event())
+    prelude, body = broke.response()
+    check(prelude['statusCode'] == 400 and json.loads(body) == {'error': 'Insufficient credits'},
+          "errors before the first byte keep their status code", failures)
+    aws.users.items[emulator.USER_ID]['credits'] = credits
+    
+    invoke_model = aws.bedrock.invoke_model
+    aws.bedrock.invoke_model = lambda **kwargs: (_ for _ in ()).throw(RuntimeError('ThrottlingException'))
+    failed, _, _ = streamed(generate_event())
+    aws.bedrock.invoke_model = invoke_model
+    prelude, events = events_of(failed)
+    check(prelude['statusCode'] == 200 and events[-1]['event'] == 'error'
+          and aws.users.items[emulator.USER_ID]['credits'] == credits,
+          "a failure after the first byte ends with an error event and refunds", failures)
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RuntimeApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start = time.perf_counter()
+    image_gen.stream_handler(generate_event(), response_stream.RuntimeApiStream('req-1', f"127.0.0.1:{server.server_port}"))
+    server.shutdown()
+    first, last = RuntimeApi.chunks[0][0] - start, RuntimeApi.chunks[-1][0] - start
+    body = b''.join(data for _, data in RuntimeApi.chunks).partition(response_stream.PRELUDE_DELIMITER)[2]
+    check(len(RuntimeApi.chunks) >= 5 and first < args.bedrock_ms / 1000 * 0.1 < last
+          and json.loads(body.splitlines()[-1])['event'] == 'done',
+          f"Runtime API writer sends {len(RuntimeApi.chunks)} chunks as they happen (first at {first * 1000:.0f} ms)",
+          failures)
+    
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Per-component latency tracing: Server-Timing from the botocore hooks in tracing.py.
+
+Starts a local HTTP stand-in for the Cognito and DynamoDB APIs (with
+--cognito-ms / --dynamodb-ms of latency), points real botocore clients at it
+through AWS_ENDPOINT_URL and calls auth.handler for a login. Checks that the
+Server-Timing header and the TRACE log line report each component's real
+time and call count, that failed calls (connection errors included) are
+timed too, and that the hooks cost only microseconds per call. Exits
+non-zero if a check fails.
+
+    python benchmarks/bench_tracing.py --cognito-ms 120 --dynamodb-ms 60
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from local_aws import add_lambda_path
+
+add_lambda_path()
+os.environ.update({
+    'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE', 'AWS_SECRET_ACCESS_KEY': 'secret', 'AWS_DEFAULT_REGION': 'ap-southeast-1',
+    'USERS_TABLE': 'imagify-users', 'USER_POOL_ID': 'ap-southeast-1_example', 'USER_POOL_CLIENT_ID': 'client'
+})
+
+LATENCY_MS = {}
+
+class StubAws(BaseHTTPRequestHandler):
+    """Answers the JSON-protocol calls of a login after the configured latency"""
+
+    def do_POST(self):
+        target = self.headers.get('X-Amz-Target', '')
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])) or b'{}')
+        service = 'cognito' if target.startswith('AWSCognito') else 'dynamodb'
+        time.sleep(LATENCY_MS[service] / 1000)
+        status, body = 200, {}
+        if target.endswith('AdminInitiateAuth'):
+            if request['AuthParameters']['PASSWORD'] != 'correct horse':
+                status, body = 400, {'__type': 'NotAuthorizedException', 'message': 'Incorrect username or password.'}
+            else:
+                body = {'AuthenticationResult': {'IdToken': 'id-token', 'AccessToken': 'a', 'ExpiresIn': 3600}}
+        elif target.endswith('.Query'):
+            body = {'Items': [{'userId': {'S': 'user_1'}, 'email': {'S': 'an@example.com'}, 'credits': {'N': '10'}}],
+                    'Count': 1, 'ScannedCount': 1}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def login(auth, password):
+    return auth.handler({'path': '/auth/login', 'httpMethod': 'POST',
+                         'body': json.dumps({'email': 'an@example.com', 'password': password})}, None)
+
+def hook_overhead_us(tracing, calls=100_000):
+    """Cost of the start + end hooks for one API call"""
+    class Model:
+        class service_model:
+            service_name = 'dynamodb'
+    tracing._current = tracing.Trace()
+    start = time.perf_counter()
+    for _ in range(calls):
+        context = {}
+        tracing._on_start(context=context, model=Model)
+        tracing._on_end(context=context)
+    tracing._current = None
+    return (time.perf_counter() - start) * 1e6 / calls
+
+def unreachable_call(tracing):
+    """Components timed for one call that fails to connect (after-call-error, no response)"""
+    import aws_clients
+    from botocore.config import Config
+    client = aws_clients.get_session().client(
+        'sqs', region_name='ap-southeast-1', endpoint_url='http://127.0.0.1:9',
+        config=Config(retries={'max_attempts': 1}, connect_timeout=1))
+    trace = tracing._current = tracing.Trace()
+    try:
+        client.list_queues()
+    except Exception:
+        pass
+    tracing._current = None
+    return trace.components
+
+def perf_harness():
+    """test_performance.PerformanceTest when its dependencies (requests) are installed"""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    try:
+        from test_performance import PerformanceTest
+    except ImportError:
+        return None
+    return PerformanceTest()
+
+def _parse(entry):
+    name, *params = [part.strip() for part in entry.split(';')]
+    values = dict(param.split('=', 1) for param in params)
+    return name, values.get('dur', 0), values.get('desc', '').strip('"')
+
+def check(condition, message, failures):
+    print(f"  {'✅' if condition else '❌'} {message}")
+    if not condition:
+        failures.append(message)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cognito-ms', type=float, default=120)
+    parser.add_argument('--dynamodb-ms', type=float, default=60)
+    args = parser.parse_args()
+    LATENCY_MS.update(cognito=args.cognito_ms, dynamodb=args.dynamodb_ms)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAws)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['AWS_ENDPOINT_URL'] = f"http://127.0.0.1:{server.server_port}"
+    import auth
+    import logger
+    import tracing
+    logger._stream = log = io.StringIO()
+
+    print(f"🧪 Tracing: login against a local Cognito ({args.cognito_ms:g} ms) / DynamoDB ({args.dynamodb_ms:g} ms)")
+    print("=" * 70)
+    login(auth, 'correct horse')  # builds the clients and the connection pools
+    log.seek(0)
+    log.truncate()
+    response = login(auth, 'correct horse')
+    header = response['headers'].get('Server-Timing', '')
+    print(f"  Server-Timing: {header}")
+    overhead = hook_overhead_us(tracing)
+    print(f"  hook overhead: {overhead:.1f} µs per call")
+    print()
+
+    print("Checks")
+    failures = []
+    timings = {name: (float(dur), desc) for name, dur, desc in
+               (_parse(entry) for entry in header.split(','))}
+    check(response['statusCode'] == 200, "login succeeded through botocore", failures)
+    check(abs(timings['cognito'][0] - args.cognito_ms) < 25 and timings['cognito'][1] == '1 call',
+          f"cognito timed at ~{args.cognito_ms:g} ms, 1 call", failures)
+    check(abs(timings['dynamodb'][0] - args.dynamodb_ms) < 25 and timings['dynamodb'][1] == '1 call',
+          f"dynamodb timed at ~{args.dynamodb_ms:g} ms, 1 call (on the login's second thread)", failures)
+    check(timings['total'][0] < args.cognito_ms + args.dynamodb_ms, "total reflects the overlapped calls",
+          failures)
+    trace = [json.loads(line) for line in log.getvalue().splitlines() if '"TRACE"' in line][-1]
+    check(trace['handler'] == 'auth' and set(trace['components']) == {'cognito', 'dynamodb'},
+          "TRACE log line carries the same components", failures)
+
+    failed = login(auth, 'wrong')
+    check(failed['statusCode'] == 401 and 'cognito;dur=' in failed['headers'].get('Server-Timing', ''),
+          "failed calls are timed too", failures)
+    unreachable = unreachable_call(tracing)
+    check(unreachable.get('sqs', [0, 0])[1] == 1, "connection errors are timed too", failures)
+    check(overhead < 20, "hooks cost under 20 µs per call", failures)
+
+    harness = perf_harness()
+    if harness is None:
+        print("  ℹ️  requests not installed, test_performance parsing not exercised")
+    else:
+        breakdown = harness.component_latency(header, timings['total'][0] + 40)
+        check(breakdown['cognito_ms'] == round(timings['cognito'][0], 1)
+              and breakdown['api_gateway_network_ms'] == 40.0, "test_performance parses the header", failures)
+
+    server.shutdown()
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
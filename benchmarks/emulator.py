@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""Local emulator for the Lambda handlers: replays API Gateway events in-process.
+
+Every AWS dependency is a stand-in from local_aws.py (DynamoDB, Cognito, S3,
+Bedrock Runtime, SQS, Secrets Manager, CloudWatch and the Cognito JWKS),
+with an optional latency per service and configurable Bedrock images, so the
+handlers run on a laptop without a deployment. For each scenario the
+emulator reports throughput, latency percentiles (HDR histograms from
+loadgen.py), AWS calls per invocation and an allocation profile
+(tracemalloc: peak and retained bytes per invocation, top retaining lines).
+With no latency configured (the default) the numbers are the handlers' own
+CPU cost, which is where hot-path regressions show first.
+
+    python benchmarks/emulator.py --iterations 200
+    python benchmarks/emulator.py --scenarios generate,history --latency dynamodb=5,bedrock=300 \\
+        --json handlers.json --compare baseline.json
+"""
+import argparse
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import loadgen
+from local_aws import (LAMBDA_DIR, FakeBedrock, FakeCloudWatch, FakeCognito, FakeDynamoDBResource, FakeJwks, FakeS3,
+                       FakeSecretsManager, FakeSQS, FakeTable, add_lambda_path, png)
+
+add_lambda_path()
+os.environ.update({
+    'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE', 'AWS_SECRET_ACCESS_KEY': 'secret', 'AWS_DEFAULT_REGION': 'ap-southeast-1',
+    'USERS_TABLE': 'imagify-users', 'IMAGES_TABLE': 'imagify-images', 'TRANSACTIONS_TABLE': 'imagify-transactions',
+    'BEDROCK_ADMISSION_TABLE': 'imagify-bedrock-admission',
+    'IMAGES_BUCKET': 'imagify-images', 'JOBS_QUEUE_URL': 'https://sqs.local/imagify-jobs',
+    'USER_POOL_ID': 'ap-southeast-1_local', 'USER_POOL_CLIENT_ID': 'local-client',
+    'VNPAY_SECRET_ARN': 'arn:aws:secretsmanager:local:000000000000:secret:vnpay'
+})
+
+SERVICES = ('dynamodb', 'cognito', 's3', 'bedrock', 'sqs', 'secretsmanager', 'cloudwatch', 'jwks')
+
+EMAIL, PASSWORD, SUB, USER_ID = 'perf@test.com', 'TestPass123!', 'sub-perf', 'user_perf'
+HASH_SECRET = 'local-hash-secret'
+
+class LocalAws:
+    """One set of stand-ins, installed into the handler modules in place of their clients"""
+
+    def __init__(self, latency_ms=None, image_size=256, history_images=50):
+        latency_ms = dict(dict.fromkeys(SERVICES, 0), **(latency_ms or {}))
+        self.latency_ms = latency_ms
+        self.users = FakeTable(os.environ['USERS_TABLE'], 'userId', indexes={'EmailIndex': 'email'},
+                               latency_ms=latency_ms['dynamodb'])
+        self.images = FakeTable(os.environ['IMAGES_TABLE'], 'imageId',
+                                indexes={'UserCreatedIndex': ('userId', 'createdAt')}, latency_ms=latency_ms['dynamodb'])
+        self.transactions = FakeTable(os.environ['TRANSACTIONS_TABLE'], 'transactionId',
+                                      latency_ms=latency_ms['dynamodb'])
+        self.admission = FakeTable(os.environ['BEDROCK_ADMISSION_TABLE'], 'windowKey', latency_ms=latency_ms['dynamodb'])
+        self.dynamodb = FakeDynamoDBResource({t.name: t for t in (self.users, self.images, self.transactions,
+                                                                  self.admission)})
+        self.cognito = FakeCognito(latency_ms['cognito'])
+        self.s3 = FakeS3(latency_ms['s3'], keep_bodies=False)
+        self.bedrock = FakeBedrock(latency_ms['bedrock'], images=[png(image_size, image_size, seed) for seed in range(2)])
+        self.sqs = FakeSQS(latency_ms['sqs'])
+        self.secrets = FakeSecretsManager(latency_ms['secretsmanager'])
+        self.cloudwatch = FakeCloudWatch(latency_ms['cloudwatch'])
+        self.jwks = None  # built with the authorizer: generating its RSA key needs cryptography
+        
+        self.cognito.add_user(EMAIL, PASSWORD)
+        self.users.load([{'userId': USER_ID, 'email': EMAIL, 'name': 'Perf', 'credits': 10 ** 9}])
+        self.images.load({'imageId': f"img_seed{i:04d}", 'userId': USER_ID, 'prompt': 'seed',
+                          'imageKey': f"images/{USER_ID}/img_seed{i:04d}.png",
+                          'createdAt': f"2024-01-01T00:{i // 60:02d}:{i % 60:02d}"} for i in range(history_images))
+        self.secrets.put_secret(os.environ['VNPAY_SECRET_ARN'],
+                                json.dumps({'tmn_code': 'LOCAL', 'hash_secret': HASH_SECRET}))
+
+    def backends(self):
+        return {'dynamodb': self.users, 'cognito': self.cognito, 's3': self.s3, 'bedrock': self.bedrock,
+                'sqs': self.sqs, 'secretsmanager': self.secrets, 'cloudwatch': self.cloudwatch, 'jwks': self.jwks}
+
+    def call_counts(self):
+        """Total calls per service so far"""
+        counts = Counter()
+        for service, backend in self.backends().items():
+            if backend is not None:
+                counts[service] += sum(backend.calls.values())
+        for table in (self.images, self.transactions, self.admission):
+            counts['dynamodb'] += sum(table.calls.values())
+        counts['dynamodb'] += sum(self.dynamodb.meta.client.calls.values())
+        return counts
+
+    def install(self, module):
+        """Point a handler module (and the shared modules it uses) at the stand-ins"""
+        import bedrock_admission
+        import image_delivery
+        import metrics
+        import model_router
+        from botocore.credentials import ReadOnlyCredentials
+        for attribute, backend in {'dynamodb': self.dynamodb, 'cognito': self.cognito, 's3': self.s3,
+                                   'bedrock': self.bedrock, 'sqs': self.sqs,
+                                   'secrets_client': self.secrets}.items():
+            if hasattr(module, attribute):
+                setattr(module, attribute, backend)
+        if module.__name__ == 'payment':
+            module._vnpay_secret = None
+        if module.__name__ == 'authorizer':
+            if self.jwks is None:
+                self.jwks = FakeJwks(self.latency_ms['jwks'])
+            module._verifier = module.TokenVerifier(os.environ['USER_POOL_ID'], os.environ['USER_POOL_CLIENT_ID'])
+            module._verifier.jwks_client = self.jwks
+        image_delivery.use_signer(image_delivery.S3UrlSigner(
+            os.environ['IMAGES_BUCKET'], 'ap-southeast-1',
+            get_credentials=lambda: ReadOnlyCredentials('AKIDEXAMPLE', 'secret', None)))
+        metrics.use_sink(metrics.CloudWatchSink(client=self.cloudwatch))
+        # Admission counts in the stand-in table, but the stand-in Bedrock has no quota to protect
+        bedrock_admission.use_governor(bedrock_admission.BedrockGovernor(
+            bedrock_admission.DynamoDbWindows(self.admission), max_rate=10 ** 6))
+        # Model stats start empty, as in a new container
+        model_router.use_router(model_router.ModelRouter())
+
+# Scenarios: name -> (module, handler, event factory(aws, n))
+
+def claims_event(method, path, body=None, resource=None, query=None):
+    return {'httpMethod': method, 'path': path, 'resource': resource or path, 'queryStringParameters': query,
+            'body': json.dumps(body) if body is not None else None,
+            'requestContext': {'authorizer': {'claims': {'sub': SUB, 'email': EMAIL}}}}
+
+def payment_event(aws, n):
+    """A package order from a distinct user (order ids are per user and millisecond)"""
+    aws.users.load([{'userId': f"user_pay{n}", 'email': f"pay{n}@test.com", 'credits': 0}])
+    event = claims_event('POST', '/payment/vnpay', {'packageType': 'basic'})
+    event['requestContext']['authorizer']['claims'] = {'sub': f"sub-pay{n}", 'email': f"pay{n}@test.com"}
+    return event
+
+def callback_event(aws, n):
+    """A signed VNPAY success callback for a fresh pending order"""
+    txn_ref = f"{USER_ID}_{1_700_000_000_000 + n}"
+    aws.transactions.load([{'transactionId': txn_ref, 'userId': USER_ID, 'packageType': 'basic', 'amount': 10000,
+                            'credits': 100, 'status': 'pending', 'createdAt': int(time.time())}])
+    params = {'vnp_Amount': '1000000', 'vnp_ResponseCode': '00', 'vnp_TmnCode': 'LOCAL',
+              'vnp_TransactionNo': str(n), 'vnp_TxnRef': txn_ref}
+    sign_data = urlencode(dict(sorted(params.items())))
+    params['vnp_SecureHash'] = hmac.new(HASH_SECRET.encode(), sign_data.encode(), hashlib.sha512).hexdigest()
+    return {'httpMethod': 'GET', 'path': '/payment/callback', 'queryStringParameters': params}
+
+_tokens = {}
+
+def authorizer_event(aws, n):
+    if 'token' not in _tokens:
+        _tokens['token'] = aws.jwks.token(os.environ['USER_POOL_CLIENT_ID'], sub=SUB, email=EMAIL,
+                                          username=USER_ID)
+    return {'type': 'TOKEN', 'authorizationToken': f"Bearer {_tokens['token']}",
+            'methodArn': 'arn:aws:execute-api:ap-southeast-1:000000000000:local/prod/GET/user/credits'}
+
+SCENARIOS = {
+    'login': ('auth', 'handler', lambda aws, n: {
+        'httpMethod': 'POST', 'path': '/auth/login', 'body': json.dumps({'email': EMAIL, 'password': PASSWORD})}),
+    'register': ('auth', 'handler', lambda aws, n: {
+        'httpMethod': 'POST', 'path': '/auth/register',
+        'body': json.dumps({'email': f"new{n}@test.com", 'password': PASSWORD, 'name': f"User {n}"})}),
+    'credits': ('auth', 'handler', lambda aws, n: claims_event('GET', '/user/credits')),
+    'generate': ('image_gen', 'handler', lambda aws, n: claims_event(
+        'POST', '/image/generate', {'prompt': 'A lighthouse at dusk'})),
+    'generate_async': ('image_gen', 'handler', lambda aws, n: claims_event(
+        'POST', '/image/generate', {'prompt': 'A lighthouse at dusk', 'async': True})),
+    'history': ('image_gen', 'handler', lambda aws, n: claims_event(
+        'GET', '/image/history', resource='/image/history', query={'limit': '20'})),
+    'payment': ('payment', 'handler', payment_event),
+    'payment_callback': ('payment', 'handler', callback_event),
+    'authorizer': ('authorizer', 'handler', authorizer_event)
+}
+
+def failed(response):
+    return isinstance(response, dict) and response.get('statusCode', 200) >= 500
+
+def run_scenario(aws, name, iterations, concurrency=1, warmup=5, allocation_iterations=50):
+    """Throughput, latency, AWS calls and allocations of one scenario; raises ImportError if its module cannot load"""
+    module_name, handler_name, make_event = SCENARIOS[name]
+    module = importlib.import_module(module_name)
+    aws.install(module)
+    handler = getattr(module, handler_name)
+    counter = iter(range(10 ** 9))
+
+    def invoke(event):
+        try:
+            response = handler(event, None)
+        except Exception as e:
+            return 'error', type(e).__name__
+        return ('error' if failed(response) else 'ok'), (response or {}).get('statusCode', 200)
+    
+    for _ in range(warmup):
+        invoke(make_event(aws, next(counter)))
+    
+    # Latency and throughput
+    events = [make_event(aws, next(counter)) for _ in range(iterations)]
+    histogram = loadgen.HdrHistogram()
+    outcomes = Counter()
+    calls_before = aws.call_counts()
+
+    def timed(event):
+        start = time.perf_counter()
+        outcome = invoke(event)
+        return (time.perf_counter() - start) * 1e6, outcome
+    
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(timed, events))
+    else:
+        results = [timed(event) for event in events]
+    elapsed = time.perf_counter() - start
+    for micros, outcome in results:
+        histogram.record(micros)
+        outcomes[outcome] += 1
+    calls = aws.call_counts() - calls_before
+    
+    return {
+        'module': f"{module_name}.{handler_name}",
+        'requests': iterations,
+        'errors': sum(count for (kind, _), count in outcomes.items() if kind == 'error'),
+        'status_codes': {str(code): count for (_, code), count in sorted(outcomes.items(), key=str)},
+        'throughput_rps': round(iterations / elapsed, 2),
+        'latency_ms': loadgen.latency_summary(histogram),
+        'aws_calls_per_request': {service: round(count / iterations, 2) for service, count in sorted(calls.items())},
+        'allocations': allocation_profile(aws, invoke, make_event, counter, allocation_iterations),
+        'histogram': histogram.to_dict()
+    }
+
+def allocation_profile(aws, invoke, make_event, counter, iterations):
+    """Per-invocation tracemalloc peak and retained bytes, and the lines retaining the most"""
+    events = [make_event(aws, next(counter)) for _ in range(iterations)]
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.take_snapshot()
+        peaks, retained = [], []
+        for event in events:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            invoke(event)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(current - before)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    lambda_files = [tracemalloc.Filter(True, os.path.join(LAMBDA_DIR, '*.py'))]
+    growth = [stat for stat in snapshot.filter_traces(lambda_files).compare_to(
+        baseline.filter_traces(lambda_files), 'lineno') if stat.size_diff > 0][:3]
+    peaks.sort()
+    return {
+        'peak_kib_p50': round(peaks[len(peaks) // 2] / 1024, 1),
+        'peak_kib_max': round(peaks[-1] / 1024, 1),
+        'retained_bytes_per_request': round(sum(retained) / len(retained)),
+        'top_retaining_lines': [f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno} "
+                                f"+{stat.size_diff / len(events):.0f} B/request" for stat in growth]
+    }
+
+def run(scenarios, iterations, concurrency=1, latency_ms=None, image_size=256, allocation_iterations=50):
+    """{'endpoints': {scenario: result}, 'skipped': {scenario: reason}} in loadgen's report shape"""
+    import logger
+    import metrics
+    logger._stream = open(os.devnull, 'w')
+    aws = LocalAws(latency_ms, image_size)
+    result = {'latency_ms': aws.latency_ms, 'concurrency': concurrency, 'endpoints': {}, 'skipped': {}}
+    try:
+        for name in scenarios:
+            try:
+                result['endpoints'][name] = run_scenario(aws, name, iterations, concurrency,
+                                                         allocation_iterations=allocation_iterations)
+            except ImportError as e:
+                # The vendored native packages (cryptography) only load on the Lambda runtime's Python
+                result['skipped'][name] = f"{type(e).__name__}: {e}"
+    finally:
+        metrics.use_sink(metrics.MemorySink())
+    return result
+
+def print_report(result):
+    print(f"  {'scenario':<17} {'req/s':>9} {'p50':>9} {'p99':>9} {'max':>9} {'errors':>6} "
+          f"{'peak KiB':>9} {'kept B':>7}  AWS calls/request")
+    for name, endpoint in result['endpoints'].items():
+        latency, allocations = endpoint['latency_ms'], endpoint['allocations']
+        calls = ', '.join(f"{service} {count:g}" for service, count in endpoint['aws_calls_per_request'].items())
+        print(f"  {name:<17} {endpoint['throughput_rps']:>9.1f} {latency['p50']:>7.2f}ms {latency['p99']:>7.2f}ms "
+              f"{latency['max']:>7.2f}ms {endpoint['errors']:>6} {allocations['peak_kib_p50']:>9.1f} "
+              f"{allocations['retained_bytes_per_request']:>7}  {calls}")
+        for line in allocations['top_retaining_lines']:
+            print(f"  {'':<17} retains {line}")
+    for name, reason in result['skipped'].items():
+        print(f"  {name:<17} skipped ({reason})")
+
+def parse_latency(spec):
+    """'dynamodb=5,bedrock=3000' -> {'dynamodb': 5.0, 'bedrock': 3000.0}"""
+    latency = {}
+    for part in spec.split(','):
+        service, _, ms = part.partition('=')
+        if service not in SERVICES:
+            raise argparse.ArgumentTypeError(f"unknown service {service!r} (choose from {', '.join(SERVICES)})")
+        latency[service] = float(ms)
+    return latency
+
+def parse_scenarios(spec):
+    names = [name for name in spec.split(',') if name]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown scenario {unknown[0]!r} (choose from {', '.join(SCENARIOS)})")
+    return names
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', type=parse_scenarios, default=list(SCENARIOS),
+                        help=f"comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--iterations', type=int, default=200, help='timed invocations per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads invoking the handler at once')
+    parser.add_argument('--latency', type=parse_latency, default={},
+                        help=f"simulated ms per call, e.g. dynamodb=5,bedrock=3000 (services: {', '.join(SERVICES)})")
+    parser.add_argument('--image-size', type=int, default=256, help='edge in pixels of the PNGs Bedrock returns')
+    parser.add_argument('--allocation-iterations', type=int, default=50)
+    parser.add_argument('--json', help='write the results (summaries and histograms) to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run; exit 1 on a latency regression')
+    parser.add_argument('--tolerance', type=float, default=0.20, help='allowed p50/p95/p99 increase vs baseline')
+    args = parser.parse_args()
+    
+    print(f"🧪 Local handler emulator: {len(args.scenarios)} scenarios x {args.iterations} invocations, "
+          f"concurrency {args.concurrency}, latency {args.latency or 'none'}")
+    print("=" * 70)
+    result = run(args.scenarios, args.iterations, args.concurrency, args.latency, args.image_size,
+                 args.allocation_iterations)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = loadgen.compare(result, json.load(f), args.tolerance)
+        for name, metric, before, after in regressions:
+            print(f"  ❌ {name} {metric}: {before:.2f}ms -> {after:.2f}ms")
+        if regressions:
+            sys.exit(1)
+        print(f"  ✅ no latency regression over {args.tolerance:.0%} vs {args.compare}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Cold-start import profile of the Lambda handler modules (python -X importtime).
+
+Each handler is imported in a fresh interpreter, the way a new Lambda
+container does it. Reports the cumulative import time per handler and the
+modules with the largest self time; with --budget-ms it exits non-zero when a
+handler goes over budget, so CI can catch a regression (e.g. a new top-level
+boto3 import).
+
+    python benchmarks/import_profile.py
+    python benchmarks/import_profile.py --budget-ms 150 --json import-profile.json
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from local_aws import LAMBDA_DIR
+
+HANDLERS = ['auth', 'authorizer', 'image_gen', 'image_gen_bedrock', 'payment']
+
+# "import time:       123 |       4567 |     botocore.session"
+LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+def profile_import(module, python=sys.executable):
+    """Import module in a fresh interpreter; returns (cumulative_us, [(self_us, name), ...])"""
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(LAMBDA_DIR), PYTHONDONTWRITEBYTECODE='1')
+    env.setdefault('AWS_DEFAULT_REGION', 'ap-southeast-1')
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    
+    cumulative = None
+    modules = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules.append((int(self_us), name))
+        # The handler is the last top-level entry; its cumulative time covers everything it pulled in
+        if name == module and len(indent) == 1:
+            cumulative = int(cumulative_us)
+    return cumulative, modules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('handlers', nargs='*', default=HANDLERS)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler (median is reported)')
+    parser.add_argument('--top', type=int, default=5, help='heaviest modules listed per handler')
+    parser.add_argument('--budget-ms', type=float, help='fail if any handler imports slower than this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+    
+    print("🧪 Handler import profile (cold interpreter, -X importtime)")
+    print("=" * 70)
+    
+    results = {}
+    failures = []
+    for handler in args.handlers:
+        try:
+            runs = [profile_import(handler) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"  {handler:<20} ❌ {e}")
+            failures.append(handler)
+            continue
+        
+        total_ms = statistics.median(cumulative for cumulative, _ in runs) / 1000
+        heaviest = sorted(runs[-1][1], reverse=True)[:args.top]
+        results[handler] = {
+            'import_ms': round(total_ms, 2),
+            'modules': len(runs[-1][1]),
+            'heaviest': [{'module': name, 'self_ms': round(us / 1000, 2)} for us, name in heaviest]
+        }
+        
+        over = args.budget_ms is not None and total_ms > args.budget_ms
+        if over:
+            failures.append(handler)
+        print(f"  {handler:<20} {total_ms:8.1f} ms  ({len(runs[-1][1])} modules){'  ❌ over budget' if over else ''}")
+        for us, name in heaviest:
+            print(f"      {us / 1000:7.1f} ms  {name}")
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'handlers': results}, f, indent=2)
+    
+    print("=" * 70)
+    if failures:
+        print(f"❌ {len(failures)} handler(s) failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ All handlers within budget" if args.budget_ms is not None else "✅ Done")
+
+if __name__ == '__main__':
+    main()
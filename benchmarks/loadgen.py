@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Open-loop load generator for the Imagify API.
+
+Requests are sent on a schedule fixed by the load profile, whatever the
+server's latency, over a pool of keep-alive connections (asyncio, standard
+library only). Each latency is measured from the request's scheduled send
+time, so queueing behind a slow server is counted instead of hidden
+(coordinated omission). Latencies go into HDR histograms per endpoint and
+the run is written as JSON that --compare checks against a baseline.
+
+Profiles:
+    constant:rate=50,duration=30            50 req/s for 30 s
+    step:start=10,step=10,every=10,steps=5  10, 20, ... 50 req/s, 10 s each
+    ramp:from=10,to=100,duration=60         linear 10 -> 100 req/s
+    
+    python benchmarks/loadgen.py --local --profile constant:rate=50,duration=10 --json run.json
+    python benchmarks/loadgen.py --url https://api.example.com/prod --email perf@test.com --password ... \\
+        --mix credits=8,history=2 --profile ramp:from=5,to=50,duration=60 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import ssl
+import sys
+import time
+from urllib.parse import urlsplit
+
+PERCENTILES = (50, 95, 99, 99.9)
+
+class HdrHistogram:
+    """High dynamic range histogram of integer values (e.g. microseconds)
+    
+    Values are kept to `significant_figures` decimal digits of precision
+    across the whole range with log-linear buckets: recording is O(1) and
+    memory does not grow with the number of samples, unlike sorting a list.
+    Counts are stored sparsely, so a histogram serializes to compact JSON.
+    """
+
+    def __init__(self, significant_figures=3):
+        self.significant_figures = significant_figures
+        # Sub-buckets per power of two, enough for the requested precision
+        self._sub_bucket_half_magnitude = math.ceil(math.log2(2 * 10 ** significant_figures)) - 1
+        self._sub_bucket_half_count = 1 << self._sub_bucket_half_magnitude
+        self._sub_bucket_mask = (2 * self._sub_bucket_half_count) - 1
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._sum = 0
+
+    def _index(self, value):
+        bucket = max(0, (value | self._sub_bucket_mask).bit_length() - (self._sub_bucket_half_magnitude + 1))
+        sub_bucket = value >> bucket
+        return ((bucket + 1) << self._sub_bucket_half_magnitude) + (sub_bucket - self._sub_bucket_half_count)
+
+    def _range(self, index):
+        """(lowest, highest) value counted at index"""
+        bucket = (index >> self._sub_bucket_half_magnitude) - 1
+        sub_bucket = (index & (self._sub_bucket_half_count - 1)) + self._sub_bucket_half_count
+        if bucket < 0:
+            sub_bucket -= self._sub_bucket_half_count
+            bucket = 0
+        lowest = sub_bucket << bucket
+        return lowest, lowest + (1 << bucket) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+        self._sum += value * count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        self._sum += other._sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def value_at_percentile(self, percentile):
+        """Highest value equivalent to the sample at percentile (0-100)"""
+        if not self.total:
+            return 0
+        target = max(1, math.ceil(round(percentile / 100 * self.total, 9)))  # 0.999 * 100000 != 99900.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._range(index)[1], self.max)
+        return self.max
+
+    def mean(self):
+        return self._sum / self.total if self.total else 0
+
+    def to_dict(self):
+        return {'significant_figures': self.significant_figures, 'total': self.total, 'min': self.min,
+                'max': self.max, 'sum': self._sum, 'counts': {str(i): c for i, c in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data['significant_figures'])
+        histogram.counts = {int(i): c for i, c in data['counts'].items()}
+        histogram.total, histogram.min, histogram.max, histogram._sum = \
+            data['total'], data['min'], data['max'], data['sum']
+        return histogram
+
+# Load profiles: each yields the send offsets (seconds from the start) of every request
+
+def constant(rate, duration):
+    return _piecewise([(float(rate), float(duration))])
+
+def step(start, step, every, steps):
+    return _piecewise([(float(start) + i * float(step), float(every)) for i in range(int(steps))])
+
+def ramp(duration, to, **kwargs):
+    """Linear ramp from kwargs['from'] to `to` req/s over duration"""
+    start, to, duration = float(kwargs['from']), float(to), float(duration)
+    slope = (to - start) / duration
+    n = 0
+    while True:
+        # Solve start*t + slope*t^2/2 = n for the n-th arrival
+        if slope:
+            t = (-start + math.sqrt(start * start + 2 * slope * n)) / slope
+        else:
+            t = n / start
+        if t >= duration:
+            return
+        yield t
+        n += 1
+
+def _piecewise(segments):
+    offset = 0.0
+    for rate, duration in segments:
+        count = int(rate * duration)
+        for i in range(count):
+            yield offset + i / rate
+        offset += duration
+
+PROFILES = {'constant': constant, 'step': step, 'ramp': ramp}
+
+def parse_profile(spec):
+    """'ramp:from=10,to=100,duration=60' -> (name, kwargs)"""
+    name, _, params = spec.partition(':')
+    if name not in PROFILES:
+        raise argparse.ArgumentTypeError(f"unknown profile {name!r} (choose from {', '.join(PROFILES)})")
+    kwargs = dict(param.split('=', 1) for param in params.split(',') if param)
+    return name, kwargs
+
+def poisson(offsets, seed=0):
+    """Same average rate, exponential gaps (a more realistic arrival process)"""
+    rng = random.Random(seed)
+    previous, current = 0.0, 0.0
+    for offset in offsets:
+        current += rng.expovariate(1.0) * (offset - previous)
+        previous = offset
+        yield current
+
+class HttpResponse:
+    def __init__(self, status, headers, body, sent):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.sent = sent  # perf_counter() when the request went out on a connection
+
+class ConnectionPool:
+    """Keep-alive HTTP/1.1 connections to one origin, at most `size` at once"""
+
+    def __init__(self, url, size=64, timeout=30):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.timeout = timeout
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self.opened = 0
+    
+    async def _connect(self):
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+    
+    async def request(self, method, path, headers=None, body=None):
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                response, keep_alive = await asyncio.wait_for(
+                    self._exchange(connection, method, path, headers or {}, body), self.timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                connection[1].close()
+            return response
+    
+    async def _exchange(self, connection, method, path, headers, body):
+        reader, writer = connection
+        payload = body if isinstance(body, bytes) else (json.dumps(body).encode() if body is not None else b'')
+        lines = [f"{method} {self.base_path}{path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(payload)}",
+                 'Connection: keep-alive']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        sent = time.perf_counter()
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await writer.drain()
+        
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b''.join(chunks)
+        else:
+            data = await reader.readexactly(int(response_headers.get('content-length', 0)))
+        keep_alive = response_headers.get('connection', '').lower() != 'close'
+        return HttpResponse(status, response_headers, data, sent), keep_alive
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+# Endpoints of the Imagify API: name -> (method, path, body, needs token)
+ENDPOINTS = {
+    'login': ('POST', '/auth/login', lambda args: {'email': args.email, 'password': args.password}, False),
+    'credits': ('GET', '/user/credits', None, True),
+    'history': ('GET', '/image/history', None, True),
+    'generate': ('POST', '/image/generate', lambda args: {'prompt': 'A lighthouse at dusk, load test'}, True),
+    'payment': ('POST', '/payment/vnpay', lambda args: {'packageType': 'basic'}, True)
+}
+
+def parse_mix(spec):
+    """'credits=8,history=2' -> [(name, weight), ...]"""
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+class EndpointStats:
+    def __init__(self):
+        self.latency = HdrHistogram()       # µs from the scheduled send time
+        self.service_time = HdrHistogram()  # µs from the write on a pooled connection
+        self.status_codes = {}
+        self.errors = 0
+
+    def summary(self, elapsed):
+        return {
+            'requests': self.latency.total,
+            'errors': self.errors,
+            'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+            'throughput_rps': round(self.latency.total / elapsed, 2) if elapsed else 0,
+            'latency_ms': latency_summary(self.latency),
+            'service_time_ms': latency_summary(self.service_time),
+            'histogram': self.latency.to_dict()
+        }
+
+def latency_summary(histogram):
+    summary = {f"p{p:g}": round(histogram.value_at_percentile(p) / 1000, 3) for p in PERCENTILES}
+    summary.update(mean=round(histogram.mean() / 1000, 3), max=round((histogram.max or 0) / 1000, 3))
+    return summary
+
+async def run_load(pool, offsets, mix, headers=None, bodies=None, seed=0):
+    """Send one request per offset following mix; returns ({endpoint: EndpointStats}, elapsed s, max lag s)"""
+    rng = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    stats = {name: EndpointStats() for name in names}
+    loop = asyncio.get_running_loop()
+    tasks = []
+    max_lag = 0.0
+    
+    async def send(name, scheduled):
+        method, path, _, _ = ENDPOINTS[name]
+        try:
+            response = await pool.request(method, path, headers, (bodies or {}).get(name))
+        except Exception:
+            stats[name].errors += 1
+            return
+        finished = time.perf_counter()
+        stats[name].latency.record((finished - scheduled) * 1e6)
+        stats[name].service_time.record((finished - response.sent) * 1e6)
+        stats[name].status_codes[response.status] = stats[name].status_codes.get(response.status, 0) + 1
+        if response.status >= 500:
+            stats[name].errors += 1
+    
+    start = time.perf_counter()
+    for offset in offsets:
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        # Open loop: never wait for earlier responses before sending the next request
+        tasks.append(loop.create_task(send(rng.choices(names, weights)[0], scheduled)))
+    await asyncio.gather(*tasks)
+    return stats, time.perf_counter() - start, max_lag
+
+async def login_token(pool, email, password):
+    response = await pool.request('POST', '/auth/login', body={'email': email, 'password': password})
+    if response.status != 200:
+        raise RuntimeError(f"login failed with {response.status}: {response.body[:200]!r}")
+    return json.loads(response.body)['token']
+
+def report(profile, stats, elapsed, max_lag, scheduled):
+    return {
+        'profile': profile,
+        'scheduled_requests': scheduled,
+        'duration_s': round(elapsed, 3),
+        'max_send_lag_ms': round(max_lag * 1000, 3),
+        'endpoints': {name: endpoint.summary(elapsed) for name, endpoint in stats.items()}
+    }
+
+def compare(current, baseline, tolerance):
+    """Regressions of current vs baseline: [(endpoint, metric, baseline ms, current ms)]"""
+    regressions = []
+    for name, endpoint in current['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if not previous:
+            continue
+        for metric in ('p50', 'p95', 'p99'):
+            before, after = previous['latency_ms'][metric], endpoint['latency_ms'][metric]
+            if after > before * (1 + tolerance):
+                regressions.append((name, metric, before, after))
+    return regressions
+
+def print_report(result):
+    print(f"  {'endpoint':<10} {'requests':>8} {'errors':>6} {'rps':>8} " +
+          ' '.join(f"{'p' + format(p, 'g'):>9}" for p in PERCENTILES) + f" {'max':>9}")
+    for name, endpoint in result['endpoints'].items():
+        latency = endpoint['latency_ms']
+        print(f"  {name:<10} {endpoint['requests']:>8} {endpoint['errors']:>6} {endpoint['throughput_rps']:>8.1f} " +
+              ' '.join(f"{latency['p' + format(p, 'g')]:>7.1f}ms" for p in PERCENTILES) + f" {latency['max']:>7.1f}ms")
+
+async def main_async(args):
+    name, kwargs = args.profile
+    offsets = list(PROFILES[name](**kwargs))
+    if args.arrivals == 'poisson':
+        offsets = list(poisson(offsets, args.seed))
+    server = None
+    url = args.url
+    if args.local:
+        from local_api import StandInApi
+        server = StandInApi(seed=args.seed)
+        url = await server.start()
+    pool = ConnectionPool(url, size=args.connections, timeout=args.timeout)
+    try:
+        headers = {}
+        if any(ENDPOINTS[endpoint][3] for endpoint, _ in args.mix):
+            headers['Authorization'] = await login_token(pool, args.email, args.password)
+        bodies = {endpoint: ENDPOINTS[endpoint][2](args) for endpoint, _ in args.mix if ENDPOINTS[endpoint][2]}
+        print(f"🧪 Open-loop load: {args.profile[0]} {kwargs}, {len(offsets)} requests, "
+              f"{args.arrivals} arrivals, {args.connections} connections -> {url}")
+        print("=" * 70)
+        stats, elapsed, max_lag = await run_load(pool, offsets, args.mix, headers, bodies, args.seed)
+    finally:
+        pool.close()
+        if server:
+            await server.stop()
+    result = report({'name': name, **kwargs, 'arrivals': args.arrivals}, stats, elapsed, max_lag, len(offsets))
+    result['connections_opened'] = pool.opened
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='API base URL (e.g. https://...execute-api.../prod)')
+    parser.add_argument('--local', action='store_true', help='run against the in-process stand-in API (local_api.py)')
+    parser.add_argument('--profile', type=parse_profile, default=parse_profile('constant:rate=20,duration=10'))
+    parser.add_argument('--arrivals', choices=('uniform', 'poisson'), default='uniform')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('credits=8,history=2'),
+                        help=f"endpoint weights, from: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--connections', type=int, default=64, help='keep-alive connection pool size')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--email', default='perf@test.com')
+    parser.add_argument('--password', default='TestPass123!')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the run (summaries and histograms) to this file')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run; exit 1 on a latency regression')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed p50/p95/p99 increase vs baseline')
+    args = parser.parse_args()
+    if not args.url and not args.local:
+        parser.error('give --url or --local')
+    
+    result = asyncio.run(main_async(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for name, metric, before, after in regressions:
+            print(f"  ❌ {name} {metric}: {before:.1f}ms -> {after:.1f}ms")
+        if regressions:
+            sys.exit(1)
+        print(f"  ✅ no latency regression over {args.tolerance:.0%} vs {args.compare}")
+
+if __name__ == '__main__':
+    main()
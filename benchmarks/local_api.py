@@ -0,0 +1,103 @@
+"""In-process stand-in for the Imagify HTTP API, for offline load tests.
+
+Serves the API Gateway routes over HTTP/1.1 keep-alive on 127.0.0.1 with
+canned JSON bodies and a log-normal latency per route (median, p99), so
+loadgen.py and the benchmarks can run without a deployment. stall() pauses
+every response for a while, to see how a client reports a server hiccup.
+"""
+import asyncio
+import json
+import math
+import random
+
+# Route -> (median ms, p99 ms), roughly the warm latencies measured in prod
+LATENCY_MS = {
+    ('POST', '/auth/login'): (250, 600),
+    ('GET', '/user/credits'): (60, 180),
+    ('GET', '/image/history'): (45, 150),
+    ('POST', '/image/generate'): (4000, 9000),
+    ('POST', '/payment/vnpay'): (80, 220)
+}
+
+_Z99 = 2.326  # standard normal quantile of p99
+
+BODIES = {
+    '/auth/login': {'token': 'local-id-token', 'user': {'userId': 'user_local', 'email': 'perf@test.com',
+                                                       'credits': 100}},
+    '/user/credits': {'userId': 'user_local', 'credits': 100, 'email': 'perf@test.com'},
+    '/image/history': {'images': [], 'nextCursor': None},
+    '/image/generate': {'imageId': 'img_local', 'imageUrl': 'https://example.com/img_local.png',
+                        'remainingCredits': 99},
+    '/payment/vnpay': {'paymentUrl': 'https://sandbox.vnpayment.vn/paymentv2/vpcpay.html', 'orderId': 'local'}
+}
+
+class StandInApi:
+    """asyncio HTTP server answering the API routes after a sampled latency"""
+
+    def __init__(self, latency_ms=None, scale=1.0, seed=0):
+        self.latency_ms = dict(LATENCY_MS if latency_ms is None else latency_ms)
+        self.scale = scale
+        self.requests = 0
+        self.connections = 0
+        self._rng = random.Random(seed)
+        self._stalled_until = 0.0
+        self._server = None
+        self._handlers = set()
+
+    def sample_ms(self, route):
+        median, p99 = self.latency_ms.get(route, (1, 1))
+        sigma = math.log(p99 / median) / _Z99 if p99 > median else 0.0
+        return median * math.exp(self._rng.gauss(0, sigma)) * self.scale
+
+    def stall(self, seconds):
+        """Hold every response until `seconds` from now"""
+        self._stalled_until = asyncio.get_running_loop().time() + seconds
+    
+    async def start(self, host='127.0.0.1', port=0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return f"http://{host}:{self._server.sockets[0].getsockname()[1]}"
+    
+    async def stop(self):
+        self._server.close()
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+    
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    if name.strip().lower() == 'content-length':
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                path = path.split('?', 1)[0]
+                self.requests += 1
+                
+                loop = asyncio.get_running_loop()
+                delay = self.sample_ms((method, path)) / 1000
+                delay = max(delay, self._stalled_until - loop.time())
+                await asyncio.sleep(delay)
+                status, body = (200, BODIES[path]) if (method, path) in self.latency_ms else (404, {'error': 'Not found'})
+                data = json.dumps(body).encode()
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: keep-alive\r\n\r\n".encode() + data)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
@@ -0,0 +1,749 @@
+"""In-memory stand-ins for the AWS resources used by the Lambdas in infrastructure/lambda.
+
+Only the call shapes the handlers actually use are implemented. Every call is
+counted so benchmarks can report round trips, and an optional per-call latency
+simulates the network.
+"""
+import base64
+import bisect
+import copy
+import io
+import json
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'infrastructure', 'lambda')
+
+def add_lambda_path():
+    """Make the Lambda modules importable from the benchmark scripts"""
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+_EQUALS = re.compile(r'^\s*(\w+)\s*=\s*(:\w+)\s*$')
+
+# Condition terms: attribute_exists(a), attribute_not_exists(a), contains(a, :v), a <op> :v
+_FUNCTION = re.compile(r'^(attribute_exists|attribute_not_exists|contains)\(\s*(#?\w+)\s*(?:,\s*(:\w+)\s*)?\)$')
+_COMPARISON = re.compile(r'^(#?\w+)\s*(=|<>|>=|<=|>|<)\s*(:\w+)$')
+# SET values: :v, a + :v, a - :v, if_not_exists(a, :v)
+_SET_VALUE = re.compile(r'^(?:(#?\w+)\s*([+-])\s*)?(:\w+)$')
+_IF_NOT_EXISTS = re.compile(r'^if_not_exists\(\s*(#?\w+)\s*,\s*(:\w+)\s*\)$')
+# Commas between actions, not inside a function's arguments
+_ACTION_SEPARATOR = re.compile(r',(?![^()]*\))')
+_UPDATE_CLAUSE = re.compile(r'\b(SET|ADD|DELETE|REMOVE)\s+')
+
+# Writes are applied under one lock so concurrent benchmark threads see atomic conditional updates
+_write_lock = threading.RLock()
+
+def _name(token, names):
+    return (names or {}).get(token, token)
+
+def _split(expression, keyword):
+    """Split expression on AND or OR outside parentheses"""
+    parts, depth, start = [], 0, 0
+    for match in re.finditer(rf'[()]|\s+{keyword}\s+', expression):
+        if match.group() == '(':
+            depth += 1
+        elif match.group() == ')':
+            depth -= 1
+        elif depth == 0:
+            parts.append(expression[start:match.start()].strip())
+            start = match.end()
+    parts.append(expression[start:].strip())
+    return parts
+
+def _parenthesized(term):
+    """Whether term is wrapped in one pair of parentheses"""
+    if not (term.startswith('(') and term.endswith(')')):
+        return False
+    depth = 0
+    for char in term[:-1]:
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if depth == 0:
+            return False
+    return True
+
+def condition_holds(expression, item, names=None, values=None):
+    """Evaluate a condition expression (AND, OR, NOT and parentheses) against item (None if it does not exist)"""
+    if not expression:
+        return True
+    item = item or {}
+    return any(all(_term_holds(term, item, names, values) for term in _split(alternative, 'AND'))
+               for alternative in _split(expression.strip(), 'OR'))
+
+def _term_holds(term, item, names, values):
+    negate = term.startswith('NOT ')
+    if negate:
+        term = term[4:].strip()
+    if _parenthesized(term):
+        return condition_holds(term[1:-1], item, names, values) != negate
+    function = _FUNCTION.match(term)
+    if function:
+        func, attr, placeholder = function.groups()
+        attr = _name(attr, names)
+        if func == 'attribute_exists':
+            result = attr in item
+        elif func == 'attribute_not_exists':
+            result = attr not in item
+        else:
+            result = values[placeholder] in item.get(attr, ())
+    else:
+        attr, op, placeholder = _COMPARISON.match(term).groups()
+        current, value = item.get(_name(attr, names)), values[placeholder]
+        if current is None:
+            result = op == '<>'
+        else:
+            result = {'=': current == value, '<>': current != value, '>=': current >= value,
+                      '<=': current <= value, '>': current > value, '<': current < value}[op]
+    return result != negate
+
+def _path(item, path, names):
+    """(parent map, attribute) of a document path like a.#b; a missing parent map is a ValidationException"""
+    *parents, attr = (_name(part.strip(), names) for part in path.split('.'))
+    for part in parents:
+        if not isinstance(item.get(part), dict):
+            raise client_error('ValidationException',
+                               'The document path provided in the update expression is invalid for update',
+                               'UpdateItem')
+        item = item[part]
+    return item, attr
+
+def apply_update(expression, item, names=None, values=None):
+    """Apply SET/ADD/DELETE/REMOVE actions to item in place"""
+    parts = _UPDATE_CLAUSE.split(expression.strip())
+    for clause, body in zip(parts[1::2], parts[2::2]):
+        for action in (a.strip() for a in _ACTION_SEPARATOR.split(body) if a.strip()):
+            if clause == 'SET':
+                target, source = (side.strip() for side in action.split('=', 1))
+                if_not_exists = _IF_NOT_EXISTS.match(source)
+                if if_not_exists:
+                    attr, placeholder = if_not_exists.groups()
+                    value = item.get(_name(attr, names), values[placeholder])
+                else:
+                    attr, op, placeholder = _SET_VALUE.match(source).groups()
+                    value = values[placeholder]
+                    if attr:
+                        base = item.get(_name(attr, names), 0)
+                        value = base + value if op == '+' else base - value
+                parent, attr = _path(item, target, names)
+                parent[attr] = value
+            elif clause == 'REMOVE':
+                parent, attr = _path(item, action, names)
+                parent.pop(attr, None)
+            else:
+                attr, placeholder = action.split()
+                attr, value = _name(attr, names), values[placeholder]
+                if clause == 'ADD':
+                    if isinstance(value, set):
+                        item[attr] = set(item.get(attr, set())) | value
+                    else:
+                        item[attr] = item.get(attr, 0) + value
+                else:
+                    remaining = set(item.get(attr, set())) - value
+                    if remaining:
+                        item[attr] = remaining
+                    else:
+                        item.pop(attr, None)
+    return item
+
+class FakeTable:
+    """Dict-backed DynamoDB Table with GSIs
+    
+    indexes maps an index name to its hash attribute, or to a (hash, range)
+    pair for indexes queried in sort order with pagination.
+    """
+
+    def __init__(self, name, key, indexes=None, latency_ms=0):
+        self.name = name
+        self.table_name = name
+        self.key = key
+        self.items = {}
+        self.indexes = {}
+        self.sort_keys = {}
+        self._sorted = {}  # index name -> hash value -> sorted [(range value, key)]
+        for index_name, attrs in (indexes or {}).items():
+            attr, sort_attr = (attrs, None) if isinstance(attrs, str) else attrs
+            self.indexes[index_name] = (attr, {})
+            if sort_attr:
+                self.sort_keys[index_name] = sort_attr
+                self._sorted[index_name] = {}
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self._segments = {}
+        self._meta = None
+
+    @property
+    def meta(self):
+        """table.meta.client: the low-level client, for calls like BatchGetItem"""
+        if self._meta is None:
+            self._meta = _Meta(FakeDynamoDBClient({self.name: self}))
+        return self._meta
+
+    def _wait(self, operation):
+        self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def _index(self, item):
+        for index_name, (attr, entries) in self.indexes.items():
+            if attr in item:
+                entries.setdefault(item[attr], {})[item[self.key]] = item
+                sort_attr = self.sort_keys.get(index_name)
+                if sort_attr in item:
+                    bisect.insort(self._sorted[index_name].setdefault(item[attr], []),
+                                  (item[sort_attr], item[self.key]))
+
+    def _unindex(self, item):
+        for index_name, (attr, entries) in self.indexes.items():
+            if attr in item:
+                entries.get(item[attr], {}).pop(item[self.key], None)
+                sort_attr = self.sort_keys.get(index_name)
+                if sort_attr in item:
+                    ordered = self._sorted[index_name].get(item[attr], [])
+                    position = bisect.bisect_left(ordered, (item[sort_attr], item[self.key]))
+                    if position < len(ordered) and ordered[position] == (item[sort_attr], item[self.key]):
+                        del ordered[position]
+
+    def load(self, items):
+        """Bulk-load items without counting calls"""
+        for item in items:
+            self.items[item[self.key]] = item
+            self._index(item)
+
+    def _store(self, item):
+        previous = self.items.get(item[self.key])
+        if previous is not None:
+            self._unindex(previous)
+        self.items[item[self.key]] = item
+        self._index(item)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self._wait('put_item')
+        with _write_lock:
+            previous = self.items.get(Item[self.key])
+            if not condition_holds(ConditionExpression, previous, ExpressionAttributeNames, ExpressionAttributeValues):
+                raise client_error('ConditionalCheckFailedException', 'The conditional request failed', 'PutItem')
+            self._store(copy.deepcopy(Item))
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE',
+                    ReturnValuesOnConditionCheckFailure='NONE', **kwargs):
+        self._wait('update_item')
+        with _write_lock:
+            previous = self.items.get(Key[self.key])
+            if not condition_holds(ConditionExpression, previous, ExpressionAttributeNames, ExpressionAttributeValues):
+                error = client_error('ConditionalCheckFailedException', 'The conditional request failed', 'UpdateItem')
+                if ReturnValuesOnConditionCheckFailure == 'ALL_OLD' and previous is not None:
+                    error.response['Item'] = copy.deepcopy(previous)
+                raise error
+            item = apply_update(UpdateExpression, copy.deepcopy(previous or dict(Key)),
+                                ExpressionAttributeNames, ExpressionAttributeValues)
+            self._store(item)
+        if ReturnValues in ('ALL_NEW', 'UPDATED_NEW'):
+            return {'Attributes': copy.deepcopy(item)}
+        if ReturnValues == 'ALL_OLD' and previous is not None:
+            return {'Attributes': copy.deepcopy(previous)}
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._wait('get_item')
+        item = self.items.get(Key[self.key])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._wait('delete_item')
+        with _write_lock:
+            previous = self.items.pop(Key[self.key], None)
+            if previous is not None:
+                self._unindex(previous)
+        return {}
+
+    def batch_writer(self):
+        """Context manager buffering put_item calls into BatchWriteItem calls of 25"""
+        return _FakeBatchWriter(self)
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, IndexName=None, Limit=None, **kwargs):
+        self._wait('query')
+        attr, placeholder = _EQUALS.match(KeyConditionExpression).groups()
+        value = ExpressionAttributeValues[placeholder]
+        if IndexName in self.sort_keys:
+            return self._query_sorted(IndexName, attr, value, Limit, **kwargs)
+        if IndexName:
+            index_attr, entries = self.indexes[IndexName]
+            assert index_attr == attr, f'{IndexName} is keyed on {index_attr}, not {attr}'
+            items = list(entries.get(value, {}).values())
+        else:
+            items = [self.items[value]] if value in self.items else []
+        if Limit:
+            items = items[:Limit]
+        self.calls['items_read'] += len(items)
+        return {'Items': copy.deepcopy(items), 'Count': len(items)}
+
+    def _query_sorted(self, index_name, attr, value, limit, ScanIndexForward=True, ExclusiveStartKey=None,
+                      ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        """One page of a range-key index, in sort order, resuming after ExclusiveStartKey"""
+        index_attr, _ = self.indexes[index_name]
+        assert index_attr == attr, f'{index_name} is keyed on {index_attr}, not {attr}'
+        sort_attr = self.sort_keys[index_name]
+        ordered = self._sorted[index_name].get(value, [])
+        if ScanIndexForward:
+            start = bisect.bisect_right(ordered, (ExclusiveStartKey[sort_attr], ExclusiveStartKey[self.key])) \
+                if ExclusiveStartKey else 0
+            page = ordered[start:start + limit] if limit else ordered[start:]
+            more = start + len(page) < len(ordered)
+        else:
+            end = bisect.bisect_left(ordered, (ExclusiveStartKey[sort_attr], ExclusiveStartKey[self.key])) \
+                if ExclusiveStartKey else len(ordered)
+            page = ordered[max(0, end - limit):end][::-1] if limit else ordered[:end][::-1]
+            more = end - len(page) > 0
+        items = [self.items[key] for _, key in page]
+        self.calls['items_read'] += len(items)
+        if ProjectionExpression:
+            attrs = [_name(a.strip(), ExpressionAttributeNames) for a in ProjectionExpression.split(',')]
+            items = [{a: item[a] for a in attrs if a in item} for item in items]
+        response = {'Items': copy.deepcopy(items), 'Count': len(items)}
+        if more and page:
+            last = self.items[page[-1][1]]
+            response['LastEvaluatedKey'] = {self.key: last[self.key], attr: last[attr], sort_attr: last[sort_attr]}
+        return response
+
+    def _segment_keys(self, segment, total_segments):
+        # Cached per table size so paginating a large segment stays linear
+        cached = self._segments.get((segment, total_segments))
+        if cached is None or cached[0] != len(self.items):
+            keys = [k for k in self.items if zlib.crc32(str(k).encode('utf-8')) % total_segments == segment]
+            cached = (len(self.items), keys, {k: i for i, k in enumerate(keys)})
+            self._segments[(segment, total_segments)] = cached
+        return cached[1], cached[2]
+
+    def scan(self, FilterExpression=None, ExpressionAttributeValues=None, Segment=0, TotalSegments=1,
+             Limit=None, ExclusiveStartKey=None, ProjectionExpression=None, ExpressionAttributeNames=None,
+             **kwargs):
+        self._wait('scan')
+        keys, positions = self._segment_keys(Segment, TotalSegments)
+        start = positions[ExclusiveStartKey[self.key]] + 1 if ExclusiveStartKey else 0
+        end = min(start + Limit, len(keys)) if Limit else len(keys)
+        items = [self.items[k] for k in keys[start:end]]
+        self.calls['items_read'] += len(items)
+        if FilterExpression:
+            attr, placeholder = _EQUALS.match(FilterExpression).groups()
+            value = ExpressionAttributeValues[placeholder]
+            items = [item for item in items if item.get(attr) == value]
+        if ProjectionExpression:
+            attrs = [_name(a.strip(), ExpressionAttributeNames) for a in ProjectionExpression.split(',')]
+            items = [{a: item[a] for a in attrs if a in item} for item in items]
+        response = {'Items': copy.deepcopy(items), 'Count': len(items)}
+        if end < len(keys):
+            response['LastEvaluatedKey'] = {self.key: keys[end - 1]}
+        return response
+
+class _FakeBatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.items = []
+
+    def put_item(self, Item):
+        self.items.append(copy.deepcopy(Item))
+        if len(self.items) >= 25:
+            self._flush()
+
+    def _flush(self):
+        if self.items:
+            self.table._wait('batch_write_item')
+            with _write_lock:
+                for item in self.items:
+                    self.table._store(item)
+            self.items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._flush()
+
+class FakeDynamoDBClient:
+    """Low-level DynamoDB client stand-in (TransactWriteItems over FakeTables)"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.calls = Counter()
+        add_lambda_path()
+        from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+        self._deserialize = TypeDeserializer().deserialize
+        self._serialize = TypeSerializer().serialize
+
+    def _plain(self, attributes):
+        return {k: self._deserialize(v) for k, v in (attributes or {}).items()}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.calls['batch_get_item'] += 1
+        responses = {}
+        for table_name, spec in RequestItems.items():
+            table = self.tables[table_name]
+            table._wait('batch_get_item')
+            attrs = None
+            if spec.get('ProjectionExpression'):
+                attrs = [_name(a.strip(), spec.get('ExpressionAttributeNames'))
+                         for a in spec['ProjectionExpression'].split(',')]
+            items = []
+            for key in spec['Keys']:
+                item = table.items.get(self._deserialize(key[table.key]))
+                if item is not None:
+                    items.append({k: self._serialize(v) for k, v in item.items() if attrs is None or k in attrs})
+            table.calls['items_read'] += len(items)
+            responses[table_name] = items
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        self.calls['transact_write_items'] += 1
+        with _write_lock:
+            # Check every condition first; nothing is written unless all of them hold
+            plans, reasons = [], []
+            for entry in TransactItems:
+                (action, spec), = entry.items()
+                table = self.tables[spec['TableName']]
+                item = self._plain(spec['Item']) if action == 'Put' else None
+                key = item[table.key] if item is not None else self._deserialize(spec['Key'][table.key])
+                current = table.items.get(key)
+                values = self._plain(spec.get('ExpressionAttributeValues'))
+                if condition_holds(spec.get('ConditionExpression'), current, spec.get('ExpressionAttributeNames'), values):
+                    reasons.append({'Code': 'None'})
+                else:
+                    reason = {'Code': 'ConditionalCheckFailed', 'Message': 'The conditional request failed'}
+                    if spec.get('ReturnValuesOnConditionCheckFailure') == 'ALL_OLD' and current is not None:
+                        reason['Item'] = {k: self._serialize(v) for k, v in current.items()}
+                    reasons.append(reason)
+                plans.append((action, spec, table, key, current, item, values))
+            
+            if any(reason['Code'] != 'None' for reason in reasons):
+                error = client_error('TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems')
+                error.response['CancellationReasons'] = reasons
+                raise error
+            
+            for action, spec, table, key, current, item, values in plans:
+                if action == 'Put':
+                    table._store(item)
+                elif action == 'Update':
+                    table._store(apply_update(spec['UpdateExpression'], copy.deepcopy(current or {table.key: key}),
+                                              spec.get('ExpressionAttributeNames'), values))
+                elif action == 'Delete':
+                    table.items.pop(key, None)
+        return {}
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+class FakeDynamoDBResource:
+    """boto3.resource('dynamodb') stand-in handing out registered FakeTables"""
+
+    def __init__(self, tables=None):
+        self.tables = dict(tables or {})
+        self.meta = _Meta(FakeDynamoDBClient(self.tables))
+        for table in self.tables.values():
+            table._meta = self.meta
+
+    def Table(self, name):
+        return self.tables[name]
+
+def client_error(code, message, operation):
+    """botocore ClientError as raised by a real client"""
+    add_lambda_path()
+    from botocore.exceptions import ClientError
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+class FakeSecretsManager:
+    """Secrets Manager client stand-in with version stages and rotation"""
+
+    def __init__(self, latency_ms=0):
+        self.secrets = {}  # SecretId -> {stage: (version_id, secret_string)}
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self._versions = 0
+
+    def put_secret(self, secret_id, secret_string):
+        """Store a new AWSCURRENT version; the old one becomes AWSPREVIOUS (like a rotation)"""
+        self._versions += 1
+        stages = self.secrets.setdefault(secret_id, {})
+        if 'AWSCURRENT' in stages:
+            stages['AWSPREVIOUS'] = stages['AWSCURRENT']
+        stages['AWSCURRENT'] = (f'v{self._versions}', secret_string)
+
+    def get_secret_value(self, SecretId, VersionStage='AWSCURRENT', **kwargs):
+        self.calls['get_secret_value'] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        version = self.secrets.get(SecretId, {}).get(VersionStage)
+        if version is None:
+            raise client_error('ResourceNotFoundException', f"{SecretId} has no {VersionStage} version",
+                               'GetSecretValue')
+        version_id, secret_string = version
+        return {'ARN': SecretId, 'VersionId': version_id, 'SecretString': secret_string,
+                'VersionStages': [VersionStage]}
+
+class FakeCognito:
+    """Cognito user pool client stand-in for the admin auth calls of auth.py"""
+
+    def __init__(self, latency_ms=0):
+        self.users = {}  # Username -> {'password', 'status', 'sub'}
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _wait(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def add_user(self, username, password):
+        """Register a confirmed user without counting calls"""
+        self.users[username] = {'password': password, 'status': 'CONFIRMED', 'sub': f'sub-{len(self.users)}'}
+
+    def admin_get_user(self, UserPoolId, Username, **kwargs):
+        self._wait('admin_get_user')
+        user = self.users.get(Username)
+        if user is None:
+            raise client_error('UserNotFoundException', 'User does not exist.', 'AdminGetUser')
+        return {'Username': Username, 'UserStatus': user['status'],
+                'UserAttributes': [{'Name': 'sub', 'Value': user['sub']}]}
+
+    def admin_create_user(self, UserPoolId, Username, TemporaryPassword, **kwargs):
+        self._wait('admin_create_user')
+        with self._lock:
+            if Username in self.users:
+                raise client_error('UsernameExistsException', 'An account with the given email already exists.',
+                                   'AdminCreateUser')
+            self.users[Username] = {'password': TemporaryPassword, 'status': 'FORCE_CHANGE_PASSWORD',
+                                    'sub': f'sub-{len(self.users)}'}
+        return {'User': {'Username': Username, 'UserStatus': 'FORCE_CHANGE_PASSWORD'}}
+
+    def admin_set_user_password(self, UserPoolId, Username, Password, Permanent=False, **kwargs):
+        self._wait('admin_set_user_password')
+        user = self.users.get(Username)
+        if user is None:
+            raise client_error('UserNotFoundException', 'User does not exist.', 'AdminSetUserPassword')
+        user['password'] = Password
+        if Permanent:
+            user['status'] = 'CONFIRMED'
+        return {}
+
+    def admin_delete_user(self, UserPoolId, Username, **kwargs):
+        self._wait('admin_delete_user')
+        if self.users.pop(Username, None) is None:
+            raise client_error('UserNotFoundException', 'User does not exist.', 'AdminDeleteUser')
+        return {}
+
+    def admin_initiate_auth(self, UserPoolId, ClientId, AuthFlow, AuthParameters, **kwargs):
+        self._wait('admin_initiate_auth')
+        user = self.users.get(AuthParameters['USERNAME'])
+        if user is None or user['password'] != AuthParameters['PASSWORD']:
+            raise client_error('NotAuthorizedException', 'Incorrect username or password.', 'AdminInitiateAuth')
+        if user['status'] != 'CONFIRMED':
+            return {'ChallengeName': 'NEW_PASSWORD_REQUIRED', 'Session': 'session'}
+        return {'AuthenticationResult': {'IdToken': f"id-token-{user['sub']}", 'AccessToken': 'access',
+                                         'RefreshToken': 'refresh', 'ExpiresIn': 3600, 'TokenType': 'Bearer'}}
+
+class FakeS3:
+    """S3 client stand-in keeping objects in memory (or only their sizes, with keep_bodies=False)"""
+
+    def __init__(self, latency_ms=0, keep_bodies=True):
+        self.objects = {}  # (Bucket, Key) -> dict(Body=bytes, ContentType=..., CacheControl=...)
+        self.latency_ms = latency_ms
+        self.keep_bodies = keep_bodies
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _wait(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._wait('put_object')
+        body = Body if isinstance(Body, bytes) else Body.read()
+        self.objects[(Bucket, Key)] = dict(kwargs, Body=body if self.keep_bodies else b'', ContentLength=len(body))
+        return {'ETag': f'"{zlib.crc32(body):08x}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._wait('get_object')
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise client_error('NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        # Body reads like botocore's StreamingBody
+        return dict(obj, Body=io.BytesIO(obj['Body']), ContentLength=len(obj['Body']))
+
+    def copy_object(self, Bucket, Key, CopySource, MetadataDirective='COPY', **kwargs):
+        self._wait('copy_object')
+        source = self.objects.get((CopySource['Bucket'], CopySource['Key']))
+        if source is None:
+            raise client_error('NoSuchKey', 'The specified key does not exist.', 'CopyObject')
+        self.objects[(Bucket, Key)] = dict(kwargs if MetadataDirective == 'REPLACE' else source, Body=source['Body'])
+        return {}
+
+def png(width, height, seed=0):
+    """A valid RGB PNG of random pixels (incompressible, so about width * height * 3 bytes)"""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b''))
+
+class FakeBedrock:
+    """Bedrock Runtime stand-in answering invoke_model with Titan or Stable Diffusion XL image responses
+    
+    images is a list of PNG bytes cycled through the numberOfImages requested;
+    the response body is a stream, like botocore's StreamingBody. latency_ms is
+    one number or {modelId: ms}, and failures maps a modelId to the error code
+    its calls fail with; calls per model are counted in model_calls. With
+    max_rps the account quota is a token bucket (burst calls deep, max_rps by
+    default): calls beyond it fail with ThrottlingException, counted as 'throttled'.
+    """
+
+    def __init__(self, latency_ms=0, images=None, max_rps=None, burst=None, failures=None):
+        self.images = images or [png(64, 64)]
+        self.latency_ms = latency_ms
+        self.failures = dict(failures or {})
+        self.model_calls = Counter()
+        self.max_rps = max_rps
+        self.burst = burst or max_rps
+        self.calls = Counter()
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._allowance = self.burst
+        self._refilled = time.monotonic()
+
+    def _over_quota(self):
+        now = time.monotonic()
+        self._allowance = min(self.burst, self._allowance + (now - self._refilled) * self.max_rps)
+        self._refilled = now
+        if self._allowance < 1:
+            return True
+        self._allowance -= 1
+        return False
+
+    def _body(self, count, artifacts=False):
+        body = self._bodies.get((count, artifacts))
+        if body is None:
+            encoded = [base64.b64encode(self.images[i % len(self.images)]).decode() for i in range(count)]
+            if artifacts:
+                payload = {'result': 'success', 'artifacts': [{'seed': i, 'base64': image, 'finishReason': 'SUCCESS'}
+                                                              for i, image in enumerate(encoded)]}
+            else:
+                payload = {'images': encoded, 'error': None}
+            body = self._bodies[(count, artifacts)] = json.dumps(payload).encode()
+        return body
+
+    def invoke_model(self, modelId, body, **kwargs):
+        with self._lock:
+            self.calls['invoke_model'] += 1
+            self.model_calls[modelId] += 1
+            if modelId in self.failures:
+                raise client_error(self.failures[modelId], f"{modelId} failed", 'InvokeModel')
+            if self.max_rps and self._over_quota():
+                self.calls['throttled'] += 1
+                raise client_error('ThrottlingException', 'Too many requests, please wait before trying again.',
+                                   'InvokeModel')
+        latency_ms = self.latency_ms.get(modelId, 0) if isinstance(self.latency_ms, dict) else self.latency_ms
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        request = json.loads(body)
+        if 'text_prompts' in request:
+            return {'body': io.BytesIO(self._body(request.get('samples', 1), artifacts=True)),
+                    'contentType': 'application/json'}
+        count = request.get('imageGenerationConfig', {}).get('numberOfImages', 1)
+        return {'body': io.BytesIO(self._body(count)), 'contentType': 'application/json'}
+
+class FakeSQS:
+    """SQS client stand-in collecting sent messages per queue"""
+
+    def __init__(self, latency_ms=0):
+        self.queues = {}  # QueueUrl -> [MessageBody]
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self._lock:
+            self.calls['send_message'] += 1
+            self.queues.setdefault(QueueUrl, []).append(MessageBody)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return {'MessageId': f"msg-{self.calls['send_message']}"}
+
+class FakeCloudWatch:
+    """CloudWatch client stand-in for metrics.CloudWatchSink"""
+
+    def __init__(self, latency_ms=0):
+        self.metric_data = []
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+
+    def put_metric_data(self, Namespace, MetricData, **kwargs):
+        self.calls['put_metric_data'] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        self.metric_data.extend(dict(datum, Namespace=Namespace) for datum in MetricData)
+        return {}
+
+class FakeJwks:
+    """Cognito JWKS stand-in: signs ID tokens with a local RSA key and serves its public key
+    
+    Plugs into authorizer.TokenVerifier as its jwks_client. Needs PyJWT with
+    the cryptography backend.
+    """
+
+    def __init__(self, latency_ms=0, kid='local-key'):
+        add_lambda_path()
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        self._jwt = jwt
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self._jwk = dict(jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key(), as_dict=True),
+                         kid=kid, alg='RS256', use='sig')
+        self.kid = kid
+        self.latency_ms = latency_ms
+        self.calls = Counter()
+
+    def token(self, client_id, lifetime=3600, **claims):
+        now = int(time.time())
+        claims = dict({'aud': client_id, 'iat': now, 'exp': now + lifetime, 'token_use': 'id'}, **claims)
+        return self._jwt.encode(claims, self._private_key, algorithm='RS256', headers={'kid': self.kid})
+
+    def get_signing_keys(self, refresh=False):
+        self.calls['get_signing_keys'] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [self._jwt.PyJWK(self._jwk)]
+
+class FakeResponseStream:
+    """Lambda response stream stand-in recording every write with its time (perf_counter)"""
+
+    def __init__(self):
+        self.writes = []  # (time, bytes)
+        self.ended_at = None
+        self.error = None  # what RuntimeApiStream would send in the error trailers
+
+    def write(self, data):
+        self.writes.append((time.perf_counter(), bytes(data)))
+
+    def end(self, error=None):
+        self.ended_at = time.perf_counter()
+        self.error = error
+
+    def response(self):
+        """(prelude dict, body bytes) as a Function URL client would see them"""
+        prelude, _, body = b''.join(data for _, data in self.writes).partition(b'\x00' * 8)
+        return json.loads(prelude), body
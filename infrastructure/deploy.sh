@@ -5,6 +5,8 @@ echo "🚀 Deploying Imagify Infrastructure..."
 # Install Python dependencies for Lambda
 cd lambda
 pip install -r requirements.txt -t .
+# Precompile the botocore models the Lambdas use (see model_snapshot.py)
+python model_snapshot.py build
 cd ..
 
 # Install CDK dependencies
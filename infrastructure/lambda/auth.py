@@ -1,22 +1,29 @@
 import json
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from botocore.config import Config
+from aws_clients import lazy_client, lazy_resource
+from identity import find_user_by_email, new_user_id, remember_user_id, resolve_user
+from logger import DEBUG, ERROR, INFO, WARNING, log_event
+from tracing import traced
 
 # Ultra-optimized connection pooling
-config = Config(
+REGION = 'ap-southeast-1'
+config = dict(
     max_pool_connections=200,  # Increase further
     retries={'max_attempts': 0},  # No retries for speed
     connect_timeout=3,  # Very short connection timeout
     read_timeout=8,     # Short read timeout
-    region_name='ap-southeast-1',
     tcp_keepalive=True  # Keep connections alive
 )
 
-# Global clients - reused across invocations
-dynamodb = boto3.resource('dynamodb', config=config)
-cognito = boto3.client('cognito-idp', config=config)
+# Global clients - reused across invocations, built on first use (see aws_clients.py)
+dynamodb = lazy_resource('dynamodb', REGION, **config)
+cognito = lazy_client('cognito-idp', REGION, **config)
+
+# Cognito errors that mean the credentials were not accepted (answered with 401)
+AUTH_FAILED_ERRORS = ('NotAuthorizedException', 'UserNotFoundException', 'UserNotConfirmedException',
+                      'PasswordResetRequiredException')
 
 def cors_response(status_code, body, content_type='application/json', cache_control=None):
     """Helper function to return response with CORS headers"""
@@ -37,14 +44,15 @@ def cors_response(status_code, body, content_type='application/json', cache_cont
         'body': json.dumps(body) if isinstance(body, dict) else body
     }
 
+@traced
 def handler(event, context):
     try:
         # Handle warming requests (skip processing)
         if event.get('isWarming'):
             return cors_response(200, {'status': 'warm'})
         
-        # Debug: Print event to see structure
-        print(f"Event: {json.dumps(event)}")
+        # Debug only: request line (never the body, which carries passwords)
+        log_event('REQUEST', DEBUG, path=event.get('path'), method=event.get('httpMethod'))
         
         path = event['path']
         method = event['httpMethod']
@@ -73,7 +81,7 @@ def get_credits(event):
     try:
         # Get user info from Cognito authorizer claims
         claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
-        print(f"Claims: {claims}")
+        log_event('CLAIMS', DEBUG, claims=claims)
         
         # Get user ID from claims (can be 'sub' or 'cognito:username')
         user_id = claims.get('sub') or claims.get('cognito:username')
@@ -83,18 +91,12 @@ def get_credits(event):
         if not user_id:
             return cors_response(401, {'error': 'No user ID in token claims'})
         
-        # Get user from DynamoDB using GSI for fast email lookup
+        # Get user from DynamoDB: cached sub -> userId point read, else EmailIndex GSI
         users_table = dynamodb.Table(os.environ['USERS_TABLE'])
         if email:
-            # FAST: Use GSI query instead of slow table scan
-            response = users_table.query(
-                IndexName='EmailIndex',
-                KeyConditionExpression='email = :email',
-                ExpressionAttributeValues={':email': email}
-            )
+            user = resolve_user(users_table, user_id, email)
             
-            if response['Items']:
-                user = response['Items'][0]
+            if user:
                 return cors_response(200, {
                     'userId': user['userId'],
                     'credits': int(user.get('credits', 0)),
@@ -102,7 +104,7 @@ def get_credits(event):
                 }, cache_control='public, max-age=300')  # 5 minute cache
             else:
                 # Auto-create DynamoDB record for existing Cognito user
-                print(f"Creating DynamoDB record for existing user: {email}")
+                log_event('USER_RECORD_CREATED', INFO, user_id=user_id)
                 users_table.put_item(
                     Item={
                         'userId': user_id,
@@ -112,6 +114,7 @@ def get_credits(event):
                         'createdAt': datetime.now().isoformat()
                     }
                 )
+                remember_user_id(user_id, user_id)
                 return cors_response(200, {
                     'userId': user_id,
                     'credits': 10,
@@ -126,98 +129,131 @@ def get_credits(event):
         })
         
     except Exception as e:
-        print(f"Error getting credits: {str(e)}")
+        log_event('CREDITS_ERROR', ERROR, error=str(e))
         return cors_response(500, {'error': str(e)})
 
+def _error_code(error):
+    return getattr(error, 'response', {}).get('Error', {}).get('Code')
+
 def register(data):
+    """Create the Cognito user and the Users table record
+    
+    Cognito's own UsernameExistsException is the duplicate check, so a new
+    sign-up costs admin_create_user followed by the password set and the
+    DynamoDB write side by side: two round trips in sequence instead of
+    four. If either of the last two fails, both are rolled back so the
+    email can register again.
+    """
     try:
-        print(f"Starting registration for email: {data['email']}")
-        
         email = data['email']
         password = data['password']
         name = data['name']
         
-        user_id = f"user_{int(datetime.now().timestamp())}"
-        print(f"Generated user_id: {user_id}")
+        user_id = new_user_id()
+        log_event('REGISTER_START', DEBUG, user_id=user_id)
         
-        # Check if user already exists in Cognito
+        # Create in Cognito; an existing user is rejected here
         try:
-            cognito.admin_get_user(
+            cognito.admin_create_user(
                 UserPoolId=os.environ['USER_POOL_ID'],
-                Username=email
+                Username=email,
+                TemporaryPassword=password,
+                MessageAction='SUPPRESS'
             )
-            # User exists
-            return cors_response(400, {'error': 'User already exists'})
         except Exception as e:
-            # User doesn't exist (UserNotFoundException) or other error, proceed with registration
-            if 'UserNotFoundException' not in str(e):
-                print(f"Unexpected error checking user: {str(e)}")
-            pass
-        
-        # Create in Cognito
-        print("Creating user in Cognito...")
-        cognito.admin_create_user(
-            UserPoolId=os.environ['USER_POOL_ID'],
-            Username=email,
-            TemporaryPassword=password,
-            MessageAction='SUPPRESS'
-        )
-        print("User created in Cognito successfully")
-        
-        # Set permanent password
-        print("Setting permanent password...")
-        cognito.admin_set_user_password(
-            UserPoolId=os.environ['USER_POOL_ID'],
-            Username=email,
-            Password=password,
-            Permanent=True
-        )
-        print("Password set successfully")
+            if _error_code(e) == 'UsernameExistsException':
+                return cors_response(400, {'error': 'User already exists'})
+            raise
+        log_event('REGISTER_COGNITO_USER_CREATED', DEBUG, user_id=user_id)
         
-        # Store in DynamoDB
-        print("Storing user in DynamoDB...")
+        # Store in DynamoDB while the permanent password is set
         table = dynamodb.Table(os.environ['USERS_TABLE'])
-        table.put_item(
-            Item={
-                'userId': user_id,
-                'email': email,
-                'name': name,
-                'credits': 10,
-                'createdAt': datetime.now().isoformat()
-            }
-        )
-        print("User stored in DynamoDB successfully")
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            stored = executor.submit(
+                table.put_item,
+                Item={
+                    'userId': user_id,
+                    'email': email,
+                    'name': name,
+                    'credits': 10,
+                    'createdAt': datetime.now().isoformat()
+                },
+                ConditionExpression='attribute_not_exists(userId)'
+            )
+            try:
+                cognito.admin_set_user_password(
+                    UserPoolId=os.environ['USER_POOL_ID'],
+                    Username=email,
+                    Password=password,
+                    Permanent=True
+                )
+                log_event('REGISTER_PASSWORD_SET', DEBUG, user_id=user_id)
+                stored.result()
+            except Exception:
+                _rollback_registration(table, email, user_id, stored)
+                raise
+        log_event('REGISTER_COMPLETE', INFO, user_id=user_id)
         
         return cors_response(201, {'message': 'User registered', 'userId': user_id})
         
     except Exception as e:
-        print(f"Registration error: {str(e)}")
+        log_event('REGISTER_ERROR', ERROR, error=str(e))
         return cors_response(500, {'error': str(e)})
 
+def _rollback_registration(table, email, user_id, stored):
+    """Undo a half-finished registration (best effort)"""
+    try:
+        if stored.exception() is None:
+            table.delete_item(Key={'userId': user_id})
+        cognito.admin_delete_user(UserPoolId=os.environ['USER_POOL_ID'], Username=email)
+        log_event('REGISTER_ROLLED_BACK', WARNING, user_id=user_id)
+    except Exception as e:
+        log_event('REGISTER_ROLLBACK_ERROR', ERROR, user_id=user_id, error=str(e))
+
 def login(data):
+    """Authenticate with Cognito and return the token with the user's profile
+    
+    The profile query needs only the email, so it runs on a second thread
+    while Cognito checks the password: a warm login costs the slower of the
+    two calls instead of their sum. The profile is only returned once
+    authentication has succeeded.
+    """
     email = data['email']
     password = data['password']
+    table = dynamodb.Table(os.environ['USERS_TABLE'])
     
-    # Authenticate with Cognito
-    auth_result = cognito.admin_initiate_auth(
-        UserPoolId=os.environ['USER_POOL_ID'],
-        ClientId=os.environ['USER_POOL_CLIENT_ID'],
-        AuthFlow='ADMIN_NO_SRP_AUTH',
-        AuthParameters={
-            'USERNAME': email,
-            'PASSWORD': password
-        }
-    )
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # FAST: Use GSI query instead of slow table scan
+        profile = executor.submit(find_user_by_email, table, email)
     
-    # FAST: Use GSI query instead of slow table scan
-    table = dynamodb.Table(os.environ['USERS_TABLE'])
-    response = table.query(
-        IndexName='EmailIndex',
-        KeyConditionExpression='email = :email',
-        ExpressionAttributeValues={':email': email}
-    )
+        # Authenticate with Cognito
+        try:
+            auth_result = cognito.admin_initiate_auth(
+                UserPoolId=os.environ['USER_POOL_ID'],
+                ClientId=os.environ['USER_POOL_CLIENT_ID'],
+                AuthFlow='ADMIN_NO_SRP_AUTH',
+                AuthParameters={
+                    'USERNAME': email,
+                    'PASSWORD': password
+                }
+            )
+        except Exception as e:
+            # Fail closed: nothing from the profile query leaves this function
+            profile.cancel()
+            if _error_code(e) in AUTH_FAILED_ERRORS:
+                log_event('LOGIN_FAILED', INFO, reason=_error_code(e))
+                return cors_response(401, {'error': 'Invalid email or password'})
+            raise
     
-    user = response['Items'][0]
+        user = profile.result()
+    
+    if 'AuthenticationResult' not in auth_result:
+        # A challenge (e.g. NEW_PASSWORD_REQUIRED) is not a completed login
+        return cors_response(401, {'error': 'Login requires a further challenge',
+                                    'challenge': auth_result.get('ChallengeName')})
+    if user is None:
+        log_event('LOGIN_PROFILE_MISSING', WARNING)
+        return cors_response(404, {'error': 'User not found'})
     
     return cors_response(200, {
         'token': auth_result['AuthenticationResult']['IdToken'],
@@ -227,5 +263,3 @@ def login(data):
             'credits': int(user['credits'])
         }
     })
-
-
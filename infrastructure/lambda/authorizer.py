@@ -1,7 +1,97 @@
+import hashlib
 import json
 import jwt
 import os
+import time
+from collections import OrderedDict
 from jwt import PyJWKClient
+from logger import WARNING, log_event
+
+REGION = 'ap-southeast-1'
+
+# Minimum gap between JWKS refetches triggered by unknown key ids
+JWKS_MIN_REFRESH_SECONDS = 60
+
+# Shorter gap after a failed fetch, so a network blip does not lock out new keys for a minute
+JWKS_RETRY_SECONDS = 5
+
+# Upper bound on verified tokens kept per warm container
+TOKEN_CACHE_MAX_ENTRIES = 1024
+
+class TokenVerifier:
+    """Verify Cognito ID tokens, keeping parsed JWKS keys and verified tokens across warm invocations"""
+
+    def __init__(self, user_pool_id, client_id, region=REGION, max_cached_tokens=TOKEN_CACHE_MAX_ENTRIES):
+        jwks_url = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json'
+        self.jwks_client = PyJWKClient(jwks_url, cache_jwk_set=False)
+        self.client_id = client_id
+        self.max_cached_tokens = max_cached_tokens
+        self._signing_keys = {}
+        self._next_refresh = 0
+        self._verified_tokens = OrderedDict()
+
+    def _refresh_signing_keys(self):
+        """Fetch the JWKS once and keep the parsed keys by kid"""
+        try:
+            signing_keys = self.jwks_client.get_signing_keys(refresh=True)
+        except Exception as e:
+            self._next_refresh = time.time() + JWKS_RETRY_SECONDS
+            log_event('JWKS_REFRESH_FAILED', WARNING, error=str(e), retry_in=JWKS_RETRY_SECONDS)
+            raise
+        self._signing_keys = {key.key_id: key for key in signing_keys}
+        self._next_refresh = time.time() + JWKS_MIN_REFRESH_SECONDS
+
+    def get_signing_key(self, kid):
+        """Return the parsed key for kid, refetching the JWKS on a miss (rate limited)"""
+        signing_key = self._signing_keys.get(kid)
+        if signing_key is None and time.time() >= self._next_refresh:
+            self._refresh_signing_keys()
+            signing_key = self._signing_keys.get(kid)
+        
+        if signing_key is None:
+            raise jwt.InvalidTokenError(f'Unable to find a signing key that matches: "{kid}"')
+        
+        return signing_key
+
+    def verify(self, token):
+        """Return the decoded claims, skipping RSA verification for tokens already verified"""
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        now = time.time()
+        
+        cached = self._verified_tokens.get(token_hash)
+        if cached is not None:
+            expires_at, claims = cached
+            if now < expires_at:
+                self._verified_tokens.move_to_end(token_hash)
+                return claims
+            del self._verified_tokens[token_hash]
+        
+        header = jwt.get_unverified_header(token)
+        signing_key = self.get_signing_key(header.get('kid'))
+        claims = jwt.decode(
+            token,
+            signing_key.key,
+            algorithms=['RS256'],
+            audience=self.client_id
+        )
+        
+        # Only cache tokens that carry an expiry, and never beyond it
+        if 'exp' in claims:
+            self._verified_tokens[token_hash] = (float(claims['exp']), claims)
+            while len(self._verified_tokens) > self.max_cached_tokens:
+                self._verified_tokens.popitem(last=False)
+        
+        return claims
+
+# Global verifier - reused across invocations
+_verifier = None
+
+def get_verifier():
+    """Return the process-wide token verifier, creating it on first use"""
+    global _verifier
+    if _verifier is None:
+        _verifier = TokenVerifier(os.environ['USER_POOL_ID'], os.environ['USER_POOL_CLIENT_ID'])
+    return _verifier
 
 def handler(event, context):
     """Lambda authorizer for API Gateway"""
@@ -13,22 +103,8 @@ def handler(event, context):
         if token.startswith('Bearer '):
             token = token[7:]
         
-        # Cognito User Pool configuration
-        user_pool_id = os.environ['USER_POOL_ID']
-        region = 'ap-southeast-1'
-        
-        # Get JWT keys from Cognito
-        jwks_url = f'https://cognito-idp.{region}.amazonaws.com/{user_pool_id}/.well-known/jwks.json'
-        jwks_client = PyJWKClient(jwks_url)
-        
-        # Decode and verify token
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
-        decoded_token = jwt.decode(
-            token,
-            signing_key.key,
-            algorithms=['RS256'],
-            audience=os.environ['USER_POOL_CLIENT_ID']
-        )
+        # Decode and verify token (cached keys and results on warm containers)
+        decoded_token = get_verifier().verify(token)
         
         # Extract user info
         user_id = decoded_token.get('username', decoded_token.get('sub'))
@@ -54,7 +130,7 @@ def handler(event, context):
         }
         
         return policy
-        
+    
     except Exception as e:
-        print(f"Authorization failed: {str(e)}")
+        log_event('AUTHORIZATION_FAILED', WARNING, error=str(e))
         raise Exception('Unauthorized')
@@ -0,0 +1,94 @@
+import copy
+import threading
+
+# Lazy AWS client registry.
+#
+# Handlers declare their clients at module level as before, but nothing is
+# imported or built until the first attribute access. All clients and
+# resources come from one boto3 Session, so they share a single botocore
+# session and its loader (service models are read and parsed once per
+# container instead of once per client). The loader serves the precompiled
+# models from model_snapshot.py when the deployment package includes them.
+# Every call made through these clients is timed by tracing.py.
+
+_lock = threading.RLock()
+_session = None
+_instances = {}
+
+def get_session():
+    """Return the shared boto3 session, importing boto3 on first use"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                import boto3
+                import botocore.session
+                from model_snapshot import create_loader
+                from tracing import install_hooks
+                botocore_session = botocore.session.get_session()
+                botocore_session.register_component('data_loader', create_loader())
+                install_hooks(botocore_session)
+                _session = boto3.session.Session(botocore_session=botocore_session)
+    return _session
+
+def _make_config(config):
+    if not config:
+        return None
+    from botocore.config import Config
+    # botocore fills in the retries dict it is given, so never hand it ours
+    return Config(**copy.deepcopy(config))
+
+def _get(kind, service_name, region_name, config):
+    key = (kind, service_name, region_name, repr(sorted(config.items())))
+    instance = _instances.get(key)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(key)
+            if instance is None:
+                factory = get_session().resource if kind == 'resource' else get_session().client
+                instance = factory(service_name, region_name=region_name, config=_make_config(config))
+                _instances[key] = instance
+    return instance
+
+def get_client(service_name, region_name=None, **config):
+    """Return the shared client for (service, region, botocore Config kwargs)"""
+    return _get('client', service_name, region_name, config)
+
+def get_resource(service_name, region_name=None, **config):
+    """Return the shared resource for (service, region, botocore Config kwargs)"""
+    return _get('resource', service_name, region_name, config)
+
+class LazyClient:
+    """Module-level stand-in for a client/resource that is built on first use"""
+
+    def __init__(self, kind, service_name, region_name=None, **config):
+        self._kind = kind
+        self._service_name = service_name
+        self._region_name = region_name
+        self._config = config
+        self._target = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not set in __init__, i.e. the real API
+        target = self._target
+        if target is None:
+            target = self._target = _get(self._kind, self._service_name, self._region_name, self._config)
+        return getattr(target, name)
+
+    def __repr__(self):
+        return f"<LazyClient {self._kind} {self._service_name} ({self._region_name or 'default region'})>"
+
+def lazy_client(service_name, region_name=None, **config):
+    """Declare a client that is created on first attribute access"""
+    return LazyClient('client', service_name, region_name, **config)
+
+def lazy_resource(service_name, region_name=None, **config):
+    """Declare a resource that is created on first attribute access"""
+    return LazyClient('resource', service_name, region_name, **config)
+
+def reset():
+    """Drop all cached clients and the session (tests and benchmarks)"""
+    global _session
+    with _lock:
+        _session = None
+        _instances.clear()
@@ -0,0 +1,288 @@
+import math
+import os
+import threading
+from botocore.exceptions import CapacityNotAvailableError, ClientError
+from botocore.retries.bucket import Clock, TokenBucket
+from botocore.retries.throttling import CubicCalculator
+from logger import INFO, WARNING, log_business_metric, log_event
+
+# Admission control in front of bedrock.invoke_model.
+#
+# The Bedrock quota is per account and region, but botocore's adaptive retry
+# mode only paces the one client it lives in, so a burst spread over many
+# containers still runs into ThrottlingException and every throttled call
+# spends its retries inside the Lambda timeout.
+#
+# Every call first takes a slot from a shared per-second budget: one atomic
+# UpdateItem on the window's row in BEDROCK_ADMISSION_TABLE counts it against
+# the global rate and against the caller's share of it (USER_SHARE of the
+# rate, so one busy user cannot take every slot). When the current second is
+# full the call queues by taking a slot in a later one, at most
+# MAX_QUEUE_SECONDS ahead, and sleeps until it starts: one BatchGetItem reads
+# the later windows' counters and one UpdateItem takes the first with room, so
+# a full queue costs three round trips however deep it is. When those are full too
+# the queue is deeper than it is worth waiting for: the call is rejected right
+# away (AdmissionRejected) with the seconds until a slot frees up, which
+# handlers return as 429 + Retry-After.
+#
+# Throttles still happen when the quota is lower than BEDROCK_MAX_RPS or
+# shared with other workloads. Each container then lowers the rate it admits
+# against the way botocore's adaptive mode does: CubicCalculator cuts it to
+# 70% on every ThrottlingException and grows it back afterwards, and a
+# TokenBucket at that rate turns away the container's own calls that come
+# faster, without spending a DynamoDB write on them.
+#
+# Without BEDROCK_ADMISSION_TABLE the counters live in memory (LocalWindows),
+# which only coordinates the calls of one container.
+
+# InvokeModel calls per second the account's quota allows, shared by all containers
+BEDROCK_MAX_RPS = float(os.environ.get('BEDROCK_MAX_RPS', 2))
+
+# Largest fraction of those one user may take
+USER_SHARE = float(os.environ.get('BEDROCK_USER_SHARE', 0.5))
+
+# How far ahead a call may queue for a slot before it is rejected
+MAX_QUEUE_SECONDS = float(os.environ.get('BEDROCK_MAX_QUEUE_SECONDS', 2))
+
+WINDOW_SECONDS = 1
+
+# Window rows are removed by DynamoDB TTL once they are this old
+WINDOW_TTL_SECONDS = 300
+
+THROTTLING_ERRORS = ('ThrottlingException',)
+
+# BatchGetItem reads at most 100 keys per request
+MAX_BATCH_GET_KEYS = 100
+
+class AdmissionRejected(Exception):
+    """Raised when no Bedrock slot frees up within the queue limit
+    
+    retry_after is the whole number of seconds to wait before retrying; reason
+    is 'rate' (the shared budget is full), 'user' (the caller used up their
+    share) or 'throttled' (this container is backing off after throttles).
+    """
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+def _count(attribute):
+    if isinstance(attribute, dict):
+        return int(attribute.get('N', 0))
+    return int(attribute or 0)
+
+class DynamoDbWindows:
+    """Per-second admission counters shared by all containers, one row per window"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def take(self, window, user_key, limit, user_limit):
+        """Count one call in window; returns None, or 'rate'/'user' for the limit that is reached"""
+        user_attribute = f"user:{user_key}"
+        try:
+            self.table.update_item(
+                Key={'windowKey': f"bedrock#{window}"},
+                UpdateExpression='ADD admitted :one, #user :one SET expiresAt = :expires',
+                # A missing counter compares false, so NOT ... >= also admits the window's first call
+                ConditionExpression='NOT admitted >= :limit AND NOT #user >= :user_limit',
+                ExpressionAttributeNames={'#user': user_attribute},
+                ExpressionAttributeValues={
+                    ':one': 1,
+                    ':limit': limit,
+                    ':user_limit': user_limit,
+                    ':expires': (window + 1) * WINDOW_SECONDS + WINDOW_TTL_SECONDS
+                },
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            current = e.response.get('Item') or {}
+            return 'user' if _count(current.get(user_attribute)) >= user_limit else 'rate'
+
+    def _read(self, windows, user_key):
+        """{window: (admitted, admitted for user_key)} for the windows that have a row"""
+        client = self.table.meta.client
+        counts = {}
+        for i in range(0, len(windows), MAX_BATCH_GET_KEYS):
+            response = client.batch_get_item(RequestItems={self.table.name: {
+                'Keys': [{'windowKey': {'S': f"bedrock#{window}"}} for window in windows[i:i + MAX_BATCH_GET_KEYS]],
+                'ProjectionExpression': 'windowKey, admitted, #user',
+                'ExpressionAttributeNames': {'#user': f"user:{user_key}"},
+                'ConsistentRead': True
+            }})
+            # Unprocessed keys count as empty: the conditional update still guards the limits
+            for item in response.get('Responses', {}).get(self.table.name, []):
+                window = int(item['windowKey']['S'].split('#', 1)[1])
+                counts[window] = (_count(item.get('admitted')), _count(item.get(f"user:{user_key}")))
+        return counts
+
+    def take_first(self, windows, user_key, limit, user_limit):
+        """Count one call in the first of windows with room; returns (window, None) or (None, reason)"""
+        reason = self.take(windows[0], user_key, limit, user_limit)
+        if reason is None or len(windows) == 1:
+            return (windows[0] if reason is None else None), reason
+        counts = self._read(windows[1:], user_key)
+        for window in windows[1:]:
+            admitted, used = counts.get(window, (0, 0))
+            if admitted >= limit:
+                reason = 'rate'
+            elif used >= user_limit:
+                reason = 'user'
+            else:
+                # Another container can fill it after the read; the condition catches that
+                reason = self.take(window, user_key, limit, user_limit)
+                if reason is None:
+                    return window, None
+        return None, reason
+
+class LocalWindows:
+    """In-memory stand-in for DynamoDbWindows (one container, local runs and benchmarks)"""
+
+    def __init__(self):
+        self._windows = {}  # window -> {'admitted': n, user_key: n}
+        self._lock = threading.Lock()
+
+    def take(self, window, user_key, limit, user_limit):
+        with self._lock:
+            for old in [w for w in self._windows if w < window - WINDOW_TTL_SECONDS]:
+                del self._windows[old]
+            counts = self._windows.setdefault(window, {'admitted': 0})
+            if counts['admitted'] >= limit:
+                return 'rate'
+            if counts.get(user_key, 0) >= user_limit:
+                return 'user'
+            counts['admitted'] += 1
+            counts[user_key] = counts.get(user_key, 0) + 1
+            return None
+
+    def take_first(self, windows, user_key, limit, user_limit):
+        reason = 'rate'
+        for window in windows:
+            reason = self.take(window, user_key, limit, user_limit)
+            if reason is None:
+                return window, None
+        return None, reason
+
+class BedrockGovernor:
+    """Admits invoke_model calls against the shared budget and adapts to throttling"""
+
+    def __init__(self, windows, max_rate=BEDROCK_MAX_RPS, user_share=USER_SHARE,
+                 max_queue_seconds=MAX_QUEUE_SECONDS, clock=None):
+        self.windows = windows
+        self.max_rate = max_rate
+        self.user_share = user_share
+        self.max_queue_seconds = max_queue_seconds
+        self.clock = clock or Clock()
+        self.rate = max_rate
+        self._cubic = CubicCalculator(starting_max_rate=max_rate, start_time=self.clock.current_time())
+        # Like botocore's ClientRateLimiter, the bucket only paces calls once a throttle was seen
+        self._bucket = TokenBucket(max_rate, self.clock)
+        self._throttled = False
+        self._lock = threading.Lock()
+
+    def limits(self):
+        """(calls per window, calls per user per window) this container admits against"""
+        limit = max(1, int(self.rate * WINDOW_SECONDS))
+        return limit, max(1, int(limit * self.user_share))
+
+    def _local_wait(self):
+        """Seconds until the container's own bucket has a token; 0 (token taken) if it has one"""
+        if not self._throttled:
+            return 0
+        try:
+            self._bucket.acquire(block=False)
+        except CapacityNotAvailableError:
+            return (1 - self._bucket.available_capacity) / self._bucket.max_rate
+        return 0
+
+    def _reject(self, user_key, reason, retry_after, depth):
+        retry_after = max(1, math.ceil(retry_after))
+        log_event('BEDROCK_ADMISSION_REJECTED', WARNING, user_id=user_key, reason=reason,
+                  retry_after=retry_after, queue_depth=depth, rate=round(self.rate, 2))
+        log_business_metric('BedrockAdmissionRejected', 1, 'Count')
+        return AdmissionRejected(f"Image generation is busy, retry in {retry_after}s", retry_after, reason)
+
+    def reserve(self, user_key, max_queue_seconds=None):
+        """Take a slot for one call; returns the clock time it may start (now, or a later window)
+        
+        Raises AdmissionRejected when no slot frees up within max_queue_seconds
+        (the governor's own limit by default; 0 only takes a slot in this window).
+        """
+        if max_queue_seconds is None:
+            max_queue_seconds = self.max_queue_seconds
+        now = self.clock.current_time()
+        local_wait = self._local_wait()
+        if local_wait:
+            raise self._reject(user_key, 'throttled', local_wait, 0)
+        
+        limit, user_limit = self.limits()
+        first = int(now // WINDOW_SECONDS)
+        last = int((now + max_queue_seconds) // WINDOW_SECONDS)
+        window, reason = self.windows.take_first(list(range(first, last + 1)), user_key, limit, user_limit)
+        if window is not None:
+            return max(now, window * WINDOW_SECONDS)
+        raise self._reject(user_key, reason, (last + 1) * WINDOW_SECONDS - now, last - first + 1)
+
+    def wait(self, start_at):
+        """Sleep until a reserved slot starts; returns the seconds waited"""
+        delay = start_at - self.clock.current_time()
+        if delay <= 0:
+            return 0
+        self.clock.sleep(delay)
+        log_business_metric('BedrockAdmissionWait', delay * 1000, 'Milliseconds')
+        return delay
+
+    def admit(self, user_key):
+        """reserve() and wait(): returns once the call may go ahead"""
+        return self.wait(self.reserve(user_key))
+
+    def _on_throttle(self):
+        with self._lock:
+            self.rate = self._cubic.error_received(self.rate, self.clock.current_time())
+            self._bucket.max_rate = self.rate
+            self._throttled = True
+        log_event('BEDROCK_THROTTLED', WARNING, rate=round(self.rate, 2))
+
+    def _on_success(self):
+        if not self._throttled:
+            return
+        with self._lock:
+            self.rate = min(self.max_rate, self._cubic.success_received(self.clock.current_time()))
+            self._bucket.max_rate = self.rate
+
+    def invoke_model(self, client, **kwargs):
+        """client.invoke_model(**kwargs), feeding throttles back into the admitted rate"""
+        try:
+            response = client.invoke_model(**kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] in THROTTLING_ERRORS:
+                self._on_throttle()
+            raise
+        self._on_success()
+        return response
+
+# Global governor - reused across invocations
+_governor = None
+_governor_lock = threading.Lock()
+
+def get_governor(dynamodb):
+    """The container's governor: counters in BEDROCK_ADMISSION_TABLE when configured, else in memory"""
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                table_name = os.environ.get('BEDROCK_ADMISSION_TABLE')
+                windows = DynamoDbWindows(dynamodb.Table(table_name)) if table_name else LocalWindows()
+                _governor = BedrockGovernor(windows)
+                log_event('BEDROCK_ADMISSION', INFO, shared=bool(table_name), max_rate=BEDROCK_MAX_RPS,
+                          user_share=USER_SHARE, max_queue_seconds=MAX_QUEUE_SECONDS)
+    return _governor
+
+def use_governor(governor):
+    """Replace the container's governor (local runs and benchmarks)"""
+    global _governor
+    _governor = governor
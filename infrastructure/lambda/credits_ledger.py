@@ -0,0 +1,150 @@
+import time
+import uuid
+from botocore.exceptions import ClientError
+
+# Reserve/commit/refund protocol on the Users table.
+#
+# reserve_credits takes credits with one conditional UpdateItem and records the
+# reservation id in the `pendingReservations` string set. commit_credits and
+# refund_credits only act while that id is still pending, so retried calls
+# (SQS redelivery, a refund after a timeout, ...) never double charge or
+# double refund.
+#
+# A reservation held by a synchronous request is also recorded, with its
+# amount and time, in the `reservations` map. If the Lambda dies between
+# reserve and commit/refund nothing else would give those credits back:
+# sweep_reservations refunds entries older than any invocation can run.
+# Queued jobs are not swept; the jobs dead-letter queue refunds those.
+
+class InsufficientCreditsError(Exception):
+    """Raised when a reservation would take the balance below zero"""
+
+def new_reservation_id(prefix='rsv'):
+    """Return a unique id for one reservation"""
+    return f"{prefix}_{uuid.uuid4().hex}"
+
+def _condition_failed(e):
+    return e.response['Error']['Code'] == 'ConditionalCheckFailedException'
+
+def _invalid_path(e):
+    """A document path into a `reservations` map the item does not have"""
+    return e.response['Error']['Code'] == 'ValidationException'
+
+def reserve_credits(users_table, user_id, amount, reservation_id, sweepable=True):
+    """Atomically take amount credits; returns the remaining balance
+
+    Raises InsufficientCreditsError if the user has fewer than amount credits.
+    Reserving an id that is already pending is a no-op. sweepable=False
+    leaves the reservation out of the sweep (queued jobs).
+    """
+    entry = {'amount': amount, 'reservedAt': int(time.time())}
+    new_map = False
+    while True:
+        names = {}
+        values = {':amount': amount, ':rid': {reservation_id}, ':rid_value': reservation_id}
+        condition = 'credits >= :amount AND NOT contains(pendingReservations, :rid_value)'
+        if not sweepable:
+            # Still create the map, so commit/refund can always remove their entry
+            track = 'reservations = if_not_exists(reservations, :no_reservations)'
+            values[':no_reservations'] = {}
+        elif new_map:
+            track = 'reservations = :reservations'
+            values[':reservations'] = {reservation_id: entry}
+            condition += ' AND attribute_not_exists(reservations)'
+        else:
+            track = 'reservations.#rid = :entry'
+            names['#rid'] = reservation_id
+            values[':entry'] = entry
+        try:
+            response = users_table.update_item(
+                Key={'userId': user_id},
+                UpdateExpression=f'SET credits = credits - :amount, {track} ADD pendingReservations :rid',
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW',
+                ReturnValuesOnConditionCheckFailure='ALL_OLD',
+                **({'ExpressionAttributeNames': names} if names else {})
+            )
+            return int(response['Attributes']['credits'])
+        except ClientError as e:
+            if _invalid_path(e) and not new_map:
+                # The user's first tracked reservation: there is no map to add it to yet
+                new_map = True
+                continue
+            if not _condition_failed(e):
+                raise
+            current = e.response.get('Item') or {}
+            if reservation_id in _pending(current):
+                return int(_value(current.get('credits', 0)))
+            if new_map and 'reservations' in current:
+                # A concurrent reservation created the map first
+                new_map = False
+                continue
+            raise InsufficientCreditsError('Insufficient credits')
+
+def _release(users_table, user_id, reservation_id, update='', values=None):
+    """Drop a pending reservation, applying update with it; returns False if it was not pending"""
+    legacy = False
+    while True:
+        try:
+            users_table.update_item(
+                Key={'userId': user_id},
+                UpdateExpression=f"{update}DELETE pendingReservations :rid{'' if legacy else ' REMOVE reservations.#rid'}",
+                ConditionExpression='contains(pendingReservations, :rid_value)',
+                ExpressionAttributeValues={
+                    ':rid': {reservation_id},
+                    ':rid_value': reservation_id,
+                    **(values or {})
+                },
+                **({} if legacy else {'ExpressionAttributeNames': {'#rid': reservation_id}})
+            )
+            return True
+        except ClientError as e:
+            if _invalid_path(e) and not legacy:
+                # Reserved before reservations were tracked: there is no map entry to remove
+                legacy = True
+                continue
+            if not _condition_failed(e):
+                raise
+            return False
+
+def commit_credits(users_table, user_id, reservation_id):
+    """Finalize a reservation; returns False if it was already committed or refunded"""
+    return _release(users_table, user_id, reservation_id)
+
+def refund_credits(users_table, user_id, amount, reservation_id):
+    """Give back a pending reservation; returns False if it was already committed or refunded"""
+    return _release(users_table, user_id, reservation_id, 'SET credits = credits + :amount ', {':amount': amount})
+
+def sweep_reservations(users_table, max_age_seconds, now=None):
+    """Refund tracked reservations older than max_age_seconds; returns [(user_id, reservation_id)] refunded
+
+    max_age_seconds must exceed the longest Lambda timeout that reserves
+    credits, or a request still running could lose its reservation.
+    """
+    cutoff = (time.time() if now is None else now) - max_age_seconds
+    kwargs = {'ProjectionExpression': 'userId, reservations'}
+    refunded = []
+    while True:
+        response = users_table.scan(**kwargs)
+        for item in response.get('Items', []):
+            for reservation_id, entry in (item.get('reservations') or {}).items():
+                if entry['reservedAt'] >= cutoff:
+                    continue
+                if refund_credits(users_table, item['userId'], int(entry['amount']), reservation_id):
+                    refunded.append((item['userId'], reservation_id))
+        if 'LastEvaluatedKey' not in response:
+            return refunded
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _pending(item):
+    """pendingReservations from a resource-level item or a low-level ALL_OLD image"""
+    pending = item.get('pendingReservations', set())
+    if isinstance(pending, dict):
+        pending = pending.get('SS', [])
+    return set(pending)
+
+def _value(attribute):
+    if isinstance(attribute, dict):
+        return attribute.get('N', 0)
+    return attribute
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+# How long a cached generation may be reused (DynamoDB TTL removes expired rows)
+CACHE_TTL_SECONDS = int(os.environ.get('GENERATION_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+# Upper bound on entries kept in the warm-container LRU in front of the table
+CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', 512))
+
+def normalize_prompt(text):
+    """Collapse whitespace so trivially different prompts share a cache entry"""
+    return ' '.join((text or '').split())
+
+def cache_key(model_id, prompt, negative_text=None, width=1024, height=1024,
+              cfg_scale=8.0, seed=None, number_of_images=1):
+    """Content address of a deterministic generation request"""
+    normalized = {
+        'model': model_id,
+        'prompt': normalize_prompt(prompt),
+        'negativeText': normalize_prompt(negative_text),
+        'size': f"{int(width)}x{int(height)}",
+        'cfgScale': float(cfg_scale),
+        'seed': int(seed),
+        'numberOfImages': int(number_of_images)
+    }
+    encoded = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+class GenerationCache:
+    """Maps cache keys to the S3 keys of previously generated images and their derivatives
+
+    Entries live in a DynamoDB table (expiring via its `expiresAt` TTL
+    attribute) with a size-bounded LRU per warm container in front of it.
+    """
+
+    def __init__(self, table, ttl_seconds=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def _remember(self, key, entry, expires_at):
+        self._entries[key] = (expires_at, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_entry(self, key):
+        """Return (s3_keys, derivatives) cached for key, or None on a miss
+        
+        derivatives holds one {name: {format: key}} per image, empty for
+        entries written before derivatives were cached.
+        """
+        now = time.time()
+
+        cached = self._entries.get(key)
+        if cached is not None:
+            expires_at, entry = cached
+            if now < expires_at:
+                self._entries.move_to_end(key)
+                return entry
+            del self._entries[key]
+
+        item = self.table.get_item(Key={'cacheKey': key}).get('Item')
+        # TTL deletion is lazy, so expired rows can still be returned
+        if not item or now >= int(item['expiresAt']):
+            return None
+
+        s3_keys = list(item['s3Keys'])
+        entry = (s3_keys, list(item.get('derivatives') or [{} for _ in s3_keys]))
+        self._remember(key, entry, int(item['expiresAt']))
+        return entry
+
+    def get(self, key):
+        """Return the cached S3 keys for key, or None on a miss"""
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, s3_keys, model_id=None, derivatives=None):
+        """Record the S3 keys (and derivatives, one {name: {format: key}} per image) produced for key"""
+        expires_at = int(time.time()) + self.ttl_seconds
+        derivatives = list(derivatives or [{} for _ in s3_keys])
+        self.table.put_item(
+            Item={
+                'cacheKey': key,
+                's3Keys': list(s3_keys),
+                'derivatives': derivatives,
+                'model': model_id,
+                'expiresAt': expires_at
+            }
+        )
+        self._remember(key, (list(s3_keys), derivatives), expires_at)
+
+# Global cache - reused across invocations
+_cache = None
+
+def get_generation_cache(dynamodb):
+    """Return the process-wide cache, or None when GENERATION_CACHE_TABLE is not configured"""
+    global _cache
+    table_name = os.environ.get('GENERATION_CACHE_TABLE')
+    if not table_name:
+        return None
+    if _cache is None:
+        _cache = GenerationCache(dynamodb.Table(table_name))
+    return _cache
@@ -0,0 +1,91 @@
+import os
+import time
+from collections import OrderedDict
+
+# Upper bound on sub -> userId mappings kept per warm container
+USER_ID_CACHE_MAX_ENTRIES = 4096
+
+# Cognito sub -> Users table userId (LRU, reused across invocations)
+_user_ids = OrderedDict()
+
+# Crockford base32, the ULID alphabet (no I, L, O, U)
+_ULID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+def new_user_id(now=None):
+    """Return a unique, time-ordered Users table id: user_ + a 26 character ULID
+
+    48 bits of millisecond timestamp then 80 random bits, so ids sort by
+    creation time and sign-ups in the same millisecond (on any container)
+    still get distinct ids.
+    """
+    millis = int((time.time() if now is None else now) * 1000)
+    value = (millis << 80) | int.from_bytes(os.urandom(10), 'big')
+    chars = []
+    for _ in range(26):
+        chars.append(_ULID_ALPHABET[value & 31])
+        value >>= 5
+    return 'user_' + ''.join(reversed(chars))
+
+def remember_user_id(sub, user_id):
+    """Cache the Users table userId for a Cognito sub"""
+    _user_ids[sub] = user_id
+    _user_ids.move_to_end(sub)
+    while len(_user_ids) > USER_ID_CACHE_MAX_ENTRIES:
+        _user_ids.popitem(last=False)
+
+def forget_user_id(sub):
+    """Drop a cached mapping (e.g. after the user record disappeared)"""
+    _user_ids.pop(sub, None)
+
+def cached_user_id(sub):
+    """Return the cached userId for a Cognito sub, or None"""
+    user_id = _user_ids.get(sub)
+    if user_id is not None:
+        _user_ids.move_to_end(sub)
+    return user_id
+
+def find_user_by_email(users_table, email):
+    """Look up a user through the EmailIndex GSI (never scans the table)"""
+    response = users_table.query(
+        IndexName='EmailIndex',
+        KeyConditionExpression='email = :email',
+        ExpressionAttributeValues={':email': email},
+        Limit=1
+    )
+    items = response.get('Items', [])
+    return items[0] if items else None
+
+def resolve_user(users_table, sub, email=None):
+    """Return the Users table item for a Cognito identity, or None if unknown
+
+    Warm containers resolve with a single get_item on the cached userId;
+    otherwise the EmailIndex GSI is queried once and the mapping cached.
+    """
+    if not sub:
+        return None
+
+    user_id = cached_user_id(sub)
+    if user_id is not None:
+        response = users_table.get_item(Key={'userId': user_id})
+        if 'Item' in response:
+            return response['Item']
+        forget_user_id(sub)
+
+    if email:
+        user = find_user_by_email(users_table, email)
+    else:
+        # Fallback: records created from token claims are keyed by sub
+        user = users_table.get_item(Key={'userId': sub}).get('Item')
+
+    if user is not None:
+        remember_user_id(sub, user['userId'])
+    return user
+
+def resolve_user_id(users_table, sub, email=None):
+    """Return only the Users table userId for a Cognito identity, or None"""
+    user_id = cached_user_id(sub) if sub else None
+    if user_id is not None:
+        return user_id
+
+    user = resolve_user(users_table, sub, email)
+    return user['userId'] if user else None
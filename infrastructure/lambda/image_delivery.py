@@ -0,0 +1,198 @@
+import datetime
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote, urlparse
+
+# Image delivery: images stay private in S3 and are handed out as short-lived
+# signed URLs, either S3 pre-signed (SigV4 query auth) or, when a CloudFront
+# distribution is configured, CloudFront signed URLs so views are served from
+# the edge. Signing is local: the SigV4 signing key is derived once per day
+# and credentials, the CloudFront private key is loaded once, and nothing
+# here makes a network call per URL.
+#
+# Signing times are rounded down to URL_WINDOW_SECONDS, so the same image
+# gets the same URL for a whole window and browsers/CloudFront can reuse
+# their cached copy; a URL stays valid for at least URL_TTL_SECONDS.
+
+# Objects are written once under a unique key and never modified
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+URL_TTL_SECONDS = int(os.environ.get('IMAGE_URL_TTL_SECONDS', 3600))
+URL_WINDOW_SECONDS = int(os.environ.get('IMAGE_URL_WINDOW_SECONDS', 600))
+
+# SigV4 query auth is valid for at most 7 days
+MAX_PRESIGN_SECONDS = 7 * 24 * 3600
+
+# Signed CloudFront URLs remembered per warm container (RSA signing is ~1 ms)
+CDN_URL_CACHE_ENTRIES = int(os.environ.get('CDN_URL_CACHE_ENTRIES', 4096))
+
+def _window(now, window_seconds):
+    return int(now // window_seconds * window_seconds) if window_seconds > 0 else int(now)
+
+class S3UrlSigner:
+    """Pre-signs S3 GET URLs locally (SigV4 query auth, UNSIGNED-PAYLOAD)"""
+
+    def __init__(self, bucket, region, get_credentials=None, ttl_seconds=URL_TTL_SECONDS,
+                 window_seconds=URL_WINDOW_SECONDS):
+        self.bucket = bucket
+        self.region = region
+        self.get_credentials = get_credentials or _session_credentials
+        self.ttl_seconds = ttl_seconds
+        self.window_seconds = window_seconds
+        # Buckets with dots break the wildcard certificate of virtual-hosted URLs
+        if '.' in bucket:
+            self.host = f"s3.{region}.amazonaws.com"
+            self.path_prefix = f"/{quote(bucket)}/"
+        else:
+            self.host = f"{bucket}.s3.{region}.amazonaws.com"
+            self.path_prefix = '/'
+        self._signing_key = (None, None)  # ((secret key, date), key)
+
+    def _key_for(self, secret_key, date):
+        cached_for, key = self._signing_key
+        if cached_for != (secret_key, date):
+            key = ('AWS4' + secret_key).encode('utf-8')
+            for part in (date, self.region, 's3', 'aws4_request'):
+                key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+            self._signing_key = ((secret_key, date), key)
+        return key
+
+    def sign(self, s3_key, now=None):
+        """Signed URL for s3_key, valid for at least ttl_seconds from now"""
+        signed_at = _window(time.time() if now is None else now, self.window_seconds)
+        # Signed up to one window ago, so the lifetime covers the window plus the TTL
+        return self.sign_at(s3_key, signed_at, min(self.ttl_seconds + self.window_seconds, MAX_PRESIGN_SECONDS))
+
+    def sign_at(self, s3_key, signed_at, expires):
+        """Signed URL for s3_key with an explicit signing time (epoch seconds) and lifetime"""
+        credentials = self.get_credentials()
+        timestamp = time.gmtime(signed_at)
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', timestamp)
+        date = amz_date[:8]
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        
+        params = [
+            ('X-Amz-Algorithm', 'AWS4-HMAC-SHA256'),
+            ('X-Amz-Credential', f"{credentials.access_key}/{scope}"),
+            ('X-Amz-Date', amz_date),
+            ('X-Amz-Expires', str(expires)),
+            ('X-Amz-SignedHeaders', 'host')
+        ]
+        if credentials.token:
+            params.append(('X-Amz-Security-Token', credentials.token))
+        params.sort()
+        query = '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}" for k, v in params)
+        path = self.path_prefix + quote(s3_key, safe='/~')
+        
+        canonical_request = f"GET\n{path}\n{query}\nhost:{self.host}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = (f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n"
+                          f"{hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()}")
+        signature = hmac.new(self._key_for(credentials.secret_key, date), string_to_sign.encode('utf-8'),
+                             hashlib.sha256).hexdigest()
+        return f"https://{self.host}{path}?{query}&X-Amz-Signature={signature}"
+
+class CloudFrontUrlSigner:
+    """Signs CloudFront URLs with a canned policy (RSA-SHA1, as CloudFront requires)"""
+
+    def __init__(self, domain, key_pair_id, private_key_pem, ttl_seconds=URL_TTL_SECONDS,
+                 window_seconds=URL_WINDOW_SECONDS, max_entries=CDN_URL_CACHE_ENTRIES):
+        from botocore.signers import CloudFrontSigner
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
+        
+        private_key = serialization.load_pem_private_key(
+            private_key_pem.encode('utf-8') if isinstance(private_key_pem, str) else private_key_pem,
+            password=None
+        )
+        self.base_url = f"https://{domain}/"
+        self.ttl_seconds = ttl_seconds
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._signer = CloudFrontSigner(
+            key_pair_id, lambda message: private_key.sign(message, padding.PKCS1v15(), hashes.SHA1())
+        )
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sign(self, s3_key, now=None):
+        now = time.time() if now is None else now
+        expires_at = _window(now, self.window_seconds) + self.window_seconds + self.ttl_seconds
+        cache_key = (s3_key, expires_at)
+        with self._lock:
+            url = self._urls.get(cache_key)
+            if url is not None:
+                self._urls.move_to_end(cache_key)
+                return url
+        
+        url = self._signer.generate_presigned_url(
+            self.base_url + quote(s3_key, safe='/~'),
+            date_less_than=datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc)
+        )
+        with self._lock:
+            self._urls[cache_key] = url
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return url
+
+def _session_credentials():
+    # Lambda credentials come from environment variables: resolved locally, no network
+    from aws_clients import get_session
+    return get_session().get_credentials().get_frozen_credentials()
+
+def _load_cdn_private_key():
+    from aws_clients import get_client
+    secret_id = os.environ['CDN_PRIVATE_KEY_SECRET_ARN']
+    return get_client('secretsmanager').get_secret_value(SecretId=secret_id)['SecretString']
+
+_signer = None
+_signer_lock = threading.Lock()
+
+def get_signer():
+    """The signer for this container: CloudFront when CDN_DOMAIN is configured, else S3"""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                if os.environ.get('CDN_DOMAIN'):
+                    _signer = CloudFrontUrlSigner(os.environ['CDN_DOMAIN'], os.environ['CDN_KEY_PAIR_ID'],
+                                                  _load_cdn_private_key())
+                else:
+                    _signer = S3UrlSigner(os.environ.get('IMAGES_BUCKET') or os.environ.get('S3_BUCKET'),
+                                          os.environ.get('IMAGES_BUCKET_REGION', 'ap-southeast-1'))
+    return _signer
+
+def use_signer(signer):
+    """Replace the container's signer (local runs and benchmarks)"""
+    global _signer
+    _signer = signer
+
+def image_key(value):
+    """S3 key of an image reference: a key, or a URL stored by older releases"""
+    if not value or not value.startswith('https://'):
+        return value
+    path = unquote(urlparse(value).path).lstrip('/')
+    host = urlparse(value).netloc
+    # Path-style URLs carry the bucket as the first path segment
+    if host.startswith('s3.') or host.startswith('s3-'):
+        path = path.split('/', 1)[1] if '/' in path else ''
+    return path
+
+def signed_url(value, now=None):
+    """Short-lived URL for an image key (or legacy public URL); None stays None"""
+    if not value:
+        return value
+    return get_signer().sign(image_key(value), now)
+
+def signed_urls(values, now=None):
+    now = time.time() if now is None else now
+    return [signed_url(value, now) for value in values]
+
+def signed_derivatives(derivatives, now=None):
+    """{name: {format: signed URL}} for a row's derivative keys"""
+    now = time.time() if now is None else now
+    return {name: {fmt: signed_url(key, now) for fmt, key in formats.items()}
+            for name, formats in (derivatives or {}).items()}
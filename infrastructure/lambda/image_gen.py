@@ -1,22 +1,73 @@
-import json
-import boto3
 import base64
+import json
 import os
 import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from botocore.config import Config
-from logger import log_api_call, log_image_generation, log_business_metric
+from botocore.exceptions import ClientError
+from logger import INFO, WARNING, log_api_call, log_event, log_image_generation, log_business_metric, log_cache_lookup
+from metrics import flush, flush_metrics
+from identity import resolve_user_id
+from credits_ledger import (InsufficientCreditsError, commit_credits, new_reservation_id, refund_credits, reserve_credits,
+                            sweep_reservations)
+from generation_cache import cache_key, get_generation_cache
+from aws_clients import lazy_client, lazy_resource
+from bedrock_admission import AdmissionRejected, get_governor
+from image_delivery import IMAGE_CACHE_CONTROL, signed_derivatives, signed_url, signed_urls
+from image_derivatives import ENCODERS, derivative_key, store_derivatives
+from image_history import InvalidCursorError, get_history, invalidate_history, parse_page_size
+from model_router import get_router
+from response_stream import NDJSON_CONTENT_TYPE, EventStream, HttpResponseStream
+from tracing import expose_header, traced
 
 # Connection pooling configuration
-config = Config(
+config = dict(
     max_pool_connections=50,
     retries={'max_attempts': 2, 'mode': 'adaptive'}
 )
 
-# Global clients - Cross-region setup
-bedrock = boto3.client('bedrock-runtime', region_name='us-east-1', config=config)  # Bedrock models in US East
-dynamodb = boto3.resource('dynamodb', region_name='ap-southeast-1', config=config)  # Data in Singapore
-s3 = boto3.client('s3', region_name='ap-southeast-1', config=config)  # Storage in Singapore
+# Bedrock calls are paced by bedrock_admission.py, so its client retries without adaptive sleeps
+bedrock_config = dict(config, retries={'max_attempts': 2, 'mode': 'standard'})
+
+# Global clients - Cross-region setup, built on first use (see aws_clients.py)
+bedrock = lazy_client('bedrock-runtime', 'us-east-1', **bedrock_config)  # Bedrock models in US East
+dynamodb = lazy_resource('dynamodb', 'ap-southeast-1', **config)  # Data in Singapore
+s3 = lazy_client('s3', 'ap-southeast-1', **config)  # Storage in Singapore
+sqs = lazy_client('sqs', 'ap-southeast-1', **config)  # Job queue in Singapore
+
+# Job lifecycle, stored as `status` on the Images table row (imageId == jobId)
+JOB_QUEUED = 'QUEUED'
+JOB_RUNNING = 'RUNNING'
+JOB_COMPLETED = 'COMPLETED'
+JOB_FAILED = 'FAILED'
+
+# A RUNNING job claimed longer ago than this lost its worker (timeout, crash) and
+# may be claimed again by the next delivery of its message; longer than the
+# worker's timeout, so a live worker never loses its job
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 90))
+
+# A request's credit reservation older than this lost its Lambda between reserve
+# and commit/refund and is refunded by reservation_sweeper; well past the
+# timeout of every function that reserves synchronously
+RESERVATION_TIMEOUT_SECONDS = int(os.environ.get('RESERVATION_TIMEOUT_SECONDS', 300))
+
+# Derivatives (image_derivatives.py) cost ~450 ms of CPU per image. The queued
+# worker renders them inline; synchronous requests (handler, stream_handler)
+# leave them to derivatives_worker through DERIVATIVES_QUEUE_URL unless this is
+# 'true', so images come back sooner and their derivatives follow a few
+# seconds later (clients show the original meanwhile)
+SYNC_DERIVATIVES = os.environ.get('SYNC_DERIVATIVES', 'false').lower() == 'true'
+
+# Titan accepts 1-5 images per invoke_model call
+MAX_IMAGES_PER_REQUEST = 5
+
+# Bounded fan-out for S3 uploads of a batch
+UPLOAD_WORKERS = 4
+
+# Bedrock errors worth re-queueing instead of failing the job
+RETRYABLE_ERRORS = ('ThrottlingException', 'ServiceUnavailableException', 'ModelNotReadyException')
 
 def cors_response(status_code, body, content_type='application/json'):
     """Helper function to return response with CORS headers"""
@@ -31,7 +82,218 @@ def cors_response(status_code, body, content_type='application/json'):
         'body': json.dumps(body) if isinstance(body, dict) else body
     }
 
+def busy_response(error):
+    """429 for a generation turned away by admission control (bedrock_admission.py)"""
+    response = cors_response(429, {'error': str(error), 'retryAfter': error.retry_after})
+    response['headers']['Retry-After'] = str(error.retry_after)
+    expose_header(response['headers'], 'Retry-After')
+    return response
+
+def parse_image_count(body):
+    """Validate the requested numberOfImages (defaults to 1)"""
+    count = int(body.get('numberOfImages', 1))
+    if not 1 <= count <= MAX_IMAGES_PER_REQUEST:
+        raise ValueError(f"numberOfImages must be between 1 and {MAX_IMAGES_PER_REQUEST}")
+    return count
+
+def parse_seed(body):
+    """Validate the optional seed; only seeded requests are deterministic and cacheable"""
+    seed = body.get('seed')
+    if seed is None:
+        return None
+    seed = int(seed)
+    if not 0 <= seed <= 2147483646:
+        raise ValueError("seed must be between 0 and 2147483646")
+    return seed
+
+def upload_image(bucket, db_user_id, image_id, image_bytes, with_derivatives=True):
+    """Upload one PNG and (with_derivatives) its derivatives; returns (s3_key, derivatives)"""
+    s3_key = f"images/{db_user_id}/{image_id}.png"
+    s3.put_object(
+        Bucket=bucket,
+        Key=s3_key,
+        Body=image_bytes,
+        ContentType='image/png',
+        CacheControl=IMAGE_CACHE_CONTROL
+    )
+    if not with_derivatives:
+        return s3_key, {}
+    return s3_key, store_derivatives(s3, bucket, s3_key, image_bytes, IMAGE_CACHE_CONTROL)
+
+def upload_images(images, db_user_id, image_ids, with_derivatives=True):
+    """Upload decoded images and their derivatives to S3 through a bounded pool
+    
+    images is an iterable of PNG bytes (e.g. image_payload.iter_images over the
+    Bedrock response body); each upload starts as soon as its image is decoded.
+    Returns (s3_keys, derivatives) in order; derivatives are rendered from the
+    bytes in memory (see image_derivatives.py), or left empty without
+    with_derivatives.
+    """
+    bucket = os.environ['IMAGES_BUCKET']
+
+    def upload(index, image_bytes):
+        return upload_image(bucket, db_user_id, image_ids[index], image_bytes, with_derivatives)
+    
+    if len(image_ids) == 1:
+        results = [upload(index, image_bytes) for index, image_bytes in zip(range(1), images)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(image_ids), UPLOAD_WORKERS)) as executor:
+            futures = [executor.submit(upload, index, image_bytes)
+                       for index, image_bytes in zip(range(len(image_ids)), images)]
+            results = [future.result() for future in futures]
+    if len(results) != len(image_ids):
+        raise ValueError(f"Bedrock returned {len(results)} images, expected {len(image_ids)}")
+    return [key for key, _ in results], [derivatives for _, derivatives in results]
+
+def copy_cached_images(source_keys, db_user_id, image_ids, source_derivatives=None):
+    """Server-side copy of cached images and their derivatives into the user's prefix
+    
+    Returns (s3_keys, derivatives) in order. Derivatives are best effort, as
+    when they are rendered: one that fails to copy is left out and clients
+    fall back to the original.
+    """
+    bucket = os.environ['IMAGES_BUCKET']
+    s3_keys = [f"images/{db_user_id}/{image_id}.png" for image_id in image_ids]
+    derivative_copies = [(index, name, fmt, source_key, derivative_key(s3_keys[index], name, fmt))
+                         for index, derivatives in enumerate(source_derivatives or [])
+                         for name, formats in derivatives.items()
+                         for fmt, source_key in formats.items()]
+
+    def copy(source_key, s3_key, content_type):
+        s3.copy_object(
+            Bucket=bucket,
+            Key=s3_key,
+            CopySource={'Bucket': bucket, 'Key': source_key},
+            ContentType=content_type,
+            CacheControl=IMAGE_CACHE_CONTROL,
+            MetadataDirective='REPLACE'
+        )
+    
+    def copy_derivative(index, name, fmt, source_key, s3_key):
+        try:
+            copy(source_key, s3_key, ENCODERS[fmt][1])
+            return True
+        except Exception as e:
+            log_event('DERIVATIVES_ERROR', WARNING, s3_key=s3_key, error=str(e))
+            return False
+    
+    workers = min(len(image_ids) + len(derivative_copies), UPLOAD_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        originals = [executor.submit(copy, source_key, s3_key, 'image/png')
+                     for source_key, s3_key in zip(source_keys, s3_keys)]
+        copied = [executor.submit(copy_derivative, *task) for task in derivative_copies]
+        for future in originals:
+            future.result()
+    
+    derivatives = [{} for _ in image_ids]
+    for (index, name, fmt, _, s3_key), future in zip(derivative_copies, copied):
+        if future.result():
+            derivatives[index].setdefault(name, {})[fmt] = s3_key
+    return s3_keys, derivatives
+
+def defer_derivatives(db_user_id, image_ids, s3_keys, derivatives):
+    """Queue the images that have no derivatives for derivatives_worker
+    
+    Best effort, like the derivatives themselves: the images are stored and
+    paid for whether or not the message goes out.
+    """
+    queue_url = os.environ.get('DERIVATIVES_QUEUE_URL')
+    images = [[image_id, s3_key] for image_id, s3_key, image_derivatives in zip(image_ids, s3_keys, derivatives)
+              if not image_derivatives]
+    if not queue_url or not images:
+        return
+    try:
+        sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'userId': db_user_id, 'images': images}))
+    except Exception as e:
+        log_event('DERIVATIVES_ERROR', WARNING, image_ids=[image_id for image_id, _ in images], error=str(e))
+
+def image_generation_config(image_count, seed=None):
+    generation_config = {
+        'numberOfImages': image_count,
+        'height': 1024,
+        'width': 1024,
+        'cfgScale': 8.0
+    }
+    if seed is not None:
+        generation_config['seed'] = seed
+    return generation_config
+
+def generate_and_store(prompt, db_user_id, image_ids, seed=None, user_id=None, with_derivatives=True):
+    """Invoke Bedrock once for len(image_ids) images, upload them to S3 and return
+    (s3_keys, derivatives, bedrock_duration_ms, cost)
+    
+    Without with_derivatives only the originals are uploaded (see
+    defer_derivatives).
+    
+    Seeded requests are deterministic, so they are served from the generation
+    cache when an identical request was generated before on the model they are
+    pinned to (the images and their derivatives are copied; bedrock_duration_ms
+    and cost are 0). Bedrock calls go through
+    admission control, which raises AdmissionRejected when the shared budget
+    has no slot soon enough, and the model router, which picks the model
+    (model_router.py).
+    """
+    generation_config = image_generation_config(len(image_ids), seed)
+    router = get_router()
+    
+    def generation_key(model_id):
+        return cache_key(model_id, prompt, None, generation_config['width'], generation_config['height'],
+                         generation_config['cfgScale'], seed, len(image_ids))
+    
+    cache = get_generation_cache(dynamodb) if seed is not None else None
+    if cache is not None:
+        preferred = router.preferred(len(image_ids))
+        entry = cache.get_entry(generation_key(preferred.model_id)) if preferred is not None else None
+        log_cache_lookup('GenerationCache', entry is not None, user_id)
+        if entry is not None:
+            source_keys, source_derivatives = entry
+            s3_keys, derivatives = copy_cached_images(source_keys, db_user_id, image_ids, source_derivatives)
+            return s3_keys, derivatives, 0, 0
+    
+    governor = get_governor(dynamodb)
+    governor.admit(db_user_id)
+    
+    bedrock_start = time.time()
+    routed = router.invoke(bedrock, prompt, generation_config, governor, db_user_id, pinned=cache is not None)
+    bedrock_duration = (time.time() - bedrock_start) * 1000
+    
+    # Decoded straight from the response stream, without holding the JSON or base64 text
+    s3_keys, derivatives = upload_images(routed.images(), db_user_id, image_ids, with_derivatives)
+    
+    if cache is not None:
+        # Keyed on the model that made the images, which is not the preferred one after a failover
+        cache.put(generation_key(routed.model_id), s3_keys, routed.model_id, derivatives)
+    
+    return s3_keys, derivatives, bedrock_duration, routed.cost(len(image_ids))
+
+def save_images(db_user_id, prompt, image_ids, s3_keys, derivatives=None):
+    """Write all Images table rows of a batch through one batch_writer
+    
+    Rows keep the S3 keys; URLs are signed when an image is returned (image_delivery.py).
+    """
+    images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+    created_at = datetime.now().isoformat()
+    with images_table.batch_writer() as batch:
+        for image_id, s3_key, image_derivatives in zip(image_ids, s3_keys, derivatives or [{} for _ in image_ids]):
+            item = {
+                'imageId': image_id,
+                'userId': db_user_id,
+                'prompt': prompt,
+                'imageKey': s3_key,
+                'createdAt': created_at
+            }
+            if image_derivatives:
+                item['derivatives'] = image_derivatives
+            batch.put_item(Item=item)
+
+@flush_metrics
+@traced
 def handler(event, context):
+    if event.get('httpMethod') == 'GET':
+        if event.get('resource', '').endswith('/history'):
+            return get_image_history(event)
+        return get_job_status(event)
+    
     start_time = time.time()
     user_id = None
     
@@ -39,6 +301,12 @@ def handler(event, context):
         body = json.loads(event['body'])
         prompt = body['prompt']
         
+        try:
+            image_count = parse_image_count(body)
+            seed = parse_seed(body)
+        except ValueError as e:
+            return cors_response(400, {'error': str(e)})
+        
         # Get user ID from Cognito authorizer claims
         claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
         user_id = claims.get('sub') or claims.get('cognito:username')
@@ -49,117 +317,568 @@ def handler(event, context):
         
         log_api_call('image_gen', user_id, 'generate_image_start', True)
         
-        # Check user credits - lookup by email since userId format is different
+        # Resolve Cognito identity to userId via EmailIndex (cached when warm, no read)
         users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+        db_user_id = resolve_user_id(users_table, user_id, email)
         
-        if email:
-            # Find user by email
-            user_response = users_table.scan(
-                FilterExpression='email = :email',
-                ExpressionAttributeValues={':email': email}
-            )
-            
-            if not user_response['Items']:
-                log_api_call('image_gen', user_id, 'user_not_found', False)
-                return {
-                    'statusCode': 404,
-                    'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User not found'})
-                }
-            
-            user = user_response['Items'][0]
-            db_user_id = user['userId']
-        else:
-            # Fallback: try direct lookup with Cognito user ID
-            user_response = users_table.get_item(Key={'userId': user_id})
-            if 'Item' not in user_response:
-                log_api_call('image_gen', user_id, 'user_not_found', False)
-                return {
-                    'statusCode': 404,
-                    'headers': {'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'User not found'})
-                }
-            user = user_response['Item']
-            db_user_id = user_id
-        
-        if int(user['credits']) < 1:
-            log_api_call('image_gen', user_id, 'insufficient_credits', False)
+        if not db_user_id:
+            log_api_call('image_gen', user_id, 'user_not_found', False)
             return {
-                'statusCode': 400,
+                'statusCode': 404,
                 'headers': {'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Insufficient credits'})
+                'body': json.dumps({'error': 'User not found'})
             }
         
-        # Generate image with Bedrock Titan Image Generator
-        bedrock_start = time.time()
-        response = bedrock.invoke_model(
-            modelId='amazon.titan-image-generator-v1',
-            body=json.dumps({
-                'taskType': 'TEXT_IMAGE',
-                'textToImageParams': {
-                    'text': prompt
-                },
-                'imageGenerationConfig': {
-                    'numberOfImages': 1,
-                    'height': 1024,
-                    'width': 1024,
-                    'cfgScale': 8.0
-                }
-            })
-        )
-        bedrock_duration = (time.time() - bedrock_start) * 1000
-        
-        result = json.loads(response['body'].read())
-        image_data = result['images'][0]
-        
-        # Upload to S3
-        image_id = f"img_{int(datetime.now().timestamp())}"
-        s3_key = f"images/{db_user_id}/{image_id}.png"
+        # Job mode: reserve credits, queue the work and return immediately
+        if body.get('async'):
+            return submit_job(user_id, db_user_id, prompt, image_count, body.get('callbackUrl'), seed)
         
-        s3.put_object(
-            Bucket=os.environ['IMAGES_BUCKET'],
-            Key=s3_key,
-            Body=base64.b64decode(image_data),
-            ContentType='image/png'
-        )
+        # Reserve all images with one conditional update (the balance check); refunded if anything fails
+        reservation_id = new_reservation_id('gen')
+        try:
+            remaining_credits = reserve_credits(users_table, db_user_id, image_count, reservation_id)
+        except InsufficientCreditsError:
+            log_api_call('image_gen', user_id, 'insufficient_credits', False)
+            return cors_response(400, {'error': 'Insufficient credits'})
         
-        image_url = f"https://{os.environ['IMAGES_BUCKET']}.s3.amazonaws.com/{s3_key}"
+        # Generate images with Bedrock (one call to the routed model) and upload to S3
+        image_ids = [f"img_{uuid.uuid4().hex}" for _ in range(image_count)]
+        try:
+            s3_keys, derivatives, bedrock_duration, cost = generate_and_store(prompt, db_user_id, image_ids, seed,
+                                                                              user_id, SYNC_DERIVATIVES)
+            
+            # Save to DynamoDB
+            save_images(db_user_id, prompt, image_ids, s3_keys, derivatives)
+        except Exception:
+            refund_credits(users_table, db_user_id, image_count, reservation_id)
+            raise
+        invalidate_history(db_user_id)
         
-        # Save to DynamoDB
-        images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
-        images_table.put_item(
-            Item={
-                'imageId': image_id,
-                'userId': db_user_id,
-                'prompt': prompt,
-                'imageUrl': image_url,
-                'createdAt': datetime.now().isoformat()
-            }
-        )
-        
-        # Deduct credits
-        users_table.update_item(
-            Key={'userId': db_user_id},
-            UpdateExpression='SET credits = credits - :dec',
-            ExpressionAttributeValues={':dec': 1}
-        )
+        commit_credits(users_table, db_user_id, reservation_id)
+        defer_derivatives(db_user_id, image_ids, s3_keys, derivatives)
         
         # Log successful generation
         total_duration = (time.time() - start_time) * 1000
-        log_image_generation(user_id, prompt, True, 0.04, total_duration)  # $0.04 per image
-        log_business_metric('BedrockDuration', bedrock_duration, 'Milliseconds', user_id)
+        if bedrock_duration:
+            log_image_generation(user_id, prompt, True, cost, total_duration)
+            log_business_metric('BedrockDuration', bedrock_duration, 'Milliseconds', user_id)
+        else:
+            log_image_generation(user_id, prompt, True, 0, total_duration)  # Served from the generation cache
         
         log_api_call('image_gen', user_id, 'generate_image_success', True, total_duration)
         
+        image_urls = signed_urls(s3_keys)
         return cors_response(200, {
-            'imageId': image_id,
-            'imageUrl': image_url,
-            'remainingCredits': int(user['credits']) - 1
+            'imageId': image_ids[0],
+            'imageUrl': image_urls[0],
+            'images': [
+                {'imageId': image_id, 'imageUrl': image_url, 'derivatives': signed_derivatives(image_derivatives)}
+                for image_id, image_url, image_derivatives in zip(image_ids, image_urls, derivatives)
+            ],
+            'remainingCredits': remaining_credits
         })
-        
+    
+    except AdmissionRejected as e:
+        # Credits were refunded above; the client retries after Retry-After
+        log_api_call('image_gen', user_id, 'generate_image_rejected', False)
+        return busy_response(e)
+    
     except Exception as e:
         duration = (time.time() - start_time) * 1000
         log_api_call('image_gen', user_id, 'generate_image_error', False, duration, e)
         log_image_generation(user_id, prompt if 'prompt' in locals() else 'unknown', False)
         
         return cors_response(500, {'error': str(e)})
+
+def submit_job(user_id, db_user_id, prompt, image_count=1, callback_url=None, seed=None):
+    """Reserve credits, record a QUEUED job and enqueue it for the worker"""
+    users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+    images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+    
+    # Atomic reservation keyed by the job id - committed or refunded by the worker (or the dead-letter queue)
+    job_id = new_reservation_id('job')
+    try:
+        remaining_credits = reserve_credits(users_table, db_user_id, image_count, job_id, sweepable=False)
+    except InsufficientCreditsError:
+        log_api_call('image_gen', user_id, 'insufficient_credits', False)
+        return cors_response(400, {'error': 'Insufficient credits'})
+    
+    job = {
+        'imageId': job_id,
+        'userId': db_user_id,
+        'prompt': prompt,
+        'status': JOB_QUEUED,
+        'numberOfImages': image_count,
+        'createdAt': datetime.now().isoformat()
+    }
+    if callback_url and callback_url.startswith('https://'):
+        job['callbackUrl'] = callback_url
+    if seed is not None:
+        job['seed'] = seed
+    
+    try:
+        images_table.put_item(Item=job)
+        sqs.send_message(
+            QueueUrl=os.environ['JOBS_QUEUE_URL'],
+            MessageBody=json.dumps({'jobId': job_id, 'cognitoSub': user_id})
+        )
+    except Exception:
+        refund_credits(users_table, db_user_id, image_count, job_id)
+        raise
+    invalidate_history(db_user_id)
+    
+    log_api_call('image_gen', user_id, 'generate_image_queued', True)
+    
+    return cors_response(202, {
+        'jobId': job_id,
+        'status': JOB_QUEUED,
+        'statusUrl': f"/image/jobs/{job_id}",
+        'remainingCredits': remaining_credits
+    })
+
+# Headers of streamed generation responses (stream_handler)
+STREAM_HEADERS = {
+    'Cache-Control': 'no-store',
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'X-Image-Ids'
+}
+
+def request_claims(event):
+    """Cognito claims of the caller: from the API Gateway authorizer, else the Bearer token
+    (Function URLs have no authorizer, so the token is verified here like authorizer.py does)
+    """
+    claims = event.get('requestContext', {}).get('authorizer', {}).get('claims')
+    if claims:
+        return claims
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    token = headers.get('authorization', '')
+    if not token:
+        return {}
+    from authorizer import get_verifier
+    try:
+        return get_verifier().verify(token[7:] if token.startswith('Bearer ') else token)
+    except Exception as e:
+        log_event('STREAM_AUTHORIZATION_FAILED', WARNING, error=str(e))
+        return {}
+
+def _stream_error(http_stream, status_code, error):
+    """Answer with a JSON error; only possible before anything was streamed"""
+    http_stream.status_code = status_code
+    http_stream.headers['Content-Type'] = 'application/json'
+    http_stream.write(json.dumps({'error': error}).encode('utf-8'))
+
+def stream_handler(event, response_stream, context=None):
+    """Streaming variant of POST /image/generate (Lambda response streaming, see response_stream.py)
+    
+    Writes NDJSON progress events as each step finishes - credits_reserved,
+    model_invoked, then image_decoded, image_uploaded and image_ready per
+    image, and done (or error) - so the client hears back at once instead of
+    after the whole pipeline. With {"stream": "image"} the body is the first
+    image's PNG bytes instead, written as soon as it is decoded and before its
+    S3 upload finishes; the ids of the batch are in the X-Image-Ids header.
+    A failure after the first byte is an error event, or in image mode the
+    Runtime API error trailers, since the PNG can carry no error of its own.
+    """
+    http_stream = HttpResponseStream(response_stream, 200, dict(STREAM_HEADERS))
+    start_time = time.time()
+    user_id = None
+    failure = None
+    
+    try:
+        raw_body = event.get('body') or '{}'
+        if event.get('isBase64Encoded'):
+            raw_body = base64.b64decode(raw_body)
+        body = json.loads(raw_body)
+        prompt = body.get('prompt')
+        
+        try:
+            if not prompt:
+                raise ValueError('prompt is required')
+            image_count = parse_image_count(body)
+            seed = parse_seed(body)
+        except ValueError as e:
+            return _stream_error(http_stream, 400, str(e))
+        
+        claims = request_claims(event)
+        user_id = claims.get('sub') or claims.get('cognito:username')
+        if not user_id:
+            return _stream_error(http_stream, 401, 'No user ID in token')
+        
+        users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+        db_user_id = resolve_user_id(users_table, user_id, claims.get('email'))
+        if not db_user_id:
+            return _stream_error(http_stream, 404, 'User not found')
+        
+        reservation_id = new_reservation_id('gen')
+        try:
+            remaining_credits = reserve_credits(users_table, db_user_id, image_count, reservation_id)
+        except InsufficientCreditsError:
+            log_api_call('image_gen', user_id, 'insufficient_credits', False)
+            return _stream_error(http_stream, 400, 'Insufficient credits')
+        
+        # Take a Bedrock slot before the first byte, so a full queue can still answer 429
+        governor = get_governor(dynamodb)
+        try:
+            start_at = governor.reserve(db_user_id)
+        except AdmissionRejected as e:
+            refund_credits(users_table, db_user_id, image_count, reservation_id)
+            log_api_call('image_gen', user_id, 'generate_image_rejected', False)
+            http_stream.headers['Retry-After'] = str(e.retry_after)
+            expose_header(http_stream.headers, 'Retry-After')
+            return _stream_error(http_stream, 429, str(e))
+        
+        image_ids = [f"img_{uuid.uuid4().hex}" for _ in range(image_count)]
+        send_image = body.get('stream') == 'image'
+        http_stream.headers['Content-Type'] = 'image/png' if send_image else NDJSON_CONTENT_TYPE
+        http_stream.headers['X-Image-Ids'] = ','.join(image_ids)
+        progress = (lambda event, **fields: None) if send_image else EventStream(http_stream).send
+        
+        try:
+            # First byte: the reservation is the first thing the client hears about
+            progress('credits_reserved', imageIds=image_ids, remainingCredits=remaining_credits,
+                     queuedMs=round(max(0, start_at - time.time()) * 1000))
+            governor.wait(start_at)
+            
+            bedrock_start = time.time()
+            routed = get_router().invoke(bedrock, prompt, image_generation_config(image_count, seed), governor,
+                                         db_user_id)
+            bedrock_duration = (time.time() - bedrock_start) * 1000
+            progress('model_invoked', modelId=routed.model_id, bedrockMs=round(bedrock_duration),
+                     fallback=routed.fallback)
+            
+            bucket = os.environ['IMAGES_BUCKET']
+            
+            def upload(index, image_bytes):
+                s3_key, derivatives = upload_image(bucket, db_user_id, image_ids[index], image_bytes,
+                                                   SYNC_DERIVATIVES)
+                progress('image_uploaded', index=index, imageId=image_ids[index])
+                progress('image_ready', index=index, imageId=image_ids[index], imageUrl=signed_url(s3_key),
+                         derivatives=signed_derivatives(derivatives))
+                return s3_key, derivatives
+            
+            with ThreadPoolExecutor(max_workers=min(image_count, UPLOAD_WORKERS)) as executor:
+                futures = []
+                for index, image_bytes in zip(range(image_count), routed.images()):
+                    progress('image_decoded', index=index, imageId=image_ids[index], bytes=len(image_bytes))
+                    if send_image and index == 0:
+                        http_stream.write(image_bytes)
+                    futures.append(executor.submit(upload, index, image_bytes))
+                results = [future.result() for future in futures]
+            if len(results) != image_count:
+                raise ValueError(f"Bedrock returned {len(results)} images, expected {image_count}")
+            
+            s3_keys = [key for key, _ in results]
+            derivatives = [image_derivatives for _, image_derivatives in results]
+            save_images(db_user_id, prompt, image_ids, s3_keys, derivatives)
+        except Exception as e:
+            refund_credits(users_table, db_user_id, image_count, reservation_id)
+            log_api_call('image_gen', user_id, 'generate_image_error', False, (time.time() - start_time) * 1000, e)
+            log_image_generation(user_id, prompt, False)
+            if not http_stream.started:
+                return _stream_error(http_stream, 500, str(e))
+            progress('error', error=str(e))
+            if send_image:
+                # The PNG already went out: without the trailers it would look like a complete image
+                failure = e
+            return
+        invalidate_history(db_user_id)
+        commit_credits(users_table, db_user_id, reservation_id)
+        defer_derivatives(db_user_id, image_ids, s3_keys, derivatives)
+        
+        total_duration = (time.time() - start_time) * 1000
+        log_image_generation(user_id, prompt, True, routed.cost(image_count), total_duration)
+        log_business_metric('BedrockDuration', bedrock_duration, 'Milliseconds', user_id)
+        log_api_call('image_gen', user_id, 'generate_image_success', True, total_duration)
+        progress('done', imageIds=image_ids, remainingCredits=remaining_credits)
+    
+    except Exception as e:
+        log_api_call('image_gen', user_id, 'generate_image_error', False, (time.time() - start_time) * 1000, e)
+        if not http_stream.started:
+            _stream_error(http_stream, 500, str(e))
+        else:
+            failure = e
+    finally:
+        http_stream.end(failure)
+        flush()
+
+def get_job_status(event):
+    """Return the status of a job owned by the caller (lightweight single get_item)"""
+    try:
+        claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
+        user_id = claims.get('sub') or claims.get('cognito:username')
+        job_id = (event.get('pathParameters') or {}).get('jobId')
+        
+        if not user_id:
+            return cors_response(401, {'error': 'No user ID in token'})
+        if not job_id:
+            return cors_response(400, {'error': 'jobId is required'})
+        
+        users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+        db_user_id = resolve_user_id(users_table, user_id, claims.get('email'))
+        
+        images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+        job = images_table.get_item(
+            Key={'imageId': job_id},
+            ProjectionExpression='imageId, userId, #s, imageKey, imageKeys, imageUrl, imageUrls, derivatives, #e, createdAt, completedAt',
+            ExpressionAttributeNames={'#s': 'status', '#e': 'error'}
+        ).get('Item')
+        
+        if not job or job.get('userId') != db_user_id:
+            return cors_response(404, {'error': 'Job not found'})
+        
+        # Rows written by the synchronous path have no status and are complete
+        status = job.get('status', JOB_COMPLETED)
+        result = {
+            'jobId': job_id,
+            'status': status,
+            'createdAt': job.get('createdAt')
+        }
+        if status == JOB_COMPLETED:
+            # Rows written before image_delivery.py hold public URLs instead of keys
+            image_keys = job.get('imageKeys') or job.get('imageUrls') or [job.get('imageKey') or job.get('imageUrl')]
+            result['imageUrls'] = signed_urls(image_keys)
+            result['imageUrl'] = result['imageUrls'][0]
+            result['derivatives'] = signed_derivatives(job.get('derivatives'))
+            result['completedAt'] = job.get('completedAt')
+        elif status == JOB_FAILED:
+            result['error'] = job.get('error')
+            result['completedAt'] = job.get('completedAt')
+        
+        return cors_response(200, result)
+    
+    except Exception as e:
+        return cors_response(500, {'error': str(e)})
+
+def notify_callback(job, status, image_urls=None, error=None):
+    """Best-effort completion notification to the client's callbackUrl"""
+    callback_url = job.get('callbackUrl')
+    if not callback_url:
+        return
+    
+    try:
+        request = urllib.request.Request(
+            callback_url,
+            data=json.dumps({
+                'jobId': job['imageId'],
+                'status': status,
+                'imageUrl': image_urls[0] if image_urls else None,
+                'imageUrls': image_urls,
+                'error': error
+            }).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+    except Exception as e:
+        log_event('JOB_CALLBACK_ERROR', WARNING, job_id=job['imageId'], error=str(e))
+
+def get_image_history(event):
+    """Return one page of the caller's images, newest first (GET /image/history?limit=&cursor=)"""
+    try:
+        claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
+        user_id = claims.get('sub') or claims.get('cognito:username')
+        params = event.get('queryStringParameters') or {}
+        
+        if not user_id:
+            return cors_response(401, {'error': 'No user ID in token'})
+        
+        users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+        db_user_id = resolve_user_id(users_table, user_id, claims.get('email'))
+        if not db_user_id:
+            return cors_response(404, {'error': 'User not found'})
+        
+        try:
+            limit = parse_page_size(params.get('limit'))
+            page = get_history(dynamodb.Table(os.environ['IMAGES_TABLE']), db_user_id, limit, params.get('cursor'))
+        except (InvalidCursorError, ValueError) as e:
+            return cors_response(400, {'error': str(e)})
+        
+        return cors_response(200, page)
+    
+    except Exception as e:
+        return cors_response(500, {'error': str(e)})
+
+def run_job(job_id, user_id=None):
+    """Worker stage for one job: Bedrock -> S3 -> Images table"""
+    start_time = time.time()
+    images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+    
+    # Claim the job; SQS may deliver the same message more than once, and a
+    # RUNNING job whose lease expired is taken over from its lost worker
+    now = int(time.time())
+    try:
+        job = images_table.update_item(
+            Key={'imageId': job_id},
+            UpdateExpression='SET #s = :running, claimedAt = :now',
+            ConditionExpression='#s = :queued OR (#s = :running AND claimedAt < :stale)',
+            ExpressionAttributeNames={'#s': 'status'},
+            ExpressionAttributeValues={
+                ':running': JOB_RUNNING,
+                ':queued': JOB_QUEUED,
+                ':now': now,
+                ':stale': now - JOB_LEASE_SECONDS
+            },
+            ReturnValues='ALL_OLD'
+        )['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            log_event('JOB_ALREADY_CLAIMED', INFO, job_id=job_id)
+            return
+        raise
+    if job['status'] == JOB_RUNNING:
+        log_event('JOB_RECLAIMED', WARNING, job_id=job_id, claimed_at=int(job['claimedAt']))
+    
+    db_user_id = job['userId']
+    prompt = job['prompt']
+    image_count = int(job.get('numberOfImages', 1))
+    
+    # The job row holds the first image; extra images of a batch get their own rows
+    image_ids = [job_id] + [f"{job_id}_{i}" for i in range(1, image_count)]
+    
+    try:
+        seed = int(job['seed']) if 'seed' in job else None
+        s3_keys, derivatives, bedrock_duration, cost = generate_and_store(prompt, db_user_id, image_ids, seed, user_id)
+        if image_count > 1:
+            save_images(db_user_id, prompt, image_ids[1:], s3_keys[1:], derivatives[1:])
+    except AdmissionRejected:
+        requeue_job(images_table, job_id)
+        raise
+    except ClientError as e:
+        if e.response['Error']['Code'] in RETRYABLE_ERRORS:
+            requeue_job(images_table, job_id)
+            raise
+        fail_job(job, user_id, prompt, e)
+        return
+    except Exception as e:
+        fail_job(job, user_id, prompt, e)
+        return
+    
+    images_table.update_item(
+        Key={'imageId': job_id},
+        UpdateExpression='SET #s = :completed, imageKey = :key, imageKeys = :keys, derivatives = :derivatives, '
+                         'completedAt = :now',
+        ExpressionAttributeNames={'#s': 'status'},
+        ExpressionAttributeValues={
+            ':completed': JOB_COMPLETED,
+            ':key': s3_keys[0],
+            ':keys': s3_keys,
+            ':derivatives': derivatives[0],
+            ':now': datetime.now().isoformat()
+        }
+    )
+    commit_credits(dynamodb.Table(os.environ['USERS_TABLE']), db_user_id, job_id)
+    # Only a cache hit on images generated without derivatives leaves any to render
+    defer_derivatives(db_user_id, image_ids, s3_keys, derivatives)
+    
+    total_duration = (time.time() - start_time) * 1000
+    if bedrock_duration:
+        log_image_generation(user_id, prompt, True, cost, total_duration)
+        log_business_metric('BedrockDuration', bedrock_duration, 'Milliseconds', user_id)
+    else:
+        log_image_generation(user_id, prompt, True, 0, total_duration)  # Served from the generation cache
+    log_api_call('image_gen', user_id, 'generate_job_success', True, total_duration)
+    
+    notify_callback(job, JOB_COMPLETED, image_urls=signed_urls(s3_keys))
+
+def requeue_job(images_table, job_id):
+    """Put a job back to QUEUED so the queue redelivers it after the visibility timeout"""
+    images_table.update_item(
+        Key={'imageId': job_id},
+        UpdateExpression='SET #s = :queued REMOVE claimedAt',
+        ExpressionAttributeNames={'#s': 'status'},
+        ExpressionAttributeValues={':queued': JOB_QUEUED}
+    )
+
+def fail_job(job, user_id, prompt, error):
+    """Mark an unfinished job FAILED and refund its reserved credits"""
+    try:
+        dynamodb.Table(os.environ['IMAGES_TABLE']).update_item(
+            Key={'imageId': job['imageId']},
+            UpdateExpression='SET #s = :failed, #e = :error, completedAt = :now',
+            ConditionExpression='#s = :queued OR #s = :running',
+            ExpressionAttributeNames={'#s': 'status', '#e': 'error'},
+            ExpressionAttributeValues={
+                ':failed': JOB_FAILED,
+                ':error': str(error),
+                ':now': datetime.now().isoformat(),
+                ':queued': JOB_QUEUED,
+                ':running': JOB_RUNNING
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            log_event('JOB_ALREADY_FINISHED', INFO, job_id=job['imageId'])
+            return
+        raise
+    refund_credits(
+        dynamodb.Table(os.environ['USERS_TABLE']),
+        job['userId'],
+        int(job.get('numberOfImages', 1)),
+        job['imageId']
+    )
+    
+    log_api_call('image_gen', user_id, 'generate_job_error', False, error=error)
+    log_image_generation(user_id, prompt, False)
+    
+    notify_callback(job, JOB_FAILED, error=str(error))
+
+@flush_metrics
+@traced
+def worker(event, context):
+    """SQS-triggered worker running queued generation jobs"""
+    for record in event.get('Records', []):
+        message = json.loads(record['body'])
+        run_job(message['jobId'], message.get('cognitoSub'))
+
+@flush_metrics
+@traced
+def dead_letter_worker(event, context):
+    """Fail and refund jobs whose message ran out of deliveries (SQS dead-letter queue of the jobs queue)
+    
+    Its last delivery's visibility timeout has passed, so no worker still
+    holds the job; jobs that finished anyway are left alone.
+    """
+    images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+    for record in event.get('Records', []):
+        message = json.loads(record['body'])
+        job = images_table.get_item(Key={'imageId': message['jobId']}).get('Item')
+        if job is None or job['status'] not in (JOB_QUEUED, JOB_RUNNING):
+            continue
+        log_event('JOB_DEAD_LETTERED', WARNING, job_id=job['imageId'], status=job['status'])
+        fail_job(job, message.get('cognitoSub'), job['prompt'], 'Job could not be run after repeated deliveries')
+
+@flush_metrics
+@traced
+def derivatives_worker(event, context):
+    """Render the derivatives of images stored without them (SQS messages from defer_derivatives)"""
+    bucket = os.environ['IMAGES_BUCKET']
+    images_table = dynamodb.Table(os.environ['IMAGES_TABLE'])
+    for record in event.get('Records', []):
+        message = json.loads(record['body'])
+        for image_id, s3_key in message['images']:
+            image_bytes = s3.get_object(Bucket=bucket, Key=s3_key)['Body'].read()
+            derivatives = store_derivatives(s3, bucket, s3_key, image_bytes, IMAGE_CACHE_CONTROL)
+            if not derivatives:
+                continue
+            try:
+                images_table.update_item(
+                    Key={'imageId': image_id},
+                    UpdateExpression='SET derivatives = :derivatives',
+                    ConditionExpression='attribute_exists(imageId)',
+                    ExpressionAttributeValues={':derivatives': derivatives}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                # Deleted since it was generated
+                log_event('DERIVATIVES_IMAGE_GONE', INFO, image_id=image_id)
+
+@flush_metrics
+@traced
+def reservation_sweeper(event, context):
+    """Refund credit reservations whose request died before committing or refunding them (scheduled)"""
+    users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+    refunded = sweep_reservations(users_table, RESERVATION_TIMEOUT_SECONDS)
+    for user_id, reservation_id in refunded:
+        log_event('RESERVATION_SWEPT', WARNING, user_id=user_id, reservation_id=reservation_id)
+    return {'refunded': len(refunded)}
@@ -1,24 +1,33 @@
 import json
-import boto3
-import base64
 import uuid
 from datetime import datetime
-import logging
+from generation_cache import cache_key, get_generation_cache
+from logger import ERROR, log_cache_lookup, log_event
+from metrics import flush_metrics
+from credits_ledger import InsufficientCreditsError, commit_credits, new_reservation_id, refund_credits, reserve_credits
+from aws_clients import lazy_client, lazy_resource
+from image_delivery import IMAGE_CACHE_CONTROL, signed_url
+from image_payload import iter_images
+from tracing import traced
 
-# Configure logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-# Initialize AWS clients - Use US East for Bedrock image models
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
-s3_client = boto3.client('s3', region_name='ap-southeast-1')
-dynamodb = boto3.resource('dynamodb')
+# AWS clients (created on first use) - Use US East for Bedrock image models
+bedrock_runtime = lazy_client('bedrock-runtime', 'us-east-1')
+s3_client = lazy_client('s3', 'ap-southeast-1')
+dynamodb = lazy_resource('dynamodb')
 
 # Environment variables
 IMAGES_TABLE = 'imagify-images'
 USERS_TABLE = 'imagify-users'
 S3_BUCKET = 'imagify-images-prod'
 
+# Fixed generation settings - identical prompts give identical images
+MODEL_ID = "amazon.titan-image-generator-v2:0"
+NEGATIVE_TEXT = "blurry, low quality, distorted"
+CFG_SCALE = 8.0
+SEED = 42
+
+@flush_metrics
+@traced
 def lambda_handler(event, context):
     """
     AWS Lambda handler for image generation using Bedrock
@@ -39,9 +48,12 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Prompt is required'})
             }
         
-        # Check user credits
-        user_credits = get_user_credits(user_id)
-        if user_credits < 1:
+        # Reserve a credit atomically (replaces the read + absolute write)
+        users_table = dynamodb.Table(USERS_TABLE)
+        reservation_id = new_reservation_id('gen')
+        try:
+            credits_remaining = reserve_credits(users_table, user_id, 1, reservation_id)
+        except InsufficientCreditsError:
             return {
                 'statusCode': 402,
                 'headers': {
@@ -51,15 +63,24 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Insufficient credits'})
             }
         
-        # Generate image using Bedrock
-        image_data = generate_image_with_bedrock(prompt)
-        
-        # Upload to S3
-        image_url = upload_to_s3(image_data, user_id)
+        try:
+            # Reuse an identical earlier generation when cached
+            image_key = get_cached_image_key(prompt, user_id)
+            
+            if image_key is None:
+                # Generate image using Bedrock
+                image_data = generate_image_with_bedrock(prompt)
+                
+                # Upload to S3
+                image_key = upload_to_s3(image_data, user_id)
+                cache_image_key(prompt, image_key)
+        except Exception:
+            refund_credits(users_table, user_id, 1, reservation_id)
+            raise
         
-        # Update user credits and save image metadata
-        update_user_credits(user_id, user_credits - 1)
-        save_image_metadata(user_id, prompt, image_url)
+        # Finalize the charge and save image metadata
+        commit_credits(users_table, user_id, reservation_id)
+        save_image_metadata(user_id, prompt, image_key)
         
         return {
             'statusCode': 200,
@@ -69,13 +90,13 @@ def lambda_handler(event, context):
             },
             'body': json.dumps({
                 'success': True,
-                'imageUrl': image_url,
-                'creditsRemaining': user_credits - 1
+                'imageUrl': signed_url(image_key),
+                'creditsRemaining': credits_remaining
             })
         }
-        
+    
     except Exception as e:
-        logger.error(f"Error generating image: {str(e)}")
+        log_event('IMAGE_GEN_ERROR', ERROR, error=str(e))
         return {
             'statusCode': 500,
             'headers': {
@@ -89,20 +110,27 @@ def generate_image_with_bedrock(prompt):
     """
     Generate image using AWS Bedrock Titan Image Generator
     """
+    return generate_images_with_bedrock(prompt, 1)[0]
+
+def generate_images_with_bedrock(prompt, number_of_images=1):
+    """
+    Generate number_of_images variations in a single Bedrock call.
+    Returns the decoded PNG bytes, one entry per image.
+    """
     try:
         # Prepare request for Bedrock Titan Image Generator
         request_body = {
             "taskType": "TEXT_IMAGE",
             "textToImageParams": {
                 "text": prompt,
-                "negativeText": "blurry, low quality, distorted",
+                "negativeText": NEGATIVE_TEXT,
             },
             "imageGenerationConfig": {
-                "numberOfImages": 1,
+                "numberOfImages": number_of_images,
                 "height": 1024,
                 "width": 1024,
-                "cfgScale": 8.0,
-                "seed": 42
+                "cfgScale": CFG_SCALE,
+                "seed": SEED
             }
         }
         
@@ -118,31 +146,27 @@ def generate_image_with_bedrock(prompt):
         # }
         
         # Call Bedrock
-        model_id = "amazon.titan-image-generator-v2:0"
         response = bedrock_runtime.invoke_model(
-            modelId=model_id,
+            modelId=MODEL_ID,
             body=json.dumps(request_body),
             contentType='application/json',
             accept='application/json'
         )
         
-        # Parse response
-        response_body = json.loads(response['body'].read())
-        
-        # Extract base64 image data
-        if 'images' in response_body:
-            image_base64 = response_body['images'][0]
-            return base64.b64decode(image_base64)
-        else:
+        # Decode the base64 images straight from the response stream (see image_payload.py)
+        decoded = list(iter_images(response['body']))
+        if not decoded:
             raise Exception("No image data in Bedrock response")
-            
+        return decoded
+    
     except Exception as e:
-        logger.error(f"Bedrock image generation failed: {str(e)}")
+        log_event('BEDROCK_ERROR', ERROR, error=str(e))
         raise
 
 def upload_to_s3(image_data, user_id):
     """
-    Upload generated image to S3 bucket
+    Upload generated image to S3 bucket (private; served through signed URLs)
+    Returns the S3 key.
     """
     try:
         # Generate unique filename
@@ -155,17 +179,53 @@ def upload_to_s3(image_data, user_id):
             Key=filename,
             Body=image_data,
             ContentType='image/png',
-            ACL='public-read'
+            CacheControl=IMAGE_CACHE_CONTROL
         )
-        
-        # Return public URL
-        image_url = f"https://{S3_BUCKET}.s3.amazonaws.com/{filename}"
-        return image_url
-        
+        return filename
+    
     except Exception as e:
-        logger.error(f"S3 upload failed: {str(e)}")
+        log_event('S3_UPLOAD_ERROR', ERROR, error=str(e))
         raise
 
+def get_cached_image_key(prompt, user_id):
+    """
+    Copy a cached generation of this prompt into the user's prefix.
+    Returns the new S3 key, or None on a cache miss.
+    """
+    cache = get_generation_cache(dynamodb)
+    if cache is None:
+        return None
+    
+    source_keys = cache.get(cache_key(MODEL_ID, prompt, NEGATIVE_TEXT, cfg_scale=CFG_SCALE, seed=SEED))
+    log_cache_lookup('GenerationCache', source_keys is not None, user_id)
+    if source_keys is None:
+        return None
+    
+    filename = f"images/{user_id}/{uuid.uuid4()}.png"
+    s3_client.copy_object(
+        Bucket=S3_BUCKET,
+        Key=filename,
+        CopySource={'Bucket': S3_BUCKET, 'Key': source_keys[0]},
+        ContentType='image/png',
+        CacheControl=IMAGE_CACHE_CONTROL,
+        MetadataDirective='REPLACE'
+    )
+    return filename
+
+def cache_image_key(prompt, image_key):
+    """
+    Record a freshly generated image in the generation cache
+    """
+    cache = get_generation_cache(dynamodb)
+    if cache is None:
+        return
+    
+    try:
+        cache.put(cache_key(MODEL_ID, prompt, NEGATIVE_TEXT, cfg_scale=CFG_SCALE, seed=SEED), [image_key], MODEL_ID)
+    except Exception as e:
+        log_event('CACHE_ERROR', ERROR, error=str(e))
+        # Don't raise - the image was generated and stored
+
 def get_user_credits(user_id):
     """
     Get user's current credit balance from DynamoDB
@@ -178,31 +238,12 @@ def get_user_credits(user_id):
             return response['Item'].get('credits', 0)
         else:
             return 0
-            
+    
     except Exception as e:
-        logger.error(f"Failed to get user credits: {str(e)}")
+        log_event('CREDITS_ERROR', ERROR, user_id=user_id, error=str(e))
         return 0
 
-def update_user_credits(user_id, new_credits):
-    """
-    Update user's credit balance in DynamoDB
-    """
-    try:
-        table = dynamodb.Table(USERS_TABLE)
-        table.update_item(
-            Key={'userId': user_id},
-            UpdateExpression='SET credits = :credits, updatedAt = :timestamp',
-            ExpressionAttributeValues={
-                ':credits': new_credits,
-                ':timestamp': datetime.utcnow().isoformat()
-            }
-        )
-        
-    except Exception as e:
-        logger.error(f"Failed to update user credits: {str(e)}")
-        raise
-
-def save_image_metadata(user_id, prompt, image_url):
+def save_image_metadata(user_id, prompt, image_key):
     """
     Save image generation metadata to DynamoDB
     """
@@ -215,13 +256,13 @@ def save_image_metadata(user_id, prompt, image_url):
                 'imageId': image_id,
                 'userId': user_id,
                 'prompt': prompt,
-                'imageUrl': image_url,
+                'imageKey': image_key,
                 'creditsUsed': 1,
                 'createdAt': datetime.utcnow().isoformat(),
                 'model': 'amazon.titan-image-generator-v1 (US East)'
             }
         )
-        
+    
     except Exception as e:
-        logger.error(f"Failed to save image metadata: {str(e)}")
+        log_event('IMAGE_METADATA_ERROR', ERROR, user_id=user_id, error=str(e))
         # Don't raise - this is not critical for user experience
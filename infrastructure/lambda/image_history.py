@@ -0,0 +1,145 @@
+import base64
+import binascii
+import json
+import os
+import time
+from collections import OrderedDict
+from image_delivery import signed_derivatives, signed_url
+
+# "My images": a user's Images table rows, newest first, one page at a time.
+#
+# Pages come from the UserCreatedIndex GSI (userId + createdAt) with keyset
+# pagination: each page resumes after the LastEvaluatedKey of the previous
+# one, handed to the client as an opaque cursor. A page reads only its own
+# rows, so its cost does not depend on how many images the user has, and the
+# index projects only the attributes returned here.
+#
+# The first page is what most requests ask for, so warm containers keep it
+# per user for HISTORY_CACHE_TTL_SECONDS. A generation served by the same
+# container drops the entry (invalidate_history); one served elsewhere (or a
+# job finished by the worker) shows up once the entry expires.
+
+HISTORY_INDEX = 'UserCreatedIndex'
+
+# Rows per page; clients may ask for up to MAX_HISTORY_PAGE_SIZE
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '20'))
+MAX_HISTORY_PAGE_SIZE = 100
+
+# Attributes projected into the index and returned per row
+HISTORY_ATTRIBUTES = ('imageId', 'createdAt', 'prompt', 'status', 'imageKey', 'imageUrl', 'derivatives')
+
+HISTORY_CACHE_TTL_SECONDS = float(os.environ.get('HISTORY_CACHE_TTL_SECONDS', '30'))
+HISTORY_CACHE_MAX_ENTRIES = 1024
+
+# userId -> (expires_at, items, last_key) of the first default-size page (LRU)
+_first_pages = OrderedDict()
+
+# Key attributes of a UserCreatedIndex LastEvaluatedKey
+_CURSOR_KEYS = {'imageId', 'userId', 'createdAt'}
+
+class InvalidCursorError(ValueError):
+    """The cursor was not issued by this endpoint for this user"""
+
+def encode_cursor(last_key):
+    """Opaque, URL-safe token for a LastEvaluatedKey"""
+    data = json.dumps(last_key, separators=(',', ':'), sort_keys=True).encode()
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def decode_cursor(cursor, user_id):
+    """ExclusiveStartKey for a cursor; it must belong to user_id"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        last_key = json.loads(data)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorError('Invalid cursor')
+    if (not isinstance(last_key, dict) or set(last_key) != _CURSOR_KEYS
+            or not all(isinstance(value, str) for value in last_key.values())):
+        raise InvalidCursorError('Invalid cursor')
+    # Cursors carry the userId, so one user's cursor cannot page through another's images
+    if last_key['userId'] != user_id:
+        raise InvalidCursorError('Invalid cursor')
+    return last_key
+
+def parse_page_size(value):
+    """Page size from the `limit` query parameter"""
+    if value in (None, ''):
+        return HISTORY_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_HISTORY_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_HISTORY_PAGE_SIZE}")
+    return limit
+
+def query_page(images_table, user_id, limit, start_key=None):
+    """One index page, newest first: (items, LastEvaluatedKey or None)"""
+    params = {
+        'IndexName': HISTORY_INDEX,
+        'KeyConditionExpression': 'userId = :user_id',
+        'ExpressionAttributeValues': {':user_id': user_id},
+        'ScanIndexForward': False,
+        'Limit': limit,
+        'ProjectionExpression': ', '.join('#s' if attr == 'status' else attr for attr in HISTORY_ATTRIBUTES),
+        'ExpressionAttributeNames': {'#s': 'status'}
+    }
+    if start_key:
+        params['ExclusiveStartKey'] = start_key
+    response = images_table.query(**params)
+    return response.get('Items', []), response.get('LastEvaluatedKey')
+
+def _cached_first_page(user_id, now):
+    entry = _first_pages.get(user_id)
+    if entry is None:
+        return None
+    if entry[0] <= now:
+        del _first_pages[user_id]
+        return None
+    _first_pages.move_to_end(user_id)
+    return entry[1], entry[2]
+
+def _remember_first_page(user_id, items, last_key, now):
+    _first_pages[user_id] = (now + HISTORY_CACHE_TTL_SECONDS, items, last_key)
+    _first_pages.move_to_end(user_id)
+    while len(_first_pages) > HISTORY_CACHE_MAX_ENTRIES:
+        _first_pages.popitem(last=False)
+
+def invalidate_history(user_id):
+    """Drop the cached first page after the user's images changed"""
+    _first_pages.pop(user_id, None)
+
+def history_item(item, now):
+    """API shape of one row; URLs are signed per response (image_delivery.py)"""
+    result = {
+        'imageId': item['imageId'],
+        'createdAt': item.get('createdAt'),
+        'prompt': item.get('prompt'),
+        # Rows written by the synchronous path have no status and are complete
+        'status': item.get('status', 'COMPLETED'),
+        'imageUrl': signed_url(item.get('imageKey') or item.get('imageUrl'), now)
+    }
+    if item.get('derivatives'):
+        result['derivatives'] = signed_derivatives(item['derivatives'], now)
+    return result
+
+def get_history(images_table, user_id, limit=None, cursor=None, now=None):
+    """{'images': [...], 'nextCursor': token or None} for one page of a user's images
+    
+    Raises InvalidCursorError for a malformed or foreign cursor.
+    """
+    now = time.time() if now is None else now
+    limit = HISTORY_PAGE_SIZE if limit is None else limit
+    start_key = decode_cursor(cursor, user_id) if cursor else None
+    
+    cacheable = start_key is None and limit == HISTORY_PAGE_SIZE and HISTORY_CACHE_TTL_SECONDS > 0
+    page = _cached_first_page(user_id, now) if cacheable else None
+    if page is None:
+        page = query_page(images_table, user_id, limit, start_key)
+        if cacheable:
+            _remember_first_page(user_id, *page, now)
+    items, last_key = page
+    
+    return {
+        'images': [history_item(item, now) for item in items],
+        'nextCursor': encode_cursor(last_key) if last_key else None
+    }
@@ -1,73 +1,103 @@
 import json
-import logging
 import os
-from datetime import datetime
-import boto3
+import random
+import sys
+import time
+from metrics import put_metric
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Structured logging fast path: one JSON line per event written straight to
+# stdout (CloudWatch Logs). Level gating and sampling happen before any
+# formatting, and field values may be callables that are only evaluated when
+# the line is actually emitted.
 
-logger = logging.getLogger(__name__)
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
 
-# CloudWatch client for custom metrics
-cloudwatch = boto3.client('cloudwatch')
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+LOG_LEVEL = {name: level for level, name in LEVEL_NAMES.items()}.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), INFO)
 
-def log_api_call(function_name, user_id=None, action=None, success=True, duration=None, error=None):
-    """Log API call with structured data"""
-    log_data = {
-        'timestamp': datetime.now().isoformat(),
-        'function': function_name,
-        'user_id': user_id,
-        'action': action,
-        'success': success,
-        'duration_ms': duration
+# Keys whose values never reach the logs (compared case-insensitively)
+REDACTED_KEYS = frozenset({
+    'password', 'temporarypassword', 'token', 'idtoken', 'accesstoken', 'refreshtoken',
+    'authorization', 'authorizationtoken', 'hash_secret', 'secretstring', 'vnp_securehash'
+})
+REDACTED = '[REDACTED]'
+
+def _parse_sample_rates(value):
+    """Parse LOG_SAMPLE_RATES, e.g. "API_CALL=0.1,CACHE=0.01" """
+    rates = {}
+    for pair in (value or '').split(','):
+        if '=' in pair:
+            event_type, rate = pair.split('=', 1)
+            rates[event_type.strip()] = float(rate)
+    return rates
+
+# Fraction of INFO/DEBUG events kept per event type (warnings and errors are never sampled)
+SAMPLE_RATES = _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES'))
+
+_stream = sys.stdout
+
+def is_enabled(level):
+    """True if events at level would be written"""
+    return level >= LOG_LEVEL
+
+def redact(value):
+    """Copy of value with sensitive keys masked, recursing into dicts and lists"""
+    if isinstance(value, dict):
+        return {
+            k: REDACTED if isinstance(k, str) and k.lower() in REDACTED_KEYS else redact(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    return value
+
+def log_event(event_type, level=INFO, **fields):
+    """Write one structured log line; returns False if gated out or sampled away"""
+    if level < LOG_LEVEL:
+        return False
+    if level < WARNING:
+        rate = SAMPLE_RATES.get(event_type)
+        if rate is not None and random.random() >= rate:
+            return False
+    
+    record = {
+        'level': LEVEL_NAMES.get(level, str(level)),
+        'event': event_type,
+        'timestamp': time.time()
     }
+    for key, value in fields.items():
+        if callable(value):
+            value = value()
+        record[key] = REDACTED if key.lower() in REDACTED_KEYS else redact(value)
     
+    _stream.write(json.dumps(record, default=str, separators=(',', ':')) + '\n')
+    return True
+
+def log_api_call(function_name, user_id=None, action=None, success=True, duration=None, error=None):
+    """Log API call with structured data"""
     if error:
-        log_data['error'] = str(error)
-        logger.error(f"API_CALL_ERROR: {json.dumps(log_data)}")
+        log_event('API_CALL_ERROR', ERROR, function=function_name, user_id=user_id, action=action,
+                  success=success, duration_ms=duration, error=str(error))
     else:
-        logger.info(f"API_CALL: {json.dumps(log_data)}")
+        log_event('API_CALL', INFO, function=function_name, user_id=user_id, action=action,
+                  success=success, duration_ms=duration)
 
 def log_business_metric(metric_name, value, unit='Count', user_id=None):
-    """Log custom business metrics to CloudWatch"""
+    """Buffer a custom business metric (flushed in batches, see metrics.py)"""
     try:
-        dimensions = []
-        if user_id:
-            dimensions.append({'Name': 'UserId', 'Value': user_id})
-        
-        cloudwatch.put_metric_data(
-            Namespace='Imagify/Business',
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit,
-                    'Dimensions': dimensions,
-                    'Timestamp': datetime.now()
-                }
-            ]
-        )
-        logger.info(f"METRIC: {metric_name}={value} {unit}")
+        dimensions = {'UserId': user_id} if user_id else None
+        put_metric(metric_name, value, unit, dimensions)
+        log_event('METRIC', DEBUG, name=metric_name, value=value, unit=unit)
     except Exception as e:
-        logger.error(f"Failed to send metric {metric_name}: {e}")
+        log_event('METRIC_ERROR', ERROR, name=metric_name, error=str(e))
 
 def log_image_generation(user_id, prompt, success=True, cost=None, duration=None):
     """Log image generation events"""
-    log_data = {
-        'event_type': 'image_generation',
-        'user_id': user_id,
-        'prompt_length': len(prompt),
-        'success': success,
-        'cost_usd': cost,
-        'duration_ms': duration,
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    logger.info(f"IMAGE_GEN: {json.dumps(log_data)}")
+    log_event('IMAGE_GEN', INFO, user_id=user_id, prompt_length=len(prompt), success=success,
+              cost_usd=cost, duration_ms=duration)
     
     # Send business metrics
     log_business_metric('ImageGeneration', 1, 'Count', user_id)
@@ -76,16 +106,8 @@ def log_image_generation(user_id, prompt, success=True, cost=None, duration=None
 
 def log_payment(user_id, package_type, amount, success=True):
     """Log payment events"""
-    log_data = {
-        'event_type': 'payment',
-        'user_id': user_id,
-        'package_type': package_type,
-        'amount_vnd': amount,
-        'success': success,
-        'timestamp': datetime.now().isoformat()
-    }
-    
-    logger.info(f"PAYMENT: {json.dumps(log_data)}")
+    log_event('PAYMENT', INFO, user_id=user_id, package_type=package_type, amount_vnd=amount,
+              success=success)
     
     # Send business metrics
     if success:
@@ -93,3 +115,9 @@ def log_payment(user_id, package_type, amount, success=True):
         log_business_metric('Revenue', amount, 'None')
     else:
         log_business_metric('PaymentFailure', 1, 'Count', user_id)
+
+def log_cache_lookup(cache_name, hit, user_id=None):
+    """Log cache hits/misses and send them as business metrics"""
+    log_event('CACHE', DEBUG, cache=cache_name, hit=hit, user_id=user_id)
+    
+    log_business_metric(f"{cache_name}Hit" if hit else f"{cache_name}Miss", 1, 'Count')
@@ -0,0 +1,193 @@
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+NAMESPACE = 'Imagify/Business'
+
+# PutMetricData accepts up to 1000 metrics per request
+MAX_METRICS_PER_REQUEST = 1000
+
+# EMF allows at most 100 values per metric per log line
+MAX_EMF_VALUES = 100
+
+# Flush when this many distinct metrics are buffered or this much time has passed
+FLUSH_MAX_METRICS = int(os.environ.get('METRICS_FLUSH_MAX', MAX_METRICS_PER_REQUEST))
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
+
+class CloudWatchSink:
+    """Sends aggregated metrics with batched PutMetricData calls"""
+
+    def __init__(self, namespace=NAMESPACE, client=None):
+        self.namespace = namespace
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            from aws_clients import get_client
+            self._client = get_client('cloudwatch')
+        return self._client
+
+    def send(self, entries):
+        metric_data = []
+        for (name, unit, dimensions), (timestamp, values) in entries:
+            datum = {
+                'MetricName': name,
+                'Unit': unit,
+                'Dimensions': [{'Name': k, 'Value': v} for k, v in dimensions],
+                'Timestamp': datetime.fromtimestamp(timestamp)
+            }
+            if len(values) == 1:
+                datum['Value'] = values[0]
+            else:
+                datum['StatisticValues'] = {
+                    'SampleCount': len(values),
+                    'Sum': sum(values),
+                    'Minimum': min(values),
+                    'Maximum': max(values)
+                }
+            metric_data.append(datum)
+
+        for i in range(0, len(metric_data), MAX_METRICS_PER_REQUEST):
+            self.client.put_metric_data(
+                Namespace=self.namespace,
+                MetricData=metric_data[i:i + MAX_METRICS_PER_REQUEST]
+            )
+
+class EmfSink:
+    """Writes metrics as CloudWatch Embedded Metric Format log lines (no network calls)"""
+
+    def __init__(self, namespace=NAMESPACE, write=print):
+        self.namespace = namespace
+        self.write = write
+
+    def send(self, entries):
+        # One log line per dimension set, all metrics for that set together
+        groups = {}
+        for (name, unit, dimensions), (timestamp, values) in entries:
+            groups.setdefault(dimensions, []).append((name, unit, timestamp, values))
+
+        for dimensions, metrics in groups.items():
+            for offset in range(0, max(len(values) for _, _, _, values in metrics), MAX_EMF_VALUES):
+                line = {
+                    '_aws': {
+                        'Timestamp': int(min(timestamp for _, _, timestamp, _ in metrics) * 1000),
+                        'CloudWatchMetrics': [{
+                            'Namespace': self.namespace,
+                            'Dimensions': [[k for k, _ in dimensions]],
+                            'Metrics': []
+                        }]
+                    }
+                }
+                line.update(dimensions)
+                for name, unit, _, values in metrics:
+                    chunk = values[offset:offset + MAX_EMF_VALUES]
+                    if not chunk:
+                        continue
+                    line['_aws']['CloudWatchMetrics'][0]['Metrics'].append({'Name': name, 'Unit': unit})
+                    line[name] = chunk[0] if len(chunk) == 1 else chunk
+                self.write(json.dumps(line))
+
+class MemorySink:
+    """Local stand-in sink that keeps flushed metrics in memory (for tests and benchmarks)"""
+
+    def __init__(self):
+        self.flushes = []
+
+    def send(self, entries):
+        self.flushes.append([
+            {'name': name, 'unit': unit, 'dimensions': dict(dimensions), 'values': list(values)}
+            for (name, unit, dimensions), (_, values) in entries
+        ])
+
+    @property
+    def metrics(self):
+        return [metric for flush in self.flushes for metric in flush]
+
+class MetricsBuffer:
+    """Aggregates metrics in-process and hands them to a sink in batches"""
+
+    def __init__(self, sink, max_metrics=FLUSH_MAX_METRICS, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.sink = sink
+        self.max_metrics = max_metrics
+        self.flush_interval = flush_interval
+        self._entries = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit='Count', dimensions=None):
+        """Record one sample; flushes when the size or time threshold is reached"""
+        key = (name, unit, tuple(sorted((dimensions or {}).items())))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = (now, [value])
+            else:
+                entry[1].append(value)
+            due = len(self._entries) >= self.max_metrics or now - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Send everything buffered so far"""
+        with self._lock:
+            entries = list(self._entries.items())
+            self._entries = {}
+            self._last_flush = time.time()
+        if not entries:
+            return
+        try:
+            self.sink.send(entries)
+        except Exception as e:
+            from logger import WARNING, log_event  # logger imports this module
+            log_event('METRICS_FLUSH_FAILED', WARNING, metrics=len(entries), error=str(e))
+
+def create_sink(mode=None):
+    """Build the sink selected by METRICS_MODE: cloudwatch (default), emf or memory"""
+    mode = mode or os.environ.get('METRICS_MODE', 'cloudwatch')
+    if mode == 'emf':
+        return EmfSink()
+    if mode == 'memory':
+        return MemorySink()
+    return CloudWatchSink()
+
+# Global buffer - reused across invocations
+_buffer = None
+
+def get_buffer():
+    """Return the process-wide metrics buffer, creating it on first use"""
+    global _buffer
+    if _buffer is None:
+        _buffer = MetricsBuffer(create_sink())
+    return _buffer
+
+def use_sink(sink):
+    """Swap the sink of the process-wide buffer (e.g. MemorySink in tests); returns the buffer"""
+    global _buffer
+    if _buffer is not None:
+        _buffer.flush()
+    _buffer = MetricsBuffer(sink)
+    return _buffer
+
+def put_metric(name, value, unit='Count', dimensions=None):
+    """Buffer a metric for the next flush"""
+    get_buffer().put(name, value, unit, dimensions)
+
+def flush():
+    """Flush buffered metrics now"""
+    if _buffer is not None:
+        _buffer.flush()
+
+def flush_metrics(handler):
+    """Decorator flushing buffered metrics when a Lambda handler returns or raises"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        try:
+            return handler(event, context)
+        finally:
+            flush()
+    return wrapper
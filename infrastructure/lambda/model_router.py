@@ -0,0 +1,345 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+from bedrock_admission import AdmissionRejected
+from image_payload import iter_images
+from logger import INFO, WARNING, log_event
+
+# Model routing for image generation.
+#
+# Every Bedrock image model takes its own request body and answers in its
+# own format. An adapter per model builds the body from the shared
+# generation config (numberOfImages, width, height, cfgScale, seed - see
+# image_gen.image_generation_config) and streams the images out of the
+# response (image_payload.py).
+#
+# ModelRouter keeps the last calls of each model in the container (latency
+# of the successes, share of failures) and sends a request to the fastest
+# healthy model that makes the batch in one call. A model without recent
+# calls ranks as if it took LATENCY_BUDGET_MS, so a new container starts on
+# the first model in IMAGE_MODELS, and only a sampled MODEL_PROBE_RATE share
+# of requests goes to an unmeasured model to measure it (again once its
+# samples are older than ROLLING_WINDOW_SECONDS). A model is unhealthy, and
+# skipped for COOLDOWN_SECONDS, when most of its recent calls failed.
+#
+# Seeded requests are deterministic and served from the generation cache,
+# whose key names the model, so they are pinned: they go to the models in
+# IMAGE_MODELS order, whatever their latency, and only fail over to the next
+# one (image_gen.generate_and_store).
+#
+# When the chosen model has not answered within LATENCY_BUDGET_MS, the next
+# one is started alongside it (a hedged request) and whichever answers first
+# is used; the other call is still recorded, then dropped. When a model fails
+# on Bedrock's side (throttled, unavailable, timed out, not enabled in the
+# account, ...) the next one is tried at once. Both kinds of extra call only
+# go out when admission control has a slot for them right now
+# (bedrock_admission.py), so they never queue behind other users' calls.
+
+TITAN_V1 = 'amazon.titan-image-generator-v1'
+TITAN_V2 = 'amazon.titan-image-generator-v2:0'
+SDXL = 'stability.stable-diffusion-xl-v1'
+
+# Models to route between, in order of preference among equals
+IMAGE_MODELS = [model_id.strip() for model_id in
+                os.environ.get('IMAGE_MODELS', f"{TITAN_V1},{TITAN_V2},{SDXL}").split(',') if model_id.strip()]
+
+# Start a hedged call on the next model when the first one has not answered by then
+LATENCY_BUDGET_MS = float(os.environ.get('MODEL_LATENCY_BUDGET_MS', 10000))
+
+# Share of requests sent to a model without recent calls, to measure it
+MODEL_PROBE_RATE = float(os.environ.get('MODEL_PROBE_RATE', 0.05))
+
+# Calls per model kept for its rolling latency and error rate, and how long they count
+ROLLING_WINDOW = 20
+ROLLING_WINDOW_SECONDS = 300
+
+# A model is unhealthy when at least this share of its recent calls (and MIN_SAMPLES of them) failed
+UNHEALTHY_ERROR_RATE = 0.5
+MIN_SAMPLES = 3
+
+# How long an unhealthy model is skipped after each failure
+COOLDOWN_SECONDS = 30
+
+# Threads running model calls; a hedged request uses two
+ROUTER_WORKERS = 16
+
+# Errors caused by the request itself: another model would not do better
+REQUEST_ERRORS = ('ValidationException',)
+
+class TitanImageAdapter:
+    """Titan Image Generator v1/v2: TEXT_IMAGE requests, {"images": [...]} responses"""
+    
+    max_images = 5
+
+    def __init__(self, model_id, cost_per_image):
+        self.model_id = model_id
+        self.cost_per_image = cost_per_image
+
+    def request_body(self, prompt, generation_config):
+        return json.dumps({
+            'taskType': 'TEXT_IMAGE',
+            'textToImageParams': {
+                'text': prompt
+            },
+            'imageGenerationConfig': generation_config
+        })
+
+    def iter_images(self, body):
+        return iter_images(body)
+
+class StableDiffusionXlAdapter:
+    """Stable Diffusion XL: text_prompts requests, {"artifacts": [{"base64": ...}]} responses, one image per call"""
+    
+    max_images = 1
+    steps = 50
+
+    def __init__(self, model_id, cost_per_image):
+        self.model_id = model_id
+        self.cost_per_image = cost_per_image
+
+    def request_body(self, prompt, generation_config):
+        body = {
+            'text_prompts': [{'text': prompt, 'weight': 1.0}],
+            'cfg_scale': generation_config['cfgScale'],
+            'steps': self.steps,
+            'width': generation_config['width'],
+            'height': generation_config['height'],
+            'samples': generation_config['numberOfImages']
+        }
+        if 'seed' in generation_config:
+            body['seed'] = generation_config['seed']
+        return json.dumps(body)
+
+    def iter_images(self, body):
+        # An artifact that did not finish with SUCCESS (ERROR, CONTENT_FILTERED) raises ValueError
+        return iter_images(body, 'artifacts', item_field='base64', status_field='finishReason')
+
+# On-demand price of one 1024x1024 standard-quality image (USD)
+ADAPTERS = {
+    TITAN_V1: TitanImageAdapter(TITAN_V1, 0.01),
+    TITAN_V2: TitanImageAdapter(TITAN_V2, 0.01),
+    SDXL: StableDiffusionXlAdapter(SDXL, 0.04)
+}
+
+def _request_error(error):
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in REQUEST_ERRORS
+
+class ModelStats:
+    """Rolling record of one model's recent calls"""
+
+    def __init__(self, size=ROLLING_WINDOW, max_age=ROLLING_WINDOW_SECONDS):
+        self.calls = deque(maxlen=size)  # (time, latency ms, or None for a failure)
+        self.max_age = max_age
+        self.retry_at = 0
+
+    def _recent(self, now):
+        return [latency_ms for at, latency_ms in self.calls if now - at <= self.max_age]
+
+    def add(self, now, latency_ms, cooldown_seconds):
+        self.calls.append((now, latency_ms))
+        if latency_ms is None:
+            recent = self._recent(now)
+            failures = recent.count(None)
+            if failures >= MIN_SAMPLES and failures >= UNHEALTHY_ERROR_RATE * len(recent):
+                self.retry_at = now + cooldown_seconds
+
+    def latency_ms(self, now):
+        """Mean latency of the recent successful calls, or None without any"""
+        successes = [latency_ms for latency_ms in self._recent(now) if latency_ms is not None]
+        return sum(successes) / len(successes) if successes else None
+
+    def error_rate(self, now):
+        recent = self._recent(now)
+        return recent.count(None) / len(recent) if recent else 0.0
+
+    def healthy(self, now):
+        return now >= self.retry_at
+
+class RoutedResponse:
+    """The invoke_model response that was used, with the model that gave it"""
+
+    def __init__(self, adapter, response, latency_ms, fallback):
+        self.adapter = adapter
+        self.response = response
+        self.latency_ms = latency_ms
+        self.fallback = fallback
+
+    @property
+    def model_id(self):
+        return self.adapter.model_id
+
+    def images(self):
+        """Decoded images, streamed out of the response body"""
+        return self.adapter.iter_images(self.response['body'])
+
+    def cost(self, image_count):
+        """What the images cost on the model that made them (USD)"""
+        return self.adapter.cost_per_image * image_count
+
+def _close_body(future):
+    """Release the connection of a call whose answer is not used"""
+    try:
+        future.result()[0]['body'].close()
+    except Exception:
+        pass
+
+class ModelRouter:
+    """Routes generations to the fastest healthy model, hedging and failing over to the next ones"""
+
+    def __init__(self, model_ids=IMAGE_MODELS, latency_budget_ms=LATENCY_BUDGET_MS,
+                 cooldown_seconds=COOLDOWN_SECONDS, probe_rate=MODEL_PROBE_RATE, clock=time.monotonic,
+                 sample=random.random):
+        self.adapters = [ADAPTERS[model_id] for model_id in model_ids]
+        self.latency_budget_ms = latency_budget_ms
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_rate = probe_rate
+        self.clock = clock
+        self.sample = sample
+        self.stats = {adapter.model_id: ModelStats() for adapter in self.adapters}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def candidates(self, image_count, pinned=False):
+        """Adapters able to make image_count images in one call, best first
+        
+        Pinned requests keep the IMAGE_MODELS order (unhealthy models still go
+        last) and are never used to probe.
+        """
+        now = self.clock()
+        ranked = []
+        unmeasured = []
+        with self._lock:
+            for index, adapter in enumerate(self.adapters):
+                if adapter.max_images < image_count:
+                    continue
+                stats = self.stats[adapter.model_id]
+                latency_ms = stats.latency_ms(now)
+                if latency_ms is None and stats.healthy(now):
+                    unmeasured.append(adapter)
+                # Unhealthy models last; models without recent calls as if they took the whole budget
+                rank = index if pinned else (latency_ms if latency_ms is not None else self.latency_budget_ms)
+                ranked.append((not stats.healthy(now), rank, index))
+        ranked = [self.adapters[index] for *_, index in sorted(ranked)]
+        if not pinned and unmeasured and ranked[0] is not unmeasured[0] and self.sample() < self.probe_rate:
+            ranked.remove(unmeasured[0])
+            ranked.insert(0, unmeasured[0])
+            log_event('MODEL_PROBE', INFO, model_id=unmeasured[0].model_id)
+        return ranked
+
+    def preferred(self, image_count):
+        """The model a pinned request goes to while it is healthy"""
+        return next((adapter for adapter in self.adapters if adapter.max_images >= image_count), None)
+
+    def record(self, model_id, latency_ms):
+        """Add one call's outcome: latency in ms, or None for a failure"""
+        with self._lock:
+            self.stats[model_id].add(self.clock(), latency_ms, self.cooldown_seconds)
+
+    def snapshot(self):
+        """{model_id: {'latencyMs', 'errorRate', 'healthy', 'calls'}} for logs and benchmarks"""
+        now = self.clock()
+        with self._lock:
+            return {model_id: {'latencyMs': stats.latency_ms(now), 'errorRate': stats.error_rate(now),
+                               'healthy': stats.healthy(now), 'calls': len(stats._recent(now))}
+                    for model_id, stats in self.stats.items()}
+
+    def _call(self, client, adapter, body, governor):
+        started = self.clock()
+        try:
+            invoke = governor.invoke_model if governor is not None else lambda c, **kwargs: c.invoke_model(**kwargs)
+            response = invoke(client, modelId=adapter.model_id, body=body)
+        except Exception as e:
+            if not _request_error(e):
+                self.record(adapter.model_id, None)
+            raise
+        latency_ms = (self.clock() - started) * 1000
+        self.record(adapter.model_id, latency_ms)
+        return response, latency_ms
+
+    def _extra_slot(self, governor, user_key):
+        """Whether admission has a slot for a hedge or failover call right now"""
+        if governor is None:
+            return True
+        try:
+            governor.reserve(user_key, max_queue_seconds=0)
+            return True
+        except AdmissionRejected:
+            return False
+
+    def invoke(self, client, prompt, generation_config, governor=None, user_key=None, pinned=False):
+        """Generate with the best model (the preferred one when pinned); returns a RoutedResponse
+        
+        The first call must already be admitted (governor.admit); hedges and
+        failovers take their own slots. Raises the last model's error when
+        every model tried failed, and request errors (ValidationException) at once.
+        """
+        candidates = self.candidates(generation_config['numberOfImages'], pinned)
+        if not candidates:
+            raise ValueError(f"No image model makes {generation_config['numberOfImages']} images in one call")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=ROUTER_WORKERS, thread_name_prefix='model-router')
+        primary = candidates[0]
+        pending = {}
+        hedge_at = None
+        
+        def start(adapter):
+            nonlocal hedge_at
+            body = adapter.request_body(prompt, generation_config)
+            pending[self._executor.submit(self._call, client, adapter, body, governor)] = adapter
+            hedge_at = self.clock() + self.latency_budget_ms / 1000
+        
+        start(candidates.pop(0))
+        error = None
+        while pending:
+            timeout = max(0, hedge_at - self.clock()) if candidates and hedge_at is not None else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if self._extra_slot(governor, user_key):
+                    log_event('MODEL_HEDGE', WARNING, model_id=list(pending.values())[-1].model_id,
+                              hedge_model_id=candidates[0].model_id, budget_ms=self.latency_budget_ms)
+                    start(candidates.pop(0))
+                else:
+                    hedge_at = None
+                continue
+            for future in done:
+                adapter = pending.pop(future)
+                try:
+                    response, latency_ms = future.result()
+                except Exception as e:
+                    if _request_error(e):
+                        for other in pending:
+                            other.add_done_callback(_close_body)
+                        raise
+                    error = e
+                    log_event('MODEL_FAILOVER', WARNING, model_id=adapter.model_id, error=str(e))
+                    if not pending and candidates and self._extra_slot(governor, user_key):
+                        start(candidates.pop(0))
+                    continue
+                for other in pending:
+                    other.add_done_callback(_close_body)
+                log_event('MODEL_ROUTED', INFO, model_id=adapter.model_id, latency_ms=round(latency_ms, 1),
+                          fallback=adapter is not primary)
+                return RoutedResponse(adapter, response, latency_ms, adapter is not primary)
+        raise error
+
+# Global router - its stats live as long as the container
+_router = None
+_router_lock = threading.Lock()
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
+
+def use_router(router):
+    """Replace the container's router (local runs and benchmarks)"""
+    global _router
+    _router = router
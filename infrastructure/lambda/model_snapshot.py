@@ -0,0 +1,165 @@
+import marshal
+import os
+import sys
+
+# Precompiled botocore models for the services our Lambdas call.
+#
+# Creating the first client for a service makes botocore's Loader scan the
+# whole data directory (list_available_services), gunzip and JSON-parse the
+# service-2 and endpoint-rule-set-1 files, and load endpoints/partitions.
+# `python model_snapshot.py build` (run by deploy.sh after pip install)
+# records exactly those loads once and writes them to a marshal file (each
+# model marshalled separately, so a handler only decodes what it uses);
+# SnapshotLoader serves from it first and falls back to the JSON files for
+# anything it does not contain.
+
+SNAPSHOT_PATH = os.environ.get(
+    'BOTOCORE_MODEL_SNAPSHOT',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'botocore_models.snapshot')
+)
+
+CLIENTS = ['dynamodb', 'cognito-idp', 's3', 'bedrock-runtime', 'secretsmanager', 'cloudwatch', 'sqs']
+RESOURCES = ['dynamodb', 's3']
+
+SNAPSHOT_FORMAT = 2
+
+def _plain(value):
+    """OrderedDicts to dicts (insertion order is kept) so marshal can store the data"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+def _loader_class():
+    from botocore.loaders import Loader
+
+    class SnapshotLoader(Loader):
+        """botocore Loader that answers from a snapshot before touching the data files"""
+        
+        def __init__(self, snapshot=None, **kwargs):
+            super().__init__(**kwargs)
+            snapshot = snapshot or {}
+            self._versions = snapshot.get('versions', {})
+            self._models = snapshot.get('models', {})
+            self._data = snapshot.get('data', {})
+        
+        def determine_latest_version(self, service_name, type_name):
+            version = self._versions.get((service_name, type_name))
+            if version is not None:
+                return version
+            return super().determine_latest_version(service_name, type_name)
+        
+        def load_service_model(self, service_name, type_name, api_version=None):
+            key = (service_name, type_name, api_version or self._versions.get((service_name, type_name)))
+            model = self._models.get(key)
+            if model is None:
+                return super().load_service_model(service_name, type_name, api_version)
+            if isinstance(model, bytes):
+                model = self._models[key] = marshal.loads(model)
+            return model
+        
+        def load_data_with_path(self, name):
+            found = self._data.get(name)
+            if found is None:
+                return super().load_data_with_path(name)
+            data, path, builtin = found
+            if isinstance(data, bytes):
+                data = marshal.loads(data)
+                self._data[name] = (data, path, builtin)
+            # Keep is_builtin_path() answering as it would for the real file
+            return data, os.path.join(self.BUILTIN_DATA_PATH, path) if builtin else path
+    
+    return SnapshotLoader
+
+class _RecordingLoader:
+    """Wraps a Loader and keeps every model and data file it hands out"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self.versions = {}
+        self.models = {}
+        self.data = {}
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def determine_latest_version(self, service_name, type_name):
+        version = self._loader.determine_latest_version(service_name, type_name)
+        self.versions[(service_name, type_name)] = version
+        return version
+
+    def load_service_model(self, service_name, type_name, api_version=None):
+        model = self._loader.load_service_model(service_name, type_name, api_version)
+        if api_version is None:
+            api_version = self.determine_latest_version(service_name, type_name)
+        self.models[(service_name, type_name, api_version)] = marshal.dumps(_plain(model))
+        return model
+
+    def load_data_with_path(self, name):
+        data, path = self._loader.load_data_with_path(name)
+        # Service files are captured through load_service_model (with extras applied)
+        if '/' not in name:
+            builtin = self._loader.is_builtin_path(path)
+            relative = os.path.relpath(path, self._loader.BUILTIN_DATA_PATH) if builtin else path
+            self.data[name] = (marshal.dumps(_plain(data)), relative, builtin)
+        return data, path
+
+    def load_data(self, name):
+        return self.load_data_with_path(name)[0]
+
+def build(path=SNAPSHOT_PATH, clients=CLIENTS, resources=RESOURCES):
+    """Create every client/resource the Lambdas use and snapshot what was loaded"""
+    import boto3
+    import botocore
+    import botocore.session
+    
+    botocore_session = botocore.session.get_session()
+    recorder = _RecordingLoader(botocore_session.get_component('data_loader'))
+    botocore_session.register_component('data_loader', recorder)
+    session = boto3.session.Session(botocore_session=botocore_session, region_name='ap-southeast-1')
+    
+    for service_name in clients:
+        session.client(service_name)
+    for service_name in resources:
+        session.resource(service_name)
+    
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'botocore': botocore.__version__,
+        'boto3': boto3.__version__,
+        'versions': recorder.versions,
+        'models': recorder.models,
+        'data': recorder.data
+    }
+    with open(path, 'wb') as f:
+        marshal.dump(snapshot, f)
+    return snapshot
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    """Return the snapshot at path, or None if it is missing or was built for other SDK versions"""
+    try:
+        with open(path, 'rb') as f:
+            snapshot = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    
+    import boto3
+    import botocore
+    if (snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('botocore') != botocore.__version__
+            or snapshot.get('boto3') != boto3.__version__):
+        return None
+    return snapshot
+
+def create_loader(path=SNAPSHOT_PATH):
+    """SnapshotLoader over the snapshot at path; plain file loading if there is none"""
+    return _loader_class()(load_snapshot(path))
+
+if __name__ == '__main__':
+    if sys.argv[1:2] != ['build']:
+        print(f"usage: python {os.path.basename(__file__)} build [path]")
+        sys.exit(2)
+    target = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+    result = build(target)
+    print(f"Wrote {len(result['models'])} models and {len(result['data'])} data files "
+          f"(botocore {result['botocore']}) to {target} ({os.path.getsize(target) // 1024} KiB)")
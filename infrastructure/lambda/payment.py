@@ -1,23 +1,27 @@
 import json
-import boto3
 import hashlib
 import hmac
 import os
 import time
 from datetime import datetime
 from urllib.parse import urlencode
-from botocore.config import Config
-from logger import log_api_call, log_payment, log_business_metric
+from logger import ERROR, log_api_call, log_event, log_payment, log_business_metric
+from metrics import flush_metrics
+from identity import resolve_user_id
+from aws_clients import lazy_client, lazy_resource
+from secret_cache import CURRENT, PREVIOUS, SecretCache
+from transactions_ledger import CREDITED, DUPLICATE, create_pending_transaction, fail_transaction, settle_transaction
+from tracing import traced
 
 # Connection pooling configuration
-config = Config(
+config = dict(
     max_pool_connections=50,
     retries={'max_attempts': 2, 'mode': 'adaptive'}
 )
 
-# Global clients - reused across invocations
-dynamodb = boto3.resource('dynamodb', config=config)
-secrets_client = boto3.client('secretsmanager')
+# Global clients - reused across invocations, built on first use (see aws_clients.py)
+dynamodb = lazy_resource('dynamodb', **config)
+secrets_client = lazy_client('secretsmanager')
 
 CREDIT_PACKAGES = {
     'basic': {'credits': 100, 'amount': 10000},
@@ -25,26 +29,74 @@ CREDIT_PACKAGES = {
     'business': {'credits': 5000, 'amount': 100000}
 }
 
-def get_vnpay_credentials():
-    """Get VNPAY credentials from Secrets Manager"""
+def build_vnpay_credentials(tmn_code, hash_secret, return_url='http://localhost:5173/payment-result'):
+    """Credentials dict with the HMAC-SHA512 key schedule computed once"""
+    return {
+        'tmn_code': tmn_code,
+        'hash_secret': hash_secret,
+        'return_url': return_url,
+        'hmac': hmac.new(hash_secret.encode('utf-8'), digestmod=hashlib.sha512)
+    }
+
+def parse_vnpay_secret(secret_string):
+    secret = json.loads(secret_string)
+    return build_vnpay_credentials(
+        secret['tmn_code'],
+        secret['hash_secret'],
+        secret.get('return_url', 'http://localhost:5173/payment-result')
+    )
+
+# Global secret cache - warm invocations only call Secrets Manager to refresh
+_vnpay_secret = None
+
+def get_vnpay_secret():
+    global _vnpay_secret
+    if _vnpay_secret is None:
+        _vnpay_secret = SecretCache(secrets_client, os.environ['VNPAY_SECRET_ARN'], transform=parse_vnpay_secret)
+    return _vnpay_secret
+
+def get_vnpay_credentials(version_stage=CURRENT, force_refresh=False):
+    """Get VNPAY credentials from the Secrets Manager cache"""
     try:
-        secret_arn = os.environ['VNPAY_SECRET_ARN']
-        response = secrets_client.get_secret_value(SecretId=secret_arn)
-        secret = json.loads(response['SecretString'])
-        return {
-            'tmn_code': secret['tmn_code'],
-            'hash_secret': secret['hash_secret'],
-            'return_url': secret.get('return_url', 'http://localhost:5173/payment-result')
-        }
+        vnpay_creds = get_vnpay_secret().get(version_stage, force_refresh)
+        if vnpay_creds is None and version_stage == CURRENT:
+            raise ValueError('VNPAY secret has no AWSCURRENT version')
+        return vnpay_creds
     except Exception as e:
-        print(f"Error getting VNPAY credentials: {str(e)}")
+        if version_stage != CURRENT:
+            return None
+        log_event('VNPAY_CREDENTIALS_ERROR', ERROR, error=str(e))
         # Fallback to environment variables for development
-        return {
-            'tmn_code': os.environ.get('VNPAY_TMN_CODE', ''),
-            'hash_secret': os.environ.get('VNPAY_HASH_SECRET', ''),
-            'return_url': 'http://localhost:5173/payment-result'
-        }
+        return build_vnpay_credentials(
+            os.environ.get('VNPAY_TMN_CODE', ''),
+            os.environ.get('VNPAY_HASH_SECRET', '')
+        )
+
+def sign(vnpay_creds, sign_data):
+    """Hex HMAC-SHA512 of sign_data using the precomputed key"""
+    mac = vnpay_creds['hmac'].copy()
+    mac.update(sign_data.encode('utf-8'))
+    return mac.hexdigest()
 
+def verify_signature(sign_data, secure_hash):
+    """Check a callback signature; returns the matching credentials or None
+
+    Tries the cached AWSCURRENT secret, then a refreshed one (it may have
+    rotated since it was cached), then AWSPREVIOUS for callbacks signed
+    before the rotation.
+    """
+    for version_stage, force_refresh in ((CURRENT, False), (CURRENT, True), (PREVIOUS, False)):
+        vnpay_creds = get_vnpay_credentials(version_stage, force_refresh)
+        if vnpay_creds and hmac.compare_digest(sign(vnpay_creds, sign_data), secure_hash):
+            return vnpay_creds
+    return None
+
+def user_id_from_txn_ref(vnp_txn_ref):
+    """Extract the Users table userId from a vnp_TxnRef ("<userId>_<timestamp in ms>")"""
+    return vnp_txn_ref.rsplit('_', 1)[0] if vnp_txn_ref else None
+
+@flush_metrics
+@traced
 def handler(event, context):
     start_time = time.time()
     user_id = None
@@ -65,14 +117,25 @@ def handler(event, context):
                     'body': json.dumps({'error': 'No user ID in token'})
                 }
             
+            # Map Cognito sub to the Users table userId credited by the callback
+            users_table = dynamodb.Table(os.environ['USERS_TABLE'])
+            db_user_id = resolve_user_id(users_table, user_id, claims.get('email'))
+            
+            if not db_user_id:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'User not found'})
+                }
+            
             body = json.loads(event['body'])
-            body['userId'] = user_id  # Add userId to body
+            body['userId'] = db_user_id  # Add userId to body
             
             log_api_call('payment', user_id, 'create_vnpay_url', True)
             return create_vnpay_url(body)
         elif '/callback' in path and method == 'GET':
             params = event['queryStringParameters']
-            user_id = params.get('vnp_TxnRef', '').split('_')[0] if params.get('vnp_TxnRef') else None
+            user_id = user_id_from_txn_ref(params.get('vnp_TxnRef'))
             log_api_call('payment', user_id, 'vnpay_callback', True)
             return handle_vnpay_callback(params)
             
@@ -95,6 +158,13 @@ def create_vnpay_url(data):
     package = CREDIT_PACKAGES[package_type]
     vnpay_creds = get_vnpay_credentials()
     
+    # Record the order; the callback settles exactly this transaction
+    txn_ref = f"{user_id}_{int(time.time() * 1000)}"
+    create_pending_transaction(
+        dynamodb.Table(os.environ['TRANSACTIONS_TABLE']),
+        txn_ref, user_id, package_type, package['amount'], package['credits']
+    )
+    
     # Log payment initiation
     log_business_metric('PaymentInitiated', 1, 'Count', user_id)
     log_business_metric('PaymentAmount', package['amount'], 'None', user_id)
@@ -105,7 +175,7 @@ def create_vnpay_url(data):
         'vnp_TmnCode': vnpay_creds['tmn_code'],
         'vnp_Amount': str(package['amount'] * 100),
         'vnp_CurrCode': 'VND',
-        'vnp_TxnRef': f"{user_id}_{int(datetime.now().timestamp())}",
+        'vnp_TxnRef': txn_ref,
         'vnp_OrderInfo': f"Mua {package['credits']} credits",
         'vnp_OrderType': 'other',
         'vnp_Locale': 'vn',
@@ -118,11 +188,7 @@ def create_vnpay_url(data):
     sorted_params = dict(sorted(vnpay_params.items()))
     sign_data = urlencode(sorted_params)
     
-    signature = hmac.new(
-        vnpay_creds['hash_secret'].encode('utf-8'),
-        sign_data.encode('utf-8'),
-        hashlib.sha512
-    ).hexdigest()
+    signature = sign(vnpay_creds, sign_data)
     
     payment_url = f"https://sandbox.vnpayment.vn/paymentv2/vpcpay.html?{sign_data}&vnp_SecureHash={signature}"
     
@@ -138,20 +204,14 @@ def handle_vnpay_callback(params):
     vnp_txn_ref = params.get('vnp_TxnRef')
     vnp_amount = params.get('vnp_Amount')
     
-    user_id = vnp_txn_ref.split('_')[0] if vnp_txn_ref else None
-    vnpay_creds = get_vnpay_credentials()
+    user_id = user_id_from_txn_ref(vnp_txn_ref)
     
     # Verify signature
     sorted_params = dict(sorted(params.items()))
     sign_data = urlencode(sorted_params)
     
-    signature = hmac.new(
-        vnpay_creds['hash_secret'].encode('utf-8'),
-        sign_data.encode('utf-8'),
-        hashlib.sha512
-    ).hexdigest()
-    
-    if signature != vnp_secure_hash:
+    vnpay_creds = verify_signature(sign_data, vnp_secure_hash)
+    if vnpay_creds is None:
         log_payment(user_id, 'unknown', 0, False)
         raise ValueError('Invalid signature')
     
@@ -169,19 +229,29 @@ def handle_vnpay_callback(params):
         if package_type:
             credits = CREDIT_PACKAGES[package_type]['credits']
             
-            table = dynamodb.Table(os.environ['USERS_TABLE'])
-            table.update_item(
-                Key={'userId': user_id},
-                UpdateExpression='SET credits = credits + :credits',
-                ExpressionAttributeValues={':credits': credits}
+            # Flip the transaction to paid and grant credits in one transaction;
+            # repeated callbacks for the same vnp_TxnRef are no-ops
+            outcome = settle_transaction(
+                dynamodb.meta.client,
+                os.environ['TRANSACTIONS_TABLE'],
+                os.environ['USERS_TABLE'],
+                vnp_txn_ref, user_id, amount, credits,
+                params.get('vnp_TransactionNo')
             )
             
-            # Log successful payment
-            log_payment(user_id, package_type, amount, True)
-            log_business_metric('CreditsAdded', credits, 'Count', user_id)
+            if outcome == CREDITED:
+                # Log successful payment
+                log_payment(user_id, package_type, amount, True)
+                log_business_metric('CreditsAdded', credits, 'Count', user_id)
+            elif outcome == DUPLICATE:
+                log_business_metric('PaymentCallbackDuplicate', 1, 'Count')
+            else:
+                log_event('PAYMENT_REJECTED', ERROR, user_id=user_id, txn_ref=vnp_txn_ref, amount_vnd=amount)
+                log_business_metric('PaymentCallbackRejected', 1, 'Count')
     else:
         # Payment failed
-        log_payment(user_id, 'unknown', int(vnp_amount) // 100 if vnp_amount else 0, False)
+        if fail_transaction(dynamodb.Table(os.environ['TRANSACTIONS_TABLE']), vnp_txn_ref, vnp_response_code):
+            log_payment(user_id, 'unknown', int(vnp_amount) // 100 if vnp_amount else 0, False)
     
     return {
         'statusCode': 302,
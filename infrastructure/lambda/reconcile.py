@@ -0,0 +1,342 @@
+import argparse
+import calendar
+import csv
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from transactions_ledger import CREDITED, DUPLICATE, PAID, PENDING, settle_transaction
+
+# Reconciles the Transactions table against a VNPAY settlement export.
+#
+# Both inputs are hash-partitioned on vnp_TxnRef into bucket files on disk
+# (the table with a parallel segmented scan, the CSV streamed line by line),
+# then joined one bucket at a time. Memory stays bounded by the size of one
+# bucket however many rows there are. Mismatches are streamed to a report
+# CSV; with --repair the ones that can be fixed safely are settled in
+# batches through transactions_ledger.settle_transaction, which is
+# idempotent, so re-running a reconciliation never double grants.
+
+# Mismatch kinds
+MISSING_CREDIT = 'missing_credit'            # settled by VNPAY, ledger still pending/failed
+MISSING_TRANSACTION = 'missing_transaction'  # settled by VNPAY, not in the ledger at all
+AMOUNT_MISMATCH = 'amount_mismatch'          # settled amount differs from the order
+NOT_SETTLED = 'not_settled'                  # paid in the ledger, failed in the settlement file
+UNSETTLED_PAID = 'unsettled_paid'            # paid in the ledger, absent from the settlement file
+
+REPAIRABLE = (MISSING_CREDIT, MISSING_TRANSACTION)
+
+# Report outcome prefix of a repair that raised (ERROR:<reason>)
+REPAIR_ERROR = 'ERROR'
+
+# VNPAY settlement export columns
+SETTLEMENT_COLUMNS = {
+    'txn_ref': 'vnp_TxnRef',
+    'amount': 'vnp_Amount',              # VND x 100, as in the callback
+    'status': 'vnp_TransactionStatus',   # '00' = settled
+    'provider_ref': 'vnp_TransactionNo',
+    'pay_date': 'vnp_PayDate'            # yyyyMMddHHmmss, GMT+7
+}
+
+# VNPAY timestamps are Vietnam time
+VNPAY_UTC_OFFSET_SECONDS = 7 * 3600
+
+# Write buffer per bucket file
+BUCKET_BUFFER_BYTES = 16 * 1024
+
+LEDGER_FIELDS = ['transactionId', 'userId', 'amount', 'credits', 'status', 'providerRef', 'createdAt', 'paidAt']
+SETTLEMENT_FIELDS = ['txn_ref', 'amount', 'status', 'provider_ref', 'pay_date']
+REPORT_FIELDS = ['kind', 'transactionId', 'userId', 'ledgerStatus', 'ledgerAmount', 'settledAmount',
+                 'providerRef', 'repaired']
+
+def bucket_of(txn_ref, buckets):
+    return zlib.crc32(txn_ref.encode('utf-8')) % buckets
+
+class BucketWriter:
+    """Appends rows to one CSV file per bucket (thread-safe)"""
+
+    def __init__(self, directory, prefix, fields, buckets):
+        self.buckets = buckets
+        self.paths = [os.path.join(directory, f'{prefix}-{i:04d}.csv') for i in range(buckets)]
+        # Binary files with a fixed buffer: a text-mode file keeps every pending
+        # row as its own str object, which adds up across hundreds of buckets
+        self._files = [open(path, 'wb', buffering=BUCKET_BUFFER_BYTES) for path in self.paths]
+        self._locks = [threading.Lock() for _ in range(buckets)]
+        # One csv formatter per thread, not per bucket (each holds a 64 KiB record buffer)
+        self._local = threading.local()
+        self.fields = fields
+        self._rows = [0] * buckets
+
+    def write(self, txn_ref, row):
+        local = self._local
+        if not hasattr(local, 'writer'):
+            local.line = io.StringIO()
+            local.writer = csv.writer(local.line)
+        local.line.seek(0)
+        local.line.truncate()
+        local.writer.writerow([row.get(field, '') for field in self.fields])
+        data = local.line.getvalue().encode('utf-8')
+        
+        i = bucket_of(txn_ref, self.buckets)
+        with self._locks[i]:
+            self._files[i].write(data)
+            self._rows[i] += 1
+
+    @property
+    def rows(self):
+        return sum(self._rows)
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+    def read(self, i):
+        with open(self.paths[i], newline='', encoding='utf-8') as f:
+            for values in csv.reader(f):
+                yield dict(zip(self.fields, values))
+
+def in_window(timestamp, since=None, until=None):
+    """Whether an epoch second falls in [since, until); rows without one are always kept"""
+    if timestamp is None:
+        return True
+    return not ((since is not None and timestamp < since) or (until is not None and timestamp >= until))
+
+def scan_ledger(table, writer, segments=8, page_size=1000, since=None, until=None):
+    """Parallel segmented scan of the Transactions table into bucket files
+    
+    since/until filter on createdAt; legacy rows without one are kept.
+    """
+    def scan_segment(segment):
+        kwargs = {
+            'Segment': segment,
+            'TotalSegments': segments,
+            'Limit': page_size,
+            'ProjectionExpression': ', '.join(f'#{field}' for field in LEDGER_FIELDS),
+            'ExpressionAttributeNames': {f'#{field}': field for field in LEDGER_FIELDS}
+        }
+        while True:
+            response = table.scan(**kwargs)
+            for item in response.get('Items', []):
+                created_at = item.get('createdAt')
+                if not in_window(int(created_at) if created_at is not None else None, since, until):
+                    continue
+                writer.write(item['transactionId'], {k: _text(v) for k, v in item.items()})
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        list(pool.map(scan_segment, range(segments)))
+
+def pay_date_epoch(value):
+    """VNPAY yyyyMMddHHmmss (GMT+7) -> epoch second, or None when missing or malformed"""
+    try:
+        return calendar.timegm(time.strptime(value, '%Y%m%d%H%M%S')) - VNPAY_UTC_OFFSET_SECONDS
+    except (TypeError, ValueError):
+        return None
+
+def read_settlement(path, writer, columns=SETTLEMENT_COLUMNS, since=None, until=None):
+    """Stream the settlement CSV into bucket files
+    
+    since/until filter on the pay date, the same window as the ledger scan;
+    rows without a pay date are kept.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            txn_ref = (row.get(columns['txn_ref']) or '').strip()
+            if not txn_ref:
+                continue
+            settled = {field: (row.get(columns[field]) or '').strip() for field in SETTLEMENT_FIELDS
+                       if field in columns}
+            if (since is not None or until is not None) and not in_window(pay_date_epoch(settled.get('pay_date')), since, until):
+                continue
+            writer.write(txn_ref, settled)
+
+def _text(value):
+    if isinstance(value, Decimal) and value == value.to_integral_value():
+        value = int(value)
+    return str(value)
+
+def _int(value, default=0):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return default
+
+def compare_bucket(ledger_rows, settlement_rows, windowed=False):
+    """Yield (kind, ledger_row, settlement_row) for every mismatch in one bucket
+    
+    In a windowed run, ledger rows without createdAt are matched but never
+    reported as unsettled: their settlement may fall outside the window.
+    """
+    ledger = {row['transactionId']: row for row in ledger_rows}
+    for settled in settlement_rows:
+        row = ledger.pop(settled['txn_ref'], None)
+        settled_ok = settled['status'] == '00'
+        settled_amount = _int(settled['amount']) // 100
+        if row is None:
+            if settled_ok:
+                yield MISSING_TRANSACTION, None, settled
+            continue
+        if not settled_ok:
+            if row['status'] == PAID:
+                yield NOT_SETTLED, row, settled
+            continue
+        if settled_amount != _int(row['amount']):
+            yield AMOUNT_MISMATCH, row, settled
+        elif row['status'] != PAID:
+            yield MISSING_CREDIT, row, settled
+    # Whatever is left was not in the settlement file
+    for row in ledger.values():
+        if row['status'] == PAID and not (windowed and not row['createdAt']):
+            yield UNSETTLED_PAID, row, None
+
+def credits_for_amount(amount):
+    from payment import CREDIT_PACKAGES
+    for package in CREDIT_PACKAGES.values():
+        if package['amount'] == amount:
+            return package['credits']
+    return None
+
+def repair(client, transactions_table_name, users_table_name, mismatch):
+    """Settle one repairable mismatch; returns the settle_transaction outcome (or None)"""
+    from payment import user_id_from_txn_ref
+    kind, row, settled = mismatch
+    txn_ref = settled['txn_ref']
+    amount = _int(settled['amount']) // 100
+    user_id = row['userId'] if row else user_id_from_txn_ref(txn_ref)
+    credits = _int(row['credits']) if row else credits_for_amount(amount)
+    if not user_id or not credits:
+        return None
+    return settle_transaction(client, transactions_table_name, users_table_name, txn_ref, user_id,
+                              amount, credits, settled.get('provider_ref'),
+                              expected_status=row['status'] if row else PENDING)
+
+def error_reason(error):
+    """Short reason for a failed repair: the cancellation or error code, else the exception type"""
+    if isinstance(error, ClientError):
+        codes = [r.get('Code') for r in error.response.get('CancellationReasons') or [] if r.get('Code') != 'None']
+        return codes[0] if codes else error.response['Error']['Code']
+    return type(error).__name__
+
+def reconcile(table, settlement_path, report_path, buckets=64, segments=8, page_size=1000, since=None, until=None,
+              repair_client=None, users_table_name=None, batch_size=25, workers=8, columns=SETTLEMENT_COLUMNS):
+    """Run a reconciliation; returns a Counter of mismatch kinds (plus 'repaired', 'already_settled' and
+    'repair_errors')
+    
+    A repair that raises (e.g. a TransactionConflict with a callback in flight)
+    is reported as ERROR:<reason> and the run carries on; re-running settles it.
+    """
+    workdir = tempfile.mkdtemp(prefix='reconcile-')
+    counts = Counter()
+    try:
+        ledger = BucketWriter(workdir, 'ledger', LEDGER_FIELDS, buckets)
+        settlement = BucketWriter(workdir, 'settlement', SETTLEMENT_FIELDS, buckets)
+        try:
+            scan_ledger(table, ledger, segments, page_size, since, until)
+            read_settlement(settlement_path, settlement, columns, since, until)
+        finally:
+            ledger.close()
+            settlement.close()
+        counts['ledger_rows'] = ledger.rows
+        counts['settlement_rows'] = settlement.rows
+        
+        with open(report_path, 'w', newline='', encoding='utf-8') as f, \
+                ThreadPoolExecutor(max_workers=workers) as pool:
+            report = csv.writer(f)
+            report.writerow(REPORT_FIELDS)
+            batch = []
+            
+            def repair_one(mismatch):
+                if mismatch[0] not in REPAIRABLE:
+                    return None
+                try:
+                    return repair(repair_client, table.name, users_table_name, mismatch)
+                except Exception as e:
+                    return f'{REPAIR_ERROR}:{error_reason(e)}'
+            
+            def flush_batch():
+                if repair_client:
+                    outcomes = list(pool.map(repair_one, batch))
+                else:
+                    outcomes = [None] * len(batch)
+                for (kind, row, settled), outcome in zip(batch, outcomes):
+                    counts['repaired'] += outcome == CREDITED
+                    # DUPLICATE means it was settled already (e.g. by a callback after the scan): nothing granted
+                    counts['already_settled'] += outcome == DUPLICATE
+                    counts['repair_errors'] += (outcome or '').startswith(REPAIR_ERROR + ':')
+                    row, settled = row or {}, settled or {}
+                    report.writerow([
+                        kind,
+                        row.get('transactionId') or settled.get('txn_ref'),
+                        row.get('userId', ''),
+                        row.get('status', ''),
+                        row.get('amount', ''),
+                        _int(settled['amount']) // 100 if settled else '',
+                        settled.get('provider_ref', ''),
+                        outcome or ''
+                    ])
+                batch.clear()
+            
+            for i in range(buckets):
+                for mismatch in compare_bucket(ledger.read(i), settlement.read(i),
+                                               since is not None or until is not None):
+                    counts[mismatch[0]] += 1
+                    batch.append(mismatch)
+                    if len(batch) >= batch_size:
+                        flush_batch()
+            flush_batch()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile the Transactions table against a VNPAY settlement CSV')
+    parser.add_argument('settlement', help='VNPAY settlement export (CSV)')
+    parser.add_argument('--report', default='reconciliation-report.csv')
+    parser.add_argument('--transactions-table', default=os.environ.get('TRANSACTIONS_TABLE'))
+    parser.add_argument('--users-table', default=os.environ.get('USERS_TABLE'))
+    parser.add_argument('--since', type=int,
+                        help='only ledger rows created / settlement rows paid at or after this epoch second')
+    parser.add_argument('--until', type=int,
+                        help='only ledger rows created / settlement rows paid before this epoch second')
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments')
+    parser.add_argument('--buckets', type=int, default=64, help='on-disk partitions (memory is ~1/buckets of the data)')
+    parser.add_argument('--batch-size', type=int, default=25)
+    parser.add_argument('--repair', action='store_true', help='settle missing credits/transactions')
+    args = parser.parse_args(argv)
+    
+    from aws_clients import get_resource
+    dynamodb = get_resource('dynamodb', max_pool_connections=max(args.segments, 8) * 2)
+    if not args.transactions_table or (args.repair and not args.users_table):
+        parser.error('--transactions-table (and --users-table with --repair) or the env vars are required')
+    
+    start = time.time()
+    counts = reconcile(
+        dynamodb.Table(args.transactions_table), args.settlement, args.report,
+        buckets=args.buckets, segments=args.segments, since=args.since, until=args.until,
+        repair_client=dynamodb.meta.client if args.repair else None,
+        users_table_name=args.users_table, batch_size=args.batch_size
+    )
+    
+    print(f"🔎 Reconciled {counts['ledger_rows']} ledger rows against {counts['settlement_rows']} settlement rows "
+          f"in {time.time() - start:.1f}s")
+    for kind in (MISSING_CREDIT, MISSING_TRANSACTION, AMOUNT_MISMATCH, NOT_SETTLED, UNSETTLED_PAID):
+        print(f"  {kind:<22} {counts[kind]}")
+    if args.repair:
+        print(f"  {'repaired':<22} {counts['repaired']}")
+        print(f"  {'already settled':<22} {counts['already_settled']}")
+        print(f"  {'repair errors':<22} {counts['repair_errors']}")
+    print(f"📝 Report: {args.report}")
+    return 1 if any(counts[kind] for kind in (AMOUNT_MISMATCH, NOT_SETTLED, UNSETTLED_PAID, 'repair_errors')) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import base64
+import http.client
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from logger import ERROR, log_event
+
+# Lambda response streaming (Function URL with InvokeMode RESPONSE_STREAM).
+#
+# A streaming handler is called as handler(event, response_stream, context)
+# and writes bytes to response_stream as they are ready, instead of returning
+# one body at the end. HttpResponseStream puts the status code and headers in
+# front of the body in the format Function URLs expect (a JSON prelude and 8
+# NUL bytes); EventStream writes newline-delimited JSON progress events on
+# top of it, one line per step, which clients read with fetch() as they arrive.
+#
+# The Python managed runtime only returns buffered responses, so streaming
+# handlers are served by serve() below: a Runtime API loop that sends each
+# response as a chunked POST. It is the entrypoint of the container image
+# built from Dockerfile.stream (ImageGenStreamFunction, served by a Function
+# URL with InvokeMode RESPONSE_STREAM).
+
+HTTP_INTEGRATION_CONTENT_TYPE = 'application/vnd.awslambda.http-integration-response'
+PRELUDE_DELIMITER = b'\x00' * 8
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+class HttpResponseStream:
+    """Body writer that sends the status code and headers before the first chunk
+    
+    status_code and headers can change until something is written, so a
+    handler can still answer 400/500 when it fails before streaming.
+    """
+
+    def __init__(self, stream, status_code=200, headers=None):
+        self.stream = stream
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        self.started = False
+        self._lock = threading.Lock()
+
+    def _start(self):
+        prelude = json.dumps({'statusCode': self.status_code, 'headers': self.headers}).encode('utf-8')
+        self.stream.write(prelude + PRELUDE_DELIMITER)
+        self.started = True
+
+    def write(self, data):
+        with self._lock:
+            if not self.started:
+                self._start()
+            if data:
+                self.stream.write(data)
+
+    def end(self, error=None):
+        """Finish the response; with error, end it with the Runtime API error trailers
+        
+        Once bytes went out the status code can no longer change, so the
+        trailers are the only way left to tell the client the body is not whole.
+        """
+        with self._lock:
+            if not self.started:
+                self._start()
+        if error is None:
+            self.stream.end()
+        else:
+            self.stream.end(error)
+
+class EventStream:
+    """Newline-delimited JSON events over an HttpResponseStream; safe to send from worker threads"""
+
+    def __init__(self, http_stream):
+        self.http_stream = http_stream
+        self.started = time.perf_counter()
+
+    def send(self, event, **fields):
+        elapsed_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        line = json.dumps(dict({'event': event, 'elapsedMs': elapsed_ms}, **fields), separators=(',', ':'))
+        self.http_stream.write(line.encode('utf-8') + b'\n')
+
+class RuntimeApiStream:
+    """Streams one invocation's response to the Lambda Runtime API as a chunked POST"""
+
+    def __init__(self, request_id, runtime_api=None):
+        host, _, port = (runtime_api or os.environ['AWS_LAMBDA_RUNTIME_API']).partition(':')
+        self._connection = http.client.HTTPConnection(host, int(port or 80))
+        self._connection.putrequest('POST', f"/2018-06-01/runtime/invocation/{request_id}/response")
+        self._connection.putheader('Lambda-Runtime-Function-Response-Mode', 'streaming')
+        self._connection.putheader('Transfer-Encoding', 'chunked')
+        self._connection.putheader('Content-Type', HTTP_INTEGRATION_CONTENT_TYPE)
+        self._connection.putheader('Trailer', 'Lambda-Runtime-Function-Error-Type, Lambda-Runtime-Function-Error-Body')
+        self._connection.endheaders()
+        self.ended = False
+
+    def write(self, data):
+        # Each write goes out as its own chunk, so the client sees it right away (an empty one would end the body)
+        if data:
+            self._connection.send(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def end(self, error=None):
+        if self.ended:
+            return
+        self.ended = True
+        trailers = b''
+        if error is not None:
+            body = json.dumps({'errorType': type(error).__name__, 'errorMessage': str(error)}).encode('utf-8')
+            trailers = (b'Lambda-Runtime-Function-Error-Type: ' + type(error).__name__.encode('utf-8') + b'\r\n' +
+                        b'Lambda-Runtime-Function-Error-Body: ' + base64.b64encode(body) + b'\r\n')
+        self._connection.send(b'0\r\n' + trailers + b'\r\n')
+        self._connection.getresponse().read()
+        self._connection.close()
+
+def load_handler(spec):
+    """'module.function' -> the function"""
+    module_name, _, function_name = spec.rpartition('.')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def serve(handler, runtime_api=None):
+    """Runtime API loop calling handler(event, response_stream, context) for every invocation"""
+    runtime_api = runtime_api or os.environ['AWS_LAMBDA_RUNTIME_API']
+    host, _, port = runtime_api.partition(':')
+    connection = http.client.HTTPConnection(host, int(port or 80))
+    while True:
+        connection.request('GET', '/2018-06-01/runtime/invocation/next')
+        response = connection.getresponse()
+        event = json.loads(response.read())
+        context = {name: value for name, value in response.getheaders() if name.lower().startswith('lambda-runtime-')}
+        request_id = response.getheader('Lambda-Runtime-Aws-Request-Id')
+        stream = RuntimeApiStream(request_id, runtime_api)
+        try:
+            handler(event, stream, context)
+        except Exception as e:
+            log_event('STREAM_HANDLER_ERROR', ERROR, request_id=request_id, error=str(e))
+            stream.end(e)
+        else:
+            stream.end()
+
+if __name__ == '__main__':
+    serve(load_handler(sys.argv[1]))
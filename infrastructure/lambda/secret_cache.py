@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from logger import WARNING, log_event
+
+# How long a fetched secret is served before it must be fetched again
+SECRET_TTL_SECONDS = int(os.environ.get('SECRET_CACHE_TTL_SECONDS', 300))
+
+# Within this many seconds of expiry, get() starts a background refresh and keeps
+# serving the current value, so warm invocations never wait on Secrets Manager
+SECRET_REFRESH_AHEAD_SECONDS = int(os.environ.get('SECRET_CACHE_REFRESH_AHEAD_SECONDS', 60))
+
+# Lower bound between forced refreshes (e.g. after a signature mismatch)
+SECRET_MIN_REFRESH_SECONDS = int(os.environ.get('SECRET_CACHE_MIN_REFRESH_SECONDS', 30))
+
+CURRENT = 'AWSCURRENT'
+PREVIOUS = 'AWSPREVIOUS'
+
+class SecretCache:
+    """In-process cache of one Secrets Manager secret, per version stage
+    
+    `transform` turns the SecretString into whatever the caller wants to keep
+    (parsed JSON by default), so derived values such as HMAC keys are built
+    once per version instead of once per request.
+    """
+
+    def __init__(self, client, secret_id, transform=json.loads, ttl_seconds=SECRET_TTL_SECONDS,
+                 refresh_ahead_seconds=SECRET_REFRESH_AHEAD_SECONDS,
+                 min_refresh_seconds=SECRET_MIN_REFRESH_SECONDS):
+        self.client = client
+        self.secret_id = secret_id
+        self.transform = transform
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self._entries = {}  # version stage -> (expires_at, fetched_at, version_id, value)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _fetch(self, version_stage):
+        try:
+            response = self.client.get_secret_value(SecretId=self.secret_id, VersionStage=version_stage)
+        except Exception as e:
+            if getattr(e, 'response', {}).get('Error', {}).get('Code') != 'ResourceNotFoundException':
+                raise
+            # No version has this stage (e.g. AWSPREVIOUS before the first rotation);
+            # cached as None so lookups don't hit Secrets Manager every time
+            response = {}
+        version_id = response.get('VersionId')
+        current = self._entries.get(version_stage)
+        # Same version as before (no rotation): keep the already transformed value
+        if current is not None and version_id is not None and current[2] == version_id:
+            value = current[3]
+        else:
+            value = self.transform(response['SecretString']) if response else None
+        now = time.time()
+        with self._lock:
+            self._entries[version_stage] = (now + self.ttl_seconds, now, version_id, value)
+        return value
+
+    def _refresh_in_background(self, version_stage):
+        try:
+            self._fetch(version_stage)
+        except Exception as e:
+            # The current value stays in use until it expires
+            log_event('SECRET_REFRESH_FAILED', WARNING, secret_id=self.secret_id, stage=version_stage, error=str(e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(version_stage)
+
+    def get(self, version_stage=CURRENT, force_refresh=False):
+        """Return the transformed secret for version_stage (None if no version has that stage)"""
+        now = time.time()
+        entry = self._entries.get(version_stage)
+        
+        if entry is not None and force_refresh and now - entry[1] >= self.min_refresh_seconds:
+            return self._fetch(version_stage)
+        
+        if entry is None or now >= entry[0]:
+            try:
+                return self._fetch(version_stage)
+            except Exception as e:
+                if entry is None:
+                    raise
+                # Serve the expired value rather than failing the request
+                log_event('SECRET_REFRESH_FAILED', WARNING, secret_id=self.secret_id, stage=version_stage,
+                          error=str(e), serving='stale')
+                return entry[3]
+        
+        if now >= entry[0] - self.refresh_ahead_seconds:
+            with self._lock:
+                start = version_stage not in self._refreshing
+                self._refreshing.add(version_stage)
+            if start:
+                threading.Thread(target=self._refresh_in_background, args=(version_stage,), daemon=True).start()
+        return entry[3]
+
+    def version_id(self, version_stage=CURRENT):
+        """VersionId of the cached value for version_stage, or None"""
+        entry = self._entries.get(version_stage)
+        return entry[2] if entry else None
+
+    def invalidate(self, version_stage=None):
+        """Drop one stage (or everything) so the next get() fetches again"""
+        with self._lock:
+            if version_stage is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(version_stage, None)
@@ -0,0 +1,118 @@
+import functools
+import threading
+import time
+from logger import INFO, log_event
+
+# Per-invocation latency of every downstream AWS call.
+#
+# install_hooks() registers botocore event handlers on the shared session in
+# aws_clients.py, so every client built from it is timed from parameter
+# validation (before-parameter-build) to the parsed response (after-call) or
+# the failure (after-call-error), retries included. @traced collects the
+# calls of one invocation per component and reports them:
+#
+#   Server-Timing: cognito;dur=251.3;desc="1 call", dynamodb;dur=150.2;desc="1 call", total;dur=252.0
+#
+# plus one TRACE log line. A component's dur is the sum of its calls, so calls
+# made in parallel (thread pools) can add up to more than total.
+
+# Service name -> Server-Timing metric name
+COMPONENTS = {
+    'cognito-idp': 'cognito',
+    'dynamodb': 'dynamodb',
+    'bedrock-runtime': 'bedrock',
+    's3': 's3',
+    'secretsmanager': 'secrets',
+    'sqs': 'sqs',
+    'cloudwatch': 'cloudwatch'
+}
+
+_START = 'imagify_trace_start'
+
+class Trace:
+    """Downstream call timings of one invocation: component -> [total ms, calls]"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.components = {}
+        self._lock = threading.Lock()
+
+    def add(self, component, ms):
+        with self._lock:
+            entry = self.components.setdefault(component, [0.0, 0])
+            entry[0] += ms
+            entry[1] += 1
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self, total_ms):
+        """Server-Timing header value"""
+        metrics = [f'{name};dur={ms:.1f};desc="{calls} call{"s" if calls != 1 else ""}"'
+                   for name, (ms, calls) in sorted(self.components.items())]
+        metrics.append(f'total;dur={total_ms:.1f}')
+        return ', '.join(metrics)
+
+# The invocation being traced; Lambda runs one at a time per container, and
+# calls from worker threads of that invocation land here too
+_current = None
+
+def current_trace():
+    return _current
+
+def _component(model):
+    service_name = model.service_model.service_name
+    return COMPONENTS.get(service_name, service_name.replace('-', ''))
+
+def _on_start(context=None, model=None, **kwargs):
+    if _current is not None and context is not None and model is not None:
+        # after-call-error gets no model, so the component travels with the start time
+        context[_START] = (time.perf_counter(), _component(model))
+
+def _on_end(context=None, **kwargs):
+    trace = _current
+    start = context.pop(_START, None) if context is not None else None
+    if trace is not None and start is not None:
+        started, component = start
+        trace.add(component, (time.perf_counter() - started) * 1000)
+
+def expose_header(headers, name):
+    """Add name to Access-Control-Expose-Headers, keeping the ones already exposed"""
+    exposed = [value.strip() for value in headers.get('Access-Control-Expose-Headers', '').split(',') if value.strip()]
+    if name not in exposed:
+        exposed.append(name)
+    headers['Access-Control-Expose-Headers'] = ','.join(exposed)
+
+def install_hooks(botocore_session):
+    """Time every API call of clients created from botocore_session"""
+    botocore_session.register('before-parameter-build', _on_start, unique_id='imagify-trace-start')
+    botocore_session.register('after-call', _on_end, unique_id='imagify-trace-end')
+    botocore_session.register('after-call-error', _on_end, unique_id='imagify-trace-error')
+
+def traced(handler):
+    """Decorator timing a Lambda handler's downstream calls
+    
+    HTTP responses (dicts with statusCode) get a Server-Timing header; every
+    invocation writes a TRACE log line.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _current
+        trace = _current = Trace()
+        response = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _current = None
+            total_ms = trace.total_ms()
+            if isinstance(response, dict) and 'statusCode' in response:
+                headers = response.setdefault('headers', {})
+                headers['Server-Timing'] = trace.server_timing(total_ms)
+                # Let browser clients read it cross-origin
+                expose_header(headers, 'Server-Timing')
+                headers['Timing-Allow-Origin'] = '*'
+            log_event('TRACE', INFO, handler=handler.__module__, total_ms=round(total_ms, 1),
+                      components=lambda: {name: {'ms': round(ms, 1), 'calls': calls}
+                                          for name, (ms, calls) in trace.components.items()})
+    return wrapper
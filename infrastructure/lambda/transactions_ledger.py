@@ -0,0 +1,154 @@
+import time
+from botocore.exceptions import ClientError
+
+# Payment transactions ledger on the Transactions table (keyed by vnp_TxnRef).
+#
+# create_pending_transaction records the order when the payment URL is
+# issued. settle_transaction grants the credits with one TransactWriteItems
+# call that flips the row from pending to paid and increments the user's
+# credits together, so a repeated VNPAY callback (retries, browser refresh)
+# fails the condition and becomes a no-op instead of a second grant.
+
+PENDING = 'pending'
+PAID = 'paid'
+FAILED = 'failed'
+
+# settle_transaction outcomes
+CREDITED = 'credited'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+class DuplicateTransactionError(Exception):
+    """Raised when a transaction id is already in the ledger"""
+
+def create_pending_transaction(transactions_table, txn_ref, user_id, package_type, amount, credits):
+    """Record an order awaiting payment"""
+    try:
+        transactions_table.put_item(
+            Item={
+                'transactionId': txn_ref,
+                'userId': user_id,
+                'packageType': package_type,
+                'amount': amount,
+                'credits': credits,
+                'status': PENDING,
+                'createdAt': int(time.time())
+            },
+            ConditionExpression='attribute_not_exists(transactionId)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        raise DuplicateTransactionError(txn_ref)
+
+def _settle_items(transactions_table_name, users_table_name, txn_ref, user_id, amount, credits,
+                  provider_ref, legacy, expected_status):
+    now = str(int(time.time()))
+    if legacy:
+        # Orders issued before the ledger existed have no pending row: insert it as paid
+        transaction_item = {
+            'Put': {
+                'TableName': transactions_table_name,
+                'Item': {
+                    'transactionId': {'S': txn_ref},
+                    'userId': {'S': user_id},
+                    'amount': {'N': str(amount)},
+                    'credits': {'N': str(credits)},
+                    'status': {'S': PAID},
+                    'paidAt': {'N': now},
+                    'providerRef': {'S': provider_ref or ''}
+                },
+                'ConditionExpression': 'attribute_not_exists(transactionId)',
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+            }
+        }
+    else:
+        transaction_item = {
+            'Update': {
+                'TableName': transactions_table_name,
+                'Key': {'transactionId': {'S': txn_ref}},
+                'UpdateExpression': 'SET #status = :paid, paidAt = :now, providerRef = :provider_ref',
+                'ConditionExpression': '#status = :pending AND userId = :user_id AND amount = :amount AND credits = :credits',
+                'ExpressionAttributeNames': {'#status': 'status'},
+                'ExpressionAttributeValues': {
+                    ':paid': {'S': PAID},
+                    ':pending': {'S': expected_status},
+                    ':now': {'N': now},
+                    ':provider_ref': {'S': provider_ref or ''},
+                    ':user_id': {'S': user_id},
+                    ':amount': {'N': str(amount)},
+                    ':credits': {'N': str(credits)}
+                },
+                'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+            }
+        }
+    
+    return [
+        transaction_item,
+        {
+            'Update': {
+                'TableName': users_table_name,
+                'Key': {'userId': {'S': user_id}},
+                'UpdateExpression': 'SET credits = credits + :credits',
+                'ConditionExpression': 'attribute_exists(userId)',
+                'ExpressionAttributeValues': {':credits': {'N': str(credits)}}
+            }
+        }
+    ]
+
+def settle_transaction(client, transactions_table_name, users_table_name, txn_ref, user_id,
+                       amount, credits, provider_ref=None, expected_status=PENDING):
+    """Mark txn_ref paid and grant credits atomically; returns CREDITED, DUPLICATE or REJECTED
+    
+    Only one call per transaction can succeed. A transaction that is already
+    paid returns DUPLICATE without changing anything; one that does not
+    match the pending order (user, amount, credits) returns REJECTED.
+    expected_status=FAILED lets reconciliation settle an order whose
+    callback reported a failure but which VNPAY did settle.
+    """
+    legacy = False
+    while True:
+        try:
+            client.transact_write_items(
+                TransactItems=_settle_items(transactions_table_name, users_table_name, txn_ref, user_id,
+                                            amount, credits, provider_ref, legacy, expected_status)
+            )
+            return CREDITED
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = e.response.get('CancellationReasons') or [{}]
+            if any(r.get('Code') == 'TransactionConflict' for r in reasons):
+                # A concurrent callback for the same order is in flight; let the caller retry
+                raise
+            reason = reasons[0]
+            if reason.get('Code') != 'ConditionalCheckFailed':
+                # The user row is missing
+                return REJECTED
+            item = reason.get('Item')
+            if not item and not legacy:
+                legacy = True
+                continue
+            status = (item or {}).get('status', {}).get('S')
+            return DUPLICATE if status == PAID else REJECTED
+
+def fail_transaction(transactions_table, txn_ref, response_code):
+    """Mark a pending transaction failed; returns False if it was not pending"""
+    try:
+        transactions_table.update_item(
+            Key={'transactionId': txn_ref},
+            UpdateExpression='SET #status = :failed, responseCode = :code, failedAt = :now',
+            ConditionExpression='#status = :pending',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':failed': FAILED,
+                ':pending': PENDING,
+                ':code': response_code or '',
+                ':now': int(time.time())
+            }
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
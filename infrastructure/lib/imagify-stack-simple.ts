@@ -6,6 +6,13 @@ import * as s3 from 'aws-cdk-lib/aws-s3';
 import * as cognito from 'aws-cdk-lib/aws-cognito';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as logs from 'aws-cdk-lib/aws-logs';
+import * as sqs from 'aws-cdk-lib/aws-sqs';
+import * as cloudfront from 'aws-cdk-lib/aws-cloudfront';
+import * as origins from 'aws-cdk-lib/aws-cloudfront-origins';
+import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
+import { SqsEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
 
 export class ImagifyStack extends cdk.Stack {
   constructor(scope: cdk.App, id: string, props?: cdk.StackProps) {
@@ -19,6 +26,12 @@ export class ImagifyStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY
     });
 
+    // GSI for email -> userId resolution (no provisioned throughput for PAY_PER_REQUEST)
+    usersTable.addGlobalSecondaryIndex({
+      indexName: 'EmailIndex',
+      partitionKey: { name: 'email', type: dynamodb.AttributeType.STRING }
+    });
+
     const imagesTable = new dynamodb.Table(this, 'ImagesTable', {
       partitionKey: { name: 'imageId', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
@@ -26,6 +39,15 @@ export class ImagifyStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY
     });
 
+    // GSI for a user's image history, newest first; projects only what the history API returns
+    imagesTable.addGlobalSecondaryIndex({
+      indexName: 'UserCreatedIndex',
+      partitionKey: { name: 'userId', type: dynamodb.AttributeType.STRING },
+      sortKey: { name: 'createdAt', type: dynamodb.AttributeType.STRING },
+      projectionType: dynamodb.ProjectionType.INCLUDE,
+      nonKeyAttributes: ['prompt', 'status', 'imageKey', 'imageUrl', 'derivatives']
+    });
+
     const transactionsTable = new dynamodb.Table(this, 'TransactionsTable', {
       partitionKey: { name: 'transactionId', type: dynamodb.AttributeType.STRING },
       billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
@@ -33,6 +55,24 @@ export class ImagifyStack extends cdk.Stack {
       removalPolicy: cdk.RemovalPolicy.DESTROY
     });
 
+    // Content-addressed cache of deterministic (seeded) generations
+    const generationCacheTable = new dynamodb.Table(this, 'GenerationCacheTable', {
+      partitionKey: { name: 'cacheKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY
+    });
+
+    // Per-second Bedrock admission counters shared by all containers (bedrock_admission.py)
+    const bedrockAdmissionTable = new dynamodb.Table(this, 'BedrockAdmissionTable', {
+      partitionKey: { name: 'windowKey', type: dynamodb.AttributeType.STRING },
+      billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption: dynamodb.TableEncryption.AWS_MANAGED,
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: cdk.RemovalPolicy.DESTROY
+    });
+
     // S3 Bucket for images
     const imagesBucket = new s3.Bucket(this, 'ImagesBucket', {
       encryption: s3.BucketEncryption.S3_MANAGED,
@@ -42,6 +82,27 @@ export class ImagifyStack extends cdk.Stack {
       autoDeleteObjects: true
     });
 
+    // Jobs whose message ran out of deliveries - failed and refunded by image_gen.dead_letter_worker
+    const imageJobsDeadLetterQueue = new sqs.Queue(this, 'ImageJobsDeadLetterQueue', {
+      retentionPeriod: cdk.Duration.days(14)
+    });
+
+    // Queue for asynchronous image generation jobs
+    const imageJobsQueue = new sqs.Queue(this, 'ImageJobsQueue', {
+      visibilityTimeout: cdk.Duration.seconds(360),  // 6x worker timeout
+      retentionPeriod: cdk.Duration.days(1),
+      deadLetterQueue: {
+        queue: imageJobsDeadLetterQueue,
+        maxReceiveCount: 5
+      }
+    });
+
+    // Images stored by synchronous requests without derivatives - rendered by image_gen.derivatives_worker
+    const derivativesQueue = new sqs.Queue(this, 'DerivativesQueue', {
+      visibilityTimeout: cdk.Duration.seconds(360),  // 6x worker timeout
+      retentionPeriod: cdk.Duration.days(1)
+    });
+
     // Cognito User Pool
     const userPool = new cognito.UserPool(this, 'UserPool', {
       selfSignUpEnabled: true,
@@ -77,13 +138,48 @@ export class ImagifyStack extends cdk.Stack {
     usersTable.grantReadWriteData(lambdaExecutionRole);
     imagesTable.grantReadWriteData(lambdaExecutionRole);
     transactionsTable.grantReadWriteData(lambdaExecutionRole);
+    generationCacheTable.grantReadWriteData(lambdaExecutionRole);
+    bedrockAdmissionTable.grantReadWriteData(lambdaExecutionRole);
     imagesBucket.grantReadWrite(lambdaExecutionRole);
 
+    // Image delivery (lambda/image_delivery.py): the bucket stays private and images are
+    // served through signed URLs - S3 pre-signed by default, or CloudFront signed URLs
+    // when a signing key is configured (public key PEM + Secrets Manager ARN of the private key)
+    const imageDeliveryEnvironment: { [key: string]: string } = {};
+    if (process.env.CDN_PUBLIC_KEY_PEM && process.env.CDN_PRIVATE_KEY_SECRET_ARN) {
+      const imagesPublicKey = new cloudfront.PublicKey(this, 'ImagesPublicKey', {
+        encodedKey: process.env.CDN_PUBLIC_KEY_PEM
+      });
+      const imagesDistribution = new cloudfront.Distribution(this, 'ImagesDistribution', {
+        defaultBehavior: {
+          origin: new origins.S3Origin(imagesBucket),
+          viewerProtocolPolicy: cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+          // Signature query strings are checked at the edge and left out of the cache key
+          cachePolicy: cloudfront.CachePolicy.CACHING_OPTIMIZED,
+          trustedKeyGroups: [new cloudfront.KeyGroup(this, 'ImagesKeyGroup', { items: [imagesPublicKey] })]
+        },
+        priceClass: cloudfront.PriceClass.PRICE_CLASS_200 // Includes Asia edge locations
+      });
+      const cdnPrivateKey = secretsmanager.Secret.fromSecretCompleteArn(
+        this, 'ImagesPrivateKey', process.env.CDN_PRIVATE_KEY_SECRET_ARN
+      );
+      cdnPrivateKey.grantRead(lambdaExecutionRole);
+      imageDeliveryEnvironment.CDN_DOMAIN = imagesDistribution.distributionDomainName;
+      imageDeliveryEnvironment.CDN_KEY_PAIR_ID = imagesPublicKey.publicKeyId;
+      imageDeliveryEnvironment.CDN_PRIVATE_KEY_SECRET_ARN = cdnPrivateKey.secretArn;
+
+      new cdk.CfnOutput(this, 'ImagesDistributionDomain', {
+        value: imagesDistribution.distributionDomainName,
+        description: 'CloudFront domain serving signed image URLs'
+      });
+    }
+
     // Bedrock permissions
     lambdaExecutionRole.addToPolicy(new iam.PolicyStatement({
       actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
       resources: [
         'arn:aws:bedrock:us-east-1::foundation-model/amazon.titan-image-generator-v1',
+        'arn:aws:bedrock:us-east-1::foundation-model/amazon.titan-image-generator-v2:0',
         'arn:aws:bedrock:us-east-1::foundation-model/stability.stable-diffusion-xl-v1'
       ]
     }));
@@ -95,7 +191,8 @@ export class ImagifyStack extends cdk.Stack {
         'cognito-idp:AdminSetUserPassword',
         'cognito-idp:AdminInitiateAuth',
         'cognito-idp:AdminGetUser',
-        'cognito-idp:AdminUpdateUserAttributes'
+        'cognito-idp:AdminUpdateUserAttributes',
+        'cognito-idp:AdminDeleteUser'  // Rolls back a half-finished registration
       ],
       resources: [userPool.userPoolArn]
     }));
@@ -123,9 +220,116 @@ export class ImagifyStack extends cdk.Stack {
       environment: {
         IMAGES_TABLE: imagesTable.tableName,
         IMAGES_BUCKET: imagesBucket.bucketName,
+        USERS_TABLE: usersTable.tableName,
+        JOBS_QUEUE_URL: imageJobsQueue.queueUrl,
+        DERIVATIVES_QUEUE_URL: derivativesQueue.queueUrl,
+        GENERATION_CACHE_TABLE: generationCacheTable.tableName,
+        BEDROCK_ADMISSION_TABLE: bedrockAdmissionTable.tableName,
+        ...imageDeliveryEnvironment
+      }
+    });
+
+    // Worker stage for queued jobs - concurrency capped to what Bedrock sustains
+    const imageGenWorkerFunction = new lambda.Function(this, 'ImageGenWorkerFunction', {
+      runtime: lambda.Runtime.PYTHON_3_10,
+      handler: 'image_gen.worker',
+      code: lambda.Code.fromAsset('lambda'),
+      role: lambdaExecutionRole,
+      timeout: cdk.Duration.seconds(60),
+      reservedConcurrentExecutions: 10,
+      environment: {
+        IMAGES_TABLE: imagesTable.tableName,
+        IMAGES_BUCKET: imagesBucket.bucketName,
+        USERS_TABLE: usersTable.tableName,
+        DERIVATIVES_QUEUE_URL: derivativesQueue.queueUrl,
+        GENERATION_CACHE_TABLE: generationCacheTable.tableName,
+        BEDROCK_ADMISSION_TABLE: bedrockAdmissionTable.tableName,
+        // Jobs can wait for a Bedrock slot longer than API requests; a rejected job comes back after the visibility timeout
+        BEDROCK_MAX_QUEUE_SECONDS: '20',
+        // Longer than the timeout above: a RUNNING job claimed earlier than this lost its worker
+        JOB_LEASE_SECONDS: '90',
+        ...imageDeliveryEnvironment
+      }
+    });
+    imageGenWorkerFunction.addEventSource(new SqsEventSource(imageJobsQueue, { batchSize: 1 }));
+    imageJobsQueue.grantSendMessages(imageGenFunction);
+    derivativesQueue.grantSendMessages(imageGenFunction);
+    derivativesQueue.grantSendMessages(imageGenWorkerFunction);
+
+    // Streaming variant of POST /image/generate (image_gen.stream_handler) behind a Function URL;
+    // the container runs response_stream.serve() as its runtime loop (lambda/Dockerfile.stream)
+    const imageGenStreamFunction = new lambda.DockerImageFunction(this, 'ImageGenStreamFunction', {
+      code: lambda.DockerImageCode.fromImageAsset('lambda', { file: 'Dockerfile.stream' }),
+      role: lambdaExecutionRole,
+      timeout: cdk.Duration.seconds(60),
+      environment: {
+        IMAGES_TABLE: imagesTable.tableName,
+        IMAGES_BUCKET: imagesBucket.bucketName,
+        USERS_TABLE: usersTable.tableName,
+        DERIVATIVES_QUEUE_URL: derivativesQueue.queueUrl,
+        BEDROCK_ADMISSION_TABLE: bedrockAdmissionTable.tableName,
+        // No API Gateway authorizer in front of a Function URL: the handler verifies the Cognito token
+        USER_POOL_ID: userPool.userPoolId,
+        USER_POOL_CLIENT_ID: userPoolClient.userPoolClientId,
+        ...imageDeliveryEnvironment
+      }
+    });
+    derivativesQueue.grantSendMessages(imageGenStreamFunction);
+    const imageGenStreamUrl = imageGenStreamFunction.addFunctionUrl({
+      authType: lambda.FunctionUrlAuthType.NONE,
+      invokeMode: lambda.InvokeMode.RESPONSE_STREAM,
+      cors: {
+        allowedOrigins: ['*'],
+        allowedMethods: [lambda.HttpMethod.POST],
+        allowedHeaders: ['Content-Type', 'Authorization'],
+        exposedHeaders: ['X-Image-Ids', 'Retry-After']
+      }
+    });
+
+    // Derivatives (~450 ms of CPU per image) off the synchronous request path; SYNC_DERIVATIVES=true renders them inline
+    const derivativesFunction = new lambda.Function(this, 'DerivativesFunction', {
+      runtime: lambda.Runtime.PYTHON_3_10,
+      handler: 'image_gen.derivatives_worker',
+      code: lambda.Code.fromAsset('lambda'),
+      role: lambdaExecutionRole,
+      timeout: cdk.Duration.seconds(60),
+      environment: {
+        IMAGES_TABLE: imagesTable.tableName,
+        IMAGES_BUCKET: imagesBucket.bucketName
+      }
+    });
+    derivativesFunction.addEventSource(new SqsEventSource(derivativesQueue, { batchSize: 1 }));
+
+    const imageJobsDeadLetterFunction = new lambda.Function(this, 'ImageJobsDeadLetterFunction', {
+      runtime: lambda.Runtime.PYTHON_3_10,
+      handler: 'image_gen.dead_letter_worker',
+      code: lambda.Code.fromAsset('lambda'),
+      role: lambdaExecutionRole,
+      timeout: cdk.Duration.seconds(30),
+      environment: {
+        IMAGES_TABLE: imagesTable.tableName,
         USERS_TABLE: usersTable.tableName
       }
     });
+    imageJobsDeadLetterFunction.addEventSource(new SqsEventSource(imageJobsDeadLetterQueue, { batchSize: 10 }));
+
+    // Refunds credits reserved by a request whose Lambda died before committing or refunding them
+    const reservationSweeperFunction = new lambda.Function(this, 'ReservationSweeperFunction', {
+      runtime: lambda.Runtime.PYTHON_3_10,
+      handler: 'image_gen.reservation_sweeper',
+      code: lambda.Code.fromAsset('lambda'),
+      role: lambdaExecutionRole,
+      timeout: cdk.Duration.minutes(5),
+      environment: {
+        USERS_TABLE: usersTable.tableName,
+        // Well past the 60s timeout of the functions reserving credits synchronously
+        RESERVATION_TIMEOUT_SECONDS: '300'
+      }
+    });
+    new events.Rule(this, 'ReservationSweeperSchedule', {
+      schedule: events.Schedule.rate(cdk.Duration.minutes(5)),
+      targets: [new targets.LambdaFunction(reservationSweeperFunction)]
+    });
 
     const paymentFunction = new lambda.Function(this, 'PaymentFunction', {
       runtime: lambda.Runtime.PYTHON_3_10,
@@ -176,6 +380,12 @@ export class ImagifyStack extends cdk.Stack {
     image.addResource('generate').addMethod('POST', new apigateway.LambdaIntegration(imageGenFunction), {
       authorizer: cognitoAuthorizer
     });
+    image.addResource('jobs').addResource('{jobId}').addMethod('GET', new apigateway.LambdaIntegration(imageGenFunction), {
+      authorizer: cognitoAuthorizer
+    });
+    image.addResource('history').addMethod('GET', new apigateway.LambdaIntegration(imageGenFunction), {
+      authorizer: cognitoAuthorizer
+    });
 
     const payment = api.root.addResource('payment');
     payment.addResource('vnpay').addMethod('POST', new apigateway.LambdaIntegration(paymentFunction), {
@@ -208,6 +418,11 @@ export class ImagifyStack extends cdk.Stack {
       description: 'API Gateway URL'
     });
 
+    new cdk.CfnOutput(this, 'ImageGenStreamUrl', {
+      value: imageGenStreamUrl.url,
+      description: 'Function URL streaming POST /image/generate'
+    });
+
     new cdk.CfnOutput(this, 'UserPoolId', {
       value: userPool.userPoolId,
       description: 'Cognito User Pool ID'
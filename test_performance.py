@@ -3,7 +3,12 @@ import requests
 import time
 import json
 import statistics
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+import loadgen
 
 # API Configuration - Updated to Singapore deployment
 API_BASE_URL = "https://atp6bmow87.execute-api.ap-southeast-1.amazonaws.com/prod"
@@ -17,15 +22,18 @@ class PerformanceTest:
             'image_gen': [],
             'payment': []
         }
+        self.breakdowns = {}  # endpoint -> [component breakdown per request]
     
     def measure_detailed_latency(self, func, endpoint_name):
-        """Measure detailed latency with component breakdown"""
+        """Measure latency with the component breakdown reported by the Lambda"""
         start_time = time.time()
         response = func()
         total_latency = (time.time() - start_time) * 1000
         
-        # Estimate component latencies based on endpoint type
-        breakdown = self.estimate_component_latency(endpoint_name, total_latency)
+        # Real per-component timings from the Server-Timing header (tracing.py)
+        breakdown = self.component_latency(response.headers.get('Server-Timing'), total_latency)
+        if breakdown:
+            self.breakdowns.setdefault(endpoint_name, []).append(breakdown)
         
         return {
             'total_ms': round(total_latency, 2),
@@ -35,40 +43,44 @@ class PerformanceTest:
             'response': response
         }
     
-    def estimate_component_latency(self, endpoint, total_ms):
-        """Estimate latency breakdown by component"""
-        if endpoint == 'login':
-            return {
-                'api_gateway_ms': round(total_ms * 0.05, 1),  # ~5%
-                'lambda_execution_ms': round(total_ms * 0.25, 1),  # ~25%
-                'cognito_auth_ms': round(total_ms * 0.50, 1),  # ~50%
-                'dynamodb_query_ms': round(total_ms * 0.15, 1),  # ~15%
-                'response_ms': round(total_ms * 0.05, 1)  # ~5%
-            }
-        elif endpoint == 'credits':
-            return {
-                'api_gateway_ms': round(total_ms * 0.10, 1),  # ~10%
-                'cognito_authorizer_ms': round(total_ms * 0.30, 1),  # ~30%
-                'lambda_execution_ms': round(total_ms * 0.40, 1),  # ~40%
-                'dynamodb_query_ms': round(total_ms * 0.20, 1)  # ~20%
-            }
-        elif endpoint == 'image_gen':
-            return {
-                'api_gateway_ms': round(total_ms * 0.02, 1),  # ~2%
-                'cognito_authorizer_ms': round(total_ms * 0.05, 1),  # ~5%
-                'lambda_execution_ms': round(total_ms * 0.08, 1),  # ~8%
-                'dynamodb_lookup_ms': round(total_ms * 0.05, 1),  # ~5%
-                'bedrock_titan_ms': round(total_ms * 0.70, 1),  # ~70%
-                's3_upload_ms': round(total_ms * 0.10, 1)  # ~10%
-            }
-        elif endpoint == 'payment':
-            return {
-                'api_gateway_ms': round(total_ms * 0.10, 1),  # ~10%
-                'cognito_authorizer_ms': round(total_ms * 0.30, 1),  # ~30%
-                'lambda_execution_ms': round(total_ms * 0.40, 1),  # ~40%
-                'vnpay_url_gen_ms': round(total_ms * 0.20, 1)  # ~20%
-            }
-        return {}
+    @staticmethod
+    def parse_server_timing(header):
+        """Parse a Server-Timing header into {name: {'ms': dur, 'desc': desc}}"""
+        metrics = {}
+        for entry in (header or '').split(','):
+            parts = [part.strip() for part in entry.split(';')]
+            if not parts[0]:
+                continue
+            metric = {'ms': 0.0, 'desc': ''}
+            for param in parts[1:]:
+                key, _, value = param.partition('=')
+                if key.strip() == 'dur':
+                    metric['ms'] = float(value)
+                elif key.strip() == 'desc':
+                    metric['desc'] = value.strip('"')
+            metrics[parts[0]] = metric
+        return metrics
+    
+    def component_latency(self, header, total_ms):
+        """Latency breakdown in ms: each downstream component, Lambda code and API Gateway + network
+        
+        Component times are summed per component, so calls the Lambda makes in
+        parallel can add up to more than its own total.
+        """
+        metrics = self.parse_server_timing(header)
+        if 'total' not in metrics:
+            return {}
+        lambda_ms = metrics.pop('total')['ms']
+        breakdown = {f"{name}_ms": round(metric['ms'], 1) for name, metric in metrics.items()}
+        breakdown['lambda_other_ms'] = round(max(0.0, lambda_ms - sum(m['ms'] for m in metrics.values())), 1)
+        breakdown['api_gateway_network_ms'] = round(max(0.0, total_ms - lambda_ms), 1)
+        return breakdown
+    
+    def print_breakdown(self, breakdown):
+        if not breakdown:
+            print("     └─ (no Server-Timing header)")
+        for name, ms in breakdown.items():
+            print(f"     └─ {name[:-3]}: {ms}ms")
     
     def login_and_get_token(self):
         """Login and get token for testing"""
@@ -83,10 +95,7 @@ class PerformanceTest:
         if result['success']:
             self.token = result['response'].json().get('token')
             print(f"  🔐 Login: {result['total_ms']:.0f}ms")
-            print(f"     └─ API Gateway: {result['breakdown']['api_gateway_ms']}ms")
-            print(f"     └─ Lambda: {result['breakdown']['lambda_execution_ms']}ms")
-            print(f"     └─ Cognito Auth: {result['breakdown']['cognito_auth_ms']}ms")
-            print(f"     └─ DynamoDB: {result['breakdown']['dynamodb_query_ms']}ms")
+            self.print_breakdown(result['breakdown'])
         else:
             print(f"  ❌ Login failed: {result['status_code']}")
         
@@ -101,10 +110,7 @@ class PerformanceTest:
         
         if result['success']:
             print(f"  💰 Credits: {result['total_ms']:.0f}ms")
-            print(f"     └─ API Gateway: {result['breakdown']['api_gateway_ms']}ms")
-            print(f"     └─ Cognito Authorizer: {result['breakdown']['cognito_authorizer_ms']}ms")
-            print(f"     └─ Lambda: {result['breakdown']['lambda_execution_ms']}ms")
-            print(f"     └─ DynamoDB: {result['breakdown']['dynamodb_query_ms']}ms")
+            self.print_breakdown(result['breakdown'])
         else:
             print(f"  💰 Credits: {result['total_ms']:.0f}ms (Status: {result['status_code']})")
         
@@ -124,12 +130,7 @@ class PerformanceTest:
         
         if result['success']:
             print(f"  🎨 Image Gen: {result['total_ms']:.0f}ms")
-            print(f"     └─ API Gateway: {result['breakdown']['api_gateway_ms']}ms")
-            print(f"     └─ Cognito Authorizer: {result['breakdown']['cognito_authorizer_ms']}ms")
-            print(f"     └─ Lambda: {result['breakdown']['lambda_execution_ms']}ms")
-            print(f"     └─ DynamoDB: {result['breakdown']['dynamodb_lookup_ms']}ms")
-            print(f"     └─ Bedrock Titan: {result['breakdown']['bedrock_titan_ms']}ms")
-            print(f"     └─ S3 Upload: {result['breakdown']['s3_upload_ms']}ms")
+            self.print_breakdown(result['breakdown'])
         else:
             print(f"  ❌ Image Gen failed: {result['status_code']}")
         
@@ -149,10 +150,7 @@ class PerformanceTest:
         
         if result['success']:
             print(f"  💳 Payment: {result['total_ms']:.0f}ms")
-            print(f"     └─ API Gateway: {result['breakdown']['api_gateway_ms']}ms")
-            print(f"     └─ Cognito Authorizer: {result['breakdown']['cognito_authorizer_ms']}ms")
-            print(f"     └─ Lambda: {result['breakdown']['lambda_execution_ms']}ms")
-            print(f"     └─ VNPAY URL Gen: {result['breakdown']['vnpay_url_gen_ms']}ms")
+            self.print_breakdown(result['breakdown'])
         else:
             print(f"  ❌ Payment failed: {result['status_code']}")
         
@@ -196,36 +194,52 @@ class PerformanceTest:
         
         self.analyze_results(all_results)
     
-    def run_concurrent_test(self, concurrent_users=3, requests_per_user=2):
-        """Run concurrent test to simulate multiple users"""
-        print(f"\n🔥 Running Concurrent Test ({concurrent_users} users, {requests_per_user} requests each)")
+    def run_load_test(self, rate=5, duration=20, mix='credits=8,history=2'):
+        """Open-loop load at a constant request rate (benchmarks/loadgen.py)"""
+        print(f"\n🔥 Running Load Test ({rate} req/s for {duration}s, mix {mix})")
         print("=" * 70)
         
-        def user_test():
-            results = []
-            for _ in range(requests_per_user):
-                result = self.run_single_test(show_details=False)
-                if result.get('credits'):
-                    results.append(result['credits'])
-                time.sleep(0.5)
-            return results
+        async def run():
+            pool = loadgen.ConnectionPool(API_BASE_URL, size=64)
+            try:
+                token = self.token or await loadgen.login_token(pool, "perf@test.com", "TestPass123!")
+                return await loadgen.run_load(pool, list(loadgen.constant(rate, duration)), loadgen.parse_mix(mix),
+                                              headers={'Authorization': token})
+            finally:
+                pool.close()
         
-        all_latencies = []
-        
-        with ThreadPoolExecutor(max_workers=concurrent_users) as executor:
-            futures = [executor.submit(user_test) for _ in range(concurrent_users)]
-            
-            for i, future in enumerate(as_completed(futures)):
-                user_results = future.result()
-                all_latencies.extend(user_results)
-                print(f"User {i+1} completed: {len(user_results)} requests")
-        
-        if all_latencies:
-            print(f"\n📊 Concurrent Test Results:")
-            print(f"Total Requests: {len(all_latencies)}")
-            print(f"Average Latency: {statistics.mean(all_latencies):.1f}ms")
-            print(f"Median Latency: {statistics.median(all_latencies):.1f}ms")
-            print(f"95th Percentile: {sorted(all_latencies)[int(len(all_latencies) * 0.95)]:.1f}ms")
+        stats, elapsed, max_lag = asyncio.run(run())
+        result = loadgen.report({'name': 'constant', 'rate': rate, 'duration': duration}, stats, elapsed, max_lag,
+                                int(rate * duration))
+        print(f"\n📊 Load Test Results (latency from each request's scheduled send time):")
+        loadgen.print_report(result)
+        return result
+    
+    @staticmethod
+    def aggregate_components(breakdowns):
+        """Per-component mean/median/p95 over the traced requests of one endpoint"""
+        names = list(dict.fromkeys(name for breakdown in breakdowns for name in breakdown))
+        summary = {}
+        for name in names:
+            # A component missing from a request took no time in it
+            values = sorted(breakdown.get(name, 0.0) for breakdown in breakdowns)
+            p95 = statistics.quantiles(values, n=20, method='inclusive')[-1] if len(values) > 1 else values[0]
+            summary[name[:-3]] = {
+                'mean_ms': round(statistics.mean(values), 1),
+                'median_ms': round(statistics.median(values), 1),
+                'p95_ms': round(p95, 1)
+            }
+        return summary
+    
+    def print_component_summary(self, endpoint):
+        breakdowns = self.breakdowns.get(endpoint)
+        if not breakdowns:
+            print("  Components: no Server-Timing data")
+            return
+        print(f"  Components ({len(breakdowns)} traced requests):")
+        for name, stats in self.aggregate_components(breakdowns).items():
+            print(f"    {name:<24} mean {stats['mean_ms']:8.1f}ms  median {stats['median_ms']:8.1f}ms  "
+                  f"p95 {stats['p95_ms']:8.1f}ms")
     
     def analyze_results(self, results):
         """Analyze and display performance results"""
@@ -269,6 +283,8 @@ class PerformanceTest:
                         print(f"  Rating:  🟡 GOOD (< 400ms)")
                     else:
                         print(f"  Rating:  🔴 NEEDS IMPROVEMENT (> 400ms)")
+                
+                self.print_component_summary(endpoint)
 
 def main():
     test = PerformanceTest()
@@ -280,8 +296,8 @@ def main():
     # Single user performance test
     test.run_performance_test(iterations=3)
     
-    # Concurrent user test
-    test.run_concurrent_test(concurrent_users=2, requests_per_user=2)
+    # Open-loop load test
+    test.run_load_test(rate=5, duration=20)
     
     print("\n✅ Performance test completed!")
     print("\n💡 Tips for optimization:")
@@ -0,0 +1,23 @@
+"""Puts the Lambda modules and the local AWS stand-ins (benchmarks/local_aws.py) on sys.path"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from local_aws import add_lambda_path  # noqa: E402
+
+add_lambda_path()
+
+@pytest.fixture(autouse=True)
+def quiet():
+    """Drop log lines and keep metrics in memory"""
+    import logger
+    import metrics
+    stream = logger._stream
+    logger._stream = open(os.devnull, 'w')
+    sink = metrics.use_sink(metrics.MemorySink()).sink
+    yield sink
+    logger._stream.close()
+    logger._stream = stream
@@ -0,0 +1,278 @@
+import json
+import os
+import time
+
+import pytest
+
+import emulator
+from local_aws import FakeResponseStream, FakeTable, client_error
+
+import credits_ledger
+import generation_cache
+import image_gen
+from bedrock_admission import BedrockGovernor, LocalWindows, use_governor
+from botocore.exceptions import ClientError
+from generation_cache import cache_key
+from model_router import TITAN_V1, TITAN_V2, ModelRouter, use_router
+from response_stream import NDJSON_CONTENT_TYPE
+
+class FrozenClock:
+    """Keeps every call in one admission window"""
+
+    def current_time(self):
+        return 1000.0
+
+    def sleep(self, seconds):
+        pass
+
+@pytest.fixture
+def aws():
+    aws = emulator.LocalAws()
+    aws.install(image_gen)
+    return aws
+
+@pytest.fixture
+def cache_table(aws, monkeypatch):
+    table = FakeTable('GenerationCache', 'cacheKey')
+    aws.dynamodb.tables[table.name] = table
+    monkeypatch.setenv('GENERATION_CACHE_TABLE', table.name)
+    monkeypatch.setattr(generation_cache, '_cache', None)
+    return table
+
+def generate():
+    return image_gen.handler(emulator.claims_event('POST', '/image/generate', {'prompt': 'A lighthouse at dusk'}), None)
+
+def test_busy_response_exposes_retry_after_through_traced_handler(aws):
+    use_governor(BedrockGovernor(LocalWindows(), max_rate=1, max_queue_seconds=0, clock=FrozenClock()))
+    
+    assert generate()['statusCode'] == 200
+    response = generate()
+    
+    assert response['statusCode'] == 429
+    assert response['headers']['Retry-After'] == '1'
+    assert json.loads(response['body'])['retryAfter'] == 1
+    exposed = response['headers']['Access-Control-Expose-Headers'].split(',')
+    assert 'Retry-After' in exposed and 'Server-Timing' in exposed
+
+def test_generation_cache_is_keyed_on_the_model_that_ran(aws, cache_table):
+    cache = cache_table
+    use_router(ModelRouter(model_ids=[TITAN_V1, TITAN_V2], probe_rate=0))
+    aws.bedrock.failures[TITAN_V1] = 'ServiceUnavailableException'
+    seeded = {'prompt': 'A lighthouse at dusk', 'seed': 7}
+    
+    assert image_gen.handler(emulator.claims_event('POST', '/image/generate', seeded), None)['statusCode'] == 200
+    
+    (entry,) = cache.items.values()
+    assert entry['model'] == TITAN_V2
+    assert entry['cacheKey'] == cache_key(TITAN_V2, 'A lighthouse at dusk', None, 1024, 1024, 8.0, 7, 1)
+    
+    # The preferred model is back: its key was never stored, so it generates rather than reusing v2's images
+    del aws.bedrock.failures[TITAN_V1]
+    assert image_gen.handler(emulator.claims_event('POST', '/image/generate', seeded), None)['statusCode'] == 200
+    assert aws.bedrock.model_calls[TITAN_V1] == 2
+    assert {item['model'] for item in cache.items.values()} == {TITAN_V1, TITAN_V2}
+
+def test_generation_cache_hit_copies_derivatives(aws, cache_table, monkeypatch):
+    monkeypatch.setattr(image_gen, 'SYNC_DERIVATIVES', True)
+    seeded = {'prompt': 'A lighthouse at dusk', 'seed': 7, 'numberOfImages': 2}
+    generated = json.loads(image_gen.handler(emulator.claims_event('POST', '/image/generate', seeded), None)['body'])
+    calls = sum(aws.bedrock.model_calls.values())
+    
+    response = image_gen.handler(emulator.claims_event('POST', '/image/generate', seeded), None)
+    
+    assert response['statusCode'] == 200
+    assert sum(aws.bedrock.model_calls.values()) == calls
+    fresh, hit = generated['images'], json.loads(response['body'])['images']
+    for before, after in zip(fresh, hit):
+        assert after['derivatives'].keys() == before['derivatives'].keys() != set()
+        for name, formats in after['derivatives'].items():
+            assert formats.keys() == before['derivatives'][name].keys()
+            assert all(after['imageId'] in url for url in formats.values())
+    bucket = os.environ['IMAGES_BUCKET']
+    copied = [key for (b, key), obj in aws.s3.objects.items()
+              if b == bucket and hit[0]['imageId'] in key and obj.get('ContentType') == 'image/webp']
+    assert len(copied) == 2
+
+def test_sync_generation_defers_derivatives_to_worker(aws, monkeypatch):
+    monkeypatch.setenv('DERIVATIVES_QUEUE_URL', 'https://sqs.local/imagify-derivatives')
+    aws.s3.keep_bodies = True  # The worker renders from the stored original
+    body = {'prompt': 'A lighthouse at dusk', 'numberOfImages': 2}
+    response = image_gen.handler(emulator.claims_event('POST', '/image/generate', body), None)
+    
+    images = json.loads(response['body'])['images']
+    assert response['statusCode'] == 200 and all(image['derivatives'] == {} for image in images)
+    assert not any(key.endswith('.webp') for _, key in aws.s3.objects)
+    (message,) = aws.sqs.queues['https://sqs.local/imagify-derivatives']
+    
+    image_gen.derivatives_worker({'Records': [{'body': message}]}, None)
+    
+    for image in images:
+        derivatives = aws.images.items[image['imageId']]['derivatives']
+        assert derivatives.keys() == {'thumb', 'medium'}
+        assert all((os.environ['IMAGES_BUCKET'], key) in aws.s3.objects
+                   for formats in derivatives.values() for key in formats.values())
+
+def test_derivatives_worker_skips_deleted_images(aws, monkeypatch):
+    monkeypatch.setenv('DERIVATIVES_QUEUE_URL', 'https://sqs.local/imagify-derivatives')
+    image_id = json.loads(generate()['body'])['images'][0]['imageId']
+    del aws.images.items[image_id]
+    (message,) = aws.sqs.queues['https://sqs.local/imagify-derivatives']
+    
+    image_gen.derivatives_worker({'Records': [{'body': message}]}, None)
+    
+    assert image_id not in aws.images.items
+
+def submit_job():
+    response = image_gen.handler(emulator.claims_event('POST', '/image/generate',
+                                                       {'prompt': 'A lighthouse at dusk', 'async': True}), None)
+    job_id = json.loads(response['body'])['jobId']
+    return job_id, {'Records': [{'body': json.dumps({'jobId': job_id, 'cognitoSub': emulator.SUB})}]}
+
+def test_job_with_expired_lease_is_reclaimed(aws):
+    job_id, event = submit_job()
+    job = aws.images.items[job_id]
+    job.update(status=image_gen.JOB_RUNNING, claimedAt=int(time.time()) - image_gen.JOB_LEASE_SECONDS - 1)
+    
+    image_gen.worker(event, None)
+    
+    assert aws.images.items[job_id]['status'] == image_gen.JOB_COMPLETED
+    assert sum(aws.bedrock.model_calls.values()) == 1
+
+def test_job_with_live_lease_is_left_to_its_worker(aws):
+    job_id, event = submit_job()
+    aws.images.items[job_id].update(status=image_gen.JOB_RUNNING, claimedAt=int(time.time()) - 5)
+    
+    image_gen.worker(event, None)
+    
+    assert aws.images.items[job_id]['status'] == image_gen.JOB_RUNNING
+    assert sum(aws.bedrock.model_calls.values()) == 0
+
+def test_dead_lettered_job_is_failed_and_refunded(aws):
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    stuck, event = submit_job()
+    aws.images.items[stuck].update(status=image_gen.JOB_RUNNING, claimedAt=int(time.time()))
+    done, done_event = submit_job()
+    image_gen.worker(done_event, None)
+    
+    image_gen.dead_letter_worker({'Records': event['Records'] + done_event['Records']}, None)
+    image_gen.dead_letter_worker(event, None)
+    
+    assert aws.images.items[stuck]['status'] == image_gen.JOB_FAILED
+    assert aws.images.items[done]['status'] == image_gen.JOB_COMPLETED
+    assert aws.users.items[emulator.USER_ID]['credits'] == credits - 1
+
+def reserve_at(aws, monkeypatch, reservation_id, age_seconds, amount=3, **kwargs):
+    """Reserve credits as a request that started age_seconds ago"""
+    started = time.time() - age_seconds
+    with monkeypatch.context() as patch:
+        patch.setattr(credits_ledger.time, 'time', lambda: started)
+        credits_ledger.reserve_credits(aws.users, emulator.USER_ID, amount, reservation_id, **kwargs)
+
+def test_sweeper_refunds_reservations_of_dead_requests(aws, monkeypatch):
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    reserve_at(aws, monkeypatch, 'rsv_dead', image_gen.RESERVATION_TIMEOUT_SECONDS + 1)
+    reserve_at(aws, monkeypatch, 'rsv_live', 5)
+    
+    assert image_gen.reservation_sweeper({}, None) == {'refunded': 1}
+    assert image_gen.reservation_sweeper({}, None) == {'refunded': 0}
+    
+    user = aws.users.items[emulator.USER_ID]
+    assert user['credits'] == credits - 3
+    assert user['pendingReservations'] == {'rsv_live'} and set(user['reservations']) == {'rsv_live'}
+    assert not credits_ledger.commit_credits(aws.users, emulator.USER_ID, 'rsv_dead')
+
+def test_sweeper_leaves_finished_requests_and_queued_jobs(aws, monkeypatch):
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    assert generate()['statusCode'] == 200
+    reserve_at(aws, monkeypatch, 'job_queued', image_gen.RESERVATION_TIMEOUT_SECONDS + 1, sweepable=False)
+    
+    assert image_gen.reservation_sweeper({}, None) == {'refunded': 0}
+    
+    user = aws.users.items[emulator.USER_ID]
+    assert user['credits'] == credits - 4 and user['reservations'] == {}
+    assert user['pendingReservations'] == {'job_queued'}
+
+def test_reservation_made_before_tracking_still_commits(aws):
+    aws.users.items[emulator.USER_ID]['pendingReservations'] = {'rsv_legacy'}
+    
+    assert credits_ledger.commit_credits(aws.users, emulator.USER_ID, 'rsv_legacy')
+    assert 'pendingReservations' not in aws.users.items[emulator.USER_ID]
+
+def stream(aws, **body):
+    response_stream = FakeResponseStream()
+    image_gen.stream_handler(emulator.claims_event('POST', '/image/generate', dict({'prompt': 'A lighthouse at dusk'},
+                                                                                   **body)), response_stream)
+    prelude, raw = response_stream.response()
+    return prelude, raw, response_stream
+
+def events_of(raw):
+    return [json.loads(line) for line in raw.decode().splitlines()]
+
+def test_stream_sends_events_in_pipeline_order(aws):
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    
+    prelude, raw, response_stream = stream(aws, numberOfImages=2)
+    
+    events = events_of(raw)
+    names = [event['event'] for event in events]
+    assert prelude['statusCode'] == 200 and prelude['headers']['Content-Type'] == NDJSON_CONTENT_TYPE
+    assert names[:2] == ['credits_reserved', 'model_invoked'] and names[-1] == 'done'
+    for index in range(2):
+        steps = [name for name, event in zip(names, events) if event.get('index') == index]
+        assert steps == ['image_decoded', 'image_uploaded', 'image_ready']
+    assert len(names) == 2 + 3 * 2 + 1
+    assert events[-1]['imageIds'] == events[0]['imageIds'] == prelude['headers']['X-Image-Ids'].split(',')
+    assert all(image_id in aws.images.items for image_id in events[-1]['imageIds'])
+    assert aws.users.items[emulator.USER_ID]['credits'] == credits - 2
+    assert response_stream.error is None
+
+def test_stream_answers_429_before_first_byte(aws):
+    governor = BedrockGovernor(LocalWindows(), max_rate=1, max_queue_seconds=0, clock=FrozenClock())
+    use_governor(governor)
+    governor.admit(emulator.USER_ID)
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    
+    prelude, raw, _ = stream(aws)
+    
+    assert prelude['statusCode'] == 429
+    assert prelude['headers']['Retry-After'] == '1'
+    assert 'Retry-After' in prelude['headers']['Access-Control-Expose-Headers'].split(',')
+    assert 'error' in json.loads(raw)
+    assert aws.bedrock.calls['invoke_model'] == 0
+    assert aws.users.items[emulator.USER_ID]['credits'] == credits
+
+def failing_uploads(aws, monkeypatch):
+    def put_object(**kwargs):
+        raise client_error('InternalError', 'We encountered an internal error', 'PutObject')
+    monkeypatch.setattr(aws.s3, 'put_object', put_object)
+
+def test_stream_refunds_and_reports_mid_stream_failure(aws, monkeypatch):
+    failing_uploads(aws, monkeypatch)
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    
+    prelude, raw, response_stream = stream(aws, numberOfImages=2)
+    
+    names = [event['event'] for event in events_of(raw)]
+    assert prelude['statusCode'] == 200
+    assert names[:2] == ['credits_reserved', 'model_invoked']
+    assert names[-1] == 'error' and 'done' not in names
+    assert aws.users.items[emulator.USER_ID]['credits'] == credits
+    assert not any(image_id in aws.images.items for image_id in prelude['headers']['X-Image-Ids'].split(','))
+
+def test_image_stream_failure_after_first_byte_ends_with_error_trailers(aws, monkeypatch):
+    failing_uploads(aws, monkeypatch)
+    credits = aws.users.items[emulator.USER_ID]['credits']
+    
+    prelude, raw, response_stream = stream(aws, stream='image')
+    
+    assert prelude['statusCode'] == 200 and prelude['headers']['Content-Type'] == 'image/png'
+    assert raw.startswith(b'\x89PNG')
+    assert isinstance(response_stream.error, ClientError)
+    assert aws.users.items[emulator.USER_ID]['credits'] == credits
+
+def test_image_stream_success_ends_cleanly(aws):
+    prelude, raw, response_stream = stream(aws, stream='image')
+    
+    image_id = prelude['headers']['X-Image-Ids']
+    assert raw.startswith(b'\x89PNG') and response_stream.error is None
+    assert aws.images.items[image_id]['imageKey'].endswith(f"{image_id}.png")
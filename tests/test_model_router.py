@@ -0,0 +1,154 @@
+import io
+import json
+
+import pytest
+
+from local_aws import FakeBedrock, png
+
+import image_gen
+from bedrock_admission import BedrockGovernor, LocalWindows
+from botocore.exceptions import ClientError
+from model_router import ADAPTERS, SDXL, TITAN_V1, TITAN_V2, ModelRouter
+
+PROMPT = 'A lighthouse at dusk'
+LATENCIES = {TITAN_V1: 30, TITAN_V2: 10, SDXL: 20}
+
+class FrozenClock:
+    """Keeps every call in one admission window"""
+
+    def current_time(self):
+        return 1000.0
+
+    def sleep(self, seconds):
+        pass
+
+def invoke(router, bedrock, image_count=1, seed=None, **kwargs):
+    routed = router.invoke(bedrock, PROMPT, image_gen.image_generation_config(image_count, seed), **kwargs)
+    assert len(list(routed.images())) == image_count
+    return routed
+
+def measured(model_ids=(TITAN_V1, TITAN_V2, SDXL), **kwargs):
+    """A router that has recorded one call of each model at LATENCIES"""
+    router = ModelRouter(model_ids=list(model_ids), probe_rate=0, **kwargs)
+    for model_id in model_ids:
+        router.record(model_id, LATENCIES[model_id])
+    return router
+
+def test_cold_router_starts_on_first_model_without_probing():
+    bedrock = FakeBedrock(LATENCIES)
+    router = ModelRouter(probe_rate=0)
+    
+    assert [invoke(router, bedrock).model_id for _ in range(3)] == [TITAN_V1] * 3
+    assert bedrock.model_calls[TITAN_V2] == bedrock.model_calls[SDXL] == 0
+
+def test_sampled_request_probes_an_unmeasured_model():
+    bedrock = FakeBedrock(LATENCIES)
+    router = ModelRouter(probe_rate=0.05, sample=iter([0.5, 0.01]).__next__)
+    
+    assert invoke(router, bedrock).model_id == TITAN_V1
+    assert invoke(router, bedrock).model_id == TITAN_V1
+    assert invoke(router, bedrock).model_id == TITAN_V2
+    assert router.snapshot()[TITAN_V2]['calls'] == 1
+
+def test_measured_router_picks_fastest_model():
+    bedrock = FakeBedrock(LATENCIES)
+    
+    routed = invoke(measured(), bedrock)
+    
+    assert routed.model_id == TITAN_V2 and not routed.fallback
+
+def test_pinned_request_keeps_configured_order():
+    bedrock = FakeBedrock(LATENCIES)
+    
+    assert invoke(measured(), bedrock, seed=7, pinned=True).model_id == TITAN_V1
+
+def test_multi_image_request_skips_single_image_model():
+    bedrock = FakeBedrock(LATENCIES)
+    router = measured()
+    router.record(TITAN_V2, None)
+    bedrock.failures[TITAN_V2] = 'ServiceUnavailableException'
+    bedrock.failures[TITAN_V1] = 'ServiceUnavailableException'
+    
+    with pytest.raises(ClientError):
+        invoke(router, bedrock, image_count=3)
+    assert bedrock.model_calls[SDXL] == 0
+
+def test_failing_model_fails_over_to_next():
+    bedrock = FakeBedrock(LATENCIES, failures={TITAN_V2: 'ServiceUnavailableException'})
+    router = measured()
+    
+    routed = invoke(router, bedrock)
+    
+    assert routed.model_id == SDXL and routed.fallback
+    assert router.snapshot()[TITAN_V2]['errorRate'] > 0
+
+def test_unhealthy_model_is_skipped_until_cooldown():
+    bedrock = FakeBedrock(LATENCIES, failures={TITAN_V2: 'ServiceUnavailableException'})
+    now = [0.0]
+    router = measured(cooldown_seconds=30, clock=lambda: now[0])
+    
+    for _ in range(3):
+        router.record(TITAN_V2, None)
+    
+    assert not router.snapshot()[TITAN_V2]['healthy']
+    assert invoke(router, bedrock).model_id == SDXL
+    assert bedrock.model_calls[TITAN_V2] == 0
+    
+    del bedrock.failures[TITAN_V2]
+    now[0] = 31.0
+    assert router.candidates(1)[0].model_id == TITAN_V2
+
+def test_request_error_is_raised_without_trying_other_models():
+    bedrock = FakeBedrock(LATENCIES, failures={TITAN_V2: 'ValidationException'})
+    router = measured()
+    
+    with pytest.raises(ClientError):
+        invoke(router, bedrock)
+    assert sum(bedrock.model_calls.values()) == 1
+    assert router.snapshot()[TITAN_V2]['errorRate'] == 0
+
+def test_slow_model_is_hedged_by_next():
+    bedrock = FakeBedrock(dict(LATENCIES, **{TITAN_V2: 1000}))
+    router = measured(latency_budget_ms=50)
+    
+    routed = invoke(router, bedrock)
+    
+    assert routed.model_id == SDXL and routed.fallback
+    assert routed.latency_ms < 1000
+    assert bedrock.model_calls[TITAN_V2] == 1
+
+def test_no_hedge_without_admission_slot():
+    bedrock = FakeBedrock(dict(LATENCIES, **{TITAN_V1: 200}))
+    router = measured(model_ids=(TITAN_V1, TITAN_V2), latency_budget_ms=20)
+    router.record(TITAN_V2, 100)
+    governor = BedrockGovernor(LocalWindows(), max_rate=1, max_queue_seconds=0, clock=FrozenClock())
+    governor.admit('user_hedge')
+    
+    routed = invoke(router, bedrock, governor=governor, user_key='user_hedge')
+    
+    assert routed.model_id == TITAN_V1 and not routed.fallback
+    assert bedrock.model_calls[TITAN_V2] == 0
+
+def test_routed_cost_is_the_serving_models_price():
+    bedrock = FakeBedrock(LATENCIES, failures={TITAN_V2: 'ServiceUnavailableException'})
+    
+    routed = invoke(measured(), bedrock)
+    
+    assert routed.cost(1) == ADAPTERS[SDXL].cost_per_image
+    assert ADAPTERS[TITAN_V1].cost_per_image < ADAPTERS[SDXL].cost_per_image
+
+@pytest.mark.parametrize('finish_reason', ['ERROR', 'CONTENT_FILTERED'])
+def test_unfinished_sdxl_artifact_is_an_error(finish_reason):
+    body = json.dumps({'result': 'success', 'artifacts': [
+        {'seed': 1, 'base64': '', 'finishReason': finish_reason}]}).encode()
+    
+    with pytest.raises(ValueError, match=finish_reason):
+        list(ADAPTERS[SDXL].iter_images(io.BytesIO(body)))
+
+def test_successful_sdxl_artifact_is_decoded():
+    image = png(8, 8)
+    bedrock = FakeBedrock(images=[image])
+    response = bedrock.invoke_model(modelId=SDXL,
+                                    body=ADAPTERS[SDXL].request_body(PROMPT, image_gen.image_generation_config(1)))
+    
+    assert list(ADAPTERS[SDXL].iter_images(response['body'])) == [image]
@@ -0,0 +1,71 @@
+import hashlib
+import hmac
+import json
+import os
+
+import pytest
+
+os.environ.setdefault('VNPAY_SECRET_ARN', 'arn:aws:secretsmanager:local:000000000000:secret:vnpay')
+
+import payment  # noqa: E402
+from local_aws import FakeSecretsManager  # noqa: E402
+from secret_cache import CURRENT, PREVIOUS, SecretCache  # noqa: E402
+
+SECRET_ARN = os.environ['VNPAY_SECRET_ARN']
+SIGN_DATA = 'vnp_Amount=1000000&vnp_ResponseCode=00&vnp_TmnCode=TESTCODE&vnp_TxnRef=user_1_1700000000'
+
+def put_hash_secret(secrets, hash_secret):
+    secrets.put_secret(SECRET_ARN, json.dumps({'tmn_code': 'TESTCODE', 'hash_secret': hash_secret}))
+
+def signature(hash_secret):
+    return hmac.new(hash_secret.encode('utf-8'), SIGN_DATA.encode('utf-8'), hashlib.sha512).hexdigest()
+
+@pytest.fixture
+def secrets(monkeypatch):
+    secrets = FakeSecretsManager()
+    put_hash_secret(secrets, 'old-secret')
+    monkeypatch.setattr(payment, 'secrets_client', secrets)
+    monkeypatch.setattr(payment, '_vnpay_secret', SecretCache(secrets, SECRET_ARN, transform=payment.parse_vnpay_secret,
+                                                              min_refresh_seconds=0))
+    return secrets
+
+def test_cached_current_secret_verifies_without_fetching_again(secrets):
+    assert payment.verify_signature(SIGN_DATA, signature('old-secret'))['hash_secret'] == 'old-secret'
+    assert payment.verify_signature(SIGN_DATA, signature('old-secret'))['hash_secret'] == 'old-secret'
+    
+    assert secrets.calls['get_secret_value'] == 1
+
+def test_rotation_since_caching_is_picked_up_by_a_forced_refresh(secrets):
+    payment.verify_signature(SIGN_DATA, signature('old-secret'))
+    put_hash_secret(secrets, 'new-secret')
+    
+    creds = payment.verify_signature(SIGN_DATA, signature('new-secret'))
+    
+    assert creds['hash_secret'] == 'new-secret'
+    assert payment.get_vnpay_secret().version_id(CURRENT) == 'v2'
+
+def test_callback_signed_before_rotation_verifies_with_previous(secrets):
+    put_hash_secret(secrets, 'new-secret')
+    
+    creds = payment.verify_signature(SIGN_DATA, signature('old-secret'))
+    
+    assert creds['hash_secret'] == 'old-secret'
+    assert payment.get_vnpay_secret().version_id(PREVIOUS) == 'v1'
+
+def test_forced_refresh_is_rate_limited(secrets):
+    payment._vnpay_secret.min_refresh_seconds = 60
+    payment.verify_signature(SIGN_DATA, signature('old-secret'))
+    put_hash_secret(secrets, 'new-secret')
+    
+    assert payment.verify_signature(SIGN_DATA, signature('new-secret')) is None
+    # One CURRENT fetch when first cached, one PREVIOUS lookup; the refresh waits for min_refresh_seconds
+    assert secrets.calls['get_secret_value'] == 2
+
+def test_unknown_signature_is_rejected_before_the_first_rotation(secrets):
+    assert payment.verify_signature(SIGN_DATA, signature('forged')) is None
+    assert payment.verify_signature(SIGN_DATA, signature('forged')) is None
+    
+    # AWSCURRENT once, a forced refresh per callback, and AWSPREVIOUS once: without
+    # a version the miss is cached instead of looked up on every callback
+    assert payment.get_vnpay_secret().get(PREVIOUS) is None
+    assert secrets.calls['get_secret_value'] == 4
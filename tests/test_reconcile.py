@@ -0,0 +1,138 @@
+import csv
+import time
+from decimal import Decimal
+
+import pytest
+
+from local_aws import FakeDynamoDBResource, FakeTable, client_error
+
+import reconcile
+from transactions_ledger import CREDITED, DUPLICATE, FAILED, PAID, PENDING
+
+START = 1700000000
+SETTLEMENT_HEADER = ['vnp_TxnRef', 'vnp_Amount', 'vnp_TransactionStatus', 'vnp_TransactionNo', 'vnp_PayDate']
+
+def pay_date(epoch):
+    """vnp_PayDate format: yyyyMMddHHmmss in GMT+7"""
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime(epoch + reconcile.VNPAY_UTC_OFFSET_SECONDS))
+
+def order(txn_ref, status=PAID, created_at=START, amount=10000, credits=100):
+    row = {'transactionId': txn_ref, 'userId': txn_ref.rsplit('_', 1)[0], 'packageType': 'basic',
+           'amount': Decimal(amount), 'credits': Decimal(credits), 'status': status}
+    if created_at is not None:
+        row['createdAt'] = Decimal(created_at)
+    return row
+
+def settled(txn_ref, paid_at=START, amount=10000, status='00'):
+    return [txn_ref, amount * 100, status, '9' + txn_ref.rsplit('_', 1)[1], pay_date(paid_at)]
+
+@pytest.fixture
+def tables():
+    transactions = FakeTable('imagify-transactions', 'transactionId')
+    users = FakeTable('imagify-users', 'userId')
+    users.load({'userId': f'user_{i}', 'credits': Decimal(0)} for i in range(3))
+    return transactions, users, FakeDynamoDBResource({transactions.name: transactions, users.name: users})
+
+def run(tmp_path, tables, ledger, settlement, repair=False, **kwargs):
+    """(counts, {transactionId: report row}) of one reconciliation over small fixtures"""
+    transactions, users, resource = tables
+    transactions.load(ledger)
+    settlement_path = tmp_path / 'settlement.csv'
+    with open(settlement_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SETTLEMENT_HEADER)
+        writer.writerows(settlement)
+    report_path = tmp_path / 'report.csv'
+    
+    counts = reconcile.reconcile(transactions, settlement_path, report_path, buckets=4, segments=2,
+                                 repair_client=resource.meta.client if repair else None,
+                                 users_table_name=users.name, **kwargs)
+    with open(report_path, newline='') as f:
+        return counts, {row['transactionId']: row for row in csv.DictReader(f)}
+
+def test_every_mismatch_kind_is_reported(tmp_path, tables):
+    ledger = [order('user_0_1'), order('user_0_2', PENDING), order('user_1_3'), order('user_1_4'),
+              order('user_2_5')]
+    settlement = [settled('user_0_1'), settled('user_0_2'), settled('user_1_3', amount=50000),
+                  settled('user_1_4', status='02'), settled('user_2_6')]
+    
+    counts, report = run(tmp_path, tables, ledger, settlement)
+    
+    assert {txn_ref: row['kind'] for txn_ref, row in report.items()} == {
+        'user_0_2': reconcile.MISSING_CREDIT,
+        'user_1_3': reconcile.AMOUNT_MISMATCH,
+        'user_1_4': reconcile.NOT_SETTLED,
+        'user_2_5': reconcile.UNSETTLED_PAID,
+        'user_2_6': reconcile.MISSING_TRANSACTION
+    }
+    assert report['user_1_3']['ledgerAmount'] == '10000' and report['user_1_3']['settledAmount'] == '50000'
+    assert counts['ledger_rows'] == counts['settlement_rows'] == 5
+    assert all(row['repaired'] == '' for row in report.values())
+
+@pytest.mark.parametrize('since, until, kept', [
+    (START + 10, None, {'user_0_2', 'user_0_3'}),
+    (None, START + 20, {'user_0_1', 'user_0_2'}),
+    (START + 10, START + 20, {'user_0_2'})
+])
+def test_window_applies_to_both_sides(tmp_path, tables, since, until, kept):
+    # Orders 10s apart, paid in the ledger but absent from the file, and the same the other way round
+    ledger = [order(f'user_0_{i}', created_at=START + 10 * (i - 1)) for i in (1, 2, 3)]
+    settlement = [settled(f'user_1_{i}', paid_at=START + 10 * (i - 1)) for i in (1, 2, 3)]
+    
+    counts, report = run(tmp_path, tables, ledger, settlement, since=since, until=until)
+    
+    assert {row['transactionId'] for row in report.values() if row['kind'] == reconcile.UNSETTLED_PAID} == kept
+    assert {row['transactionId'] for row in report.values() if row['kind'] == reconcile.MISSING_TRANSACTION} == {
+        txn_ref.replace('user_0', 'user_1') for txn_ref in kept}
+
+def test_epoch_zero_since_is_a_bound(tmp_path, tables):
+    counts, report = run(tmp_path, tables, [order('user_0_1', created_at=None)], [settled('user_0_1', paid_at=-1)],
+                         since=0)
+    
+    assert counts['settlement_rows'] == 0
+    # Without createdAt the ledger row is kept but, in a windowed run, never reported as unsettled
+    assert counts['ledger_rows'] == 1 and not report
+
+def test_repair_credits_missing_and_reports_duplicates(tmp_path, tables):
+    transactions, users, _ = tables
+    ledger = [order('user_0_1', FAILED), order('user_1_2')]
+    settlement = [settled('user_0_1'), settled('user_1_2'), settled('user_2_3')]
+    # A callback settles user_1_2 after the scan saw it pending
+    scan = transactions.scan
+    
+    def scan_before_callback(**kwargs):
+        response = scan(**kwargs)
+        for item in response['Items']:
+            if item['transactionId'] == 'user_1_2':
+                item['status'] = PENDING
+        return response
+    transactions.scan = scan_before_callback
+    
+    counts, report = run(tmp_path, tables, ledger, settlement, repair=True)
+    
+    assert report['user_0_1']['repaired'] == report['user_2_3']['repaired'] == CREDITED
+    assert report['user_1_2']['repaired'] == DUPLICATE
+    assert counts['repaired'] == 2 and counts['already_settled'] == 1 and counts['repair_errors'] == 0
+    assert [users.items[f'user_{i}']['credits'] for i in range(3)] == [100, 0, 100]
+    assert transactions.items['user_2_3']['status'] == PAID
+
+def test_repair_conflict_is_reported_and_run_continues(tmp_path, tables):
+    _, users, resource = tables
+    client = resource.meta.client
+    transact_write_items = client.transact_write_items
+    
+    def conflict_on_user_1(TransactItems, **kwargs):
+        if TransactItems[0]['Update']['Key']['transactionId']['S'] == 'user_1_1':
+            error = client_error('TransactionCanceledException', 'Transaction cancelled', 'TransactWriteItems')
+            error.response['CancellationReasons'] = [{'Code': 'TransactionConflict'}, {'Code': 'None'}]
+            raise error
+        return transact_write_items(TransactItems, **kwargs)
+    client.transact_write_items = conflict_on_user_1
+    
+    counts, report = run(tmp_path, tables, [order(f'user_{i}_{i}', PENDING) for i in range(3)],
+                         [settled(f'user_{i}_{i}') for i in range(3)], repair=True)
+    
+    assert report['user_1_1']['repaired'] == 'ERROR:TransactionConflict'
+    assert report['user_0_0']['repaired'] == report['user_2_2']['repaired'] == CREDITED
+    assert counts['repaired'] == 2 and counts['repair_errors'] == 1
+    assert users.items['user_1']['credits'] == 0
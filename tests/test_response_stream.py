@@ -0,0 +1,127 @@
+import base64
+import json
+import socket
+import threading
+
+from local_aws import FakeResponseStream
+
+from response_stream import (HTTP_INTEGRATION_CONTENT_TYPE, PRELUDE_DELIMITER, EventStream, HttpResponseStream,
+                             RuntimeApiStream)
+
+class RuntimeApi:
+    """One-shot Runtime API stand-in capturing the raw bytes of the response POST"""
+
+    def __init__(self):
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.address = '127.0.0.1:%d' % self.server.getsockname()[1]
+        self.request = b''
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        connection, _ = self.server.accept()
+        with connection:
+            # The body ends with the last chunk: 0, optional trailers, then an empty line
+            while not (b'\r\n0\r\n' in self.request and self.request.endswith(b'\r\n\r\n')):
+                data = connection.recv(65536)
+                if not data:
+                    break
+                self.request += data
+            connection.sendall(b'HTTP/1.1 202 Accepted\r\nContent-Length: 0\r\n\r\n')
+        self.server.close()
+
+    def captured(self):
+        """(request line, {header: value}, body) of the POST"""
+        self._thread.join(timeout=5)
+        head, _, body = self.request.partition(b'\r\n\r\n')
+        request_line, *header_lines = head.decode().split('\r\n')
+        headers = dict(line.split(': ', 1) for line in header_lines)
+        return request_line, headers, body
+
+def test_prelude_precedes_body_with_eight_nul_delimiter():
+    stream = FakeResponseStream()
+    http_stream = HttpResponseStream(stream, 200, {'Content-Type': 'text/plain'})
+    http_stream.status_code = 201
+    http_stream.headers['X-Image-Ids'] = 'img_1'
+    
+    http_stream.write(b'first')
+    http_stream.write(b'')
+    http_stream.write(b'second')
+    http_stream.end()
+    
+    raw = b''.join(data for _, data in stream.writes)
+    prelude = json.dumps({'statusCode': 201, 'headers': {'Content-Type': 'text/plain', 'X-Image-Ids': 'img_1'}})
+    assert PRELUDE_DELIMITER == b'\x00' * 8
+    assert raw == prelude.encode() + PRELUDE_DELIMITER + b'firstsecond'
+    assert len(stream.writes) == 3 and stream.ended_at is not None
+
+def test_headers_change_only_before_first_write():
+    stream = FakeResponseStream()
+    http_stream = HttpResponseStream(stream)
+    http_stream.write(b'body')
+    http_stream.status_code = 500
+    http_stream.end()
+    
+    prelude, body = stream.response()
+    assert prelude == {'statusCode': 200, 'headers': {}} and body == b'body'
+
+def test_end_without_body_still_sends_prelude():
+    stream = FakeResponseStream()
+    HttpResponseStream(stream, 204).end()
+    
+    assert b''.join(data for _, data in stream.writes) == b'{"statusCode": 204, "headers": {}}' + PRELUDE_DELIMITER
+
+def test_events_are_newline_delimited_json():
+    stream = FakeResponseStream()
+    events = EventStream(HttpResponseStream(stream))
+    
+    events.send('credits_reserved', imageIds=['img_1'], remainingCredits=4)
+    threads = [threading.Thread(target=events.send, args=('image_ready',), kwargs={'index': i}) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    events.send('done')
+    
+    _, body = stream.response()
+    assert body.endswith(b'\n')
+    lines = [json.loads(line) for line in body.decode().split('\n')[:-1]]
+    assert [line['event'] for line in lines] == ['credits_reserved'] + ['image_ready'] * 8 + ['done']
+    assert lines[0]['imageIds'] == ['img_1'] and lines[0]['remainingCredits'] == 4
+    assert sorted(line['index'] for line in lines[1:-1]) == list(range(8))
+    assert all(isinstance(line['elapsedMs'], float) for line in lines)
+    assert b' ' not in body
+
+def test_runtime_api_stream_posts_chunked_response():
+    runtime = RuntimeApi()
+    stream = RuntimeApiStream('req-1', runtime.address)
+    
+    stream.write(b'hello')
+    stream.write(b'')
+    stream.write(b'x' * 300)
+    stream.end()
+    stream.end()
+    
+    request_line, headers, body = runtime.captured()
+    assert request_line == 'POST /2018-06-01/runtime/invocation/req-1/response HTTP/1.1'
+    assert headers['Lambda-Runtime-Function-Response-Mode'] == 'streaming'
+    assert headers['Transfer-Encoding'] == 'chunked'
+    assert headers['Content-Type'] == HTTP_INTEGRATION_CONTENT_TYPE
+    assert 'Content-Length' not in headers
+    assert body == b'5\r\nhello\r\n12c\r\n' + b'x' * 300 + b'\r\n0\r\n\r\n'
+
+def test_runtime_api_stream_reports_error_in_trailers():
+    runtime = RuntimeApi()
+    stream = RuntimeApiStream('req-2', runtime.address)
+    
+    stream.write(b'partial')
+    stream.end(ValueError('Bedrock returned 1 images, expected 2'))
+    
+    _, headers, body = runtime.captured()
+    assert headers['Trailer'] == 'Lambda-Runtime-Function-Error-Type, Lambda-Runtime-Function-Error-Body'
+    chunks, _, trailers = body.partition(b'\r\n0\r\n')
+    assert chunks == b'7\r\npartial'
+    fields = dict(line.split(': ', 1) for line in trailers.decode().split('\r\n') if line)
+    assert fields['Lambda-Runtime-Function-Error-Type'] == 'ValueError'
+    assert json.loads(base64.b64decode(fields['Lambda-Runtime-Function-Error-Body'])) == {
+        'errorType': 'ValueError', 'errorMessage': 'Bedrock returned 1 images, expected 2'}